@@ -0,0 +1,95 @@
+# Description: Module to record which input branches are read by other modules,
+#              and to create a keep/drop list to prune the input branches
+# Sources:
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/treeReaderArrayTools.py
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/branchselection.py
+import os, re
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from TauFW.common.tools.log import Logger
+LOG = Logger('BranchRecorder')
+
+
+def readbranchsel(fname):
+  """Read branches kept by a keep/drop list, created by BranchRecorder."""
+  branches = set()
+  if fname and os.path.isfile(fname):
+    with open(fname,'r') as file:
+      for line in file:
+        line = line.split('#')[0].strip()
+        if line.startswith('keep '):
+          branches.add(line.split()[1])
+  return branches
+  
+
+def writebranchsel(fname,branches,header=None):
+  """Write keep/drop list that drops all branches, except the given ones."""
+  with open(fname,'w') as file:
+    if header:
+      file.write("# %s\n"%(header))
+    file.write("drop *\n")
+    for branch in sorted(branches):
+      file.write("keep %s\n"%(branch))
+  return fname
+  
+
+class BranchRecorder(Module):
+  """Record which branches of the input tree are read by the other modules via nanoAOD-tools'
+  Event, Collection and Object, i.e. the branches with a TTreeReader. This module should come first,
+  as it only checks which branches were read in the previous event.
+  If record=True, update the keep/drop list in endJob with the recorded branches.
+  Reading a pruned branch (i.e. with status 0) already fails in nanoAOD-tools' readBranch."""
+  
+  def __init__(self, fname, **kwargs):
+    self.filename  = fname # keep/drop list
+    self.dorecord  = kwargs.get('record',   False ) # update keep/drop list at the end
+    self.formulas  = kwargs.get('formulas', [ ]   ) # e.g. preselection cut
+    self.header    = kwargs.get('header',   None  ) # comment at top of keep/drop list
+    self.verbosity = kwargs.get('verb',     0     )
+    self.branches  = set() # recorded branches
+    self.tree      = None
+    self.nread     = 0
+  
+  def beginJob(self):
+    """Before processing any events or files."""
+    print ">>> %-12s = %r"%('branchsel',self.filename)
+    print ">>> %-12s = %s"%('record',self.dorecord)
+  
+  def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """Before processing a new file: Get branches in formulas."""
+    self.tree   = inputTree
+    self.nread  = 0
+    names       = [b.GetName() for b in inputTree.GetListOfBranches()]
+    for formula in self.formulas:
+      if formula:
+        self.branches.update(set(re.findall(r"\b[A-Za-z_]\w*\b",formula)) & set(names))
+    self.update()
+  
+  def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """After processing a file."""
+    self.update()
+    self.tree = None
+  
+  def endJob(self):
+    """Update keep/drop list."""
+    if self.dorecord:
+      branches = readbranchsel(self.filename) | self.branches
+      print ">>> BranchRecorder.endJob: Writing %d branches (%d recorded) to %s..."%(len(branches),len(self.branches),self.filename)
+      writebranchsel(self.filename,branches,header=self.header)
+  
+  def analyze(self, event):
+    """Check for new branches read by the modules, which create a reader for each new branch."""
+    if len(self.tree._ttras)+len(self.tree._ttrvs)!=self.nread:
+      self.update()
+    return True
+  
+  def update(self):
+    """Update set of branches that are read."""
+    if self.tree is None: return
+    read = set(self.tree._ttras.keys()) | set(self.tree._ttrvs.keys())
+    self.nread = len(self.tree._ttras)+len(self.tree._ttrvs)
+    new  = read - self.branches
+    if new:
+      if self.verbosity>=2:
+        print ">>> BranchRecorder.update: New branches: %s"%(', '.join(sorted(new)))
+      self.branches.update(new)
+  
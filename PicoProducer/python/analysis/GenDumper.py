@@ -7,8 +7,7 @@
 #   https://github.com/cms-sw/cmssw/blob/master/PhysicsTools/NanoAOD/python/genparticles_cff.py
 #   https://github.com/cms-sw/cmssw/blob/master/PhysicsTools/NanoAOD/plugins/LHETablesProducer.cc
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
-from TauFW.PicoProducer.analysis.utils import hasbit
+from TauFW.PicoProducer.analysis.utils import hasbit, getgenindex
 
 # DUMPER MODULE
 class GenDumper(Module):
@@ -22,26 +21,24 @@ class GenDumper(Module):
     print "\n%s event %s %s"%('-'*10,event.event,'-'*60)
     self.nevents += 1
     leptonic = False
-    particles = Collection(event,'GenPart')
-    #particles = Collection(event,'LHEPart')
+    index = getgenindex(event)
     print " \033[4m%7s %8s %8s %8s %8s %8s %8s %8s %9s %10s  \033[0m"%(
       "index","pdgId","moth","mothid","dR","pt","eta","status","prompt","last copy")
-    for i, particle in enumerate(particles):
-      mothidx  = particle.genPartIdxMother
-      if 0<=mothidx<len(particles):
-        moth    = particles[mothidx]
-        mothpid = moth.pdgId
-        mothdR  = min(999,particle.DeltaR(moth)) #particle.p4().DeltaR(moth.p4())
+    for i in xrange(index.n):
+      mothidx  = index.mother[i]
+      if 0<=mothidx<index.n:
+        mothpid = index.pdgId[mothidx]
+        mothdR  = min(999,index.deltaR(mothidx,index.eta[i],index.phi[i]))
       else:
         mothpid = -1
         mothdR  = -1
-      eta       = min(999,particle.eta)
-      prompt    = hasbit(particle.statusFlags,0)
-      lastcopy  = hasbit(particle.statusFlags,13)
+      eta       = min(999,index.eta[i])
+      prompt    = hasbit(index.flags[i],0)
+      lastcopy  = index.lastcopy[i]
       print " %7d %8d %8d %8d %8.2f %8.2f %8.2f %8d %9s %10s"%(
-        i,particle.pdgId,mothidx,mothpid,mothdR,particle.pt,eta,particle.status,prompt,lastcopy)
-      if abs(particle.pdgId) in [11,13,15]:
-        leptonic = True
+        i,index.pdgId[i],mothidx,mothpid,mothdR,index.pt[i],eta,index.status[i],prompt,lastcopy)
+    if any(pid in index.buckets for pid in [11,13,15]):
+      leptonic = True
     if leptonic:
       self.nleptons += 1
   
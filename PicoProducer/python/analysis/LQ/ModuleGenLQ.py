@@ -6,7 +6,7 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import Pos
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 from TauFW.PicoProducer.analysis.TreeProducerBase import TreeProducerBase
-from TauFW.PicoProducer.analysis.utils import dumpgenpart
+from TauFW.PicoProducer.analysis.utils import dumpgenpart, getgenindex
 
 
 class ModuleGenLQ(Module):
@@ -39,66 +39,61 @@ class ModuleGenLQ(Module):
     self.out.cutflow.Fill(0)
     
     # LQs
-    lqs      = [ ]
+    lqs      = [ ] # indices of last copies
+    decays   = { } # LQ index -> daughter PDG IDs
     lqids    = [46,9000002,9000006]
-    genparts = Collection(event,'GenPart')
+    index    = getgenindex(event)
+    pdgIds   = index.pdgId
     taus     = [ ]
     tnus     = [ ]
     tops     = [ ]
     #print '-'*80
-    for part in genparts:
-      pid = abs(part.pdgId)
-      #dumpgenpart(part,genparts=genparts)
+    for id in xrange(index.n):
+      pid  = abs(pdgIds[id])
+      moth = index.mother[id]
+      #dumpgenpart(index.particle(id),event=event)
       if pid in lqids:
-        if part.status<60: continue
+        if index.status[id]<60: continue
         for i, lq in enumerate(lqs):
-          if lq._index==part.genPartIdxMother and lq.pdgId==part.pdgId:
-            lqs[i] = part
+          if lq==moth and pdgIds[lq]==pdgIds[id]:
+            lqs[i] = id
+            decays[id] = decays.pop(lq)
             break
         else:
-          part.decays = [ ]
-          lqs.append(part)
+          decays[id] = [ ]
+          lqs.append(id)
       else:
-        for lq in lqs:
-          if lq._index==part.genPartIdxMother:
-            lq.decays.append(pid)
+        if moth in decays:
+          decays[moth].append(pid)
         if pid==6:
           for i, top in enumerate(tops):
-            if top._index==part.genPartIdxMother and top.pdgId==part.pdgId:
-              tops[i] = part
+            if top==moth and pdgIds[top]==pdgIds[id]:
+              tops[i] = id
               break
           else:
-            tops.append(part)
+            tops.append(id)
         elif pid==15:
           for i, tau in enumerate(taus):
-            if tau._index==part.genPartIdxMother and tau.pdgId==part.pdgId:
-              taus[i] = part
+            if tau==moth and pdgIds[tau]==pdgIds[id]:
+              taus[i] = id
               break
           else:
-            taus.append(part)
+            taus.append(id)
         elif pid==16:
-          tnus.append(part)
+          tnus.append(id)
     
     # TAUS
-    vistaus = [ ]
-    for vistau in Collection(event,'GenVisTau'):
-      vistau.mother = -1
+    vistaus = [ ] # (pt, mother PDG ID)
+    for pt, eta, phi, status in index.vistaus():
+      mother = -1
       for tau in taus:
-        if tau.DeltaR(vistau)>0.3: continue
-        moth = tau
-        while moth.genPartIdxMother>=0:
-          moth = genparts[moth.genPartIdxMother]
-          if abs(moth.pdgId)!=15:
-            vistau.mother = moth.pdgId
-            break
+        if index.deltaR(tau,eta,phi)>0.3: continue
+        moth = index.ancestor(tau) # first mother that is not a tau
+        if moth>=0:
+          mother = pdgIds[moth]
         break
-      #moth = vistau
-      #while moth.genPartIdxMother>=0:
-      #  moth = genparts[moth.genPartIdxMother]
-      #  if abs(moth.pdgId)!=15:
-      #    vistau.mother = moth.pdgId
-      #    break
-      vistaus.append(vistau)
+      vistaus.append((pt,mother))
+    lqs = [(index.pt[lq],sorted(decays[lq])) for lq in lqs]
     
     # SAVE VARIABLES
     self.out.genweight[0]  = event.genWeight
@@ -108,21 +103,18 @@ class ModuleGenLQ(Module):
     self.out.nvistaus[0]   = len(vistaus)
     self.out.ntops[0]      = len(tops)
     if len(lqs)>=2:
-      lqs[0].decays.sort()
-      lqs[1].decays.sort()
-      self.out.pt_lq1[0]   = lqs[0].pt
-      self.out.pt_lq2[0]   = lqs[1].pt
-      self.out.dau1_lq1[0] = lqs[0].decays[0] if len(lqs[0].decays)>=1 else -1
-      self.out.dau1_lq2[0] = lqs[1].decays[0] if len(lqs[1].decays)>=1 else -1
-      self.out.dau2_lq1[0] = lqs[0].decays[1] if len(lqs[0].decays)>=2 else -1
-      self.out.dau2_lq2[0] = lqs[1].decays[1] if len(lqs[1].decays)>=2 else -1
+      self.out.pt_lq1[0]   = lqs[0][0]
+      self.out.pt_lq2[0]   = lqs[1][0]
+      self.out.dau1_lq1[0] = lqs[0][1][0] if len(lqs[0][1])>=1 else -1
+      self.out.dau1_lq2[0] = lqs[1][1][0] if len(lqs[1][1])>=1 else -1
+      self.out.dau2_lq1[0] = lqs[0][1][1] if len(lqs[0][1])>=2 else -1
+      self.out.dau2_lq2[0] = lqs[1][1][1] if len(lqs[1][1])>=2 else -1
     elif len(lqs)>=1:
-      lqs[0].decays.sort()
-      self.out.pt_lq1[0]   = lqs[0].pt
+      self.out.pt_lq1[0]   = lqs[0][0]
       self.out.pt_lq2[0]   = -1
-      self.out.dau1_lq1[0] = lqs[0].decays[0] if len(lqs[0].decays)>=1 else -1
+      self.out.dau1_lq1[0] = lqs[0][1][0] if len(lqs[0][1])>=1 else -1
       self.out.dau1_lq2[0] = -1
-      self.out.dau2_lq1[0] = lqs[0].decays[1] if len(lqs[0].decays)>=2 else -1
+      self.out.dau2_lq1[0] = lqs[0][1][1] if len(lqs[0][1])>=2 else -1
       self.out.dau2_lq2[0] = -1
     else:
       self.out.pt_lq1[0]   = -1
@@ -132,14 +124,14 @@ class ModuleGenLQ(Module):
       self.out.dau2_lq1[0] = -1
       self.out.dau2_lq2[0] = -1
     if len(vistaus)>=2:
-      self.out.pt_vistau1[0]   = vistaus[0].pt
-      self.out.pt_vistau2[0]   = vistaus[1].pt
-      self.out.moth_vistau1[0] = vistaus[0].mother
-      self.out.moth_vistau2[0] = vistaus[1].mother
+      self.out.pt_vistau1[0]   = vistaus[0][0]
+      self.out.pt_vistau2[0]   = vistaus[1][0]
+      self.out.moth_vistau1[0] = vistaus[0][1]
+      self.out.moth_vistau2[0] = vistaus[1][1]
     elif len(vistaus)>=1:
-      self.out.pt_vistau1[0]   = vistaus[0].pt
+      self.out.pt_vistau1[0]   = vistaus[0][0]
       self.out.pt_vistau2[0]   = -1
-      self.out.moth_vistau1[0] = vistaus[0].mother
+      self.out.moth_vistau1[0] = vistaus[0][1]
       self.out.moth_vistau2[0] = -1
     else:
       self.out.pt_vistau1[0]   = -1
@@ -4,7 +4,8 @@ import sys
 import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerEMu import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
-from TauFW.PicoProducer.analysis.utils import LeptonPair, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.utils import LeptonPair, bestpair, pairkeys, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import pairs, choosepair, deltaR as deltaR_arr
 from TauFW.PicoProducer.corrections.MuonSFs import *
 from TauFW.PicoProducer.corrections.ElectronSFs import *
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool
@@ -17,19 +18,16 @@ class ModuleEMu(ModuleTauPair):
     super(ModuleEMu,self).__init__(fname,**kwargs)
     self.out = TreeProducerEMu(fname,self)
     
-    # TRIGGERS
+    # TRIGGERS: muon (pt, eta) thresholds of the first entry with a fired trigger (see ModuleTauPair.getTrigCuts)
     if self.year==2016:
-      self.trigger    = lambda e: e.HLT_IsoMu22 or e.HLT_IsoMu22_eta2p1 or e.HLT_IsoTkMu22 or e.HLT_IsoTkMu22_eta2p1 #or e.HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1
-      self.muonCutPt  = lambda e: 23
-      self.muonCutEta = lambda e: 2.4 if e.HLT_IsoMu22 or e.HLT_IsoTkMu22 else 2.1
+      self.muonTriggers = ['HLT_IsoMu22','HLT_IsoMu22_eta2p1','HLT_IsoTkMu22','HLT_IsoTkMu22_eta2p1'] #,'HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1'
+      self.muonCuts     = [(['HLT_IsoMu22','HLT_IsoTkMu22'],23,2.4),([ ],23,2.1)]
     elif self.year==2017:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muonCutPt  = lambda e: 25 if e.HLT_IsoMu24 else 28
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [(['HLT_IsoMu24'],25,2.4),([ ],28,2.4)]
     else:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muonCutPt  = lambda e: 25
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [([ ],25,2.4)]
     self.eleCutPt     = 15
     self.eleCutEta    = 2.3
     self.tauCutPt     = 20
@@ -53,8 +51,8 @@ class ModuleEMu(ModuleTauPair):
   def beginJob(self):
     """Before processing any events or files."""
     super(ModuleEMu,self).beginJob()
-    print ">>> %-12s = %s"%('muonCutPt',  self.muonCutPt)
-    print ">>> %-12s = %s"%('muonCutEta', self.muonCutEta)
+    print ">>> %-12s = %s"%('triggers',   self.muonTriggers)
+    print ">>> %-12s = %s"%('muonCuts',   self.muonCuts)
     print ">>> %-12s = %s"%('eleCutPt',   self.eleCutPt)
     print ">>> %-12s = %s"%('eleCutEta',  self.eleCutEta)
     print ">>> %-12s = %s"%('tauCutPt',   self.tauCutPt)
@@ -86,63 +84,143 @@ class ModuleEMu(ModuleTauPair):
     
     
     ##### TRIGGER ####################################
-    if not self.trigger(event):
+    if not self.fired(event,self.muonTriggers):
       return False
     self.out.cutflow.fill('trig')
     
     
     ##### ELECTRON ###################################
-    electrons = [ ]
-    for electron in Collection(event,'Electron'):
-      #if self.ismc and self.ees!=1:
-      #  electron.pt   *= self.ees
-      #  electron.mass *= self.ees
-      if electron.pt<self.eleCutPt: continue
-      if abs(electron.eta)>self.eleCutEta: continue
-      if abs(electron.dz)>0.2: continue
-      if abs(electron.dxy)>0.045: continue
-      if not electron.convVeto: continue
-      if electron.lostHits>1: continue
-      if not (electron.mvaFall17V2Iso_WP90 or electron.mvaFall17V2noIso_WP90): continue
-      electrons.append(electron)
+    electrons = self.getElectrons(event,self.eleCutPt,self.eleCutEta)
     if len(electrons)==0:
       return False
     self.out.cutflow.fill('electron')
     
     
     ##### MUON #######################################
-    muons = [ ]
-    for muon in Collection(event,'Muon'):
-      if muon.pt<self.muonCutPt(event): continue
-      if abs(muon.eta)>self.muonCutEta(event): continue
-      if abs(muon.dz)>0.2: continue
-      if abs(muon.dxy)>0.045: continue
-      if not muon.mediumId: continue
-      if muon.pfRelIso04_all>0.50: continue
-      muons.append(muon)
+    muons = self.getMuons(event,*self.getTrigCuts(event,self.muonCuts))
     if len(muons)==0:
       return False
     self.out.cutflow.fill('muon')
     
     
     ##### MUMU PAIR #################################
-    dileps = [ ]
-    for electron in electrons:
-      for muon in muons:
-        if muon.DeltaR(electron)<0.5: continue
-        ltau = LeptonPair(electron,electron.pfRelIso03_all,muon,muon.pfRelIso04_all)
-        dileps.append(ltau)
-    if len(dileps)==0:
+    dilep = bestpair(electrons,[e.pfRelIso03_all for e in electrons],muons,[m.pfRelIso04_all for m in muons],LeptonPair,self.pairCutDR)
+    if dilep is None:
       return False
-    electron, muon = max(dileps).pair
+    electron, muon = dilep
     electron.tlv   = electron.p4()
     muon.tlv       = muon.p4()
     self.out.cutflow.fill('pair')
     
     
+    # FILL BRANCHES
+    self.fillBranches(event,electron,muon)
+    return True
+  
+  
+  def analyzeBlock(self, block):
+    """Process and pre-select a block of events with numpy arrays (see analysis/columnar.py);
+    fill branches for the passed events, and return the number of passed events."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    mask = self.blockNoCut(block)
+    
+    
+    ##### TRIGGER ####################################
+    mask = mask & self.blockFired(block,self.muonTriggers)
+    self.out.cutflow.fillN('trig',mask.sum())
+    
+    
+    ##### ELECTRON ###################################
+    electrons = self.blockElectrons(block,mask,self.eleCutPt,self.eleCutEta)
+    mask      = mask & (electrons.nperevent()>0)
+    self.out.cutflow.fillN('electron',mask.sum())
+    
+    
+    ##### MUON #######################################
+    muons  = self.blockMuons(block,mask,*self.blockTrigCuts(block,self.muonCuts))
+    mask   = mask & (muons.nperevent()>0)
+    self.out.cutflow.fillN('muon',mask.sum())
+    
+    
+    ##### EMU PAIR ###################################
+    iele, imuon = pairs(electrons,muons)
+    dR     = deltaR_arr(muons.eta[imuon],muons.phi[imuon],electrons.eta[iele],electrons.phi[iele])
+    iele, imuon = iele[dR>=self.pairCutDR], imuon[dR>=self.pairCutDR]
+    keys   = pairkeys(electrons.pt[iele],electrons.pfRelIso03_all[iele],muons.pt[imuon],muons.pfRelIso04_all[imuon],LeptonPair)
+    best   = choosepair(electrons.evt[iele],keys)
+    iele, imuon = iele[best], imuon[best]
+    self.out.cutflow.fillN('pair',len(best))
+    
+    
+    # FILL BRANCHES of passed events
+    if len(best)>0:
+      self.fillBlockBranches(block,electrons[iele],muons[imuon])
+    return len(best)
+    
+  
+  def fillBlockBranches(self, block, electron, muon):
+    """Fill branches for the selected electron-muon pairs in a block of events straight from arrays, like fillBranches,
+    given the selected electron and muon with one per passed event."""
+    ievt    = electron.evt
+    columns = self.blockEventColumns(block,ievt)
+    
+    
+    # VETOS
+    extramuon_veto, extraelec_veto, dilepton_veto = self.blockLepVetoes(block,ievt,[electron],[muon],[ ])
+    columns['extramuon_veto'], columns['extraelec_veto'], columns['dilepton_veto'] = extramuon_veto, extraelec_veto, dilepton_veto
+    columns['lepton_vetoes']       = extramuon_veto | extraelec_veto | dilepton_veto
+    columns['lepton_vetoes_notau'] = columns['lepton_vetoes']
+    
+    
+    # ELECTRON & MUON
+    columns.update(self.blockObjectColumns(electron,1,elevars))
+    columns.update(self.blockObjectColumns(muon,2,[('iso','pfRelIso04_all')]))
+    
+    
+    # TAU for jet -> tau fake rate measurement in emu+tau events
+    columns.update(self.blockExtraTauColumns(block,ievt,[electron,muon]))
+    
+    
+    # GENERATOR
+    if self.ismc:
+      columns['genmatch_1'] = electron.genPartFlav
+      columns['genmatch_2'] = muon.genPartFlav
+    
+    
+    # JETS
+    jetcolumns, jets = self.blockJetColumns(block,ievt,[electron,muon])
+    columns.update(jetcolumns)
+    
+    
+    # WEIGHTS
+    if self.ismc:
+      columns.update(self.blockCorrColumns(block,ievt,jets))
+      self.blockFillEffMaps(jets,ievt,(electron.pfRelIso03_all<0.50) & (muon.pfRelIso04_all<0.50))
+      
+      # MUON WEIGHTS
+      columns['trigweight']    = self.muSFs.getTriggerSFArray(electron.pt,electron.eta)
+      columns['idisoweight_1'] = self.muSFs.getIdIsoSFArray(electron.pt,electron.eta)
+      columns['idisoweight_2'] = self.muSFs.getIdIsoSFArray(muon.pt,muon.eta)
+    
+    
+    # MET & DILEPTON VARIABLES
+    columns.update(self.blockMETAndDiLeptonColumns(block,ievt,columns))
+    
+    
+    self.out.fillColumns(columns,len(ievt))
+  
+  
+  
+  def fillBranches(self, event, electron, muon):
+    """Fill branches for the selected electron-muon pair."""
+    
+    
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[muon],[ ],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[muon],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[muon],[ ],self.channel,cache=self.objcache)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[muon],[ ],self.channel,cache=self.objcache)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -183,7 +261,7 @@ class ModuleEMu(ModuleTauPair):
     # TAU for jet -> tau fake rate measurement in emu+tau events
     maxtau = None
     ptmax  = 20
-    for tau in Collection(event,'Tau'):
+    for tau in self.objcache.collection(event,'Tau'):
       if tau.pt<ptmax: continue
       if electron.DeltaR(tau)<0.5: continue
       if muon.DeltaR(tau)<0.5: continue
@@ -202,7 +280,7 @@ class ModuleEMu(ModuleTauPair):
       self.out.q_3[0]                      = maxtau.charge
       self.out.dm_3[0]                     = maxtau.decayMode
       self.out.iso_3[0]                    = maxtau.rawIso
-      self.out.idiso_2[0]                  = idIso(maxtau) # cut-based tau isolation (rawIso)
+      self.out.idiso_3[0]                  = idIso(maxtau) # cut-based tau isolation (rawIso)
       self.out.idAntiEle_3[0]              = maxtau.idAntiEle
       self.out.idAntiMu_3[0]               = maxtau.idAntiMu
       self.out.idMVAoldDM2017v2_3[0]       = maxtau.idMVAoldDM2017v2
@@ -229,8 +307,8 @@ class ModuleEMu(ModuleTauPair):
       self.out.idDeepTau2017v2p1VSmu_3[0]  = -1
       self.out.idDeepTau2017v2p1VSjet_3[0] = -1
       self.out.iso_3[0]                    = -1
+      self.out.idiso_3[0]                  = -1
       self.out.jpt_match_3[0]              = -1
-      self.out.jpt_genmatch_3[0]           = -1
       if self.ismc:
         self.out.jpt_genmatch_3[0]         = -1
         self.out.genmatch_3[0]             = -1
@@ -262,5 +340,4 @@ class ModuleEMu(ModuleTauPair):
     
     
     self.out.fill()
-    return True
     
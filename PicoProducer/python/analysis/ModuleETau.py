@@ -5,7 +5,8 @@ import numpy as np
 from TauFW.PicoProducer import datadir
 from TauFW.PicoProducer.analysis.TreeProducerETau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
-from TauFW.PicoProducer.analysis.utils import LeptonTauPair, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.utils import LeptonTauPair, bestpair, pairkeys, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import pairs, choosepair, deltaR as deltaR_arr
 from TauFW.PicoProducer.corrections.ElectronSFs import *
 from TauFW.PicoProducer.corrections.TrigObjMatcher import TrigObjMatcher
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool, TauFESTool
@@ -56,6 +57,18 @@ class ModuleETau(ModuleTauPair):
     pass
     
   
+  def getPreselection(self):
+    """Return preselection per cutflow bin for TTree::Draw (see ModuleTauPair.getPreselection).
+    The electron selection is looser, as it does not include the ID and trigger matching."""
+    electron = "Sum$(Electron_pt>=%s && abs(Electron_eta)<=%s && abs(Electron_dz)<=%s && abs(Electron_dxy)<=%s && "%(
+               self.eleCutPt,self.eleCutEta,self.eleCutDz,self.eleCutDxy)+\
+               "Electron_convVeto && Electron_lostHits<=%s)>0"%(self.eleCutHits)
+    return super(ModuleETau,self).getPreselection() + [
+      ('trig',     self.trigger.path),
+      ('electron', electron),
+    ]
+    
+  
   def analyze(self, event):
     """Process and pre-select events; fill branches and return True if the events passes,
     return False otherwise."""
@@ -86,86 +99,189 @@ class ModuleETau(ModuleTauPair):
     
     
     ##### ELECTRON ###################################
-    electrons = [ ]
-    for electron in Collection(event,'Electron'):
-      #if self.ismc and self.ees!=1:
-      #  electron.pt   *= self.ees
-      #  electron.mass *= self.ees
-      if electron.pt<self.eleCutPt: continue
-      if abs(electron.eta)>self.eleCutEta: continue
-      if abs(electron.dz)>0.2: continue
-      if abs(electron.dxy)>0.045: continue
-      if not electron.convVeto: continue
-      if electron.lostHits>1: continue
-      if not (electron.mvaFall17V2Iso_WP90 or electron.mvaFall17V2noIso_WP90): continue
-      if not self.trigger.match(event,electron): continue
-      electrons.append(electron)
+    electrons = self.getElectrons(event,self.eleCutPt,self.eleCutEta)
+    trigobjs  = self.trigger.matchall(event,electrons) # match all candidates at once
+    electrons = [e for e, o in zip(electrons,trigobjs) if o is not None]
     if len(electrons)==0:
       return False
     self.out.cutflow.fill('electron')
     
     
     ##### TAU ########################################
-    taus = [ ]
-    for tau in Collection(event,'Tau'):
-      if abs(tau.eta)>self.tauCutEta: continue
-      if abs(tau.dz)>0.2: continue
-      if tau.decayMode not in [0,1,10,11]: continue
-      if abs(tau.charge)!=1: continue
-      if tau.idDeepTau2017v2p1VSe<1: continue  # VVVLoose
-      if tau.idDeepTau2017v2p1VSmu<1: continue # VLoose
-      if tau.idDeepTau2017v2p1VSjet<self.tauwp: continue
-      if self.ismc:
-        tau.es   = 1 # store energy scale for propagating to MET
-        genmatch = tau.genPartFlav
-        if genmatch==5: # real tau
-          if self.tes!=None: # user-defined energy scale (for TES studies)
-            tes = self.tes
-          else: # (apply by default)
-            tes = self.tesTool.getTES(tau.pt,tau.decayMode,unc=self.tessys)
-          if tes!=1:
-            tau.pt   *= tes
-            tau.mass *= tes
-            tau.es    = tes
-        elif self.ltf and 0<genmatch<5: # lepton -> tau fake
-          tau.pt   *= self.ltf
-          tau.mass *= self.ltf
-          tau.es    = self.ltf
-        elif genmatch in [1,3]: # electron -> tau fake (apply by default, override with 'ltf=1.0')
-          fes = self.fesTool.getFES(tau.eta,tau.decayMode,unc=self.fes)
-          tau.pt   *= fes
-          tau.mass *= fes
-          tau.es    = fes
-        elif self.jtf!=1.0 and genmatch==0: # jet -> tau fake
-          tau.pt   *= self.jtf
-          tau.mass *= self.jtf
-          tau.es    = self.jtf
-      if tau.pt<self.tauCutPt: continue
-      taus.append(tau)
+    taus = self.getTaus(event)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    passed = self.analyzePair(event,electrons,taus)
+    if self.variations:
+      for variation in self.variations: # reuse electrons, only shift taus
+        self.setVariation(variation)
+        self.analyzePair(event,electrons,taus)
+      self.setVariation(None)
+    return passed
+    
+  
+  def analyzePair(self, event, electrons, taus):
+    """Apply the tau energy scale, select the best electron-tau pair, and fill branches;
+    return True if the events passes. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    if self.ismc:
+      for tau in taus:
+        self.applyTauES(tau)
+    taus = [t for t in taus if t.pt>=self.tauCutPt]
     if len(taus)==0:
       return False
-    self.out.cutflow.fill('tau')
+    if not self.variation:
+      self.out.cutflow.fill('tau')
     
     
     ##### ETAU PAIR ##################################
-    ltaus = [ ]
-    for electron in electrons:
-      for tau in taus:
-        if tau.DeltaR(electron)<0.5: continue
-        ltau = LeptonTauPair(electron,electron.pfRelIso03_all,tau,tau.rawDeepTau2017v2p1VSjet)
-        ltaus.append(ltau)
-    
-    if len(ltaus)==0:
+    ltau = bestpair(electrons,[e.pfRelIso03_all for e in electrons],taus,[t.rawDeepTau2017v2p1VSjet for t in taus],LeptonTauPair,self.pairCutDR)
+    if ltau is None:
       return False
-    electron, tau = max(ltaus).pair
+    electron, tau = ltau
     electron.tlv  = electron.p4()
     tau.tlv       = tau.p4()
-    self.out.cutflow.fill('pair')
+    if not self.variation:
+      self.out.cutflow.fill('pair')
+    
+    
+    # FILL BRANCHES
+    self.fillBranches(event,electron,tau)
+    return True
+  
+  
+  def analyzeBlock(self, block):
+    """Process and pre-select a block of events with numpy arrays (see analysis/columnar.py);
+    fill branches for the passed events, and return the number of passed events."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    mask = self.blockNoCut(block)
+    
+    
+    ##### TRIGGER ####################################
+    mask = mask & self.trigger.firedBlock(block)
+    self.out.cutflow.fillN('trig',mask.sum())
+    
+    
+    ##### ELECTRON ###################################
+    electrons = self.blockElectrons(block,mask,self.eleCutPt,self.eleCutEta)
+    electrons = electrons[self.trigger.matchBlock(block,electrons)]
+    mask      = mask & (electrons.nperevent()>0)
+    self.out.cutflow.fillN('electron',mask.sum())
+    
+    
+    ##### TAU ########################################
+    taus = self.blockTaus(block,mask)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    npass = self.analyzeBlockPair(block,mask,electrons,taus)
+    if self.variations:
+      for variation in self.variations: # reuse electrons, only shift taus
+        self.setVariation(variation)
+        self.analyzeBlockPair(block,mask,electrons,taus)
+      self.setVariation(None)
+    return npass
+  
+  
+  def analyzeBlockPair(self, block, mask, electrons, taus):
+    """Apply the tau energy scale, select the best electron-tau pair per event, and fill branches;
+    return the number of passed events. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    taues  = self.blockTauES(taus)
+    passpt = taus.pt*taues>=self.tauCutPt
+    taus, taues = taus[passpt], taues[passpt]
+    mask   = mask & (taus.nperevent()>0)
+    if not self.variation:
+      self.out.cutflow.fillN('tau',mask.sum())
+    
+    
+    ##### ETAU PAIR ##################################
+    iele, itau = pairs(electrons,taus)
+    dR     = deltaR_arr(taus.eta[itau],taus.phi[itau],electrons.eta[iele],electrons.phi[iele])
+    iele, itau = iele[dR>=self.pairCutDR], itau[dR>=self.pairCutDR]
+    keys   = pairkeys(electrons.pt[iele],electrons.pfRelIso03_all[iele],taus.pt[itau]*taues[itau],taus.rawDeepTau2017v2p1VSjet[itau],LeptonTauPair)
+    best   = choosepair(electrons.evt[iele],keys)
+    iele, itau = iele[best], itau[best]
+    if not self.variation:
+      self.out.cutflow.fillN('pair',len(best))
+    
+    
+    # FILL BRANCHES of passed events
+    if len(best)>0:
+      self.fillBlockBranches(block,electrons[iele],taus[itau],taues[itau])
+    return len(best)
+    
+  
+  def fillBlockBranches(self, block, electron, tau, taues):
+    """Fill branches for the selected electron-tau pairs in a block of events straight from arrays, like fillBranches,
+    given the selected electron and tau with one per passed event, and the tau energy scales."""
+    ievt    = electron.evt
+    columns = self.blockEventColumns(block,ievt)
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[ ],[tau],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[ ],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = self.blockLepVetoes(block,ievt,[electron],[ ],[tau])
+    columns['extramuon_veto'], columns['extraelec_veto'], columns['dilepton_veto'] = self.blockLepVetoes(block,ievt,[electron],[ ],[ ])
+    columns['lepton_vetoes']       = columns['extramuon_veto'] | columns['extraelec_veto'] | columns['dilepton_veto']
+    columns['lepton_vetoes_notau'] = extramuon_veto | extraelec_veto | dilepton_veto
+    
+    
+    # ELECTRON & TAU
+    columns.update(self.blockObjectColumns(electron,1,elevars))
+    columns.update(self.blockTauColumns(tau,2,taues,['rawAntiEle','rawMVAoldDM2017v2','rawMVAnewDM2017v2']+tauvars))
+    
+    
+    # GENERATOR
+    if self.ismc:
+      columns['genmatch_1'] = electron.genPartFlav
+      columns['genmatch_2'] = tau.genPartFlav
+      columns['genvistaupt_2'], columns['genvistaueta_2'], columns['genvistauphi_2'], columns['gendm_2'] = self.blockGenVisTau(block,tau)
+    
+    
+    # JETS
+    jetcolumns, jets = self.blockJetColumns(block,ievt,[electron,tau])
+    columns.update(jetcolumns)
+    columns['jpt_match_2'], jpt_genmatch = self.blockTauJet(block,tau)
+    
+    
+    # WEIGHTS
+    if self.ismc:
+      columns['jpt_genmatch_2'] = jpt_genmatch
+      columns.update(self.blockCorrColumns(block,ievt,jets))
+      if not self.variation:
+        self.blockFillEffMaps(jets,ievt,(electron.pfRelIso03_all<0.50) & (tau.idDeepTau2017v2p1VSjet>=2))
+      columns['trigweight']    = self.eleSFs.getTriggerSFArray(electron.pt,electron.eta)
+      columns['idisoweight_1'] = self.eleSFs.getIdIsoSFArray(electron.pt,electron.eta)
+      columns.update(self.blockTauSFColumns(tau,columns['pt_2'],2))
+      columns['weight']        = self.blockWeight(columns,['genweight','puweight','trigweight','idisoweight_1'])
+    elif self.isembed:
+      columns['genweight']     = block.genWeight[ievt]
+      columns['trackweight']   = np.select([tau.decayMode==0,tau.decayMode==1,tau.decayMode==10,tau.decayMode==11],[0.975,1.0247,0.927,0.974],1.0)
+    
+    
+    # MET & DILEPTON VARIABLES
+    columns.update(self.blockMETAndDiLeptonColumns(block,ievt,columns,es2=taues))
+    
+    
+    self.out.fillColumns(columns,len(ievt))
+  
+  
+  
+  def fillBranches(self, event, electron, tau):
+    """Fill branches for the selected electron-tau pair."""
+    
+    
+    # VETOS
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[electron],[ ],[tau],self.channel,cache=self.objcache)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[electron],[ ],[ ],self.channel,cache=self.objcache)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -259,13 +375,22 @@ class ModuleETau(ModuleTauPair):
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBraches(event,jets,met,njets_vars,met_vars)
-      if electron.pfRelIso03_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2:
+      if electron.pfRelIso03_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2 and not self.variation:
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       
       # MUON WEIGHTS
       self.out.trigweight[0]              = self.eleSFs.getTriggerSF(electron.pt,electron.eta)
       self.out.idisoweight_1[0]           = self.eleSFs.getIdIsoSF(electron.pt,electron.eta)
       
+      # DEFAULTS
+      self.out.idweight_2[0]              = 1.
+      self.out.ltfweight_2[0]             = 1.
+      if not self.dotight:
+        self.out.idweightUp_2[0]          = 1.
+        self.out.idweightDown_2[0]        = 1.
+        self.out.ltfweightUp_2[0]         = 1.
+        self.out.ltfweightDown_2[0]       = 1.
+      
       # TAU WEIGHTS
       if tau.genPartFlav==5: # real tau
         self.out.idweight_2[0]              = self.tauSFs.getSFvsPT(tau.pt)
@@ -294,5 +419,4 @@ class ModuleETau(ModuleTauPair):
     
     
     self.out.fill()
-    return True
     
@@ -4,7 +4,9 @@ import sys
 import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerMuMu import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
-from TauFW.PicoProducer.analysis.utils import LeptonPair, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.utils import LeptonPair, pairkeys, idIso, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import uniquepairs, choosepair, deltaR as deltaR_arr
+from TauFW.PicoProducer.analysis.kinematics import invmass
 from TauFW.PicoProducer.corrections.MuonSFs import *
 #from TauFW.PicoProducer.corrections.TrigObjMatcher import loadTriggerDataFromJSON, TrigObjMatcher
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool
@@ -18,20 +20,18 @@ class ModuleMuMu(ModuleTauPair):
     self.out = TreeProducerMuMu(fname,self)
     self.zwindow = kwargs.get('ZWindow', True )
     
-    # TRIGGERS
+    # TRIGGERS: leading muon pt and muon eta thresholds of the first entry with a fired trigger (see ModuleTauPair.getTrigCuts)
     if self.year==2016:
-      self.trigger    = lambda e: e.HLT_IsoMu22 or e.HLT_IsoMu22_eta2p1 or e.HLT_IsoTkMu22 or e.HLT_IsoTkMu22_eta2p1 #or e.HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1
-      self.muon1CutPt = lambda e: 23
-      self.muonCutEta = lambda e: 2.4 if e.HLT_IsoMu22 or e.HLT_IsoTkMu22 else 2.1
+      self.muonTriggers = ['HLT_IsoMu22','HLT_IsoMu22_eta2p1','HLT_IsoTkMu22','HLT_IsoTkMu22_eta2p1'] #,'HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1'
+      self.muonCuts     = [(['HLT_IsoMu22','HLT_IsoTkMu22'],23,2.4),([ ],23,2.1)]
     elif self.year==2017:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muon1CutPt = lambda e: 25 if e.HLT_IsoMu24 else 28
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [(['HLT_IsoMu24'],25,2.4),([ ],28,2.4)]
     else:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muon1CutPt = lambda e: 25
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [([ ],25,2.4)]
     self.muon2CutPt   = 15
+    self.zCutMass     = (70,110) # Z mass window
     self.tauCutPt     = 20
     self.tauCutEta    = 2.3
     
@@ -51,9 +51,9 @@ class ModuleMuMu(ModuleTauPair):
   def beginJob(self):
     """Before processing any events or files."""
     super(ModuleMuMu,self).beginJob()
-    print ">>> %-12s = %s"%('muon1CutPt', self.muon1CutPt)
+    print ">>> %-12s = %s"%('triggers',   self.muonTriggers)
+    print ">>> %-12s = %s"%('muonCuts',   self.muonCuts)
     print ">>> %-12s = %s"%('muon2CutPt', self.muon2CutPt)
-    print ">>> %-12s = %s"%('muonCutEta', self.muonCutEta)
     print ">>> %-12s = %s"%('tauCutPt',   self.tauCutPt)
     print ">>> %-12s = %s"%('tauCutEta',  self.tauCutEta)
     pass
@@ -83,21 +83,14 @@ class ModuleMuMu(ModuleTauPair):
     
     
     ##### TRIGGER ####################################
-    if not self.trigger(event):
+    if not self.fired(event,self.muonTriggers):
       return False
     self.out.cutflow.fill('trig')
     
     
     ##### MUON #######################################
-    muons = [ ]
-    for muon in Collection(event,'Muon'):
-      if muon.pt<self.muon2CutPt: continue # lower pt cut
-      if abs(muon.eta)>self.muonCutEta(event): continue
-      if abs(muon.dz)>0.2: continue
-      if abs(muon.dxy)>0.045: continue
-      if not muon.mediumId: continue
-      if muon.pfRelIso04_all>0.50: continue
-      muons.append(muon)
+    ptcut, etacut = self.getTrigCuts(event,self.muonCuts) # trigger dependent
+    muons = self.getMuons(event,self.muon2CutPt,etacut) # lower pt cut
     if len(muons)==0:
       return False
     self.out.cutflow.fill('muon')
@@ -105,12 +98,11 @@ class ModuleMuMu(ModuleTauPair):
     
     ##### MUMU PAIR #################################
     dileps = [ ]
-    ptcut  = self.muon1CutPt(event) # trigger dependent
     for i, muon1 in enumerate(muons,1):
       for muon2 in muons[i:]:
-        if muon2.DeltaR(muon1)<0.5: continue
+        if muon2.DeltaR(muon1)<self.pairCutDR: continue
         if muon1.pt<ptcut and muon2.pt<ptcut: continue # larger pt cut
-        if self.zwindow and not (70<(muon1.p4()+muon2.p4()).M()<110): continue # Z mass
+        if self.zwindow and not (self.zCutMass[0]<(muon1.p4()+muon2.p4()).M()<self.zCutMass[1]): continue # Z mass
         ltau = LeptonPair(muon1,muon1.pfRelIso04_all,muon2,muon2.pfRelIso04_all)
         dileps.append(ltau)
     if len(dileps)==0:
@@ -121,9 +113,116 @@ class ModuleMuMu(ModuleTauPair):
     self.out.cutflow.fill('pair')
     
     
+    # FILL BRANCHES
+    self.fillBranches(event,muon1,muon2)
+    return True
+  
+  
+  def analyzeBlock(self, block):
+    """Process and pre-select a block of events with numpy arrays (see analysis/columnar.py);
+    fill branches for the passed events, and return the number of passed events."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    mask = self.blockNoCut(block)
+    
+    
+    ##### TRIGGER ####################################
+    mask = mask & self.blockFired(block,self.muonTriggers)
+    self.out.cutflow.fillN('trig',mask.sum())
+    
+    
+    ##### MUON #######################################
+    ptcut, etacut = self.blockTrigCuts(block,self.muonCuts) # trigger dependent
+    muons  = self.blockMuons(block,mask,np.full(block.nevents,self.muon2CutPt),etacut) # lower pt cut
+    mask   = mask & (muons.nperevent()>0)
+    self.out.cutflow.fillN('muon',mask.sum())
+    
+    
+    ##### MUMU PAIR #################################
+    imuon1, imuon2 = uniquepairs(muons)
+    pt1, pt2 = muons.pt[imuon1], muons.pt[imuon2]
+    ptcut  = ptcut[muons.evt[imuon1]]
+    passed = (deltaR_arr(muons.eta[imuon2],muons.phi[imuon2],muons.eta[imuon1],muons.phi[imuon1])>=self.pairCutDR) &\
+             ((pt1>=ptcut) | (pt2>=ptcut)) # larger pt cut
+    if self.zwindow: # Z mass
+      mass   = invmass(pt1,muons.eta[imuon1],muons.phi[imuon1],muons.mass[imuon1],
+                       pt2,muons.eta[imuon2],muons.phi[imuon2],muons.mass[imuon2])[0]
+      passed &= (self.zCutMass[0]<mass) & (mass<self.zCutMass[1])
+    imuon1, imuon2 = imuon1[passed], imuon2[passed]
+    keys   = pairkeys(muons.pt[imuon1],muons.pfRelIso04_all[imuon1],muons.pt[imuon2],muons.pfRelIso04_all[imuon2],LeptonPair)
+    best   = choosepair(muons.evt[imuon1],keys)
+    imuon1, imuon2 = imuon1[best], imuon2[best]
+    self.out.cutflow.fillN('pair',len(best))
+    
+    
+    # FILL BRANCHES of passed events
+    if len(best)>0:
+      self.fillBlockBranches(block,muons[imuon1],muons[imuon2])
+    return len(best)
+    
+  
+  def fillBlockBranches(self, block, muon1, muon2):
+    """Fill branches for the selected dimuon pairs in a block of events straight from arrays, like fillBranches,
+    given the selected muons with one per passed event."""
+    ievt    = muon1.evt
+    columns = self.blockEventColumns(block,ievt)
+    
+    
+    # VETOS
+    extramuon_veto, extraelec_veto, dilepton_veto = self.blockLepVetoes(block,ievt,[ ],[muon1,muon2],[ ])
+    columns['extramuon_veto'], columns['extraelec_veto'], columns['dilepton_veto'] = extramuon_veto, extraelec_veto, dilepton_veto
+    columns['lepton_vetoes']       = extramuon_veto | extraelec_veto | dilepton_veto
+    columns['lepton_vetoes_notau'] = columns['lepton_vetoes']
+    
+    
+    # MUONS
+    columns.update(self.blockObjectColumns(muon1,1,[('iso','pfRelIso04_all')]))
+    columns.update(self.blockObjectColumns(muon2,2,[('iso','pfRelIso04_all')]))
+    
+    
+    # TAU for jet -> tau fake rate measurement in mumu+tau events
+    columns.update(self.blockExtraTauColumns(block,ievt,[muon1,muon2]))
+    
+    
+    # GENERATOR
+    if self.ismc:
+      columns['genmatch_1'] = muon1.genPartFlav
+      columns['genmatch_2'] = muon2.genPartFlav
+    
+    
+    # JETS
+    jetcolumns, jets = self.blockJetColumns(block,ievt,[muon1,muon2])
+    columns.update(jetcolumns)
+    
+    
+    # WEIGHTS
+    if self.ismc:
+      columns.update(self.blockCorrColumns(block,ievt,jets))
+      self.blockFillEffMaps(jets,ievt,(muon1.pfRelIso04_all<0.50) & (muon2.pfRelIso04_all<0.50))
+      
+      # MUON WEIGHTS
+      columns['trigweight']    = self.muSFs.getTriggerSFArray(muon1.pt,muon1.eta)
+      columns['idisoweight_1'] = self.muSFs.getIdIsoSFArray(muon1.pt,muon1.eta)
+      columns['idisoweight_2'] = self.muSFs.getIdIsoSFArray(muon2.pt,muon2.eta)
+    
+    
+    # MET & DILEPTON VARIABLES
+    columns.update(self.blockMETAndDiLeptonColumns(block,ievt,columns))
+    
+    
+    self.out.fillColumns(columns,len(ievt))
+  
+  
+  
+  def fillBranches(self, event, muon1, muon2):
+    """Fill branches for the selected dimuon pair."""
+    
+    
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon1,muon2],[ ],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = extramuon_veto or extraelec_veto or dilepton_veto
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon1,muon2],[ ],self.channel,cache=self.objcache)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = extramuon_veto, extraelec_veto, dilepton_veto
     self.out.lepton_vetoes[0]       = extramuon_veto or extraelec_veto or dilepton_veto
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -159,7 +258,7 @@ class ModuleMuMu(ModuleTauPair):
     # TAU for jet -> tau fake rate measurement in mumu+tau events
     maxtau = None
     ptmax  = 20
-    for tau in Collection(event,'Tau'):
+    for tau in self.objcache.collection(event,'Tau'):
       if tau.pt<ptmax: continue
       if muon1.DeltaR(tau)<0.5: continue
       if muon2.DeltaR(tau)<0.5: continue
@@ -178,7 +277,7 @@ class ModuleMuMu(ModuleTauPair):
       self.out.q_3[0]                      = maxtau.charge
       self.out.dm_3[0]                     = maxtau.decayMode
       self.out.iso_3[0]                    = maxtau.rawIso
-      self.out.idiso_2[0]                  = idIso(maxtau) # cut-based tau isolation (rawIso)
+      self.out.idiso_3[0]                  = idIso(maxtau) # cut-based tau isolation (rawIso)
       self.out.idAntiEle_3[0]              = maxtau.idAntiEle
       self.out.idAntiMu_3[0]               = maxtau.idAntiMu
       self.out.idMVAoldDM2017v2_3[0]       = maxtau.idMVAoldDM2017v2
@@ -205,6 +304,7 @@ class ModuleMuMu(ModuleTauPair):
       self.out.idDeepTau2017v2p1VSmu_3[0]  = -1
       self.out.idDeepTau2017v2p1VSjet_3[0] = -1
       self.out.iso_3[0]                    = -1
+      self.out.idiso_3[0]                  = -1
       self.out.jpt_match_3[0]              = -1
       if self.ismc:
         self.out.jpt_genmatch_3[0]         = -1
@@ -237,5 +337,4 @@ class ModuleMuMu(ModuleTauPair):
     
     
     self.out.fill()
-    return True
     
@@ -4,7 +4,8 @@ import sys
 import numpy as np
 from TauFW.PicoProducer.analysis.TreeProducerMuTau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
-from TauFW.PicoProducer.analysis.utils import LeptonTauPair, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.utils import LeptonTauPair, bestpair, pairkeys, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import pairs, choosepair, deltaR as deltaR_arr
 from TauFW.PicoProducer.corrections.MuonSFs import *
 #from TauFW.PicoProducer.corrections.TrigObjMatcher import loadTriggerDataFromJSON, TrigObjMatcher
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool
@@ -17,19 +18,16 @@ class ModuleMuTau(ModuleTauPair):
     super(ModuleMuTau,self).__init__(fname,**kwargs)
     self.out = TreeProducerMuTau(fname,self)
     
-    # TRIGGERS
+    # TRIGGERS: muon (pt, eta) thresholds of the first entry with a fired trigger (see ModuleTauPair.getTrigCuts)
     if self.year==2016:
-      self.trigger    = lambda e: e.HLT_IsoMu22 or e.HLT_IsoMu22_eta2p1 or e.HLT_IsoTkMu22 or e.HLT_IsoTkMu22_eta2p1 #or e.HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1
-      self.muonCutPt  = lambda e: 23
-      self.muonCutEta = lambda e: 2.4 if e.HLT_IsoMu22 or e.HLT_IsoTkMu22 else 2.1
+      self.muonTriggers = ['HLT_IsoMu22','HLT_IsoMu22_eta2p1','HLT_IsoTkMu22','HLT_IsoTkMu22_eta2p1'] #,'HLT_IsoMu19_eta2p1_LooseIsoPFTau20_SingleL1'
+      self.muonCuts     = [(['HLT_IsoMu22','HLT_IsoTkMu22'],23,2.4),([ ],23,2.1)]
     elif self.year==2017:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muonCutPt  = lambda e: 25 if e.HLT_IsoMu24 else 28
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [(['HLT_IsoMu24'],25,2.4),([ ],28,2.4)]
     else:
-      self.trigger    = lambda e: e.HLT_IsoMu24 or e.HLT_IsoMu27 #or e.HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1
-      self.muonCutPt  = lambda e: 25
-      self.muonCutEta = lambda e: 2.4
+      self.muonTriggers = ['HLT_IsoMu24','HLT_IsoMu27'] #,'HLT_IsoMu20_eta2p1_LooseChargedIsoPFTau27_eta2p1_CrossL1'
+      self.muonCuts     = [([ ],25,2.4)]
     self.tauCutPt     = 20
     self.tauCutEta    = 2.3
     
@@ -56,13 +54,22 @@ class ModuleMuTau(ModuleTauPair):
     """Before processing any events or files."""
     super(ModuleMuTau,self).beginJob()
     print ">>> %-12s = %s"%('tauwp',      self.tauwp)
-    print ">>> %-12s = %s"%('muonCutPt',  self.muonCutPt)
-    print ">>> %-12s = %s"%('muonCutEta', self.muonCutEta)
+    print ">>> %-12s = %s"%('triggers',   self.muonTriggers)
+    print ">>> %-12s = %s"%('muonCuts',   self.muonCuts)
     print ">>> %-12s = %s"%('tauCutPt',   self.tauCutPt)
     print ">>> %-12s = %s"%('tauCutEta',  self.tauCutEta)
     pass
     
   
+  def getPreselection(self):
+    """Return preselection per cutflow bin for TTree::Draw (see ModuleTauPair.getPreselection)."""
+    return super(ModuleMuTau,self).getPreselection() + [
+      ('trig', " || ".join(self.muonTriggers)),
+      ('muon', self.getMuonPreselection(self.muonCuts)),
+      ('tau',  self.getTauPreselection()),
+    ]
+    
+  
   def analyze(self, event):
     """Process and pre-select events; fill branches and return True if the events passes,
     return False otherwise."""
@@ -87,86 +94,191 @@ class ModuleMuTau(ModuleTauPair):
     
     
     ##### TRIGGER ####################################
-    if not self.trigger(event):
+    if not self.fired(event,self.muonTriggers):
       return False
     self.out.cutflow.fill('trig')
     
     
     ##### MUON #######################################
-    muons = [ ]
-    for muon in Collection(event,'Muon'):
-      if muon.pt<self.muonCutPt(event): continue
-      if abs(muon.eta)>self.muonCutEta(event): continue
-      if abs(muon.dz)>0.2: continue
-      if abs(muon.dxy)>0.045: continue
-      if not muon.mediumId: continue
-      if muon.pfRelIso04_all>0.50: continue
-      muons.append(muon)
+    muons = self.getMuons(event,*self.getTrigCuts(event,self.muonCuts))
     if len(muons)==0:
       return False
     self.out.cutflow.fill('muon')
     
     
     ##### TAU ########################################
-    taus = [ ]
-    for tau in Collection(event,'Tau'):
-      if abs(tau.eta)>self.tauCutEta: continue
-      if abs(tau.dz)>0.2: continue
-      if tau.decayMode not in [0,1,10,11]: continue
-      if abs(tau.charge)!=1: continue
-      if tau.idDeepTau2017v2p1VSe<1: continue # VVVLoose
-      if tau.idDeepTau2017v2p1VSmu<1: continue # VLoose
-      if tau.idDeepTau2017v2p1VSjet<self.tauwp: continue
-      if self.ismc:
-        tau.es   = 1 # store energy scale for propagating to MET
-        genmatch = tau.genPartFlav
-        if genmatch==5: # real tau
-          if self.tes!=None: # user-defined energy scale (for TES studies)
-            tes = self.tes
-          else: # (apply by default)
-            tes = self.tesTool.getTES(tau.pt,tau.decayMode,unc=self.tessys)
-          if tes!=1:
-            tau.pt   *= tes
-            tau.mass *= tes
-            tau.es    = tes
-        elif self.ltf and 0<genmatch<5: # lepton -> tau fake
-          tau.pt   *= self.ltf
-          tau.mass *= self.ltf
-          tau.es    = self.ltf
-        #elif genmatch in [1,3]: # electron -> tau fake (apply by default, override with 'ltf=1.0')
-        #  fes = self.fesTool.getFES(tau.eta,tau.decayMode,unc=self.fes)
-        #  tau.pt   *= fes
-        #  tau.mass *= fes
-        #  tau.es    = fes
-        elif self.jtf!=1.0 and genmatch==0: # jet -> tau fake
-          tau.pt   *= self.jtf
-          tau.mass *= self.jtf
-          tau.es    = self.jtf
-      if tau.pt<self.tauCutPt: continue
-      taus.append(tau)
+    taus = self.getTaus(event)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    passed = self.analyzePair(event,muons,taus)
+    if self.variations:
+      for variation in self.variations: # reuse muons, only shift taus
+        self.setVariation(variation)
+        self.analyzePair(event,muons,taus)
+      self.setVariation(None)
+    return passed
+    
+  
+  def analyzePair(self, event, muons, taus):
+    """Apply the tau energy scale, select the best muon-tau pair, and fill branches;
+    return True if the events passes. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    if self.ismc:
+      for tau in taus:
+        self.applyTauES(tau)
+    taus = [t for t in taus if t.pt>=self.tauCutPt]
     if len(taus)==0:
       return False
-    self.out.cutflow.fill('tau')
+    if not self.variation:
+      self.out.cutflow.fill('tau')
     
     
     ##### MUTAU PAIR #################################
-    ltaus = [ ]
-    for muon in muons:
-      for tau in taus:
-        if tau.DeltaR(muon)<0.5: continue
-        ltau = LeptonTauPair(muon,muon.pfRelIso04_all,tau,tau.rawDeepTau2017v2p1VSjet)
-        ltaus.append(ltau)
-    if len(ltaus)==0:
+    ltau = bestpair(muons,[m.pfRelIso04_all for m in muons],taus,[t.rawDeepTau2017v2p1VSjet for t in taus],LeptonTauPair,self.pairCutDR)
+    if ltau is None:
       return False
-    muon, tau = max(ltaus).pair
+    muon, tau = ltau
     muon.tlv  = muon.p4()
     tau.tlv   = tau.p4()
-    self.out.cutflow.fill('pair')
+    if not self.variation:
+      self.out.cutflow.fill('pair')
+    
+    
+    # FILL BRANCHES
+    self.fillBranches(event,muon,tau)
+    return True
+    
+  
+  def analyzeBlock(self, block):
+    """Process and pre-select a block of events with numpy arrays (see analysis/columnar.py);
+    fill branches for the passed events, and return the number of passed events."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    mask = self.blockNoCut(block)
+    
+    
+    ##### TRIGGER ####################################
+    mask = mask & self.blockFired(block,self.muonTriggers)
+    self.out.cutflow.fillN('trig',mask.sum())
+    
+    
+    ##### MUON #######################################
+    muons  = self.blockMuons(block,mask,*self.blockTrigCuts(block,self.muonCuts))
+    mask   = mask & (muons.nperevent()>0)
+    self.out.cutflow.fillN('muon',mask.sum())
+    
+    
+    ##### TAU ########################################
+    taus   = self.blockTaus(block,mask)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    npass = self.analyzeBlockPair(block,mask,muons,taus)
+    if self.variations:
+      for variation in self.variations: # reuse muons, only shift taus
+        self.setVariation(variation)
+        self.analyzeBlockPair(block,mask,muons,taus)
+      self.setVariation(None)
+    return npass
+  
+  
+  def analyzeBlockPair(self, block, mask, muons, taus):
+    """Apply the tau energy scale, select the best muon-tau pair per event, and fill branches;
+    return the number of passed events. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    taues  = self.blockTauES(taus)
+    passpt = taus.pt*taues>=self.tauCutPt
+    taus, taues = taus[passpt], taues[passpt]
+    mask   = mask & (taus.nperevent()>0)
+    if not self.variation:
+      self.out.cutflow.fillN('tau',mask.sum())
+    
+    
+    ##### MUTAU PAIR #################################
+    imuon, itau = pairs(muons,taus)
+    dR     = deltaR_arr(taus.eta[itau],taus.phi[itau],muons.eta[imuon],muons.phi[imuon])
+    imuon, itau = imuon[dR>=self.pairCutDR], itau[dR>=self.pairCutDR]
+    keys   = pairkeys(muons.pt[imuon],muons.pfRelIso04_all[imuon],taus.pt[itau]*taues[itau],taus.rawDeepTau2017v2p1VSjet[itau],LeptonTauPair)
+    best   = choosepair(muons.evt[imuon],keys)
+    imuon, itau = imuon[best], itau[best]
+    if not self.variation:
+      self.out.cutflow.fillN('pair',len(best))
+    
+    
+    # FILL BRANCHES of passed events
+    if len(best)>0:
+      self.fillBlockBranches(block,muons[imuon],taus[itau],taues[itau])
+    return len(best)
+    
+  
+  def fillBlockBranches(self, block, muon, tau, taues):
+    """Fill branches for the selected muon-tau pairs in a block of events straight from arrays, like fillBranches,
+    given the selected muon and tau with one per passed event, and the tau energy scales."""
+    ievt    = muon.evt
+    columns = self.blockEventColumns(block,ievt)
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon],[tau],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[muon],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = self.blockLepVetoes(block,ievt,[ ],[muon],[tau])
+    columns['extramuon_veto'], columns['extraelec_veto'], columns['dilepton_veto'] = self.blockLepVetoes(block,ievt,[ ],[muon],[ ])
+    columns['lepton_vetoes']       = columns['extramuon_veto'] | columns['extraelec_veto'] | columns['dilepton_veto']
+    columns['lepton_vetoes_notau'] = extramuon_veto | extraelec_veto | dilepton_veto
+    
+    
+    # MUON & TAU
+    columns.update(self.blockObjectColumns(muon,1,[('iso','pfRelIso04_all')]))
+    columns.update(self.blockTauColumns(tau,2,taues,['rawAntiEle','rawMVAoldDM2017v2','rawMVAnewDM2017v2']+tauvars))
+    
+    
+    # GENERATOR
+    if self.ismc:
+      columns['genmatch_1'] = muon.genPartFlav
+      columns['genmatch_2'] = tau.genPartFlav
+      columns['genvistaupt_2'], columns['genvistaueta_2'], columns['genvistauphi_2'], columns['gendm_2'] = self.blockGenVisTau(block,tau)
+    
+    
+    # JETS
+    jetcolumns, jets = self.blockJetColumns(block,ievt,[muon,tau])
+    columns.update(jetcolumns)
+    columns['jpt_match_2'], jpt_genmatch = self.blockTauJet(block,tau)
+    
+    
+    # WEIGHTS
+    if self.ismc:
+      columns['jpt_genmatch_2'] = jpt_genmatch
+      columns.update(self.blockCorrColumns(block,ievt,jets))
+      if not self.variation:
+        self.blockFillEffMaps(jets,ievt,(muon.pfRelIso04_all<0.50) & (tau.idDeepTau2017v2p1VSjet>=2))
+      columns['trigweight']    = self.muSFs.getTriggerSFArray(muon.pt,muon.eta)
+      columns['idisoweight_1'] = self.muSFs.getIdIsoSFArray(muon.pt,muon.eta)
+      columns.update(self.blockTauSFColumns(tau,columns['pt_2'],2))
+      columns['weight']        = self.blockWeight(columns,['genweight','puweight','trigweight','idisoweight_1'])
+    elif self.isembed:
+      columns['genweight']     = block.genWeight[ievt]
+      columns['trackweight']   = np.select([tau.decayMode==0,tau.decayMode==1,tau.decayMode==10,tau.decayMode==11],[0.975,1.0247,0.927,0.974],1.0)
+    
+    
+    # MET & DILEPTON VARIABLES
+    columns.update(self.blockMETAndDiLeptonColumns(block,ievt,columns,es2=taues))
+    
+    
+    self.out.fillColumns(columns,len(ievt))
+    
+  
+  def fillBranches(self, event, muon, tau):
+    """Fill branches for the selected muon-tau pair."""
+    
+    
+    # VETOS
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[muon],[tau],self.channel,cache=self.objcache)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[muon],[ ],self.channel,cache=self.objcache)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto or dilepton_veto
     
@@ -225,7 +337,7 @@ class ModuleMuTau(ModuleTauPair):
     if self.ismc:
       self.out.genmatch_1[0]     = muon.genPartFlav
       self.out.genmatch_2[0]     = tau.genPartFlav
-      pt, phi, eta, status       = matchgenvistau(event,tau)
+      pt, eta, phi, status       = matchgenvistau(event,tau)
       self.out.genvistaupt_2[0]  = pt
       self.out.genvistaueta_2[0] = eta
       self.out.genvistauphi_2[0] = phi
@@ -243,7 +355,7 @@ class ModuleMuTau(ModuleTauPair):
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBraches(event,jets,met,njets_vars,met_vars)
-      if muon.pfRelIso04_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2:
+      if muon.pfRelIso04_all<0.50 and tau.idDeepTau2017v2p1VSjet>=2 and not self.variation:
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       
       # MUON WEIGHTS
@@ -287,5 +399,4 @@ class ModuleMuTau(ModuleTauPair):
     
     
     self.out.fill()
-    return True
     
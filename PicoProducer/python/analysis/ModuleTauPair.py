@@ -2,18 +2,33 @@
 # Description: Base class for tau pair analysis
 from ROOT import TFile, TTree
 import sys, re
-from math import sqrt, exp, cos
-from ROOT import TLorentzVector, TVector3
+import numpy as np
+from math import exp
+from ROOT import TLorentzVector
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
 from TauFW.PicoProducer.corrections.PileupTool import *
 from TauFW.PicoProducer.corrections.RecoilCorrectionTool import *
 #from TauFW.PicoProducer.corrections.PreFireTool import *
 from TauFW.PicoProducer.corrections.BTagTool import BTagWeightTool, BTagWPs
-from TauFW.common.tools.log import header
-from TauFW.PicoProducer.analysis.utils import ensurebranches, deltaPhi, getmet, getmetfilters, correctmet, getlepvetoes
+from TauFW.common.tools.log import Logger, header
+from TauFW.PicoProducer.analysis.columnar import drawcolumns, pairs, uniquepairs, choosepair, eventcolumn, overlaps, isselected, rank
+from TauFW.PicoProducer.analysis.utils import ensurebranches, redirectformula, getmet, getmetbranches, getmetfilters, getmetfilterbranches, getlepvetoes, getoverlaps, idIsoArray, ObjectCache, EventCache, getvariations
+from TauFW.PicoProducer.analysis.kinematics import deltaR, deltaPhi, wrapphi, p4, ptphi, invmass, rapidity, mt, pzeta, project, correctmet
 __metaclass__ = type # to use super() with subclasses from CommonProducer
+LOG           = Logger('ModuleTauPair')
 tauSFVersion  = { 2016: '2016Legacy', 2017: '2017ReReco', 2018: '2018ReReco' }
+tauvars       = [ # tau variables stored in branches of the same name, e.g. idDeepTau2017v2p1VSjet_2
+  'rawDeepTau2017v2p1VSe','rawDeepTau2017v2p1VSmu','rawDeepTau2017v2p1VSjet','idAntiEle','idAntiMu',
+  'idDecayMode','idDecayModeNewDMs','idMVAoldDM2017v2','idMVAnewDM2017v2',
+  'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet',
+  'chargedIso','neutralIso','leadTkPtOverTauPt','photonsOutsideSignalCone','puCorr',
+]
+elevars       = [ # (branch, variable) of electrons, e.g. mvaFall17Iso_WP90_1
+  ('iso','pfRelIso03_all'),('cutBased','cutBased'),
+  ('mvaFall17Iso_WP90','mvaFall17V2Iso_WP90'),('mvaFall17Iso_WP80','mvaFall17V2Iso_WP80'),
+  ('mvaFall17noIso_WP90','mvaFall17V2noIso_WP90'),('mvaFall17noIso_WP80','mvaFall17V2noIso_WP80'),
+]
 
 
 
@@ -45,10 +60,26 @@ class ModuleTauPair(Module):
     self.dotight    = kwargs.get('tight',   self.tes not in [1,None] or self.tessys!=None or self.ltf!=1 or self.jtf!=1) # save memory
     self.dojec      = kwargs.get('jec',     True           ) and self.ismc #and self.year==2016 #False
     self.dojecsys   = kwargs.get('jecsys',  self.dojec     ) and self.ismc and not self.dotight #and self.dojec #and False
+    self.buffersize = kwargs.get('buffer',  0              ) # number of events to buffer before writing to tree
     self.verbosity  = kwargs.get('verb',    0              ) # verbosity
     self.jetCutPt   = 30
     self.bjetCutEta = 2.7
+    self.muonCutDz  = 0.2 # object selection, shared by analyze, analyzeBlock and getPreselection
+    self.muonCutDxy = 0.045
+    self.muonCutId  = 'mediumId'
+    self.muonCutIso = 0.50 # pfRelIso04_all
+    self.eleCutDz   = 0.2
+    self.eleCutDxy  = 0.045
+    self.eleCutHits = 1 # lost hits
+    self.eleCutIds  = ['mvaFall17V2Iso_WP90','mvaFall17V2noIso_WP90'] # pass any
+    self.tauCutDz   = 0.2
+    self.tauCutDMs  = [0,1,10,11]
+    self.tauCutVSe  = 1 # VVVLoose
+    self.tauCutVSmu = 1 # VLoose
+    self.pairCutDR  = 0.5
     self.isUL       = 'UL' in self.era
+    self.objcache   = ObjectCache() # share collections and selections of objects per event
+    self.evtcache   = kwargs.get('evtcache',None) or EventCache() # share event-level quantities with other channels
     
     assert self.year in [2016,2017,2018], "Did not recognize year %s! Please choose from 2016, 2017 and 2018."%self.year
     assert self.dtype in ['mc','data','embed'], "Did not recognize data type '%s'! Please choose from 'mc', 'data' and 'embed'."%self.dtype
@@ -56,13 +87,17 @@ class ModuleTauPair(Module):
     # YEAR-DEPENDENT IDs
     self.met        = getmet(self.era,"nom" if self.dojec else "",verb=self.verbosity)
     self.filter     = getmetfilters(self.era,self.isdata,verb=self.verbosity)
+    self.metbranches = getmetbranches(self.era,"nom" if self.dojec else "") # for arrays in columnar mode
+    self.metfilters  = getmetfilterbranches(self.era,self.isdata)
     
     # CORRECTIONS
     self.ptnom            = lambda j: j.pt # use 'pt' as nominal jet pt (not corrected)
+    self.ptnomvar         = 'pt' # same for arrays of jets
+    self.estables         = None # TES and FES per decay mode for arrays of taus, see getESTables
     self.jecUncLabels     = [ ]
     self.metUncLabels     = [ ]
     if self.ismc:
-      self.puTool         = PileupWeightTool(era=self.era,sample=self.filename,verb=self.verbosity)
+      self.puTool         = PileupWeightTool(era=self.era,sample=self.filename,updown=not self.dotight,verb=self.verbosity)
       self.btagTool       = BTagWeightTool('DeepCSV','medium',channel=self.channel,year=self.year,maxeta=self.bjetCutEta) #,loadsys=not self.dotight
       if self.dozpt:
         self.zptTool      = ZptCorrectionTool(year=self.year)
@@ -72,6 +107,7 @@ class ModuleTauPair(Module):
       #  self.prefireTool  = PreFireTool(self.year)
       if self.dojec:
         self.ptnom = lambda j: j.pt_nom # use 'pt_nom' as nominal jet pt
+        self.ptnomvar = 'pt_nom'
       #if self.dojecsys:
       #  self.jecUncLabels = [ u+v for u in ['jer','jesTotal'] for v in ['Down','Up']]
       #  self.metUncLabels = [ u+v for u in ['jer','jesTotal','unclustEn'] for v in ['Down','Up']]
@@ -81,6 +117,16 @@ class ModuleTauPair(Module):
     
     self.deepcsv_wp       = BTagWPs('DeepCSV',year=self.year)
     
+    # SYSTEMATIC VARIATIONS of tau energy scale and fakes in the same event loop, e.g. tesvars=0.97,1.03
+    self.variations       = [ ] # (key, value, treename), e.g. ('tes', 0.97, 'tree_TES0p970')
+    self.variation        = None # current variation; None = nominal
+    self.nomscales        = (self.tes, self.ltf, self.jtf)
+    if self.ismc:
+      for key in ['tes','ltf','jtf']:
+        for value in getvariations(kwargs.get(key+'vars',[ ])):
+          treename = "tree_%s%s"%(key.upper(),("%.3f"%value).replace('.','p'))
+          self.variations.append((key,value,treename))
+    
   
   def beginJob(self):
     """Before processing any events or files."""
@@ -108,6 +154,10 @@ class ModuleTauPair(Module):
     print ">>> %-12s = %s"%('dotight',   self.dotight)
     print ">>> %-12s = %s"%('jetCutPt',  self.jetCutPt)
     print ">>> %-12s = %s"%('bjetCutEta',self.bjetCutEta)
+    if self.variations:
+      print ">>> %-12s = %s"%('variations',self.variations)
+    for key, value, treename in self.variations:
+      self.out.addTree(treename,"%s=%s"%(key,value))
     
   
   def endJob(self):
@@ -120,6 +170,11 @@ class ModuleTauPair(Module):
   def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
     """Before processing a new file."""
     sys.stdout.flush()
+    ensurebranches(inputTree,self.getBranchMap())
+  
+  
+  def getBranchMap(self):
+    """Return list of (new branch, old branch or default value) for branches that may be missing in the nanoAOD files."""
     branches = [
       ('Electron_mvaFall17V2Iso',        'Electron_mvaFall17Iso'        ),
       ('Electron_mvaFall17V2Iso_WPL',    'Electron_mvaFall17Iso_WPL'    ),
@@ -135,7 +190,603 @@ class ModuleTauPair(Module):
         ('HLT_IsoMu22_eta2p1',   False ),
         ('HLT_IsoTkMu22_eta2p1', False ),
       ]
-    ensurebranches(inputTree,branches)
+    return branches
+    
+  
+  def analyzeBlock(self, block):
+    """Process a block of events in columnar mode (see analysis/columnar.py),
+    and return the number of passed events. By default, fall back to analyze for each event."""
+    npass = 0
+    for i in np.nonzero(block.mask)[0]:
+      if self.analyze(block.event(i)):
+        npass += 1
+    return npass
+    
+  
+  def blockNoCut(self, block):
+    """Fill the cutflow (and pileup) for a block of events in columnar mode,
+    and return the mask of events with a primary vertex (data) or pileup (MC)."""
+    mask = block.mask
+    self.out.cutflow.fillN('none',mask.sum())
+    if self.isdata:
+      self.out.cutflow.fillN('weight',mask.sum())
+      mask = mask & (block.PV_npvs>0)
+      self.out.cutflow.fillN('weight_no0PU',mask.sum())
+    else:
+      self.out.cutflow.fillN('weight',mask.sum(),block.genWeight[mask])
+      self.out.pileup.FillN(mask.sum(),np.ascontiguousarray(block.Pileup_nTrueInt[mask]),np.ones(mask.sum()))
+      mask = mask & (block.Pileup_nTrueInt>0)
+      self.out.cutflow.fillN('weight_no0PU',mask.sum(),block.genWeight[mask])
+    return mask
+    
+  
+  def fired(self, event, triggers):
+    """Return True if any trigger in a list fired."""
+    return any(getattr(event,t) for t in triggers)
+    
+  
+  def blockFired(self, block, triggers):
+    """Return mask of events in a block where any trigger in a list fired, like fired."""
+    mask = np.zeros(block.nevents,dtype=bool)
+    for trigger in triggers:
+      mask |= getattr(block,trigger)>0
+    return mask
+    
+  
+  def getTrigCuts(self, event, cuts):
+    """Return the (pt, eta) thresholds of the first (triggers, pt, eta) entry in a list
+    with a fired trigger. Entries without triggers always apply."""
+    for triggers, pt, eta in cuts:
+      if not triggers or self.fired(event,triggers):
+        return pt, eta
+    return cuts[-1][1:]
+    
+  
+  def blockTrigCuts(self, block, cuts):
+    """Return arrays of the (pt, eta) thresholds of the events in a block, like getTrigCuts."""
+    ptcut  = np.full(block.nevents,cuts[-1][1],dtype=np.float64)
+    etacut = np.full(block.nevents,cuts[-1][2],dtype=np.float64)
+    for triggers, pt, eta in reversed(cuts): # first entry wins
+      fired = self.blockFired(block,triggers) if triggers else slice(None)
+      ptcut[fired], etacut[fired] = pt, eta
+    return ptcut, etacut
+    
+  
+  def getTrigCutsFormula(self, cuts, formula):
+    """Return formula for TTree::Draw with the (pt, eta) thresholds of the first entry with a fired trigger,
+    like getTrigCuts, given a formula with two %s placeholders for the pt and eta thresholds."""
+    terms, vetoes = [ ], [ ]
+    for triggers, pt, eta in cuts:
+      conds = vetoes + (["(%s)"%(" || ".join(triggers))] if triggers else [ ])
+      terms.append("(%s)"%(" && ".join(conds+[formula%(pt,eta)])))
+      if not triggers: break
+      vetoes.append("!(%s)"%(" || ".join(triggers)))
+    return " || ".join(terms)
+    
+  
+  def getMuons(self, event, ptcut, etacut):
+    """Select muons in an event with pt and eta thresholds."""
+    muons = [ ]
+    for muon in self.objcache.collection(event,'Muon'):
+      if muon.pt<ptcut: continue
+      if abs(muon.eta)>etacut: continue
+      if abs(muon.dz)>self.muonCutDz: continue
+      if abs(muon.dxy)>self.muonCutDxy: continue
+      if not getattr(muon,self.muonCutId): continue
+      if muon.pfRelIso04_all>self.muonCutIso: continue
+      muons.append(muon)
+    return muons
+    
+  
+  def blockMuons(self, block, mask, ptcut, etacut):
+    """Select muons in a block of events passing a mask, like getMuons, with arrays of pt and eta thresholds per event."""
+    muons = block.collection('Muon',mask)
+    return muons[ (muons.pt>=ptcut[muons.evt]) & (abs(muons.eta)<=etacut[muons.evt]) &
+                  (abs(muons.dz)<=self.muonCutDz) & (abs(muons.dxy)<=self.muonCutDxy) &
+                  (getattr(muons,self.muonCutId)>0) & (muons.pfRelIso04_all<=self.muonCutIso) ]
+    
+  
+  def getMuonPreselection(self, cuts):
+    """Return formula to preselect events with a muon, given a list of (triggers, pt, eta) thresholds (see getTrigCuts)."""
+    muon = "Sum$(Muon_pt>=%%s && abs(Muon_eta)<=%%s && abs(Muon_dz)<=%s && abs(Muon_dxy)<=%s && Muon_%s && Muon_pfRelIso04_all<=%s)>0"%(
+           self.muonCutDz,self.muonCutDxy,self.muonCutId,self.muonCutIso)
+    return self.getTrigCutsFormula(cuts,muon)
+    
+  
+  def getElectrons(self, event, ptcut, etacut):
+    """Select electrons in an event with pt and eta thresholds."""
+    electrons = [ ]
+    for electron in self.objcache.collection(event,'Electron'):
+      #if self.ismc and self.ees!=1:
+      #  electron.pt   *= self.ees
+      #  electron.mass *= self.ees
+      if electron.pt<ptcut: continue
+      if abs(electron.eta)>etacut: continue
+      if abs(electron.dz)>self.eleCutDz: continue
+      if abs(electron.dxy)>self.eleCutDxy: continue
+      if not electron.convVeto: continue
+      if electron.lostHits>self.eleCutHits: continue
+      if not any(getattr(electron,id) for id in self.eleCutIds): continue
+      electrons.append(electron)
+    return electrons
+    
+  
+  def blockElectrons(self, block, mask, ptcut, etacut):
+    """Select electrons in a block of events passing a mask, like getElectrons."""
+    electrons = block.collection('Electron',mask)
+    passid    = np.zeros(len(electrons),dtype=bool)
+    for id in self.eleCutIds:
+      passid |= getattr(electrons,id)>0
+    return electrons[ (electrons.pt>=ptcut) & (abs(electrons.eta)<=etacut) &
+                      (abs(electrons.dz)<=self.eleCutDz) & (abs(electrons.dxy)<=self.eleCutDxy) &
+                      (electrons.convVeto>0) & (electrons.lostHits<=self.eleCutHits) & passid ]
+    
+  
+  def getTaus(self, event):
+    """Select tau candidates in an event (before the energy scale)."""
+    taus = [ ]
+    for tau in self.objcache.collection(event,'Tau'):
+      if abs(tau.eta)>self.tauCutEta: continue
+      if abs(tau.dz)>self.tauCutDz: continue
+      if tau.decayMode not in self.tauCutDMs: continue
+      if abs(tau.charge)!=1: continue
+      if tau.idDeepTau2017v2p1VSe<self.tauCutVSe: continue
+      if tau.idDeepTau2017v2p1VSmu<self.tauCutVSmu: continue
+      if tau.idDeepTau2017v2p1VSjet<self.tauwp: continue
+      taus.append(tau)
+    return taus
+    
+  
+  def blockTaus(self, block, mask):
+    """Select tau candidates in a block of events passing a mask, like getTaus (before the energy scale)."""
+    taus = block.collection('Tau',mask)
+    return taus[ (abs(taus.eta)<=self.tauCutEta) & (abs(taus.dz)<=self.tauCutDz) & np.isin(taus.decayMode,self.tauCutDMs) &
+                 (abs(taus.charge)==1) & (taus.idDeepTau2017v2p1VSe>=self.tauCutVSe) & (taus.idDeepTau2017v2p1VSmu>=self.tauCutVSmu) &
+                 (taus.idDeepTau2017v2p1VSjet>=self.tauwp) ]
+    
+  
+  def getESTables(self):
+    """Tabulate the tau energy scale (TES) per decay mode, and the electron -> tau fake energy scale (FES)
+    per decay mode in the barrel and endcap, to look them up for arrays of taus in blockTauES.
+    Each table is checked against the tool for a range of pt or eta, and is None if the energy scale
+    depends on more (e.g. the pt-dependent TES uncertainties), so the tool is called for each tau instead."""
+    testable, festable = None, None
+    if hasattr(self,'tesTool'):
+      testable = { }
+      for dm in self.tauCutDMs:
+        tes = self.tesTool.getTES(50.,dm,unc=self.tessys)
+        if any(self.tesTool.getTES(pt,dm,unc=self.tessys)!=tes for pt in [20.,30.,34.,100.,170.,500.,1000.]):
+          LOG.warning("getESTables: TES of DM %s depends on pt for tessys=%r! Using TauESTool for each tau..."%(dm,self.tessys))
+          testable = None
+          break
+        testable[dm] = tes
+    if hasattr(self,'fesTool'):
+      festable = { }
+      for dm in self.tauCutDMs:
+        fes = (self.fesTool.getFES(0.,dm,unc=self.fes),self.fesTool.getFES(2.,dm,unc=self.fes)) # barrel, endcap
+        if any(self.fesTool.getFES(eta,dm,unc=self.fes)!=fes[1 if abs(eta)>=1.5 else 0]
+               for a in [0.,0.5,1.2,1.479,1.499,1.5,1.6,2.0,2.3,2.5] for eta in [-a,a]):
+          LOG.warning("getESTables: FES of DM %s does not only depend on barrel or endcap! Using TauFESTool for each tau..."%(dm))
+          festable = None
+          break
+        festable[dm] = fes
+    return testable, festable
+    
+  
+  def blockTauES(self, taus):
+    """Return the energy scales of the taus in a block of events, like applyTauES,
+    with the TES and FES looked up per decay mode (see getESTables)."""
+    es       = np.ones(len(taus))
+    if not self.ismc:
+      return es
+    if self.estables is None:
+      self.estables = self.getESTables()
+    testable, festable = self.estables
+    genmatch = taus.genPartFlav
+    dms      = taus.decayMode.astype(np.int64)
+    isreal   = genmatch==5
+    if self.tes!=None: # user-defined energy scale (for TES studies)
+      es[isreal] = self.tes
+    elif testable is not None: # (apply by default)
+      for dm in np.unique(dms[isreal]):
+        es[isreal & (dms==dm)] = testable[dm]
+    else:
+      for i, pt, dm in zip(np.nonzero(isreal)[0],taus.pt[isreal],dms[isreal]):
+        es[i] = self.tesTool.getTES(pt,int(dm),unc=self.tessys)
+    if self.ltf: # lepton -> tau fake
+      es[(0<genmatch) & (genmatch<5)] = self.ltf
+    elif festable is not None: # electron -> tau fake
+      isele = (genmatch==1) | (genmatch==3)
+      for dm in np.unique(dms[isele]):
+        barrel, endcap = festable[dm]
+        mask     = isele & (dms==dm)
+        es[mask] = np.where(abs(taus.eta[mask])<1.5,barrel,endcap)
+    elif hasattr(self,'fesTool'):
+      isele = (genmatch==1) | (genmatch==3)
+      for i, eta, dm in zip(np.nonzero(isele)[0],taus.eta[isele],dms[isele]):
+        es[i] = self.fesTool.getFES(eta,int(dm),unc=self.fes)
+    if self.jtf!=1.0: # jet -> tau fake
+      es[genmatch==0] = self.jtf
+    return es
+    
+  
+  def blockEventColumns(self, block, ievt):
+    """Return columns of common event variables of a list of passed events in a block,
+    like fillEventBranches, as a dictionary of branch name -> array, for TreeProducer.fillColumns."""
+    columns = {
+      'evt':       block.getcolumn('event')[ievt].astype(np.int64),
+      'data':      self.isdata,
+      'run':       block.run[ievt],
+      'lumi':      block.luminosityBlock[ievt],
+      'npv':       block.PV_npvs[ievt],
+      'npv_good':  block.PV_npvsGood[ievt],
+      'metfilter': np.all([getattr(block,f)[ievt]>0 for f in self.metfilters],axis=0),
+    }
+    if self.ismc:
+      columns['genmet']    = block.GenMET_pt[ievt]
+      columns['genmetphi'] = block.GenMET_phi[ievt]
+      columns['npu']       = block.Pileup_nPU[ievt]
+      columns['npu_true']  = block.Pileup_nTrueInt[ievt]
+      columns['NUP']       = block.LHE_Njets[ievt] if block.tree.GetBranch('LHE_Njets') else -1
+    return columns
+    
+  
+  def blockLepVetoes(self, block, ievt, electrons, muons, taus):
+    """Return arrays of the extra muon, extra electron and dilepton vetoes of a list of passed events in a block,
+    like getlepvetoes, given the selected electrons, muons and taus as lists of collections with one object per event."""
+    passed = np.zeros(block.nevents,dtype=bool)
+    passed[ievt] = True
+    
+    # EXTRA MUON VETO
+    vetomuons  = block.collection('Muon',passed)
+    vetomuons  = vetomuons[ (vetomuons.pt>=10) & (abs(vetomuons.eta)<=2.4) & (abs(vetomuons.dz)<=0.2) &
+                            (abs(vetomuons.dxy)<=0.045) & (vetomuons.pfRelIso04_all<=0.3) ]
+    vetomuons  = vetomuons[~overlaps(vetomuons,taus,0.4)]
+    extramuons = vetomuons[(vetomuons.mediumId>0) & ~isselected(vetomuons,muons)]
+    loosemuons = vetomuons[(vetomuons.pt>15) & (vetomuons.isPFcand>0) & (vetomuons.isGlobal>0) & (vetomuons.isTracker>0)]
+    
+    # EXTRA ELECTRON VETO
+    vetoelecs  = block.collection('Electron',passed)
+    vetoelecs  = vetoelecs[ (vetoelecs.pt>=10) & (abs(vetoelecs.eta)<=2.5) & (abs(vetoelecs.dz)<=0.2) &
+                            (abs(vetoelecs.dxy)<=0.045) & (vetoelecs.pfRelIso03_all<=0.3) ]
+    vetoelecs  = vetoelecs[~overlaps(vetoelecs,taus,0.4) & isselected(vetoelecs,electrons)] # like getlepvetoes
+    extraelecs = vetoelecs[(vetoelecs.convVeto==1) & (vetoelecs.lostHits<=1) & (vetoelecs.mvaFall17V2Iso_WP90>0)]
+    looseelecs = vetoelecs[(vetoelecs.pt>15) & (vetoelecs.cutBased>0) & (vetoelecs.mvaFall17V2Iso_WPL>0)]
+    
+    # DILEPTON VETO
+    dilepton   = np.zeros(block.nevents,dtype=bool)
+    leptons, dRmin = { 'mutau': (loosemuons,0.15), 'eletau': (looseelecs,0.20) }.get(self.channel,(None,None))
+    if leptons is not None:
+      i1, i2   = uniquepairs(leptons)
+      opposite = (leptons.charge[i1]*leptons.charge[i2]<0) & (deltaR(leptons.eta[i1],leptons.phi[i1],leptons.eta[i2],leptons.phi[i2])>dRmin)
+      dilepton[leptons.evt[i1[opposite]]] = True
+    
+    return extramuons.nperevent()[ievt]>0, extraelecs.nperevent()[ievt]>0, dilepton[ievt]
+    
+  
+  def blockObjectColumns(self, objects, i, vars=[ ], es=None):
+    """Return columns of the branches of the i'th object of the pair (e.g. pt_1), like fillBranches,
+    given the selected objects with one per passed event, a list of (branch, variable) of extra branches,
+    e.g. ('iso','pfRelIso04_all') for iso_1, and the energy scales of the objects, if any."""
+    pt, eta, phi, m = objects.pt, objects.eta, objects.phi, objects.mass
+    if es is not None:
+      pt, m = pt*es, m*es
+    columns = {
+      'pt_%d'%i:  pt,
+      'eta_%d'%i: eta,
+      'phi_%d'%i: phi,
+      'm_%d'%i:   m,
+      'y_%d'%i:   rapidity(pt,eta,phi,m),
+      'dxy_%d'%i: objects.dxy,
+      'dz_%d'%i:  objects.dz,
+      'q_%d'%i:   objects.charge,
+    }
+    for branch, var in vars:
+      columns["%s_%d"%(branch,i)] = getattr(objects,var)
+    return columns
+    
+  
+  def blockTauColumns(self, taus, i, es, vars):
+    """Return columns of the branches of the i'th tau of the pair, like blockObjectColumns,
+    given their energy scales, and a list of variables stored in branches of the same name."""
+    columns = self.blockObjectColumns(taus,i,[('dm','decayMode'),('iso','rawIso')]+[(v,v) for v in vars],es=es)
+    columns['idiso_%d'%i] = idIsoArray(taus.rawIso,taus.photonsOutsideSignalCone,columns['pt_%d'%i]) # cut-based tau isolation (rawIso)
+    return columns
+    
+  
+  def blockExtraTauColumns(self, block, ievt, objects):
+    """Return columns of the leading extra tau (e.g. pt_3) for the jet -> tau fake rate measurement,
+    like fillBranches of ModuleEMu and ModuleMuMu, after removing overlap with the selected objects."""
+    passed = np.zeros(block.nevents,dtype=bool)
+    passed[ievt] = True
+    taus   = block.collection('Tau',passed)
+    taus   = taus[ (taus.pt>=20) & (abs(taus.eta)<=2.3) & (abs(taus.dz)<=0.2) &
+                   np.isin(taus.decayMode,[0,1,10,11]) & (abs(taus.charge)==1) ]
+    taus   = taus[~overlaps(taus,objects,0.5)]
+    taus   = taus[choosepair(taus.evt,[taus.pt])] # highest pt, last one wins ties
+    jpt, jpt_genmatch = self.blockTauJet(block,taus)
+    columns = {
+      'pt_3':        eventcolumn(taus,taus.pt,ievt,-1),
+      'eta_3':       eventcolumn(taus,taus.eta,ievt,-9),
+      'm_3':         eventcolumn(taus,taus.mass,ievt,-1),
+      'q_3':         eventcolumn(taus,taus.charge,ievt,0),
+      'dm_3':        eventcolumn(taus,taus.decayMode,ievt,-1),
+      'iso_3':       eventcolumn(taus,taus.rawIso,ievt,-1),
+      'idiso_3':     eventcolumn(taus,idIsoArray(taus.rawIso,taus.photonsOutsideSignalCone,taus.pt),ievt,-1),
+      'jpt_match_3': eventcolumn(taus,jpt,ievt,-1),
+    }
+    for var in ['idAntiEle','idAntiMu','idMVAoldDM2017v2','idMVAnewDM2017v2',
+                'idDeepTau2017v2p1VSe','idDeepTau2017v2p1VSmu','idDeepTau2017v2p1VSjet']:
+      columns[var+'_3'] = eventcolumn(taus,getattr(taus,var),ievt,-1)
+    if self.ismc:
+      columns['jpt_genmatch_3'] = eventcolumn(taus,jpt_genmatch,ievt,-1)
+      columns['genmatch_3']     = eventcolumn(taus,taus.genPartFlav,ievt,-1)
+    return columns
+    
+  
+  def blockGenVisTau(self, block, taus):
+    """Return arrays of pt, eta, phi and status of the generator-level visible tau matched to each tau,
+    like matchgenvistau, for taus with at most one per event."""
+    genvis = block.collection('GenVisTau',taus.nperevent()>0)
+    itau, igen = pairs(taus,genvis)
+    dR     = deltaR(taus.eta[itau],taus.phi[itau],genvis.eta[igen],genvis.phi[igen])
+    itau, igen, dR = itau[dR<0.5], igen[dR<0.5], dR[dR<0.5]
+    best   = choosepair(taus.evt[itau],[-np.arange(len(itau)),-dR]) # smallest dR, first one wins ties
+    itau, igen = itau[best], igen[best]
+    matches = [ ]
+    for var, default in [('pt',-1),('eta',-9),('phi',-9),('status',-1)]:
+      values = np.full(len(taus),default,dtype=np.float64)
+      values[itau] = getattr(genvis,var)[igen]
+      matches.append(values)
+    return matches
+    
+  
+  def blockTauJet(self, block, taus):
+    """Return arrays of the pt of the jet and of the generator-level jet matched to each tau, like matchtaujet."""
+    jpt, jpt_genmatch = np.full(len(taus),-1.), np.full(len(taus),-1.)
+    jetidx = taus.jetIdx.astype(np.int64)
+    itau   = np.nonzero(jetidx>=0)[0]
+    counts = block.counts('Jet')
+    ijet   = (np.cumsum(counts)-counts)[taus.evt[itau]] + jetidx[itau]
+    jpt[itau] = block.getcolumn('Jet_pt')[ijet]
+    if self.ismc:
+      genidx = block.getcolumn('Jet_genJetIdx')[ijet].astype(np.int64)
+      hasgen = genidx>=0
+      counts = block.counts('GenJet')
+      igen   = (np.cumsum(counts)-counts)[taus.evt[itau[hasgen]]] + genidx[hasgen]
+      jpt_genmatch[itau[hasgen]] = block.getcolumn('GenJet_pt')[igen]
+    return jpt, jpt_genmatch
+    
+  
+  def blockJetColumns(self, block, ievt, objects):
+    """Return columns of the jet variables of a list of passed events in a block, like fillJetBranches,
+    after removing overlap with the selected objects, given as a list of collections with one object per event.
+    Also return the selected jets."""
+    nevts   = block.nevents
+    passed  = np.zeros(nevts,dtype=bool)
+    passed[ievt] = True
+    jets    = block.collection('Jet',passed)
+    jets    = jets[(abs(jets.eta)<=4.7) & (jets.jetId>=2)] # Tight
+    jets    = jets[~overlaps(jets,objects,0.5)]
+    jets    = jets[getattr(jets,self.ptnomvar)>=self.jetCutPt]
+    jetpt   = getattr(jets,self.ptnomvar)
+    central = abs(jets.eta)<=2.4
+    btagged = (jets.btagDeepB>self.deepcsv_wp.medium) & (abs(jets.eta)<self.bjetCutEta)
+    bjets, bjetpt = jets[btagged], jetpt[btagged]
+    columns = {
+      'njets':  jets.nperevent()[ievt],
+      'nfjets': np.bincount(jets.evt[~central],minlength=nevts)[ievt],
+      'ncjets': np.bincount(jets.evt[central],minlength=nevts)[ievt],
+      'nbtag':  bjets.nperevent()[ievt],
+    }
+    jetrank, bjetrank = rank(jets.evt,jetpt), rank(bjets.evt,bjetpt)
+    for i in [1,2]: # (SUB)LEADING (B) JETS
+      lead = jetrank==i-1
+      jet  = jets[lead]
+      columns['jpt_%d'%i]    = eventcolumn(jet,jetpt[lead],ievt,-1.)
+      columns['jeta_%d'%i]   = eventcolumn(jet,jet.eta,ievt,-9.)
+      columns['jphi_%d'%i]   = eventcolumn(jet,jet.phi,ievt,-9.)
+      columns['jdeepb_%d'%i] = eventcolumn(jet,jet.btagDeepB,ievt,-9.)
+      lead = bjetrank==i-1
+      bjet = bjets[lead]
+      columns['bpt_%d'%i]    = eventcolumn(bjet,bjetpt[lead],ievt,-1.)
+      columns['beta_%d'%i]   = eventcolumn(bjet,bjet.eta,ievt,-9.)
+    return columns, jets
+    
+  
+  def blockCorrColumns(self, block, ievt, jets):
+    """Return columns of common corrections and weights of a list of passed events in a block,
+    like fillCommonCorrBraches, given the selected jets."""
+    columns = { }
+    passed  = np.zeros(block.nevents,dtype=bool)
+    passed[ievt] = True
+    if self.dozpt:
+      zpt, zmass = getzbosonarray(block,passed)
+      columns['m_moth']     = zmass[ievt]
+      columns['pt_moth']    = zpt[ievt]
+      columns['zptweight']  = self.zptTool.getZptWeightArray(zpt[ievt],zmass[ievt])
+    elif self.dotoppt:
+      toppt1, toppt2 = gettopptarray(block,passed)
+      columns['pt_moth']    = toppt1[ievt]
+      columns['ttptweight'] = getTopPtWeightArray(toppt1[ievt],toppt2[ievt])
+    npus = block.Pileup_nTrueInt[ievt]
+    columns['genweight']    = block.genWeight[ievt]
+    columns['puweight']     = self.puTool.getWeightArray(npus)
+    if not self.dotight:
+      columns['puweightUp']   = self.puTool.getWeightArray(npus,unc='Up')
+      columns['puweightDown'] = self.puTool.getWeightArray(npus,unc='Down')
+    tagged = getattr(jets,self.btagTool.tagvar)>self.btagTool.wp
+    columns['btagweight']   = self.btagTool.getWeightArray(jets.pt,jets.eta,jets.partonFlavour,tagged,evt=jets.evt,nevts=block.nevents)[ievt]
+    return columns
+    
+  
+  def blockFillEffMaps(self, jets, ievt, mask):
+    """Fill the b tag efficiency maps with the selected jets of a list of passed events,
+    where the events also pass a mask, like fillEffMaps."""
+    passed = np.zeros(jets.block.nevents,dtype=bool)
+    passed[ievt[mask]] = True
+    jets   = jets[passed[jets.evt]]
+    self.btagTool.fillEffMapsArray(getattr(jets,self.ptnomvar),jets.eta,jets.partonFlavour,
+                                   getattr(jets,self.btagTool.tagvar)>self.btagTool.wp)
+    
+  
+  def blockSFs(self, func, mask, *args, **kwargs):
+    """Return array of scale factors from a tool for single objects (e.g. TauIDSFTool.getSFvsPT)
+    for arrays of arguments, where only objects passing a mask get a scale factor, and others 1."""
+    sfs = np.ones(len(mask))
+    sfs[mask] = [func(*a,**kwargs) for a in zip(*[np.asarray(x)[mask] for x in args])]
+    return sfs
+    
+  
+  def blockTauSFColumns(self, taus, pts, i):
+    """Return columns of the tau ID and lepton -> tau fake scale factors of the i'th tau of the pair,
+    like fillBranches of ModuleMuTau and ModuleETau, given the tau pt after the energy scale."""
+    genmatch = taus.genPartFlav.astype(np.int64)
+    real     = genmatch==5
+    etf      = (genmatch==1) | (genmatch==3)
+    mtf      = (genmatch==2) | (genmatch==4)
+    columns  = { }
+    for unc in [None]+([ ] if self.dotight else ['Up','Down']):
+      label = unc or ""
+      columns['idweight%s_%d'%(label,i)]  = self.blockSFs(self.tauSFs.getSFvsPT,real,pts,unc=unc)
+      columns['ltfweight%s_%d'%(label,i)] = np.where(etf,self.blockSFs(self.etfSFs.getSFvsEta,etf,taus.eta,genmatch,unc=unc),
+                                                         self.blockSFs(self.mtfSFs.getSFvsEta,mtf,taus.eta,genmatch,unc=unc))
+    return columns
+    
+  
+  def blockWeight(self, columns, weights):
+    """Return the product of weight columns, like the product of float32 weight branches in fillBranches."""
+    weight = np.ones(len(columns[weights[0]]),dtype=np.float32)
+    for name in weights:
+      weight *= columns[name].astype(np.float32)
+    return weight
+    
+  
+  def blockMETAndDiLeptonColumns(self, block, ievt, columns, es1=None, es2=None):
+    """Return columns of variables related to the MET and both objects of the pair, like fillMETAndDiLeptonBranches,
+    given the columns of both objects, and their energy scales (if any) to propagate to the MET."""
+    
+    # PROPAGATE TES/LTF/JTF shift to MET (assume shift is already applied to object)
+    metpt, metphi = [getattr(block,b)[ievt] for b in self.metbranches]
+    metpx, metpy  = metpt*np.cos(metphi), metpt*np.sin(metphi)
+    pt1, eta1, phi1, m1 = [columns[v+'_1'] for v in ['pt','eta','phi','m']]
+    pt2, eta2, phi2, m2 = [columns[v+'_2'] for v in ['pt','eta','phi','m']]
+    px1, py1, pz1, e1 = p4(pt1,eta1,phi1,m1)
+    px2, py2, pz2, e2 = p4(pt2,eta2,phi2,m2)
+    if self.ismc and 't' in self.channel:
+      for px, py, es in [(px1,py1,es1),(px2,py2,es2)]:
+        if es is not None:
+          metpx, metpy = correctmet(metpx,metpy,px*(1.-1./es),py*(1.-1./es))
+    metpt, metphi = ptphi(metpx,metpy)
+    pzetamiss, pzetavis, zetaaxis = pzeta(px1,py1,px2,py2,metpx,metpy)
+    
+    # STORED values in float32, like self.out.pt_1[0] in fillMETAndDiLeptonBranches
+    pt1f, eta1f, phi1f, pt2f, eta2f, phi2f = [np.asarray(x,dtype=np.float32) for x in [pt1,eta1,phi1,pt2,eta2,phi2]]
+    
+    # MET & DILEPTON
+    columns = {
+      'met':       metpt,
+      'metphi':    metphi,
+      'mt_1':      mt(pt1f.astype(np.float64),phi1f.astype(np.float64),metpt,metphi),
+      'mt_2':      mt(pt2f.astype(np.float64),phi2f.astype(np.float64),metpt,metphi),
+      'pzetamiss': pzetamiss,
+      'pzetavis':  pzetavis,
+      'dzeta':     pzetamiss - 0.85*pzetavis,
+      'dR_ll':     deltaR(eta1,phi1,eta2,phi2),
+      'dphi_ll':   wrapphi((phi1f-phi2f).astype(np.float64)),
+      'deta_ll':   abs(eta1f-eta2f),
+      'chi':       np.exp(abs(rapidity(pt1,eta1,phi1,m1) - rapidity(pt2,eta2,phi2,m2))),
+    }
+    columns['m_vis'], columns['pt_ll'] = invmass(pt1,eta1,phi1,m1,pt2,eta2,phi2,m2)
+    return columns
+    
+  
+  def getPreselection(self):
+    """Return a list of (cutflow bin, formula) to preselect events in C++ with TTree::Draw, before analyze.
+    The formulas should exactly reproduce the selection of their cutflow bin in analyze,
+    except for the last one, which may be looser."""
+    if self.isdata:
+      return [('weight_no0PU',"PV_npvs>0")]
+    return [('weight_no0PU',"Pileup_nTrueInt>0")]
+    
+  
+  def getTauPreselection(self, ntaus=1):
+    """Return formula to preselect events with loose tau candidates.
+    The pT threshold is loosened to allow for the largest energy scale."""
+    esmax = 1.
+    if self.ismc:
+      esmax = max([1.2]+[s for s in self.nomscales if s]+[v for k, v, t in self.variations])
+    return "Sum$(Tau_pt>=%.4f && abs(Tau_eta)<=%s && abs(Tau_dz)<=%s && abs(Tau_charge)==1 && "%(self.tauCutPt/esmax,self.tauCutEta,self.tauCutDz)+\
+           "(%s) && "%(" || ".join("Tau_decayMode==%d"%dm for dm in self.tauCutDMs))+\
+           "Tau_idDeepTau2017v2p1VSe>=%d && Tau_idDeepTau2017v2p1VSmu>=%d && Tau_idDeepTau2017v2p1VSjet>=%d)>=%d"%(
+           self.tauCutVSe,self.tauCutVSmu,self.tauwp,ntaus)
+    
+  
+  def preselect(self, tree, nevts, first=0):
+    """Evaluate the preselection for a range of entries with one TTree::Draw, and return a mask of passed events.
+    The events that fail it never reach analyze, so fill their cutflow bins (and pileup) here.
+    Missing branches are redirected as in beginFile."""
+    branches = self.getBranchMap()
+    stages   = [(c,redirectformula(tree,f,branches)) for c, f in self.getPreselection()]
+    code     = "" # number of consecutive stages passed
+    for cutname, formula in reversed(stages):
+      code = "(%s)*(1+%s)"%(formula,code) if code else "(%s)"%(formula)
+    exprs    = ['genWeight','Pileup_nTrueInt',code] if self.ismc else [code]
+    columns  = drawcolumns(tree,exprs,nevts,first,nevts)
+    passed   = columns[-1]>=len(stages)
+    failed   = ~passed
+    nfail    = failed.sum()
+    if nfail>0:
+      stage     = columns[-1][failed]
+      genweight = columns[0][failed] if self.ismc else None
+      self.out.cutflow.fillN('none',nfail)
+      self.out.cutflow.fillN('weight',nfail,genweight)
+      if self.ismc:
+        self.out.pileup.FillN(nfail,np.ascontiguousarray(columns[1][failed]),np.ones(nfail))
+      for i, (cutname, formula) in enumerate(stages,1):
+        passedi = stage>=i
+        weights = genweight[passedi] if genweight is not None and cutname=='weight_no0PU' else None
+        self.out.cutflow.fillN(cutname,passedi.sum(),weights)
+    return passed
+    
+  
+  def setVariation(self, variation=None):
+    """Set the tau energy scale or fake energy scale of a systematic variation,
+    and fill its output tree from now on. Reset to nominal if variation is None."""
+    self.tes, self.ltf, self.jtf = self.nomscales
+    self.variation = variation
+    if variation:
+      key, value, treename = variation
+      setattr(self,key,value)
+      self.out.setTree(treename)
+    else:
+      self.out.setTree('tree')
+    
+  
+  def applyTauES(self, tau):
+    """Apply the energy scale of a tau object depending on its generator match,
+    and store it as tau.es for propagating to the MET. The unshifted pT and mass are kept,
+    so the energy scale can be reapplied for each systematic variation of the same event."""
+    if not hasattr(tau,'pt_noes'):
+      tau.pt_noes   = tau.pt
+      tau.mass_noes = tau.mass
+    es       = 1 # store energy scale for propagating to MET
+    genmatch = tau.genPartFlav
+    if genmatch==5: # real tau
+      if self.tes!=None: # user-defined energy scale (for TES studies)
+        es = self.tes
+      else: # (apply by default)
+        es = self.tesTool.getTES(tau.pt_noes,tau.decayMode,unc=self.tessys)
+    elif self.ltf and 0<genmatch<5: # lepton -> tau fake
+      es = self.ltf
+    elif genmatch in [1,3] and hasattr(self,'fesTool'): # electron -> tau fake (apply by default, override with 'ltf=1.0')
+      es = self.fesTool.getFES(tau.eta,tau.decayMode,unc=self.fes)
+    elif self.jtf!=1.0 and genmatch==0: # jet -> tau fake
+      es = self.jtf
+    tau.pt   = tau.pt_noes*es
+    tau.mass = tau.mass_noes*es
+    tau.es   = es
+    return tau
     
   
   def fillEventBranches(self,event):
@@ -148,7 +799,7 @@ class ModuleTauPair(Module):
     self.out.lumi[0]            = event.luminosityBlock
     self.out.npv[0]             = event.PV_npvs
     self.out.npv_good[0]        = event.PV_npvsGood
-    self.out.metfilter[0]       = self.filter(event)
+    self.out.metfilter[0]       = self.evtcache.get(event,'metfilter',self.filter,event)
     
     if self.ismc:
       ###self.out.ngentauhads[0]   = ngentauhads
@@ -183,11 +834,9 @@ class ModuleTauPair(Module):
     nbtag          = 0
     
     # SELECT JET, remove overlap with selected objects
-    for jet in Collection(event,'Jet'):
-      if abs(jet.eta)>4.7: continue
-      if jet.DeltaR(tau1)<0.5: continue
-      if jet.DeltaR(tau2)<0.5: continue
-      if jet.jetId<2: continue # Tight
+    seljets = self.objcache.select(event,'jet','Jet',lambda j: abs(j.eta)<=4.7 and j.jetId>=2) # Tight
+    for jet, overlap in zip(seljets,getoverlaps(seljets,[tau1,tau2],0.5)):
+      if overlap: continue
       
       # SAVE JEC VARIATIONS
       if self.dojec:
@@ -312,7 +961,10 @@ class ModuleTauPair(Module):
       self.out.ttptweight[0]       = getTopPtWeight(toppt1,toppt2)
     
     self.out.genweight[0]          = event.genWeight
-    self.out.puweight[0]           = self.puTool.getWeight(event.Pileup_nTrueInt)
+    self.out.puweight[0]           = self.evtcache.get(event,'puweight',self.puTool.getWeight,event.Pileup_nTrueInt)
+    if not self.dotight:
+      self.out.puweightUp[0]       = self.evtcache.get(event,'puweightUp',self.puTool.getWeight,event.Pileup_nTrueInt,unc='Up')
+      self.out.puweightDown[0]     = self.evtcache.get(event,'puweightDown',self.puTool.getWeight,event.Pileup_nTrueInt,unc='Down')
     self.out.btagweight[0]         = self.btagTool.getWeight(jets)
     #if not self.dotight:
     #  self.out.btagweightUp[0]   = self.btagTool.getWeight(jets,unc='Up')
@@ -326,22 +978,22 @@ class ModuleTauPair(Module):
      and fill the corresponding branches."""
     
     # PROPAGATE TES/LTF/JTF shift to MET (assume shift is already applied to object)
+    metpx, metpy = met.Px(), met.Py()
+    px1, py1, pz1, e1 = p4(tau1.pt,tau1.eta,tau1.phi,tau1.mass)
+    px2, py2, pz2, e2 = p4(tau2.pt,tau2.eta,tau2.phi,tau2.mass)
     if self.ismc and 't' in self.channel:
       if hasattr(tau1,'es') and tau1.es!=1:
-        dp = tau1.tlv*(1.-1./tau1.es) # assume shift is already applied
-        correctmet(met,dp)
+        metpx, metpy = correctmet(metpx,metpy,px1*(1.-1./tau1.es),py1*(1.-1./tau1.es)) # assume shift is already applied
       if hasattr(tau2,'es') and tau2.es!=1:
-        dp = tau2.tlv*(1.-1./tau2.es)
-        #print ">>> fillMETAndDiLeptonBranches: Correcting MET for es=%.3f, pt=%.3f, dpt=%.3f, gm=%d"%(tau2.es,tau2.pt,dp.Pt(),tau2.genPartFlav)
-        correctmet(met,tau2.tlv*(1.-1./tau2.es))
-    tau1 = tau1.tlv # continue with TLorentzVector
-    tau2 = tau2.tlv # continue with TLorentzVector
+        #print ">>> fillMETAndDiLeptonBranches: Correcting MET for es=%.3f, pt=%.3f, gm=%d"%(tau2.es,tau2.pt,tau2.genPartFlav)
+        metpx, metpy = correctmet(metpx,metpy,px2*(1.-1./tau2.es),py2*(1.-1./tau2.es))
+    metpt, metphi = ptphi(metpx,metpy)
     
     # MET
-    self.out.met[0]       = met.Pt()
-    self.out.metphi[0]    = met.Phi()
-    self.out.mt_1[0]      = sqrt( 2*self.out.pt_1[0]*met.Pt()*(1-cos(deltaPhi(self.out.phi_1[0],met.Phi()))) )
-    self.out.mt_2[0]      = sqrt( 2*self.out.pt_2[0]*met.Pt()*(1-cos(deltaPhi(self.out.phi_2[0],met.Phi()))) )
+    self.out.met[0]       = metpt
+    self.out.metphi[0]    = metphi
+    self.out.mt_1[0]      = mt(self.out.pt_1[0],self.out.phi_1[0],metpt,metphi)
+    self.out.mt_2[0]      = mt(self.out.pt_2[0],self.out.phi_2[0],metpt,metphi)
     ###self.out.puppimetpt[0]             = event.PuppiMET_pt
     ###self.out.puppimetphi[0]            = event.PuppiMET_phi
     ###self.out.metsignificance[0]        = event.MET_significance
@@ -351,28 +1003,24 @@ class ModuleTauPair(Module):
     ###self.out.fixedGridRhoFastjetAll[0] = event.fixedGridRhoFastjetAll
     
     # PZETA
-    leg1                  = TVector3(tau1.Px(),tau1.Py(),0.)
-    leg2                  = TVector3(tau2.Px(),tau2.Py(),0.)
-    zetaAxis              = TVector3(leg1.Unit()+leg2.Unit()).Unit()
-    pzetavis              = leg1*zetaAxis + leg2*zetaAxis
-    pzetamiss             = met.Vect()*zetaAxis
+    pzetamiss, pzetavis, zetaaxis = pzeta(px1,py1,px2,py2,metpx,metpy)
     self.out.pzetamiss[0] = pzetamiss
     self.out.pzetavis[0]  = pzetavis
     self.out.dzeta[0]     = pzetamiss - 0.85*pzetavis
     
     # MET SYSTEMATICS
     for unc, met_var in met_vars.iteritems():
-      getattr(self.out,"met_"+unc)[0]    = met_var.Pt()
-      getattr(self.out,"metphi_"+unc)[0] = met_var.Phi()
-      getattr(self.out,"mt_1_"+unc)[0]   = sqrt( 2 * self.out.pt_1[0] * met_var.Pt() * ( 1 - cos(deltaPhi(self.out.phi_1[0],met_var.Phi())) ))
-      getattr(self.out,"dzeta_"+unc)[0]  = met_var.Vect()*zetaAxis - 0.85*pzeta_vis
+      metpt_var, metphi_var = ptphi(met_var.Px(),met_var.Py())
+      getattr(self.out,"met_"+unc)[0]    = metpt_var
+      getattr(self.out,"metphi_"+unc)[0] = metphi_var
+      getattr(self.out,"mt_1_"+unc)[0]   = mt(self.out.pt_1[0],self.out.phi_1[0],metpt_var,metphi_var)
+      getattr(self.out,"dzeta_"+unc)[0]  = project(met_var.Px(),met_var.Py(),*zetaaxis) - 0.85*pzetavis
     
     # DILEPTON
-    self.out.m_vis[0]     = (tau1 + tau2).M()
-    self.out.pt_ll[0]     = (tau1 + tau2).Pt()
+    self.out.m_vis[0], self.out.pt_ll[0] = invmass(tau1.pt,tau1.eta,tau1.phi,tau1.mass,tau2.pt,tau2.eta,tau2.phi,tau2.mass)
     self.out.dR_ll[0]     = tau1.DeltaR(tau2)
     self.out.dphi_ll[0]   = deltaPhi(self.out.phi_1[0], self.out.phi_2[0])
     self.out.deta_ll[0]   = abs(self.out.eta_1[0] - self.out.eta_2[0])
-    self.out.chi[0]       = exp(abs(tau1.Rapidity() - tau2.Rapidity()))
+    self.out.chi[0]       = exp(abs(rapidity(tau1.pt,tau1.eta,tau1.phi,tau1.mass) - rapidity(tau2.pt,tau2.eta,tau2.phi,tau2.mass)))
     
 
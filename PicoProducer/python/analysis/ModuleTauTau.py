@@ -5,7 +5,8 @@ import numpy as np
 from TauFW.PicoProducer import datadir
 from TauFW.PicoProducer.analysis.TreeProducerTauTau import *
 from TauFW.PicoProducer.analysis.ModuleTauPair import *
-from TauFW.PicoProducer.analysis.utils import DiTauPair, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.utils import DiTauPair, bestpair, pairkeys, loosestIso, idIso, matchgenvistau, matchtaujet
+from TauFW.PicoProducer.analysis.columnar import uniquepairs, choosepair, deltaR as deltaR_arr
 from TauFW.PicoProducer.corrections.TrigObjMatcher import TrigObjMatcher
 from TauFW.PicoProducer.corrections.TauTriggerSFs import TauTriggerSFs
 from TauPOG.TauIDSFs.TauIDSFTool import TauIDSFTool, TauESTool, TauFESTool
@@ -53,6 +54,14 @@ class ModuleTauTau(ModuleTauPair):
     print ">>> %-12s = '%s'"%('triggers',self.trigger.path.replace("||","\n>>> %s||"%(' '*16)))
     
   
+  def getPreselection(self):
+    """Return preselection per cutflow bin for TTree::Draw (see ModuleTauPair.getPreselection)."""
+    return super(ModuleTauTau,self).getPreselection() + [
+      ('trig', self.trigger.path),
+      ('tau',  self.getTauPreselection()),
+    ]
+    
+  
   def analyze(self, event):
     """Process and pre-select events; fill branches and return True if the events passes,
     return False otherwise."""
@@ -83,65 +92,189 @@ class ModuleTauTau(ModuleTauPair):
     
     
     ##### TAU ########################################
-    taus = [ ]
-    for tau in Collection(event,'Tau'):
-      if abs(tau.eta)>self.tauCutEta: continue
-      if abs(tau.dz)>0.2: continue
-      if tau.decayMode not in [0,1,10,11]: continue
-      if abs(tau.charge)!=1: continue
-      if tau.idDeepTau2017v2p1VSe<1: continue   # VVVLoose
-      if tau.idDeepTau2017v2p1VSmu<1: continue  # VLoose
-      if tau.idDeepTau2017v2p1VSjet<self.tauwp: continue
-      if self.ismc:
-        tau.es   = 1 # store energy scale for propagating to MET
-        genmatch = tau.genPartFlav
-        if genmatch==5: # real tau
-          if self.tes!=None: # user-defined energy scale (for TES studies)
-            tes = self.tes
-          else: # (apply by default)
-            tes = self.tesTool.getTES(tau.pt,tau.decayMode,unc=self.tessys)
-          if tes!=1:
-            tau.pt   *= tes
-            tau.mass *= tes
-            tau.es    = tes
-        elif self.ltf and 0<genmatch<5: # lepton -> tau fake
-          tau.pt   *= self.ltf
-          tau.mass *= self.ltf
-          tau.es    = self.ltf
-        elif genmatch in [1,3]: # electron -> tau fake (apply by default, override with 'ltf=1.0')
-          fes = self.fesTool.getFES(tau.eta,tau.decayMode,unc=self.fes)
-          tau.pt   *= fes
-          tau.mass *= fes
-          tau.es    = fes
-        elif self.jtf!=1.0 and genmatch==0: # jet -> tau fake
-          tau.pt   *= self.jtf
-          tau.mass *= self.jtf
-          tau.es    = self.jtf
-      if tau.pt<self.tauCutPt: continue
-      taus.append(tau)
+    taus = self.getTaus(event)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    passed = self.analyzePair(event,taus)
+    if self.variations:
+      for variation in self.variations: # only shift taus
+        self.setVariation(variation)
+        self.analyzePair(event,taus)
+      self.setVariation(None)
+    return passed
+    
+  
+  def analyzePair(self, event, taus):
+    """Apply the tau energy scale, select the best ditau pair, and fill branches;
+    return True if the events passes. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    if self.ismc:
+      for tau in taus:
+        self.applyTauES(tau)
+    taus = [t for t in taus if t.pt>=self.tauCutPt]
     if len(taus)==0:
       return False
-    self.out.cutflow.fill('tau')
+    if not self.variation:
+      self.out.cutflow.fill('tau')
     
     
     ##### DITAU PAIR #################################
-    ditaus = [ ]
-    for i, tau1 in enumerate(taus,1):
-      for tau2 in taus[i:]:
-        if tau1.DeltaR(tau2)<0.5: continue
-        ditau = DiTauPair(tau1,tau1.rawDeepTau2017v2p1VSjet,tau2,tau2.rawDeepTau2017v2p1VSjet)
-        ditaus.append(ditau)
-    if len(ditaus)==0:
+    ditau = bestpair(taus,[t.rawDeepTau2017v2p1VSjet for t in taus],ordering=DiTauPair,dRmin=self.pairCutDR)
+    if ditau is None:
       return False
-    tau1, tau2 = max(ditaus).pair
+    tau1, tau2 = ditau
     tau1.tlv   = tau1.p4()
     tau2.tlv   = tau2.p4()
-    self.out.cutflow.fill('pair')
+    if not self.variation:
+      self.out.cutflow.fill('pair')
+    
+    
+    # FILL BRANCHES
+    self.fillBranches(event,tau1,tau2)
+    return True
+  
+  
+  def analyzeBlock(self, block):
+    """Process and pre-select a block of events with numpy arrays (see analysis/columnar.py);
+    fill branches for the passed events, and return the number of passed events."""
+    sys.stdout.flush()
+    
+    
+    ##### NO CUT #####################################
+    mask = self.blockNoCut(block)
+    
+    
+    ##### TRIGGER ####################################
+    mask = mask & self.trigger.firedBlock(block)
+    self.out.cutflow.fillN('trig',mask.sum())
+    
+    
+    ##### TAU ########################################
+    taus = self.blockTaus(block,mask)
+    
+    
+    ##### NOMINAL & SYSTEMATIC VARIATIONS ############
+    npass = self.analyzeBlockPair(block,mask,taus)
+    if self.variations:
+      for variation in self.variations: # only shift taus
+        self.setVariation(variation)
+        self.analyzeBlockPair(block,mask,taus)
+      self.setVariation(None)
+    return npass
+  
+  
+  def analyzeBlockPair(self, block, mask, taus):
+    """Apply the tau energy scale, select the best ditau pair per event, and fill branches;
+    return the number of passed events. Repeated for each systematic variation."""
+    
+    
+    ##### TAU ENERGY SCALE ###########################
+    taues  = self.blockTauES(taus)
+    passpt = taus.pt*taues>=self.tauCutPt
+    taus, taues = taus[passpt], taues[passpt]
+    mask   = mask & (taus.nperevent()>0)
+    if not self.variation:
+      self.out.cutflow.fillN('tau',mask.sum())
+    
+    
+    ##### DITAU PAIR #################################
+    itau1, itau2 = uniquepairs(taus)
+    dR     = deltaR_arr(taus.eta[itau2],taus.phi[itau2],taus.eta[itau1],taus.phi[itau1])
+    itau1, itau2 = itau1[dR>=self.pairCutDR], itau2[dR>=self.pairCutDR]
+    taupt  = taus.pt*taues
+    keys   = pairkeys(taupt[itau1],taus.rawDeepTau2017v2p1VSjet[itau1],taupt[itau2],taus.rawDeepTau2017v2p1VSjet[itau2],DiTauPair)
+    best   = choosepair(taus.evt[itau1],keys)
+    itau1, itau2 = itau1[best], itau2[best]
+    if not self.variation:
+      self.out.cutflow.fillN('pair',len(best))
+    
+    
+    # FILL BRANCHES of passed events
+    if len(best)>0:
+      self.fillBlockBranches(block,taus[itau1],taus[itau2],taues[itau1],taues[itau2])
+    return len(best)
+    
+  
+  def fillBlockBranches(self, block, tau1, tau2, taues1, taues2):
+    """Fill branches for the selected ditau pairs in a block of events straight from arrays, like fillBranches,
+    given the selected taus with one per passed event, and their energy scales."""
+    ievt    = tau1.evt
+    columns = self.blockEventColumns(block,ievt)
+    
+    
+    # VETOS
+    extramuon_veto, extraelec_veto, dilepton_veto = self.blockLepVetoes(block,ievt,[ ],[ ],[tau1,tau2])
+    columns['extramuon_veto'], columns['extraelec_veto'], columns['dilepton_veto'] = self.blockLepVetoes(block,ievt,[ ],[ ],[ ])
+    columns['lepton_vetoes']       = columns['extramuon_veto'] | columns['extraelec_veto'] #| columns['dilepton_veto']
+    columns['lepton_vetoes_notau'] = extramuon_veto | extraelec_veto #| dilepton_veto
+    
+    
+    # TAUS
+    columns.update(self.blockTauColumns(tau1,1,taues1,tauvars))
+    columns.update(self.blockTauColumns(tau2,2,taues2,tauvars))
+    
+    
+    # GENERATOR
+    if self.ismc:
+      columns['genmatch_1'] = tau1.genPartFlav
+      columns['genmatch_2'] = tau2.genPartFlav
+      columns['genvistaupt_1'], columns['genvistaueta_1'], columns['genvistauphi_1'], columns['gendm_1'] = self.blockGenVisTau(block,tau1)
+      columns['genvistaupt_2'], columns['genvistaueta_2'], columns['genvistauphi_2'], columns['gendm_2'] = self.blockGenVisTau(block,tau2)
+    
+    
+    # JETS
+    jetcolumns, jets = self.blockJetColumns(block,ievt,[tau1,tau2])
+    columns.update(jetcolumns)
+    columns['jpt_match_1'], jpt_genmatch_1 = self.blockTauJet(block,tau1)
+    columns['jpt_match_2'], jpt_genmatch_2 = self.blockTauJet(block,tau2)
+    
+    
+    # WEIGHTS
+    if self.ismc:
+      columns['jpt_genmatch_1'] = jpt_genmatch_1
+      columns['jpt_genmatch_2'] = jpt_genmatch_2
+      columns.update(self.blockCorrColumns(block,ievt,jets))
+      if not self.variation:
+        self.blockFillEffMaps(jets,ievt,(tau1.idDeepTau2017v2p1VSjet>=2) & (tau2.idDeepTau2017v2p1VSjet>=2))
+      columns['trigweight']         = self.trigTool.getSFPairArray(columns['pt_1'],columns['dm_1'],columns['pt_2'],columns['dm_2'])
+      columns['trigweight_tight']   = self.trigTool_tight.getSFPairArray(columns['pt_1'],columns['dm_1'],columns['pt_2'],columns['dm_2'])
+      if not self.dotight:
+        columns['trigweightUp']     = self.trigTool.getSFPairArray(columns['pt_1'],columns['dm_1'],columns['pt_2'],columns['dm_2'],unc='Up')
+        columns['trigweightDown']   = self.trigTool.getSFPairArray(columns['pt_1'],columns['dm_1'],columns['pt_2'],columns['dm_2'],unc='Down')
+      
+      # TAU WEIGHTS
+      for i, tau in [(1,tau1),(2,tau2)]:
+        pt, dm   = columns['pt_%d'%i], tau.decayMode.astype(np.int64)
+        genmatch = tau.genPartFlav.astype(np.int64)
+        real     = genmatch==5
+        etf      = (genmatch==1) | (genmatch==3)
+        mtf      = (genmatch>0) & ~real & ~etf
+        columns['idweight_tight_%d'%i] = self.blockSFs(self.tauSFs_tight.getSFvsDM,real,pt,dm)
+        for unc in [None]+([ ] if self.dotight else ['Up','Down']):
+          label = unc or ""
+          columns['idweight%s_%d'%(label,i)]  = self.blockSFs(self.tauSFs.getSFvsDM,real,pt,dm,unc=unc)
+          columns['ltfweight%s_%d'%(label,i)] = np.where(etf,self.blockSFs(self.etfSFs.getSFvsEta,etf,tau.eta,genmatch,unc=unc),
+                                                             self.blockSFs(self.mtfSFs.getSFvsEta,mtf,tau.eta,genmatch,unc=unc))
+    
+    
+    # MET & DILEPTON VARIABLES
+    columns.update(self.blockMETAndDiLeptonColumns(block,ievt,columns,es1=taues1,es2=taues2))
+    
+    
+    self.out.fillColumns(columns,len(ievt))
+  
+  
+  
+  def fillBranches(self, event, tau1, tau2):
+    """Fill branches for the selected ditau pair."""
     
     
     # VETOS
-    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[ ],[tau1,tau2],self.channel)
-    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[ ],[ ],self.channel)
+    extramuon_veto, extraelec_veto, dilepton_veto = getlepvetoes(event,[ ],[ ],[tau1,tau2],self.channel,cache=self.objcache)
+    self.out.extramuon_veto[0], self.out.extraelec_veto[0], self.out.dilepton_veto[0] = getlepvetoes(event,[ ],[ ],[ ],self.channel,cache=self.objcache)
     self.out.lepton_vetoes[0]       = self.out.extramuon_veto[0] or self.out.extraelec_veto[0] #or self.out.dilepton_veto[0]
     self.out.lepton_vetoes_notau[0] = extramuon_veto or extraelec_veto #or dilepton_veto
     
@@ -216,8 +349,8 @@ class ModuleTauTau(ModuleTauPair):
     if self.ismc:
       self.out.genmatch_1[0]     = tau1.genPartFlav
       self.out.genmatch_2[0]     = tau2.genPartFlav
-      pt1, phi1, eta1, status1   = matchgenvistau(event,tau1)
-      pt2, phi2, eta2, status2   = matchgenvistau(event,tau2)
+      pt1, eta1, phi1, status1   = matchgenvistau(event,tau1)
+      pt2, eta2, phi2, status2   = matchgenvistau(event,tau2)
       self.out.genvistaupt_1[0]  = pt1
       self.out.genvistaueta_1[0] = eta1
       self.out.genvistauphi_1[0] = phi1
@@ -230,14 +363,18 @@ class ModuleTauTau(ModuleTauPair):
     
     # JETS
     jets, met, njets_vars, met_vars = self.fillJetBranches(event,tau1,tau2)
-    self.out.jpt_match_1[0], self.out.jpt_genmatch_1[0] = matchtaujet(event,tau1,self.ismc)
-    self.out.jpt_match_2[0], self.out.jpt_genmatch_2[0] = matchtaujet(event,tau2,self.ismc)
+    if self.ismc:
+      self.out.jpt_match_1[0], self.out.jpt_genmatch_1[0] = matchtaujet(event,tau1,self.ismc)
+      self.out.jpt_match_2[0], self.out.jpt_genmatch_2[0] = matchtaujet(event,tau2,self.ismc)
+    else:
+      self.out.jpt_match_1[0] = matchtaujet(event,tau1,self.ismc)[0]
+      self.out.jpt_match_2[0] = matchtaujet(event,tau2,self.ismc)[0]
     
     
     # WEIGHTS
     if self.ismc:
       self.fillCommonCorrBraches(event,jets,met,njets_vars,met_vars)
-      if tau1.idDeepTau2017v2p1VSjet>=2 and tau2.idDeepTau2017v2p1VSjet>=2:
+      if tau1.idDeepTau2017v2p1VSjet>=2 and tau2.idDeepTau2017v2p1VSjet>=2 and not self.variation:
         self.btagTool.fillEffMaps(jets,usejec=self.dojec)
       self.out.trigweight[0]             = self.trigTool.getSFPair(tau1,tau2)
       self.out.trigweight_tight[0]       = self.trigTool_tight.getSFPair(tau1,tau2)
@@ -250,7 +387,7 @@ class ModuleTauTau(ModuleTauPair):
       self.out.idweight_2[0]        = 1.
       self.out.idweight_tight_1[0]  = 1.
       self.out.idweight_tight_2[0]  = 1.
-      self.out.ltfweight_2[0]       = 1.
+      self.out.ltfweight_1[0]       = 1.
       self.out.ltfweight_2[0]       = 1.
       if not self.dotight:
         self.out.idweightUp_1[0]    = 1.
@@ -277,18 +414,18 @@ class ModuleTauTau(ModuleTauPair):
           self.out.ltfweightDown_1[0] = ltfTool.getSFvsEta(tau1.eta,tau1.genPartFlav,unc='Down')
       
       # TAU 2 WEIGHTS
-      if tau1.genPartFlav==5:
-        self.out.idweight_2[0]        = self.tauSFs.getSFvsDM(tau1.pt,tau1.decayMode)
-        self.out.idweight_tight_2[0]  = self.tauSFs_tight.getSFvsDM(tau1.pt,tau1.decayMode)
+      if tau2.genPartFlav==5:
+        self.out.idweight_2[0]        = self.tauSFs.getSFvsDM(tau2.pt,tau2.decayMode)
+        self.out.idweight_tight_2[0]  = self.tauSFs_tight.getSFvsDM(tau2.pt,tau2.decayMode)
         if not self.dotight:
-          self.out.idweightUp_2[0]    = self.tauSFs.getSFvsDM(tau1.pt,tau1.decayMode,unc='Up')
-          self.out.idweightDown_2[0]  = self.tauSFs.getSFvsDM(tau1.pt,tau1.decayMode,unc='Down')
-      elif tau1.genPartFlav>0:
-        ltfTool = self.etfSFs if tau1.genPartFlav in [1,3] else self.mtfSFs
-        self.out.ltfweight_2[0]       = ltfTool.getSFvsEta(tau1.eta,tau1.genPartFlav)
+          self.out.idweightUp_2[0]    = self.tauSFs.getSFvsDM(tau2.pt,tau2.decayMode,unc='Up')
+          self.out.idweightDown_2[0]  = self.tauSFs.getSFvsDM(tau2.pt,tau2.decayMode,unc='Down')
+      elif tau2.genPartFlav>0:
+        ltfTool = self.etfSFs if tau2.genPartFlav in [1,3] else self.mtfSFs
+        self.out.ltfweight_2[0]       = ltfTool.getSFvsEta(tau2.eta,tau2.genPartFlav)
         if not self.dotight:
-          self.out.ltfweightUp_2[0]   = ltfTool.getSFvsEta(tau1.eta,tau1.genPartFlav,unc='Up')
-          self.out.ltfweightDown_2[0] = ltfTool.getSFvsEta(tau1.eta,tau1.genPartFlav,unc='Down')
+          self.out.ltfweightUp_2[0]   = ltfTool.getSFvsEta(tau2.eta,tau2.genPartFlav,unc='Up')
+          self.out.ltfweightDown_2[0] = ltfTool.getSFvsEta(tau2.eta,tau2.genPartFlav,unc='Down')
     
     
     # MET & DILEPTON VARIABLES
@@ -296,5 +433,4 @@ class ModuleTauTau(ModuleTauPair):
     
     
     self.out.fill()
-    return True
     
@@ -0,0 +1,57 @@
+# Description: Module to run several channel modules on the same event stream,
+#              so the input is read and decompressed only once per event
+# Sources:
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/eventloop.py
+import time
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from TauFW.common.tools.log import Logger
+LOG = Logger('MultiChannel')
+
+
+class MultiChannel(Module):
+  """Run several channel modules, e.g. ModuleMuTau and ModuleETau, on the same events.
+  Each module writes its own output file and cutflow. Unlike a plain list of modules
+  in nanoAOD-tools' PostProcessor, every module sees every event, even if a previous module
+  rejected it. Event-level quantities can be shared by passing the same EventCache to all modules."""
+  
+  def __init__(self, modules, **kwargs):
+    self.modules   = modules
+    self.names     = kwargs.get('names',[m.__class__.__name__ for m in modules])
+    self.npass     = [0]*len(modules) # number of passed events per module
+    self.times     = [0.]*len(modules) # time spent per module
+    LOG.insist(len(self.names)==len(self.modules),"Number of names (%d) does not match modules (%d)!"%(len(self.names),len(self.modules)))
+  
+  def beginJob(self):
+    """Before processing any events or files."""
+    print ">>> %-12s = %s"%('channels',self.names)
+    for module in self.modules:
+      module.beginJob()
+  
+  def endJob(self):
+    """Wrap up after running on all events and files, and print the number of passed events per channel."""
+    for module in self.modules:
+      module.endJob()
+    for name, npass, dt in zip(self.names,self.npass,self.times):
+      print ">>> %-12s %8d events passed, %.1f seconds in analyze"%(name,npass,dt)
+  
+  def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """Before processing a new file."""
+    for module in self.modules:
+      module.beginFile(inputFile,outputFile,inputTree,wrappedOutputTree)
+  
+  def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """After processing a file."""
+    for module in self.modules:
+      module.endFile(inputFile,outputFile,inputTree,wrappedOutputTree)
+  
+  def analyze(self, event):
+    """Run all modules on this event, and return True if any of them passed it."""
+    passed = False
+    for i, module in enumerate(self.modules):
+      start = time.time()
+      if module.analyze(event):
+        self.npass[i] += 1
+        passed = True
+      self.times[i] += time.time()-start
+    return passed
+  
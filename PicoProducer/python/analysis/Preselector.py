@@ -0,0 +1,54 @@
+# Description: Module to reject events in C++ before they reach the python event loop of the next modules
+# Sources:
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/eventloop.py
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/treeReaderArrayTools.py
+import numpy as np
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from TauFW.common.tools.log import Logger
+LOG = Logger('Preselector')
+
+
+class Preselector(Module):
+  """Evaluate the preselection of a channel module (see ModuleTauPair.preselect) for all events of a file
+  with one TTree::Draw in beginFile, on the same tree and entry list (e.g. JSON) as the PostProcessor.
+  The events that fail it are rejected in analyze before any branch is read,
+  so the following modules never see them. This module should come right before the channel module."""
+  
+  def __init__(self, module, **kwargs):
+    self.module     = module
+    self.firstEntry = kwargs.get('firstEntry', 0    ) # same as PostProcessor
+    self.maxEntries = kwargs.get('maxEntries', None ) # same as PostProcessor
+    self.verbosity  = kwargs.get('verb',       0    )
+    self.passed     = np.zeros(0,dtype=bool) # mask of passed events in current file
+    self.offset     = 0 # index of first event in mask
+    self.npass      = 0
+    self.ntot       = 0
+  
+  def endJob(self):
+    """Print number of passed events."""
+    print ">>> Preselector: %d/%d events passed the preselection"%(self.npass,self.ntot)
+  
+  def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+    """Before processing a new file: Evaluate the preselection for all events that will be processed.
+    If the PostProcessor has an entry list, the event loop runs over its indices instead of the tree entries."""
+    elist = getattr(inputTree,'_entrylist',None)
+    if elist:
+      nevts, first = elist.GetN(), 0 # index in entry list
+      inputTree.SetEntryList(elist) # let TTree::Draw only loop over its entries
+    else:
+      nevts, first = inputTree.GetEntries()-self.firstEntry, self.firstEntry
+    if self.maxEntries!=None and self.maxEntries>0:
+      nevts = min(nevts,self.maxEntries)
+    self.passed = self.module.preselect(inputTree,max(nevts,0),first)
+    self.offset = first
+    if elist:
+      inputTree.SetEntryList(None)
+    npass = self.passed.sum()
+    self.npass += npass
+    self.ntot  += len(self.passed)
+    LOG.verb("Preselector.beginFile: %d/%d events pass the preselection"%(npass,len(self.passed)),self.verbosity,1)
+  
+  def analyze(self, event):
+    """Return True if the event passed the preselection."""
+    return bool(self.passed[event._entry-self.offset])
+  
@@ -12,6 +12,7 @@
 #   Float_t   'F'     'f'/'float32'        32-bit float
 #   Double_t  'D'     'd'/'float64'/float  64-bit float
 import numpy as np
+import ROOT
 from ROOT import TTree, TFile, TH1D
 from TauFW.PicoProducer.analysis.utils import Cutflow
 
@@ -30,17 +31,51 @@ np_dtype = { # ROOT -> numpy data type
 }
 
 
+def loadFillBlock():
+  """Compile C++ function to fill a tree from a buffer of rows,
+  copying each field into the address of its branch."""
+  if not hasattr(ROOT,'fillTreeBlock'):
+    ROOT.gInterpreter.Declare("""
+      #include <cstring>
+      #include <vector>
+      #include "TTree.h"
+      Long64_t fillTreeBlock(TTree* tree, Long64_t buffer, Long64_t nrows, Long64_t rowsize,
+                             const std::vector<Long64_t>& addresses, const std::vector<Long64_t>& offsets,
+                             const std::vector<Long64_t>& sizes) {
+        Long64_t nbytes = 0;
+        for(Long64_t i=0; i<nrows; i++){
+          const char* row = (const char*) (buffer+i*rowsize);
+          for(size_t j=0; j<addresses.size(); j++)
+            std::memcpy((void*) addresses[j],row+offsets[j],sizes[j]);
+          nbytes += tree->Fill();
+        }
+        return nbytes;
+      }
+    """)
+  return ROOT.fillTreeBlock
+  
+
 class TreeProducer(object):
-  """Base class to create and prepare a custom output file & tree for analysis modules."""
+  """Base class to create and prepare a custom output file & tree for analysis modules.
+  With buffer=N, the branch values of each event are collected as one row of a numpy buffer,
+  which is written to the tree in blocks of N rows in C++, and the cutflow is only filled at the end.
+  Extra trees with the same branches can be added, e.g. for systematic variations."""
   
   def __init__(self, filename, module, **kwargs):
     self.filename = filename
     self.module   = module
     self.outfile  = TFile(filename,'RECREATE')
     ncuts         = kwargs.get('ncuts',25)
-    self.cutflow  = Cutflow('cutflow',ncuts)
+    self.nbuffer  = kwargs.get('buffer',getattr(module,'buffersize',0)) # number of events per block
+    self.cutflow  = Cutflow('cutflow',ncuts,inmemory=self.nbuffer>0)
     self.pileup   = TH1D('pileup', 'pileup', 100, 0, 100)
     self.tree     = TTree('tree','tree')
+    self.trees    = { 'tree': self.tree } # trees sharing the same branch addresses
+    self.treename = 'tree' # tree to fill
+    self.arrays   = [ ] # (name, array) of branch addresses
+    self.buffers  = { } # buffer of rows per tree
+    self.nrows    = { } # number of buffered rows per tree
+    self.row      = None
   
   def addBranch(self, name, dtype='f', default=None, title=None, arrname=None):
     """Add branch with a given name, and create an array of the same name as address."""
@@ -54,7 +89,9 @@ class TreeProducer(object):
     if isinstance(dtype,str): # Set correct data type for numpy:
       if dtype=='D':          # 'D' = 'complex128', which do not work for filling float branches
         dtype = 'float64'     # 'd' = 'float64' -> 'D' -> Double_t
+    assert self.row is None, "Cannot add branch '%s' after the buffer was created!"%(name)
     setattr(self,arrname,np.zeros(1,dtype=dtype))
+    self.arrays.append((arrname,getattr(self,arrname)))
     branch = self.tree.Branch(name,getattr(self,arrname),'%s/%s'%(name,root_dtype[dtype]))
     if default!=None:
       getattr(self,name)[0] = default
@@ -62,12 +99,105 @@ class TreeProducer(object):
       branch.SetTitle(title)
     return branch
   
+  def addTree(self, name, title=None):
+    """Add an empty tree with the same branches (and branch addresses) as the main tree.
+    Should be called after all branches are added."""
+    if name in self.trees:
+      raise IOError("Tree of name '%s' already exists!"%(name))
+    self.outfile.cd()
+    tree = self.tree.CloneTree(0)
+    tree.SetName(name)
+    tree.SetTitle(title or name)
+    self.trees[name] = tree
+    return tree
+  
+  def setTree(self, name):
+    """Set tree to fill with the next calls of fill()."""
+    if name not in self.trees:
+      raise IOError("Tree of name '%s' does not exist! Available: %s"%(name,sorted(self.trees.keys())))
+    self.treename = name
+  
   def fill(self):
-    """Fill tree."""
-    return self.tree.Fill()
+    """Fill tree, or add event as a row to the buffer of the tree."""
+    if self.row is None:
+      if self.nbuffer<=0:
+        return self.trees[self.treename].Fill()
+      self.createBuffer()
+    name   = self.treename
+    buffer = self.getBuffer(name)
+    buffer[self.nrows[name]] = self.row[0]
+    self.nrows[name] += 1
+    if self.nrows[name]>=len(buffer) or self.nbuffer<=0: # unbuffered after fillColumns
+      self.flush(name)
+    return 1
+  
+  def fillColumns(self, columns, nrows):
+    """Fill nrows entries at once from a dictionary of branch name -> array of nrows values (or a constant),
+    e.g. in columnar mode, by writing them straight into the buffer of the tree, without the row of fill().
+    Other branches get the value of the row, i.e. their default."""
+    if nrows<=0:
+      return 0
+    if self.row is None:
+      self.createBuffer()
+    name   = self.treename
+    buffer = self.getBuffer(name)
+    start  = 0
+    while start<nrows:
+      nrow = self.nrows[name]
+      n    = min(nrows-start,len(buffer)-nrow)
+      rows = buffer[nrow:nrow+n]
+      rows[:] = self.row[0] # defaults
+      for branch, values in columns.iteritems():
+        rows[branch] = values[start:start+n] if np.ndim(values) else values
+      self.nrows[name] += n
+      start += n
+      if self.nrows[name]>=len(buffer):
+        self.flush(name)
+    if self.nbuffer<=0:
+      self.flush(name)
+    return nrows
+  
+  def getBuffer(self, name):
+    """Return the buffer of rows of a tree, and create it if it does not exist yet.
+    Without buffering (buffer=0), a small one is used for fillColumns."""
+    buffer = self.buffers.get(name)
+    if buffer is None:
+      buffer = self.buffers[name] = np.zeros(self.nbuffer if self.nbuffer>0 else 1000,dtype=self.row.dtype)
+      self.nrows[name] = 0
+    return buffer
+  
+  def createBuffer(self):
+    """Create a row with one field per branch, and point the branch arrays (e.g. self.pt_1)
+    to the fields of this row, which is copied to the buffer of the tree in fill()."""
+    dtype     = np.dtype([(n,a.dtype) for n, a in self.arrays],align=True)
+    self.row  = np.zeros(1,dtype=dtype)
+    self.vaddresses = ROOT.std.vector('Long64_t')()
+    self.voffsets   = ROOT.std.vector('Long64_t')()
+    self.vsizes     = ROOT.std.vector('Long64_t')()
+    for name, array in self.arrays:
+      self.row[name][0] = array[0] # keep defaults
+      setattr(self,name,self.row[name]) # point to field of row
+      self.vaddresses.push_back(array.ctypes.data) # address of branch
+      self.voffsets.push_back(dtype.fields[name][1])
+      self.vsizes.push_back(array.dtype.itemsize)
+    self.fillBlock = loadFillBlock()
+  
+  def flush(self, name=None):
+    """Write buffered rows to a given tree, or to all trees."""
+    nbytes = 0
+    for name in ([name] if name else self.buffers.keys()):
+      buffer = self.buffers[name]
+      if self.nrows[name]>0:
+        nbytes += self.fillBlock(self.trees[name],buffer.ctypes.data,self.nrows[name],buffer.dtype.itemsize,
+                                 self.vaddresses,self.voffsets,self.vsizes)
+        self.nrows[name] = 0
+    return nbytes
   
   def endJob(self):
     """Write and close files after the job ends."""
+    if self.nbuffer>0:
+      self.flush()
+      self.cutflow.flush()
     self.outfile.Write()
     self.outfile.Close()
   
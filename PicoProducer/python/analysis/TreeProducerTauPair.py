@@ -48,6 +48,9 @@ class TreeProducerTauPair(TreeProducer):
         self.addBranch('trigweightUp',    'f', 1.)
         self.addBranch('trigweightDown',  'f', 1.)
       self.addBranch('puweight',          'f', 1., title="pileup up reweighting")
+      if not module.dotight:
+        self.addBranch('puweightUp',      'f', 1., title="pileup reweighting, minimum bias cross section +4.6%")
+        self.addBranch('puweightDown',    'f', 1., title="pileup reweighting, minimum bias cross section -4.6%")
       self.addBranch('zptweight',         'f', 1., title="Z pT reweighting")
       self.addBranch('ttptweight',        'f', 1., title="top pT reweighting")
       self.addBranch('btagweight',        'f', 1.)
@@ -0,0 +1,316 @@
+# Description: Columnar processing of nanoAOD in blocks of events with numpy arrays
+# Sources:
+#   https://root.cern.ch/doc/master/classTTree.html#a73450649dc6e54b5b94516c468523e45 (TTree::Draw)
+#   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/framework/postprocessor.py
+import os, sys
+import time
+import numpy as np
+from ROOT import TFile
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import preSkim
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.kinematics import deltaPhi, deltaR
+LOG = Logger('Columnar')
+
+
+def drawcolumns(tree, exprs, nentries, first, nrows):
+  """Read up to four expressions for a range of entries into numpy arrays with TTree::Draw.
+  All expressions should have the same number of rows (i.e. be of the same collection)."""
+  assert 1<=len(exprs)<=4, "drawcolumns: Can only draw 1-4 expressions at the same time! Got %s"%(exprs)
+  if nrows<=0:
+    return [np.zeros(0,dtype=np.float64) for e in exprs]
+  tree.SetEstimate(nrows+1) # make sure buffers can hold all rows
+  ndrawn = tree.Draw(':'.join(exprs),"","goff",nentries,first)
+  if ndrawn<0:
+    LOG.throw(IOError,"drawcolumns: Could not draw %s! Does the tree have all branches?"%(exprs))
+  assert ndrawn==nrows, "drawcolumns: Expected %d rows for %s, but got %s!"%(nrows,exprs,ndrawn)
+  arrays = [ ]
+  for i, expr in enumerate(exprs,1):
+    buffer = getattr(tree,"GetV%d"%i)()
+    buffer.SetSize(nrows)
+    arrays.append(np.frombuffer(buffer,dtype=np.float64,count=nrows).copy())
+  return arrays
+  
+
+class EventBlock(object):
+  """Block of consecutive events, with branches read lazily into numpy arrays.
+  Branches can be accessed as attributes, e.g. block.HLT_IsoMu24, or per collection:
+    muons = block.collection('Muon')
+    muons.pt, muons.evt # flattened array of muon pT, index of event in block
+  Missing branches are redirected to another branch or a default value with
+  a list of (new branch, old branch or default value), like ensurebranches (see utils.py).
+  """
+  
+  def __init__(self, tree, first, nevents, mask=None, **kwargs):
+    self.tree     = tree
+    self.first    = first   # first entry in tree
+    self.nevents  = nevents # number of events in block
+    self.mask     = np.ones(nevents,dtype=bool) if mask is None else mask # e.g. JSON
+    self.redirects = dict(kwargs.get('branches',[ ])) # new branch -> old branch or default
+    self.verbosity = kwargs.get('verb',0)
+    self._columns = { }
+    self._counts  = { }
+    self._missing = set()
+  
+  def __getattr__(self, name):
+    if name.startswith('_'):
+      raise AttributeError("EventBlock has no attribute %r"%(name))
+    return self.getcolumn(name)
+  
+  def entries(self, mask=None):
+    """Return tree entries of the events in this block, optionally with a mask."""
+    entries = np.arange(self.first,self.first+self.nevents)
+    return entries if mask is None else entries[mask]
+  
+  def event(self, i):
+    """Return nanoAOD Event of i'th event in this block, for event-by-event processing."""
+    return Event(self.tree,self.first+int(i))
+  
+  def load(self, branches):
+    """Preload a list of branches, grouping those in the same collection per TTree::Draw call."""
+    groups = { }
+    for branch in branches:
+      if branch in self._columns: continue
+      if not self.tree.GetBranch(branch):
+        self._setmissing(branch)
+        continue
+      prefix = self._prefix(branch)
+      groups.setdefault(prefix,[ ]).append(branch)
+    for prefix, group in groups.iteritems():
+      nrows = self.counts(prefix).sum() if prefix else self.nevents
+      for i in xrange(0,len(group),4):
+        exprs  = group[i:i+4]
+        arrays = drawcolumns(self.tree,exprs,self.nevents,self.first,nrows)
+        for branch, array in zip(exprs,arrays):
+          self._columns[branch] = array
+  
+  def getcolumn(self, branch):
+    """Get flat numpy array of branch for all events (or all objects) in this block."""
+    if branch not in self._columns:
+      self.load([branch])
+    return self._columns[branch]
+  
+  def counts(self, prefix):
+    """Return number of objects per event for a given collection, e.g. nMuon."""
+    if prefix not in self._counts:
+      self._counts[prefix] = self.getcolumn('n'+prefix).astype(np.int64)
+    return self._counts[prefix]
+  
+  def collection(self, prefix, mask=None):
+    """Return objects of a collection, optionally only for events passing a mask."""
+    return ObjectBlock(self,prefix,mask=mask)
+  
+  def _prefix(self, branch):
+    """Return collection prefix of branch, or None for event-level branches."""
+    if '_' not in branch:
+      return None
+    prefix = branch.split('_')[0]
+    if self.tree.GetBranch('n'+prefix):
+      return prefix
+    return None
+  
+  def _setmissing(self, branch):
+    """Redirect missing branch to another branch or a default value, or set it to default zeros."""
+    prefix = self._prefix(branch)
+    nrows  = self.counts(prefix).sum() if prefix else self.nevents
+    if branch in self.redirects:
+      value = self.redirects[branch]
+      if isinstance(value,str): # rename
+        self._columns[branch] = self.getcolumn(value)
+      else: # set default
+        self._columns[branch] = np.full(nrows,float(value),dtype=np.float64)
+      return
+    if branch not in self._missing:
+      LOG.warning("EventBlock: Branch %r does not exist! Using zeros..."%(branch))
+      self._missing.add(branch)
+    self._columns[branch] = np.zeros(nrows,dtype=np.float64)
+  
+
+class ObjectBlock(object):
+  """Flattened collection of objects in a block of events, e.g. all muons in a block.
+  Object attributes are numpy arrays, e.g. muons.pt, while
+    muons.evt is the index of the event in the block, and
+    muons.idx is the index of the object in its event's collection."""
+  
+  def __init__(self, block, prefix, sel=None, mask=None):
+    self.block  = block
+    self.prefix = prefix
+    counts      = block.counts(prefix)
+    if sel is None:
+      sel       = np.arange(counts.sum())
+      if mask is not None: # only events passing mask
+        sel     = sel[np.repeat(mask,counts)]
+    self.sel    = sel # index in flat array of all objects in the block
+    offsets     = np.cumsum(counts) - counts
+    allevt      = np.repeat(np.arange(len(counts)),counts)
+    self.evt    = allevt[sel]
+    self.idx    = sel - offsets[self.evt]
+  
+  def __len__(self):
+    return len(self.sel)
+  
+  def __getattr__(self, name):
+    if name.startswith('_'):
+      raise AttributeError("ObjectBlock has no attribute %r"%(name))
+    return self.block.getcolumn("%s_%s"%(self.prefix,name))[self.sel]
+  
+  def __getitem__(self, mask):
+    """Return subset of objects passing some mask."""
+    return ObjectBlock(self.block,self.prefix,sel=self.sel[mask])
+  
+  def nperevent(self):
+    """Count number of (selected) objects per event in the block."""
+    return np.bincount(self.evt,minlength=self.block.nevents)
+  
+
+def pairs(objects1, objects2):
+  """Return indices of all combinations of objects in the same event,
+  ordered in the same way as nested loops over both collections."""
+  nevts   = objects1.block.nevents
+  counts2 = objects2.nperevent()
+  offset2 = np.cumsum(counts2) - counts2
+  nrep    = counts2[objects1.evt] # number of partners per object in first collection
+  index1  = np.repeat(np.arange(len(objects1)),nrep)
+  start   = np.repeat(np.cumsum(nrep)-nrep,nrep)
+  index2  = offset2[objects1.evt][index1] + np.arange(len(index1)) - start
+  return index1, index2
+  
+
+def uniquepairs(objects):
+  """Return indices of all unique combinations of objects of one collection in the same event,
+  ordered in the same way as nested loops over objects[i+1:]."""
+  index1, index2 = pairs(objects,objects)
+  unique = index1<index2
+  return index1[unique], index2[unique]
+  
+
+def choosepair(evt, keys):
+  """Return indices of the best pair per event, given sorting keys of increasing priority,
+  which are 'larger is better'. Like max() over the pair objects, the last one wins ties."""
+  if len(evt)==0:
+    return np.zeros(0,dtype=np.int64)
+  order  = np.lexsort(tuple(keys)+(evt,)) # stable: ties keep order
+  sevt   = evt[order]
+  islast = np.append(sevt[1:]!=sevt[:-1],True)
+  return order[islast]
+  
+
+def eventindex(objects):
+  """Return the index of the object in each event of the block, or -1 if there is none,
+  for collections with at most one object per event, e.g. the selected ones."""
+  index = np.full(objects.block.nevents,-1,dtype=np.int64)
+  index[objects.evt] = np.arange(len(objects))
+  return index
+  
+
+def eventcolumn(objects, values, ievt, default=-1):
+  """Return array of the values of objects (at most one per event) for a list of events in the block,
+  with a default for events without object."""
+  column = np.full(objects.block.nevents,default,dtype=np.float64)
+  column[objects.evt] = values
+  return column[ievt]
+  
+
+def overlaps(objects, others, dRmin):
+  """Return mask of objects within DeltaR<dRmin of any of the other objects in the same event,
+  like utils.getoverlaps, with others a list of collections with at most one object per event."""
+  overlap = np.zeros(len(objects),dtype=bool)
+  for other in others:
+    index = eventindex(other)[objects.evt]
+    has   = index>=0
+    overlap[has] |= deltaR(objects.eta[has],objects.phi[has],other.eta[index[has]],other.phi[index[has]])<dRmin
+  return overlap
+  
+
+def isselected(objects, others):
+  """Return mask of objects that are one of the other objects of the same collection,
+  with others a list of collections with at most one object per event."""
+  same = np.zeros(len(objects),dtype=bool)
+  for other in others:
+    index = eventindex(other)[objects.evt]
+    has   = index>=0
+    same[has] |= objects.idx[has]==other.idx[index[has]]
+  return same
+  
+
+def rank(evt, values):
+  """Return the rank of objects in their event when sorted by decreasing value (0 = leading),
+  keeping the order of equal values, like sort(key=value,reverse=True) per event."""
+  order = np.lexsort((-values,evt)) # stable
+  sevt  = evt[order]
+  ranks = np.empty(len(evt),dtype=np.int64)
+  ranks[order] = np.arange(len(evt)) - np.searchsorted(sevt,sevt)
+  return ranks
+  
+
+class ColumnarProcessor(object):
+  """Simple replacement of nanoAOD-tools' PostProcessor to process blocks of events,
+  calling analyzeBlock instead of analyze for each module."""
+  
+  def __init__(self, infiles, modules, **kwargs):
+    self.infiles    = infiles
+    self.modules    = modules
+    self.jsonInput  = kwargs.get('jsonInput',  None  )
+    self.maxEntries = kwargs.get('maxEntries', None  ) # per file, like PostProcessor
+    self.firstEntry = kwargs.get('firstEntry', 0     ) # per file, like PostProcessor
+    self.blocksize  = kwargs.get('blocksize',  10000 )
+    self.treename   = kwargs.get('treename',   'Events')
+    self.verbosity  = kwargs.get('verb',       0     )
+    if kwargs.get('prefetch',False):
+      LOG.warning("ColumnarProcessor: Prefetching is not supported, reading files directly...")
+  
+  def run(self):
+    """Process all files."""
+    time0  = time.time()
+    ntot, npass = 0, 0
+    for module in self.modules:
+      module.beginJob()
+    for fname in self.infiles:
+      print ">>> Processing %s..."%(fname)
+      file = TFile.Open(fname)
+      if not file or file.IsZombie():
+        LOG.throw(IOError,"ColumnarProcessor: Could not open %s!"%(fname))
+      tree = InputTree(file.Get(self.treename))
+      nevts, nsel = self.processfile(file,tree)
+      ntot  += nevts
+      npass += nsel
+      file.Close()
+    for module in self.modules:
+      module.endJob()
+    dt = time.time()-time0
+    print ">>> Processed %d entries in %.1f seconds (%.1f Hz), %d passed"%(ntot,dt,ntot/dt if dt>0 else 0,npass)
+    return ntot, npass
+  
+  def processfile(self, file, tree):
+    """Process all blocks in one file. Return number of processed and passed events."""
+    start    = self.firstEntry
+    end      = tree.GetEntries()
+    if self.maxEntries!=None:
+      end    = min(end,start+self.maxEntries)
+    jsonmask = None
+    if self.jsonInput:
+      elist, jsonFilter = preSkim(tree,self.jsonInput,None,maxEntries=end-start,firstEntry=start)
+      jsonmask = np.zeros(end,dtype=bool)
+      if elist:
+        entries  = np.array([elist.GetEntry(i) for i in xrange(elist.GetN())],dtype=np.int64)
+        jsonmask[entries[(start<=entries) & (entries<end)]] = True
+    branches = [ ] # redirect missing branches, like ensurebranches in beginFile
+    for module in self.modules:
+      module.beginFile(file,None,tree,None)
+      if hasattr(module,'getBranchMap'):
+        branches += module.getBranchMap()
+    nevts, npass = 0, 0
+    for first in xrange(start,end,self.blocksize):
+      nblock = min(self.blocksize,end-first)
+      mask   = None if jsonmask is None else jsonmask[first:first+nblock]
+      block  = EventBlock(tree,first,nblock,mask=mask,branches=branches,verb=self.verbosity)
+      nevts += block.mask.sum()
+      for module in self.modules:
+        npass += module.analyzeBlock(block)
+      if self.verbosity>=1:
+        print ">>> Processed %d/%d entries..."%(first+nblock-start,end-start)
+    for module in self.modules:
+      module.endFile(file,None,tree,None)
+    return nevts, npass
+  
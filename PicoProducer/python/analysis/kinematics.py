@@ -0,0 +1,130 @@
+# Description: Kinematics kernels that work on plain floats, as well as on numpy arrays,
+#              without creating TLorentzVector or TVector3 objects.
+#              The formulas follow the ROOT vector classes, so results agree to machine precision.
+# Sources:
+#   https://root.cern.ch/doc/master/classTLorentzVector.html
+#   https://root.cern.ch/doc/master/classTVector3.html
+import math
+from math import pi
+from collections import namedtuple
+import numpy as np
+Funcs  = namedtuple('Funcs',['sqrt','cos','sin','sinh','atan2','log'])
+_math  = Funcs(math.sqrt,math.cos,math.sin,math.sinh,math.atan2,math.log)
+_numpy = Funcs(np.sqrt,np.cos,np.sin,np.sinh,np.arctan2,np.log)
+
+
+def funcs(*values):
+  """Return math functions for plain floats, or numpy functions if any of the values is an array."""
+  for value in values:
+    if isinstance(value,np.ndarray):
+      return _numpy
+  return _math
+  
+
+def wrapphi(phi):
+  """Wrap angle(s) to [-pi,pi) in closed form."""
+  return (phi + pi)%(2*pi) - pi
+  
+
+def deltaPhi(phi1, phi2):
+  """Compute DeltaPhi of (arrays of) angles, wrapped to [-pi,pi)."""
+  return wrapphi(phi1 - phi2)
+  
+
+def deltaR(eta1, phi1, eta2, phi2):
+  """Compute DeltaR of (arrays of) objects."""
+  deta = eta1 - eta2
+  dphi = deltaPhi(phi1,phi2)
+  return funcs(deta,dphi).sqrt( deta*deta + dphi*dphi )
+  
+
+def deltaRMatrix(eta1, phi1, eta2, phi2):
+  """Compute DeltaR between all objects of two collections, given as arrays.
+  Return a matrix with the objects of the first collection as rows."""
+  eta1, phi1 = np.asarray(eta1,dtype=np.float64)[:,None], np.asarray(phi1,dtype=np.float64)[:,None]
+  eta2, phi2 = np.asarray(eta2,dtype=np.float64)[None,:], np.asarray(phi2,dtype=np.float64)[None,:]
+  return deltaR(eta1,phi1,eta2,phi2)
+  
+
+def p4(pt, eta, phi, mass):
+  """Return (px, py, pz, E), like TLorentzVector.SetPtEtaPhiM."""
+  f  = funcs(pt,eta,phi,mass)
+  px = pt*f.cos(phi)
+  py = pt*f.sin(phi)
+  pz = pt*f.sinh(eta)
+  return px, py, pz, f.sqrt(px*px+py*py+pz*pz+mass*mass)
+  
+
+def ptphi(px, py):
+  """Return pT and phi of (arrays of) vectors in the transverse plane, like TVector3.Pt and Phi."""
+  f   = funcs(px,py)
+  pt  = f.sqrt(px*px+py*py)
+  if f is _math:
+    phi = 0.0 if px==0.0 and py==0.0 else f.atan2(py,px)
+  else:
+    phi = np.where((px==0.0) & (py==0.0),0.0,f.atan2(py,px))
+  return pt, phi
+  
+
+def mass(px, py, pz, E):
+  """Return invariant mass of (arrays of) four-vectors, like TLorentzVector.M,
+  which is negative for space-like vectors."""
+  mm = E*E - (px*px+py*py+pz*pz)
+  return funcs(mm).sqrt(abs(mm))*((mm>=0)*2-1)
+  
+
+def invmass(pt1, eta1, phi1, m1, pt2, eta2, phi2, m2):
+  """Return invariant mass and pT of the sum of two (arrays of) objects."""
+  px1, py1, pz1, e1 = p4(pt1,eta1,phi1,m1)
+  px2, py2, pz2, e2 = p4(pt2,eta2,phi2,m2)
+  px, py, pz, e = px1+px2, py1+py2, pz1+pz2, e1+e2
+  return mass(px,py,pz,e), funcs(px,py).sqrt(px*px+py*py)
+  
+
+def rapidity(pt, eta, phi, m):
+  """Return rapidity of (arrays of) objects, like TLorentzVector.Rapidity."""
+  px, py, pz, e = p4(pt,eta,phi,m)
+  return 0.5*funcs(pz,e).log((e+pz)/(e-pz))
+  
+
+def mt(pt1, phi1, pt2, phi2):
+  """Return transverse mass of (arrays of) two objects, e.g. a lepton and the MET."""
+  return funcs(pt1,pt2,phi1,phi2).sqrt( 2*pt1*pt2*(1-funcs(phi1,phi2).cos(deltaPhi(phi1,phi2))) )
+  
+
+def unit(px, py):
+  """Return unit vector(s) in the transverse plane, like TVector3.Unit, which leaves null vectors."""
+  f   = funcs(px,py)
+  mag = f.sqrt(px*px+py*py)
+  if f is _math:
+    tot = 1.0/mag if mag>0 else 1.0
+  else:
+    tot = 1.0/np.where(mag>0,mag,1.0)
+  return px*tot, py*tot
+  
+
+def zetaaxis(px1, py1, px2, py2):
+  """Return the zeta axis, i.e. the bisector of two (arrays of) objects in the transverse plane."""
+  ux1, uy1 = unit(px1,py1)
+  ux2, uy2 = unit(px2,py2)
+  return unit(ux1+ux2,uy1+uy2)
+  
+
+def pzeta(px1, py1, px2, py2, metpx, metpy):
+  """Return the projections pzetamiss and pzetavis, and the zeta axis.
+  The axis can be reused to project MET variations with project(metpx,metpy,zetax,zetay)."""
+  zetax, zetay = zetaaxis(px1,py1,px2,py2)
+  pzetavis  = project(px1,py1,zetax,zetay) + project(px2,py2,zetax,zetay)
+  pzetamiss = project(metpx,metpy,zetax,zetay)
+  return pzetamiss, pzetavis, (zetax, zetay)
+  
+
+def project(px, py, axisx, axisy):
+  """Project (arrays of) vectors on a (unit) axis."""
+  return px*axisx + py*axisy
+  
+
+def correctmet(metpx, metpy, dpx, dpy):
+  """Correct the MET by removing a shift in the transverse momentum of an object."""
+  return metpx - dpx, metpy - dpy
+  
@@ -1,5 +1,7 @@
 # Author: Izaak Neutelings (May 2020)
-import os, sys
+import os, sys, re
+import numpy as np
+from array import array
 from math import sqrt, sin, cos, pi
 from itertools import combinations
 from ROOT import TH1D, TLorentzVector
@@ -8,6 +10,7 @@ from TauFW.common.tools.utils import getyear, convertstr # for picojob.py
 from TauFW.common.tools.file import ensurefile
 from TauFW.common.tools.file import ensuremodule as _ensuremodule
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.kinematics import deltaPhi, deltaR, deltaRMatrix
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
 LOG = Logger('Analysis')
 
@@ -43,6 +46,17 @@ def ensurebranches(tree,branches):
       redirectbranch(oldbranch,newbranch)
   
 
+def redirectformula(tree,formula,branches):
+  """Redirect the branches in a TTreeFormula expression that are not available in the tree,
+  in the same way as ensurebranches: to another branch, or to a default value."""
+  fullbranchlist = tree.GetListOfBranches()
+  for newbranch, oldbranch in branches:
+    if newbranch not in fullbranchlist:
+      value   = oldbranch if isinstance(oldbranch,str) else "(%s)"%(int(oldbranch) if isinstance(oldbranch,bool) else oldbranch)
+      formula = re.sub(r"\b%s\b"%(newbranch),value,formula)
+  return formula
+  
+
 def redirectbranch(oldbranch,newbranch):
   """Redirect some branch names. newbranch -> oldbranch"""
   if isinstance(oldbranch,str): # rename
@@ -84,31 +98,20 @@ def dumpgenpart(part,genparts=None,event=None):
   print info
   
 
-def deltaR(eta1, phi1, eta2, phi2):
-  """Compute DeltaR."""
-  deta = eta1 - eta2
-  dphi = deltaPhi(phi1, phi2)
-  return sqrt( deta*deta + dphi*dphi )
-  
-
-def deltaPhi(phi1, phi2):
-  """Computes DeltaPhi, handling periodic limit conditions."""
-  res = phi1 - phi2
-  while res>pi:
-    res -= 2*pi
-  while res<-pi:
-    res += 2*pi
-  return res
-  
-
-def getmet(era,var="",verb=0):
-  """Return year-dependent MET recipe."""
+def getmetbranches(era,var=""):
+  """Return names of the year-dependent MET pt and phi branches."""
   branch  = 'METFixEE2017' if ('2017' in era and 'UL' not in era) else 'MET'
   pt      = '%s_pt'%(branch)
   phi     = '%s_phi'%(branch)
   if var:
     pt   += '_'+var
     phi  += '_'+var
+  return pt, phi
+  
+
+def getmet(era,var="",verb=0):
+  """Return year-dependent MET recipe."""
+  pt, phi = getmetbranches(era,var)
   funcstr = "func = lambda e: TLorentzVector(e.%s*cos(e.%s),e.%s*sin(e.%s),0,e.%s)"%(pt,phi,pt,phi,pt)
   if verb>=1:
     LOG.verb(">>> getmet: %r"%(funcstr))
@@ -116,13 +119,6 @@ def getmet(era,var="",verb=0):
   return func
   
 
-def correctmet(met,dp):
-  """Correct the MET by removing a four-vector, ensuring the MET has no z component or mass component.""" 
-  met -= dp
-  met.SetPxPyPzE(met.Px(),met.Py(),0,sqrt(met.Px()**2+met.Py()**2))
-  return met
-  
-
 def getmetfilters(era,isdata,verb=0):
   """Return a method to check if an event passes the recommended MET filters."""
   # https://twiki.cern.ch/twiki/bin/viewauth/CMS/MissingETOptionalFiltersRun2
@@ -140,6 +136,16 @@ def getmetfilters(era,isdata,verb=0):
   #  else:
   #    return lambda e: e.Flag_goodVertices and e.Flag_globalSuperTightHalo2016Filter and e.Flag_HBHENoiseFilter and e.Flag_HBHENoiseIsoFilter and\
   #                     e.Flag_EcalDeadCellTriggerPrimitiveFilter and e.Flag_BadPFMuonFilter # eeBadScFilter "not suggested"
+  filters = getmetfilterbranches(era,isdata)
+  funcstr = "func = lambda e: e."+' and e.'.join(filters)
+  if verb>=1:
+    LOG.verb(">>> getmetfilters: %r"%(funcstr))
+  exec funcstr #in locals()
+  return func
+  
+
+def getmetfilterbranches(era,isdata):
+  """Return list of the recommended MET filter flags."""
   filters = [
     'Flag_goodVertices',
     'Flag_globalSuperTightHalo2016Filter',
@@ -152,11 +158,7 @@ def getmetfilters(era,isdata,verb=0):
     filters.extend(['Flag_eeBadScFilter']) # eeBadScFilter "not suggested" for MC
   if ('2017' in era or '2018' in era) and ('UL' not in era):
     filters.extend(['Flag_ecalBadCalibFilterV2']) # under review for change in Ultra Legacy
-  funcstr = "func = lambda e: e."+' and e.'.join(filters)
-  if verb>=1:
-    LOG.verb(">>> getmetfilters: %r"%(funcstr))
-  exec funcstr #in locals()
-  return func
+  return filters
   
 
 def loosestIso(tau):
@@ -175,17 +177,25 @@ def idIso(tau):
   return 0 if raw>4.5 else 1 if raw>3.5 else 3 # VVLoose, VLoose
   
 
+def idIsoArray(rawIso, photonsOutsideSignalCone, pt):
+  """Compute WPs of cut-based tau isolation for arrays of taus, like idIso."""
+  tight = np.select([rawIso>4.5,rawIso>3.5,rawIso>2.5,rawIso>1.5,rawIso>0.8],[0,1,3,7,15],31)
+  loose = np.select([rawIso>4.5,rawIso>3.5],[0,1],3)
+  return np.where(photonsOutsideSignalCone/pt<0.10,tight,loose)
+  
+
 def matchgenvistau(event,tau,dRmin=0.5):
   """Help function to match tau object to gen vis tau."""
   # TO CHECK: taumatch.genPartIdxMother==tau.genPartIdx ?
   taumatch = None
-  for genvistau in Collection(event,'GenVisTau'):
-    dR = genvistau.DeltaR(tau)
+  for genvistau in getgenindex(event).vistaus():
+    pt, eta, phi, status = genvistau
+    dR = deltaR(tau.eta,tau.phi,eta,phi)
     if dR<dRmin:
       dRmin    = dR
       taumatch = genvistau
   if taumatch:
-    return taumatch.pt, taumatch.eta, taumatch.phi, taumatch.status
+    return taumatch
   else:
     return -1, -9, -9, -1
   
@@ -202,23 +212,197 @@ def matchtaujet(event,tau,ismc):
   return jpt_match, jpt_genmatch
 
 
-def getlepvetoes(event, electrons, muons, taus, channel):
-  """Check if event has extra electrons or muons. (HTT definitions.)"""
+def getvariations(values):
+  """Parse list of systematic variations, e.g. from a comma-separated string '0.97,1.03'."""
+  if isinstance(values,str):
+    values = [v for v in values.split(',') if v]
+  elif not isinstance(values,(list,tuple)):
+    values = [values]
+  return [float(v) for v in values]
+  
+
+class ObjectCache:
+  """Cache collections and object selections of one event, so they can be shared between
+  analyze, getlepvetoes and fillJetBranches. Objects read each variable only once,
+  and the cache is cleared automatically when a new event is passed."""
+  
+  def __init__(self):
+    self.event       = None
+    self.collections = { }
+    self.selections  = { }
+  
+  def reset(self, event):
+    """Clear cache if this is a new event."""
+    if event is not self.event:
+      self.event = event
+      self.collections.clear()
+      self.selections.clear()
+  
+  def collection(self, event, prefix):
+    """Return collection of objects, e.g. 'Muon', created once per event."""
+    self.reset(event)
+    if prefix not in self.collections:
+      self.collections[prefix] = Collection(event,prefix)
+    return self.collections[prefix]
+  
+  def select(self, event, key, prefix, cut):
+    """Return list of objects in collection passing a cut function, evaluated once per event."""
+    self.reset(event)
+    if key not in self.selections:
+      self.selections[key] = [o for o in self.collection(event,prefix) if cut(o)]
+    return self.selections[key]
+  
+
+class EventCache:
+  """Cache event-level quantities of one event, like MET filters and pileup weights, so they can be
+  shared between several channel modules running on the same events (see MultiChannel).
+  The cache is cleared automatically when an event with another entry is passed,
+  so modules may use different Event objects for the same entry (e.g. in columnar mode)."""
+  
+  def __init__(self):
+    self.tree   = None
+    self.entry  = None
+    self.values = { }
+  
+  def get(self, event, key, func, *args, **kwargs):
+    """Return func(*args,**kwargs), evaluated once per event."""
+    if event._entry!=self.entry or event._tree is not self.tree:
+      self.tree  = event._tree
+      self.entry = event._entry
+      self.values.clear()
+    if key not in self.values:
+      self.values[key] = func(*args,**kwargs)
+    return self.values[key]
+  
+
+class GenIndex:
+  """Index of the generator particles of one event, decoded once from the GenPart arrays,
+  so gen-level utilities do not each loop over Collection(event,'GenPart'):
+    pdgId, status, flags, mother, pt, eta, phi, mass: lists of GenPart variables,
+    daughters: list of daughter indices per particle,
+    lastcopy:  flag if particle is the last copy (bit 13 of statusFlags),
+    buckets:   abs(pdgId) -> indices of particles (in order of the collection),
+    hardleps:  indices of hard-process leptons (status 1 electrons & muons, status 2 taus),
+    hardtaus:  indices of last copies of hard-process taus,
+    bosons:    indices of last copies of Z, W, H bosons,
+    tops:      indices of top quarks after radiation (status 62).
+  Use getgenindex(event) to create it only once per event."""
+  
+  def __init__(self, event):
+    self.event     = event
+    self.n         = nparts = event.nGenPart
+    self.pdgId     = [event.GenPart_pdgId[i] for i in xrange(nparts)]
+    self.status    = [event.GenPart_status[i] for i in xrange(nparts)]
+    self.flags     = [event.GenPart_statusFlags[i] for i in xrange(nparts)]
+    self.mother    = [event.GenPart_genPartIdxMother[i] for i in xrange(nparts)]
+    self.pt        = [event.GenPart_pt[i] for i in xrange(nparts)]
+    self.eta       = [event.GenPart_eta[i] for i in xrange(nparts)]
+    self.phi       = [event.GenPart_phi[i] for i in xrange(nparts)]
+    self.mass      = [event.GenPart_mass[i] for i in xrange(nparts)]
+    self.daughters = [[ ] for i in xrange(nparts)]
+    self.buckets   = { }
+    self.lastcopy  = [hasbit(f,13) for f in self.flags]
+    self.hardleps  = [ ]
+    self.hardtaus  = [ ]
+    self.bosons    = [ ]
+    self.tops      = [ ]
+    for i in xrange(nparts):
+      pid, status, flags, moth = abs(self.pdgId[i]), self.status[i], self.flags[i], self.mother[i]
+      if 0<=moth<nparts:
+        self.daughters[moth].append(i)
+      self.buckets.setdefault(pid,[ ]).append(i)
+      if hasbit(flags,8) and ((status==1 and (pid==11 or pid==13)) or (status==2 and pid==15)):
+        self.hardleps.append(i)
+      if pid==15 and hasbit(flags,8) and self.lastcopy[i]:
+        self.hardtaus.append(i)
+      elif pid in (23,24,25) and self.lastcopy[i]:
+        self.bosons.append(i)
+      elif pid==6 and status==62:
+        self.tops.append(i)
+    self._collection = None
+    self._vistaus    = None
+  
+  def bucket(self, pid):
+    """Return indices of particles with given abs(pdgId)."""
+    return self.buckets.get(abs(pid),[ ])
+  
+  def p4(self, i):
+    """Return TLorentzVector of i'th particle, like Object.p4."""
+    tlv = TLorentzVector()
+    tlv.SetPtEtaPhiM(self.pt[i],self.eta[i],self.phi[i],self.mass[i])
+    return tlv
+  
+  def particle(self, i):
+    """Return nanoAOD Object of i'th particle."""
+    if self._collection is None:
+      self._collection = Collection(self.event,'GenPart')
+    return self._collection[i]
+  
+  def ancestor(self, i):
+    """Follow the mothers of the i'th particle until the PDG ID changes. Return index, or -1 if none."""
+    pid  = abs(self.pdgId[i])
+    moth = self.mother[i]
+    while moth>=0 and abs(self.pdgId[moth])==pid:
+      moth = self.mother[moth]
+    return moth
+  
+  def deltaR(self, i, eta, phi):
+    """Compute DeltaR of i'th particle to a given eta and phi."""
+    return deltaR(eta,phi,self.eta[i],self.phi[i])
+  
+  def vistaus(self):
+    """Return list of (pt, eta, phi, status) of the visible gen taus."""
+    if self._vistaus is None:
+      event = self.event
+      self._vistaus = [(event.GenVisTau_pt[i],event.GenVisTau_eta[i],event.GenVisTau_phi[i],event.GenVisTau_status[i])
+                       for i in xrange(event.nGenVisTau)]
+    return self._vistaus
+  
+
+_genindex = None
+def getgenindex(event):
+  """Return the GenIndex of this event, created only once per event."""
+  global _genindex
+  if _genindex is None or _genindex.event is not event:
+    _genindex = GenIndex(event)
+  return _genindex
+  
+
+def getoverlaps(objects, others, dRmin):
+  """Return flags for each object if it overlaps with any of the other objects, i.e. DeltaR<dRmin,
+  computing the DeltaR matrix in one go."""
+  if not objects or not others:
+    return [False]*len(objects)
+  dRs = deltaRMatrix([o.eta for o in objects],[o.phi for o in objects],[o.eta for o in others],[o.phi for o in others])
+  return (dRs<dRmin).any(axis=1)
+  
+
+def isvetomuon(muon):
+  """Kinematic, vertex and isolation cuts of the extra muon veto."""
+  return not (muon.pt<10 or abs(muon.eta)>2.4 or abs(muon.dz)>0.2 or abs(muon.dxy)>0.045 or muon.pfRelIso04_all>0.3)
+  
+
+def isvetoelectron(electron):
+  """Kinematic, vertex and isolation cuts of the extra electron veto."""
+  return not (electron.pt<10 or abs(electron.eta)>2.5 or abs(electron.dz)>0.2 or abs(electron.dxy)>0.045 or electron.pfRelIso03_all>0.3)
+  
+
+def getlepvetoes(event, electrons, muons, taus, channel, cache=None):
+  """Check if event has extra electrons or muons. (HTT definitions.)
+  Pass an ObjectCache to reuse the preselected leptons between calls for the same event."""
   # https://twiki.cern.ch/twiki/bin/viewauth/CMS/HiggsToTauTauWorkingLegacyRun2#Common_lepton_vetoes
   
   extramuon_veto = False
   extraelec_veto = False
   dilepton_veto  = False
+  if cache is None:
+    cache = ObjectCache()
   
   # EXTRA MUON VETO
   looseMuons = [ ]
-  for muon in Collection(event,'Muon'):
-    if muon.pt<10: continue
-    if abs(muon.eta)>2.4: continue
-    if abs(muon.dz)>0.2: continue
-    if abs(muon.dxy)>0.045: continue
-    if muon.pfRelIso04_all>0.3: continue
-    if any(muon.DeltaR(tau)<0.4 for tau in taus): continue
+  vetomuons  = cache.select(event,'vetomuon','Muon',isvetomuon)
+  for muon, overlap in zip(vetomuons,getoverlaps(vetomuons,taus,0.4)):
+    if overlap: continue
     if muon.mediumId and all(m._index!=muon._index for m in muons):
       extramuon_veto = True
     if muon.pt>15 and muon.isPFcand and muon.isGlobal and muon.isTracker:
@@ -226,13 +410,9 @@ def getlepvetoes(event, electrons, muons, taus, channel):
   
   # EXTRA ELECTRON VETO
   looseElectrons = [ ]
-  for electron in Collection(event,'Electron'):
-    if electron.pt<10: continue
-    if abs(electron.eta)>2.5: continue
-    if abs(electron.dz)>0.2: continue
-    if abs(electron.dxy)>0.045: continue
-    if electron.pfRelIso03_all>0.3: continue
-    if any(electron.DeltaR(tau)<0.4 for tau in taus): continue
+  vetoelecs      = cache.select(event,'vetoelectron','Electron',isvetoelectron)
+  for electron, overlap in zip(vetoelecs,getoverlaps(vetoelecs,taus,0.4)):
+    if overlap: continue
     if all(e._index!=electron._index for e in electrons): continue
     if electron.convVeto==1 and electron.lostHits<=1 and electron.mvaFall17V2Iso_WP90:
       extraelec_veto = True
@@ -265,6 +445,8 @@ class LeptonPair:
     self.iso2 = iso2
     self.pair = [obj1,obj2]
   
+  isosigns = (-1,-1) # greater = smaller isolation, see bestpair
+  
   def __gt__(self, opair):
     """Order dilepton pairs according to the pT of both objects first, then in isolation."""
     if   self.pt1  != opair.pt1:  return self.pt1  > opair.pt1  # greater = higher pT
@@ -274,6 +456,7 @@ class LeptonPair:
     return True
   
 class LeptonTauPair(LeptonPair):
+  isosigns = (-1,+1)
   def __gt__(self, opair):
     """Override for tau isolation."""
     if   self.pt1  != opair.pt1:  return self.pt1  > opair.pt1  # greater = higher pT
@@ -283,6 +466,7 @@ class LeptonTauPair(LeptonPair):
     return True
   
 class DiTauPair(LeptonPair):
+  isosigns = (+1,+1)
   def __gt__(self, opair):
     """Override for tau isolation."""
     if   self.pt1  != opair.pt1:  return self.pt1  > opair.pt1  # greater = higher pT
@@ -292,14 +476,58 @@ class DiTauPair(LeptonPair):
     return True
   
 
+def bestpair(objects1, isos1, objects2=None, isos2=None, ordering=LeptonPair, dRmin=0.5):
+  """Return the best pair of objects with DeltaR>=dRmin, like max() over a list of LeptonPair objects,
+  without creating them: Compare key tuples (pt1, pt2, +/-iso1, +/-iso2) with the signs of
+  ordering.isosigns, and let the last pair win ties, like LeptonPair.__gt__.
+  If objects2 is None, take all unique pairs of objects1, like nested loops with objects1[i:].
+  Return None if there is no valid pair."""
+  sign1, sign2 = ordering.isosigns
+  keys1   = [(o.pt,sign1*iso) for o, iso in zip(objects1,isos1)]
+  if objects2 is None:
+    objects2, keys2 = objects1, [(o.pt,sign2*iso) for o, iso in zip(objects1,isos1)]
+  else:
+    keys2 = [(o.pt,sign2*iso) for o, iso in zip(objects2,isos2)]
+  unique  = objects2 is objects1
+  best    = None
+  bestkey = None
+  for i, obj1 in enumerate(objects1):
+    pt1, iso1 = keys1[i]
+    for j in xrange(i+1 if unique else 0,len(objects2)):
+      obj2 = objects2[j]
+      if obj2.DeltaR(obj1)<dRmin: continue
+      pt2, iso2 = keys2[j]
+      key = (pt1,pt2,iso1,iso2)
+      if bestkey is None or key>=bestkey: # last wins ties
+        best, bestkey = (i,j), key
+  if best is None:
+    return None
+  return objects1[best[0]], objects2[best[1]]
+  
+
+def pairkeys(pt1, iso1, pt2, iso2, ordering=LeptonPair):
+  """Return sorting keys of increasing priority for columnar.choosepair from arrays of
+  the pT and isolation of both objects of each pair, with the same ordering as bestpair."""
+  sign1, sign2 = ordering.isosigns
+  return (sign2*iso2, sign1*iso1, pt2, pt1)
+  
+
 class Cutflow(object):
-  """Container class for cutflow."""
+  """Container class for cutflow.
+  If inmemory=True, keep the counters in python, and only copy them to the histogram
+  with flush() before writing, to avoid calling TH1::Fill several times per event."""
   
   def __init__(self, histname, ncuts, **kwargs):
-    self.hist    = TH1D('cutflow','cutflow',ncuts,0,ncuts)
+    self.hist     = TH1D('cutflow','cutflow',ncuts,0,ncuts)
     self.hist.GetXaxis().SetLabelSize(0.041)
-    self.nextidx = 0
-    self.cuts    = { }
+    self.nextidx  = 0
+    self.cuts     = { }
+    self.inmemory = kwargs.get('inmemory',False)
+    self.sumw     = [0.]*ncuts # bin contents
+    self.sumw2    = [0.]*ncuts # sum of squared weights
+    self.stats    = [0.]*4     # sumw, sumw2, sumwx, sumwx2 (see TH1::GetStats)
+    self.nentries = 0
+    self.weighted = False      # TH1::Sumw2 is called after the first weight!=1
   
   def addcut(self, name, title, index=None):
     if index==None:
@@ -315,5 +543,56 @@ class Cutflow(object):
   def fill(self, cut, *args):
     assert cut in self.cuts, "Did not find cut '%s'! Choose from %s"%(cut,self.cuts)
     index = self.cuts[cut]
-    self.hist.Fill(index,*args)
+    if self.inmemory:
+      self.add(index,args[0] if args else 1.)
+    else:
+      self.hist.Fill(index,*args)
+  
+  def fillN(self, cut, nevts, weights=None):
+    """Fill cut for a number of events at once, optionally with an array of weights."""
+    assert cut in self.cuts, "Did not find cut '%s'! Choose from %s"%(cut,self.cuts)
+    if nevts<=0: return
+    if self.inmemory:
+      if weights is None:
+        self.addN(self.cuts[cut],nevts,float(nevts),float(nevts))
+      else:
+        weights = np.asarray(weights,dtype=np.float64)
+        self.addN(self.cuts[cut],nevts,weights.sum(),np.dot(weights,weights),(weights!=1.0).any())
+    else:
+      if weights is None:
+        weights = np.ones(nevts,dtype=np.float64)
+      else:
+        weights = np.ascontiguousarray(weights,dtype=np.float64)
+      index = np.full(nevts,self.cuts[cut],dtype=np.float64)
+      self.hist.FillN(nevts,index,weights)
+  
+  def add(self, index, weight):
+    """Add weight to counters, like TH1::Fill."""
+    self.addN(index,1,weight,weight*weight,weight!=1.0)
+  
+  def addN(self, index, nevts, sumw, sumw2, weighted=False):
+    """Add the sum of weights and squared weights of a number of events to the counters at once."""
+    self.sumw[index]  += sumw
+    self.sumw2[index] += sumw2
+    self.stats[0]     += sumw
+    self.stats[1]     += sumw2
+    self.stats[2]     += sumw*index
+    self.stats[3]     += sumw*index*index
+    self.nentries     += nevts
+    if weighted:
+      self.weighted    = True
+  
+  def flush(self):
+    """Copy counters into histogram."""
+    if not self.inmemory:
+      return self.hist
+    if self.weighted:
+      self.hist.Sumw2()
+    for index, sumw in enumerate(self.sumw):
+      self.hist.SetBinContent(1+index,sumw)
+      if self.weighted:
+        self.hist.GetSumw2().SetAt(self.sumw2[index],1+index)
+    self.hist.SetEntries(self.nentries)
+    self.hist.PutStats(array('d',self.stats))
+    return self.hist
   
@@ -10,11 +10,14 @@
 #   https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/modules/btv/btagSFProducer.py
 import os
 from array import array
+from bisect import bisect_right
+import numpy as np
 import ROOT
 #ROOT.gROOT.ProcessLine('.L ./BTagCalibrationStandalone.cpp+')
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.file import ensureTFile
 from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.ScaleFactorTool import BinnedLookup
 from ROOT import TH2F, BTagCalibration, BTagCalibrationReader
 from ROOT.BTagEntry import OP_LOOSE, OP_MEDIUM, OP_TIGHT, OP_RESHAPING
 from ROOT.BTagEntry import FLAV_B, FLAV_C, FLAV_UDSG
@@ -57,8 +60,12 @@ class BTagWPs:
 
 class BTagWeightTool:
   
-  def __init__(self, tagger, wp='medium', channel='mutau', year=2017, maxeta=2.4, loadsys=False, type_bc='comb'):
-    """Load b tag weights from CSV file."""
+  def __init__(self, tagger, wp='medium', channel='mutau', year=2017, maxeta=2.4, loadsys=False, type_bc='comb',
+               tabulate=True, validate=True):
+    """Load b tag weights from CSV file.
+    If tabulate=True, the SFs are tabulated on a fine pt grid, and interpolated linearly.
+    If validate=True, the tabulated SFs are checked against BTagCalibrationReader for random jets,
+    and the reader is used instead if they differ by more than BTagSFTable.tolerance."""
     
     assert(year in [2016,2017,2018]), "You must choose a year from: 2016, 2017, or 2018."
     assert(tagger in ['CSVv2','DeepCSV']), "BTagWeightTool: You must choose a tagger from: CSVv2, DeepCSV!"
@@ -96,6 +103,7 @@ class BTagWeightTool:
       tagged = lambda j: j.btagDeepB>self.wp
     else:
       tagged = lambda j: j.btagCSVV2>self.wp
+    self.tagvar = 'btagDeepB' if 'deep' in tagger.lower() else 'btagCSVV2' # discriminator, e.g. for arrays of jets
     
     # CSV READER
     print "Loading BTagWeightTool for %s (%s WP)..."%(tagger,wp) #,(", "+sigma) if sigma!='central' else ""
@@ -113,6 +121,28 @@ class BTagWeightTool:
       reader.load(calib,FLAV_C,   type_bc)
       reader.load(calib,FLAV_UDSG,type_udsg)
     
+    # TABULATE SFs
+    tables = { }
+    if tabulate:
+      opint = 0 if wp=='loose' else 1 if wp=='medium' else 2
+      for unc, reader in readers.items():
+        tables[unc] = { }
+        for FLAV, type in [(FLAV_B,type_bc),(FLAV_C,type_bc),(FLAV_UDSG,type_udsg)]:
+          etabins, ptbins = getCSVBins(csvname,opint,type,FLAV)
+          if not ptbins:
+            LOG.warning("Could not find pt bins for flavor %s and %r in %s! Not tabulating..."%(FLAV,type,csvname))
+            tables = { }
+            break
+          tables[unc][FLAV] = BTagSFTable(reader,FLAV,etabins,ptbins)
+          if validate:
+            diff, pt, eta = tables[unc][FLAV].validate(reader)
+            if diff>BTagSFTable.tolerance:
+              LOG.warning("Difference %.2g of tabulated SFs for %s, flavor %s at pt=%.2f, |eta|=%.3f exceeds tolerance %.2g! Not tabulating..."%(
+                          diff,unc,FLAV,pt,eta,BTagSFTable.tolerance))
+              tables = { }
+              break
+        if not tables: break
+    
     # EFFICIENCIES
     hists      = { } # histograms to compute the b tagging efficiencies in MC
     effmaps    = { } # b tag efficiencies in MC to compute b tagging weight for an event
@@ -137,6 +167,7 @@ class BTagWeightTool:
         effmaps[flavor]    = getDefaultEffMap(effname,flavor,wp)
       effmaps[flavor].SetDirectory(0)
     efffile.Close()
+    efftables  = { f: BinnedLookup.fromhist(h) for f, h in effmaps.iteritems() }
     
     if default:
       LOG.warning("Made use of default efficiency histograms! The b tag weights from this module should be regarded as placeholders only,\n"+\
@@ -146,9 +177,11 @@ class BTagWeightTool:
     self.tagged  = tagged
     self.calib   = calib
     self.readers = readers
+    self.tables  = tables
     self.loadsys = loadsys
     self.hists   = hists
     self.effmaps = effmaps
+    self.efftabs = efftables
     self.maxeta  = maxeta
   
   def getWeight(self,jets,unc='Nom'):
@@ -164,7 +197,10 @@ class BTagWeightTool:
     FLAV = flavorToFLAV(flavor)
     if   eta>=+2.4: eta = +2.399 # BTagCalibrationReader returns zero if |eta| > 2.4
     elif eta<=-2.4: eta = -2.399
-    sf   = self.readers[unc].eval(FLAV,abs(eta),pt) #eval_auto_bounds
+    if self.tables:
+      sf = self.tables[unc][FLAV].eval(abs(eta),pt)
+    else:
+      sf = self.readers[unc].eval(FLAV,abs(eta),pt) #eval_auto_bounds
     if tagged:
       weight = sf
     else:
@@ -179,18 +215,42 @@ class BTagWeightTool:
   def getEff(self,pt,eta,flavor):
     """Get b tag efficiency for a single jet in MC."""
     flavor = flavorToString(flavor)
-    hist   = self.effmaps[flavor]
-    xbin   = hist.GetXaxis().FindBin(pt)
-    ybin   = hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>hist.GetYaxis().GetNbins(): ybin -= 1
-    eff    = hist.GetBinContent(xbin,ybin)
+    eff    = self.efftabs[flavor].lookup(pt,eta)
     ###if eff==1:
     ###  print "Warning! BTagWeightTool.getEff: MC efficiency is 1 for pt=%s, eta=%s, flavor=%s, sf=%s"%(pt,eta,flavor,sf)
     return eff
   
+  def getWeightArray(self,pts,etas,flavors,tagged,unc='Nom',evt=None,nevts=1):
+    """Get b tagging event weight for arrays of jet pt, eta, flavor and tag decision.
+    If the index of the event of each jet is given, return an array of the weights of nevts events."""
+    pts, etas = np.asarray(pts,dtype=np.float64), np.asarray(etas,dtype=np.float64)
+    flavors   = np.abs(flavors)
+    tagged    = np.asarray(tagged,dtype=bool)
+    central   = np.abs(etas)<self.maxeta
+    etas      = np.clip(etas,-2.399,+2.399) # BTagCalibrationReader returns zero if |eta| > 2.4
+    sfs       = np.ones(pts.shape)
+    effs      = np.zeros(pts.shape)
+    for FLAV, flavor, mask in [(FLAV_B,'b',flavors==5),(FLAV_C,'c',(flavors==4)|(flavors==15)),(FLAV_UDSG,'udsg',(flavors!=5)&(flavors!=4)&(flavors!=15))]:
+      mask = mask & central
+      if not mask.any(): continue
+      if self.tables:
+        sfs[mask] = self.tables[unc][FLAV].evalarray(np.abs(etas[mask]),pts[mask])
+      else:
+        sfs[mask] = [self.readers[unc].eval(FLAV,abs(e),p) for p, e in zip(pts[mask],etas[mask])]
+      effflavor   = np.where(flavors[mask]==4,'c',np.where(flavors[mask]==5,'b','udsg')) # c-tau jets use udsg eff.
+      for f in ['b','c','udsg']:
+        fmask = np.zeros(pts.shape,dtype=bool)
+        fmask[mask] = (effflavor==f)
+        if fmask.any():
+          effs[fmask] = self.efftabs[f].lookuparray(pts[fmask],etas[fmask])
+    weights = np.where(tagged,sfs,np.where(effs==1,1.,(1.-sfs*effs)/np.where(effs==1,2.,1.-effs)))
+    weights = np.where(central,weights,1.)
+    if evt is None:
+      return np.prod(weights)
+    eventweights = np.ones(nevts)
+    np.multiply.at(eventweights,evt,weights) # in order of the jets, like getWeight
+    return eventweights
+  
   def fillEffMaps(self,jets,usejec=False):
     """Fill histograms to make efficiency map for MC, split by true jet flavor,
     and jet pT and eta. Numerator = b tagged jets; denominator = all jets."""
@@ -201,6 +261,18 @@ class BTagWeightTool:
         self.hists[flavor].Fill(jetpt,jet.eta)
       self.hists[flavor+'_all'].Fill(jetpt,jet.eta)
   
+  def fillEffMapsArray(self,pts,etas,flavors,tagged):
+    """Fill histograms to make efficiency map for MC, like fillEffMaps,
+    for arrays of jet pt, eta, flavor and tag decision."""
+    flavors = np.abs(flavors)
+    tagged  = np.asarray(tagged,dtype=bool)
+    for flavor, mask in [('b',flavors==5),('c',flavors==4),('udsg',(flavors!=5)&(flavors!=4))]:
+      for histname, fmask in [(flavor,mask&tagged),(flavor+'_all',mask)]:
+        njets = fmask.sum()
+        if njets>0:
+          self.hists[histname].FillN(njets,np.ascontiguousarray(pts[fmask],dtype=np.float64),
+                                     np.ascontiguousarray(etas[fmask],dtype=np.float64),np.ones(njets))
+  
   def setDir(self,directory,subdirname=None):
     """Set directory of histograms (efficiency map) before writing."""
     if subdirname:
@@ -248,3 +320,97 @@ def getDefaultEffMap(histname,flavor,wp='medium'):
       hist.SetBinContent(xbin,ybin,eff)
   return hist
   
+
+def getCSVBins(csvname,op,type,FLAV):
+  """Help function to get the |eta| and pt bin edges of a given operating point,
+  measurement type and flavor from a CSV file read by BTagCalibration."""
+  flavint = 0 if FLAV==FLAV_B else 1 if FLAV==FLAV_C else 2
+  etabins, ptbins = set(), set()
+  with open(csvname,'r') as file:
+    for line in file:
+      row = [c.strip() for c in line.split(',',10)]
+      if len(row)<11 or not row[0].isdigit(): continue # header
+      if int(row[0])!=op or row[1]!=type or int(row[3])!=flavint: continue
+      etabins.update([abs(float(row[4])),abs(float(row[5]))])
+      ptbins.update([float(row[6]),float(row[7])])
+  etabins.add(0.0)
+  return sorted(etabins), sorted(ptbins)
+  
+
+class BTagSFTable:
+  """Table of SFs from a BTagCalibrationReader for one flavor, tabulated at load time
+  on a fine, logarithmic pt grid per |eta| bin, and interpolated linearly in between.
+  The pt bins of the CSV file are nodes of the grid, so the steps between them are kept."""
+  
+  tolerance = 1e-5  # maximum difference with BTagCalibrationReader
+  step      = 0.002 # relative step size in pt
+  
+  def __init__(self, reader, FLAV, etabins, ptbins):
+    self.FLAV    = FLAV
+    self.etabins = list(etabins)
+    self.netas   = len(etabins)-1
+    grids        = [ ] # grid per pt bin
+    for ptmin, ptmax in zip(ptbins[:-1],ptbins[1:]):
+      if ptmin>0:
+        npts = max(2,int(np.ceil(np.log(ptmax/ptmin)/np.log(1.+self.step))))
+        grids.append(np.geomspace(ptmin,ptmax,npts+1))
+      else:
+        grids.append(np.linspace(ptmin,ptmax,int(1./self.step)+1))
+    self.nodes   = np.concatenate([g[:-1] for g in grids]+[[ptbins[-1]]])
+    self.npts    = len(self.nodes)-1 # number of intervals
+    self.offsets = np.zeros((self.netas,self.npts))
+    self.slopes  = np.zeros((self.netas,self.npts))
+    self.under   = np.zeros(self.netas) # below lowest pt bin
+    self.over    = np.zeros(self.netas) # above highest pt bin
+    for ieta in range(self.netas):
+      eta     = 0.5*(etabins[ieta]+etabins[ieta+1])
+      offsets = [ ]
+      slopes  = [ ]
+      for grid in grids:
+        eps = 1e-9*(grid[-1]-grid[0]) # stay inside the pt bin at its edges
+        ys  = np.array([reader.eval(FLAV,eta,x) for x in [grid[0]+eps]+list(grid[1:-1])+[grid[-1]-eps]])
+        offsets.append(ys[:-1])
+        slopes.append(np.diff(ys)/np.diff(grid))
+      self.offsets[ieta] = np.concatenate(offsets)
+      self.slopes[ieta]  = np.concatenate(slopes)
+      self.under[ieta]   = reader.eval(FLAV,eta,0.5*self.nodes[0])
+      self.over[ieta]    = reader.eval(FLAV,eta,2.0*self.nodes[-1])
+    self._nodes   = self.nodes.tolist() # bisect on python lists is faster for scalars
+    self._offsets = self.offsets.tolist()
+    self._slopes  = self.slopes.tolist()
+  
+  def findetabin(self, abseta):
+    """Get index of |eta| bin, clamped to the first and last bin."""
+    return min(max(bisect_right(self.etabins,abseta)-1,0),self.netas-1)
+  
+  def eval(self, abseta, pt):
+    """Get SF for a single jet."""
+    ieta = self.findetabin(abseta)
+    i    = bisect_right(self._nodes,pt)-1
+    if i<0:
+      return self.under[ieta]
+    if i>=self.npts:
+      return self.over[ieta]
+    return self._offsets[ieta][i] + self._slopes[ieta][i]*(pt-self._nodes[i])
+  
+  def evalarray(self, abseta, pt):
+    """Get SFs for arrays of jets."""
+    ieta  = np.searchsorted(self.etabins,abseta,side='right')-1
+    ieta  = np.clip(ieta,0,self.netas-1)
+    i     = np.searchsorted(self.nodes,pt,side='right')-1
+    j     = np.clip(i,0,self.npts-1)
+    sfs   = self.offsets[ieta,j] + self.slopes[ieta,j]*(pt-self.nodes[j])
+    return np.where(i<0,self.under[ieta],np.where(i>=self.npts,self.over[ieta],sfs))
+  
+  def validate(self, reader, npoints=10000, seed=1):
+    """Compare to BTagCalibrationReader for random jets, and return maximum difference."""
+    random  = np.random.RandomState(seed) # reproducible, and leave the global state alone
+    pts     = random.uniform(0.8*self.nodes[0],1.2*self.nodes[-1],npoints)
+    etas    = random.uniform(0.0,2.399,npoints)
+    maxdiff = (0.,0.,0.)
+    for pt, eta in zip(pts,etas):
+      diff = abs(self.eval(eta,pt)-reader.eval(self.FLAV,eta,pt))
+      if diff>maxdiff[0]:
+        maxdiff = (diff,pt,eta)
+    return maxdiff
+  
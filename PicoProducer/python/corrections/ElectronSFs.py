@@ -45,3 +45,11 @@ class ElectronSFs:
     """Get SF for electron identification + isolation."""
     return self.sftool_idiso.getSF(pt,eta)
   
+  def getTriggerSFArray(self, pts, etas):
+    """Get SFs for single electron trigger for arrays of pT, eta."""
+    return self.sftool_trig.getSFArray(pts,etas)
+  
+  def getIdIsoSFArray(self, pts, etas):
+    """Get SFs for electron identification + isolation for arrays of pT, eta."""
+    return self.sftool_idiso.getSFArray(pts,etas)
+  
@@ -2,12 +2,12 @@
 import os
 from TauFW.PicoProducer import datadir
 from RooWorkspaceTool import RooScaleFactor
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from TauFW.PicoProducer.analysis.utils import getgenindex
 pathSFs = os.path.join(datadir, "embedding")
 
 
 class EmbeddingSFs:
-    def __init__(self, era):
+    def __init__(self, era, **kwargs):
         eras = ['2016', '2017', '2018', 'UL2017']
         assert era in eras, "MuonSFs: You must choose a year from: %s." % (
             ', '.join(eras))
@@ -18,46 +18,62 @@ class EmbeddingSFs:
             "2018": pathSFs + "/Run2018/htt_scalefactors_legacy_2018.root"
         }
         self.workspace = workspace_dict[self.era]
+        # tabulate the workspace functions on grids, and cache them on disk
+        self.sfargs = {
+            'tabulate': kwargs.get('tabulate', True),
+            'cache': kwargs.get('cache', os.path.join(pathSFs, "cache")),
+            'strict': kwargs.get('strict', True), # check table against getVal
+            'verb': kwargs.get('verb', 0)
+        }
 
 
 class EmbeddingMuonSFs(EmbeddingSFs):
-    def __init__(self, era):
-        EmbeddingSFs.__init__(self, era)
+    def __init__(self, era, **kwargs):
+        EmbeddingSFs.__init__(self, era, **kwargs)
         """Load workspaces from files."""
         self.arguments = ["m_pt", "m_eta"]
         if self.era == '2016':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="m_id_ratio_emb",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="m_iso_ratio_emb",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(workspace=self.workspace,
                                              function="m_trg_ratio_emb",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
         elif self.era == '2017':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="m_id_embed_kit_ratio",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="m_iso_embed_kit_ratio",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(
                 workspace=self.workspace,
                 function="m_trg24_27_embed_kit_ratio",
-                arguments=self.arguments)
+                arguments=self.arguments,
+                **self.sfargs)
 
         elif self.era == '2018':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="m_id_embed_kit_ratio",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="m_iso_embed_kit_ratio",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(
                 workspace=self.workspace,
                 function="m_trg24_27_embed_kit_ratio",
-                arguments=self.arguments)
+                arguments=self.arguments,
+                **self.sfargs)
 
     def getIdSF(self, pt, eta):
         """Get SF for muon identification."""
@@ -76,45 +92,54 @@ class EmbeddingMuonSFs(EmbeddingSFs):
 
 
 class EmbeddingElectronSFs(EmbeddingSFs):
-    def __init__(self, era):
-        EmbeddingSFs.__init__(self, era)
+    def __init__(self, era, **kwargs):
+        EmbeddingSFs.__init__(self, era, **kwargs)
         """Load workspaces from files."""
         self.arguments = ["e_pt", "e_eta"]
 
         if era == '2016':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="e_id_ratio_emb",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="e_iso_ratio_emb",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(workspace=self.workspace,
                                              function="e_trg_ratio_emb",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
 
         elif era == '2017':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="e_id_embed_kit_ratio",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="e_iso_embed_kit_ratio",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(
                 workspace=self.workspace,
                 function="e_trg27_trg35_embed_kit_ratio",
-                arguments=self.arguments)
+                arguments=self.arguments,
+                **self.sfargs)
 
         elif era == '2018':
             self.sftool_id = RooScaleFactor(workspace=self.workspace,
                                             function="e_id_embed_kit_ratio",
-                                            arguments=self.arguments)
+                                            arguments=self.arguments,
+                                            **self.sfargs)
             self.sftool_iso = RooScaleFactor(workspace=self.workspace,
                                              function="e_iso_embed_kit_ratio",
-                                             arguments=self.arguments)
+                                             arguments=self.arguments,
+                                             **self.sfargs)
             self.sftool_trg = RooScaleFactor(
                 workspace=self.workspace,
                 function="e_trg27_trg35_embed_kit_ratio",
-                arguments=self.arguments)
+                arguments=self.arguments,
+                **self.sfargs)
 
     def getIdSF(self, pt, eta):
         """Get SF for electron identification."""
@@ -133,39 +158,40 @@ class EmbeddingElectronSFs(EmbeddingSFs):
 
 
 class EmbeddingSelectionSFs(EmbeddingSFs):
-    def __init__(self, era):
-        EmbeddingSFs.__init__(self, era)
+    def __init__(self, era, **kwargs):
+        EmbeddingSFs.__init__(self, era, **kwargs)
         if self.era == "2016":
 
             self.sftool_seltrg = RooScaleFactor(
                 workspace=self.workspace,
                 function="m_sel_trg_kit_ratio",
-                arguments=["gt1_pt", "gt2_pt", "gt1_eta", "gt2_eta"])
+                arguments=["gt1_pt", "gt2_pt", "gt1_eta", "gt2_eta"],
+                **self.sfargs)
             self.sftool_selid = RooScaleFactor(
                 workspace=self.workspace,
                 function="m_sel_idemb_kit_ratio",
-                arguments=["gt_pt", "gt_eta"])
+                arguments=["gt_pt", "gt_eta"],
+                **self.sfargs)
         else:
             self.sftool_seltrg = RooScaleFactor(
                 workspace=self.workspace,
                 function="m_sel_trg_ratio",
-                arguments=["gt1_pt", "gt2_pt", "gt1_eta", "gt2_eta"])
+                arguments=["gt1_pt", "gt2_pt", "gt1_eta", "gt2_eta"],
+                **self.sfargs)
             self.sftool_selid = RooScaleFactor(workspace=self.workspace,
                                                function="m_sel_idEmb_ratio",
-                                               arguments=["gt_pt", "gt_eta"])
+                                               arguments=["gt_pt", "gt_eta"],
+                                               **self.sfargs)
 
     def getEmbeddingSelectionTriggerSF(self, event):
         """Get SF for embedding trigger selection efficiency. we use the two gentaus in the event
            Since we know from the embedding, that there are always two of those in the event, this can be done
         """
         parameters = {}
-        genparticles = Collection(event, 'GenPart')
-        i = 1
-        for genparticle in genparticles:
-            if abs(genparticle.pdgId) == 15:
-                parameters["gt{}_pt".format(i)] = genparticle.pt
-                parameters["gt{}_eta".format(i)] = abs(genparticle.eta)
-                i += 1
+        index = getgenindex(event)
+        for i, id in enumerate(index.bucket(15)[:2], 1):
+            parameters["gt{}_pt".format(i)] = index.pt[id]
+            parameters["gt{}_eta".format(i)] = abs(index.eta[id])
         return self.sftool_seltrg.getSF(parameters)
 
     def getEmbeddingSelectionIdSF(self, event, index):
@@ -177,9 +203,9 @@ class EmbeddingSelectionSFs(EmbeddingSFs):
             pdgId = 15
         else:
             pdgId = -15
-        genparticles = Collection(event, 'GenPart')
-        for genparticle in genparticles:
-            if genparticle.pdgId == pdgId:
-                parameters["gt_pt"] = genparticle.pt
-                parameters["gt_eta"] = abs(genparticle.eta)
+        index = getgenindex(event)
+        for id in index.bucket(15):
+            if index.pdgId[id] == pdgId:
+                parameters["gt_pt"] = index.pt[id]
+                parameters["gt_eta"] = abs(index.eta[id])
         return self.sftool_selid.getSF(parameters)
\ No newline at end of file
@@ -3,6 +3,7 @@
 # HTT: https://github.com/CMS-HTT/LeptonEfficiencies
 # https://twiki.cern.ch/twiki/bin/view/CMS/MuonReferenceEffs2017
 import os
+import numpy as np
 from TauFW.PicoProducer import datadir
 from ScaleFactorTool import ScaleFactor, ScaleFactorHTT
 pathPOG = os.path.join(datadir,"lepton/MuonPOG/")
@@ -47,3 +48,11 @@ class MuonSFs:
     """Get SF for muon identification + isolation."""
     return self.sftool_idiso.getSF(pt,abs(eta))
   
+  def getTriggerSFArray(self, pts, etas):
+    """Get SFs for single muon trigger for arrays of pT, eta."""
+    return self.sftool_trig.getSFArray(pts,np.abs(etas))
+  
+  def getIdIsoSFArray(self, pts, etas):
+    """Get SFs for muon identification + isolation for arrays of pT, eta."""
+    return self.sftool_idiso.getSFArray(pts,np.abs(etas))
+  
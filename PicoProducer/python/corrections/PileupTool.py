@@ -1,5 +1,7 @@
 # Author: Izaak Neutelings (November 2018)
 import os, re
+from bisect import bisect_right
+import numpy as np
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.file import ensureTFile
 from TauFW.common.tools.log import Logger
@@ -9,18 +11,14 @@ LOG     = Logger('PileupTool',showname=True)
 
 class PileupWeightTool:
   
-  def __init__(self, era, sigma='central', sample=None, buggy=False, flat=False, verb=0):
-    """Load data and MC pilup profiles."""
+  def __init__(self, era, sigma='central', sample=None, buggy=False, flat=False, updown=False, verb=0):
+    """Load data and MC pilup profiles, and precompute the weights per bin.
+    If updown=True, also precompute the weights for the up/down variation of the minimum bias cross section."""
     
     assert( sigma in ['central','up','down'] ), "You must choose a s.d. variation from: 'central', 'up', or 'down'."
-    minbias = '69p2'
-    if sigma=='down':
-      minbias = '66p0168' # -4.6%
-    elif sigma=='up':
-      minbias = '72p3832' # +4.6%
+    minbiases = { 'central': '69p2', 'down': '66p0168', 'up': '72p3832' } # +/-4.6%
     
     if era=='2016':
-      datafilename = os.path.join(datadir,"Data_PileUp_%s_%s.root"%(era,minbias))
       mcfilename   = os.path.join(datadir,"MC_PileUp_%s_Moriond17.root"%(era))
     elif era=='2017':
       tag = ""
@@ -28,44 +26,107 @@ class PileupWeightTool:
         buggy = buggy or hasBuggyPU(sample)
         if buggy: tag = "_old_pmx"
         else:     tag = "_new_pmx"
-      datafilename = os.path.join(datadir,"Data_PileUp_%s_%s.root"%(era,minbias))
       mcfilename   = os.path.join(datadir,"MC_PileUp_%s_Winter17_V2%s.root"%(era,tag))
     elif era=='UL2017':
-      datafilename = os.path.join(datadir,"Data_PileUp_%s_%s.root"%(era,minbias))
       mcfilename   = os.path.join(datadir,"MC_PileUp_%s_Summer19.root"%(era))
     elif era=='2018':
-      datafilename = os.path.join(datadir,"Data_PileUp_%s_%s.root"%(era,minbias))
       mcfilename   = os.path.join(datadir,"MC_PileUp_%s_Autumn18.root"%(era))
     else:
       raise IOError("Did not recognize era %r! You must choose a year from: 2016, 2017, UL2017, or 2018."%(era))
     
     if flat or (sample and hasFlatPU(sample)):
       mcfilename   = os.path.join(datadir,"MC_PileUp_%d_FlatPU0to75.root"%year)
+    datafilenames  = { s: os.path.join(datadir,"Data_PileUp_%s_%s.root"%(era,m)) for s, m in minbiases.items() }
     
-    print "Loading PileupWeightTool for '%s' and '%s'"%(datafilename,mcfilename)
-    self.datafile = ensureTFile(datafilename, 'READ')
-    self.mcfile   = ensureTFile(mcfilename, 'READ')
-    self.datahist = self.datafile.Get('pileup')
-    self.mchist   = self.mcfile.Get('pileup')
-    self.datahist.SetDirectory(0)
-    self.mchist.SetDirectory(0)
-    self.datahist.Scale(1./self.datahist.Integral())
-    self.mchist.Scale(1./self.mchist.Integral())
-    self.datafile.Close()
-    self.mcfile.Close()
+    print "Loading PileupWeightTool for '%s' and '%s'"%(datafilenames[sigma],mcfilename)
+    self.mchist   = gethist(mcfilename)
+    self.datahist = gethist(datafilenames[sigma])
+    self.table    = self.gettable(self.datahist,self.mchist)
+    self.tables   = { None: self.table }
+    if updown:
+      for unc, var in [('Up','up'),('Down','down')]:
+        self.tables[unc] = self.gettable(gethist(datafilenames[var]),self.mchist)
     
   
-  def getWeight(self,npu):
+  def gettable(self, datahist, mchist):
+    """Compute the weights for all bins of the data and MC profiles, including under- and overflow,
+    for which a single lookup replaces the two FindBin calls per event."""
+    edges   = sorted(set(getedges(datahist)+getedges(mchist)))
+    points  = [edges[0]-1.]+[0.5*(a+b) for a, b in zip(edges[:-1],edges[1:])]+[edges[-1]+1.]
+    weights = [ ]
+    for x in points:
+      data = datahist.GetBinContent(datahist.GetXaxis().FindBin(x))
+      mc   = mchist.GetBinContent(mchist.GetXaxis().FindBin(x))
+      if mc>0.:
+        weights.append(min(5.,data/mc))
+      else:
+        if data>0.:
+          LOG.warning("PileupWeightTools.gettable: Could not make pileup weight for npu=%s data=%s, mc=%s"%(x,data,mc))
+        weights.append(1.)
+    return PileupTable(edges,weights)
+    
+  
+  def getWeight(self, npu, unc=None):
     """Get pileup weight for a given number of pileup interactions."""
-    data = self.datahist.GetBinContent(self.datahist.GetXaxis().FindBin(npu))
-    mc   = self.mchist.GetBinContent(self.mchist.GetXaxis().FindBin(npu))
-    if mc>0.:
-      ratio = data/mc
-      if ratio>5.: return 5.
-      return data/mc
-    LOG.warning("PileupWeightTools.getWeight: Could not make pileup weight for npu=%s data=%s, mc=%s"%(npu,data,mc))
-    return 1.
+    return self.tables[unc].lookup(npu)
+    
+  
+  def getWeightArray(self, npus, unc=None):
+    """Get pileup weights for an array of numbers of pileup interactions."""
+    return self.tables[unc].lookuparray(npus)
+    
+  
+
+class PileupTable:
+  """Pileup weights per bin of the merged binning of the data and MC profiles.
+  For the same fixed binning in both (usually one bin per integer number of interactions),
+  the bin index is computed directly like TAxis::FindBin, otherwise with a binary search."""
   
+  def __init__(self, edges, weights):
+    self.edges   = np.array(edges,dtype=np.float64)
+    self.weights = np.array(weights,dtype=np.float64) # includes under- and overflow
+    self._edges  = list(edges)
+    self._wgts   = list(weights)
+    self.nbins   = len(edges)-1
+    self.xmin    = edges[0]
+    self.xmax    = edges[-1]
+    widths       = np.diff(self.edges)
+    self.fixed   = bool(np.allclose(widths,widths[0],rtol=1e-9,atol=0))
+  
+  def lookup(self, x):
+    """Get weight for a single value."""
+    if self.fixed:
+      if x<self.xmin: return self._wgts[0]
+      if not x<self.xmax: return self._wgts[-1]
+      return self._wgts[1+int(self.nbins*(x-self.xmin)/(self.xmax-self.xmin))]
+    return self._wgts[bisect_right(self._edges,x)]
+  
+  def lookuparray(self, x):
+    """Get weights for an array of values."""
+    x = np.asarray(x,dtype=np.float64)
+    if self.fixed:
+      inside = (x>=self.xmin) & (x<self.xmax)
+      ibins  = np.where(x<self.xmin,0,self.nbins+1) # under- and overflow (including NaN)
+      ibins[inside] = 1+(self.nbins*(x[inside]-self.xmin)/(self.xmax-self.xmin)).astype(np.int64)
+    else:
+      ibins = np.searchsorted(self.edges,x,side='right')
+    return self.weights[ibins]
+  
+
+def getedges(hist):
+  """Get bin edges of a histogram."""
+  axis = hist.GetXaxis()
+  return [axis.GetBinLowEdge(i) for i in range(1,axis.GetNbins()+2)]
+  
+
+def gethist(filename, histname='pileup'):
+  """Get normalized pileup profile from file."""
+  file = ensureTFile(filename,'READ')
+  hist = file.Get(histname)
+  hist.SetDirectory(0)
+  hist.Scale(1./hist.Integral())
+  file.Close()
+  return hist
   
 
 def hasBuggyPU(sample):
@@ -4,10 +4,10 @@
 #  https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/modules/common/PrefireCorr.py
 import os
 from math import sqrt
-from corrections import modulepath, extractTH1
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection 
-from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
-path = os.path.join(os.getenv('CMSSW_BASE'),"src/PhysicsTools/NanoAODTools/data/prefire_maps/")
+from bisect import bisect_right
+import numpy as np
+from TauFW.common.tools.file import gethist
+path = os.path.join(os.getenv('CMSSW_BASE',""),"src/PhysicsTools/NanoAODTools/data/prefire_maps/")
 
 
 class PreFireTool():
@@ -19,8 +19,8 @@ class PreFireTool():
         jethistname       = "L1prefiring_jetpt_%s"%dataset
         photonhistname    = "L1prefiring_photonpt_%s"%dataset
         
-        self.jetmap       = extractTH1(jetfilename,   jethistname)
-        self.photonmap    = extractTH1(photonfilename,photonhistname)
+        self.jetmap       = PrefireMap(gethist(jetfilename,   jethistname))
+        self.photonmap    = PrefireMap(gethist(photonfilename,photonhistname))
         ###self.UseEMpT      = "jetempt" in jetroot
         self.JetMinPt     = 20 # Min/Max Values may need to be fixed for new maps
         self.JetMaxPt     = 500
@@ -30,86 +30,195 @@ class PreFireTool():
         self.PhotonMaxPt  = 500
         self.PhotonMinEta = 2.0
         self.PhotonMaxEta = 3.0
-        
+    
     
     def getWeight(self, event):
-        """Get pre-fire weight"""
+        """Get pre-fire weight (down, nominal, up) in one pass over the jets, photons and electrons."""
+        return self.getWeightFromArrays(
+          event.Jet_pt,      event.Jet_eta,
+          event.Photon_pt,   event.Photon_eta,   event.Photon_jetIdx,   event.Photon_electronIdx,
+          event.Electron_pt, event.Electron_eta, event.Electron_jetIdx, event.Electron_photonIdx)
+    
+    
+    def getWeightFromArrays(self, jetpt, jeteta, phopt, phoeta, phojet, phoele, elept, eleeta, elejet, elepho):
+        """Get pre-fire weight (down, nominal, up) from the jet, photon and electron arrays of a single event.
+        First, multiply the photon and electron weights per associated jet (or -1 if not associated),
+        then multiply per jet the lower weight of the jet and its photons/electrons."""
         
-        # WEIGHTS
-        weightDown = 1.
-        weightNom  = 1.
-        weightUp   = 1.
+        # PHOTONS & ELECTRONS
+        njets    = len(jetpt)
+        egweight = { } # jet index -> [down, nom, up]
+        phoinjet = { } # photon index -> jet index
+        for pid in xrange(len(phopt)):
+          pt, eta, jid = phopt[pid], phoeta[pid], phojet[pid]
+          if (jid<-1 or jid>=njets) or not (pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(eta)<=self.PhotonMaxEta):
+            continue
+          probs = self.photonmap.getProbs(eta,min(pt,self.PhotonMaxPt-0.01))
+          eid   = phoele[pid]
+          if eid>-1 and elept[eid]>=self.PhotonMinPt and self.PhotonMinEta<=abs(eleeta[eid])<=self.PhotonMaxEta:
+            eleprobs = self.photonmap.getProbs(eleeta[eid],min(elept[eid],self.PhotonMaxPt-0.01))
+            probs    = [max(p,e) for p, e in zip(probs,eleprobs)] # higher prefire probability of photon and electron
+          weights = egweight.setdefault(jid,[1.,1.,1.])
+          for i in xrange(3):
+            weights[i] *= 1.-probs[i]
+          phoinjet[pid] = jid
+        for eid in xrange(len(elept)):
+          pt, eta, jid = elept[eid], eleeta[eid], elejet[eid]
+          if (jid<-1 or jid>=njets) or phoinjet.get(elepho[eid],-2)==jid or\
+             not (pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(eta)<=self.PhotonMaxEta):
+            continue
+          probs   = self.photonmap.getProbs(eta,min(pt,self.PhotonMaxPt-0.01))
+          weights = egweight.setdefault(jid,[1.,1.,1.])
+          for i in xrange(3):
+            weights[i] *= 1.-probs[i]
         
-        # LOOP over JETS
-        jets = Collection(event,'Jet')
-        for jid, jet in enumerate(jets): # First loop over all jets
-          jetpt = jet.pt
+        # JETS
+        weightDown, weightNom, weightUp = 1., 1., 1.
+        for jid in xrange(njets):
+          pt, eta = jetpt[jid], jeteta[jid]
           ###if self.UseEMpT:
-          ###  jetpt *= (jet.chEmEF + jet.neEmEF)
-          
-          if jetpt>=self.JetMinPt and self.JetMinEta<=abs(jet.eta)<=self.JetMaxEta:
-            pfProbDown, pfProbNom, pfProbUp = self.getPrefireProbability(self.jetmap,jet.eta,jetpt,self.JetMaxPt)
-            jetWeightDown = 1.-pfProbDown
-            jetWeightNom  = 1.-pfProbNom
-            jetWeightUp   = 1.-pfProbUp
+          ###  pt *= (jet.chEmEF + jet.neEmEF)
+          if pt>=self.JetMinPt and self.JetMinEta<=abs(eta)<=self.JetMaxEta:
+            probDown, probNom, probUp = self.jetmap.getProbs(eta,min(pt,self.JetMaxPt-0.01))
+            jetWeightDown, jetWeightNom, jetWeightUp = 1.-probDown, 1.-probNom, 1.-probUp
           else:
-            jetWeightDown = 1.0
-            jetWeightNom  = 1.0
-            jetWeightUp   = 1.0
-          
+            jetWeightDown, jetWeightNom, jetWeightUp = 1., 1., 1.
           # The higher prefire-probablity between the jet and the lower-pt photon(s)/elecron(s) from the jet is chosen
-          egWeightDown, egWeightNom, egWeightUp = self.getEGPrefireWeight(event,jid)
+          egWeightDown, egWeightNom, egWeightUp = egweight.get(jid,(1.,1.,1.))
           weightDown *= min(jetWeightDown,egWeightDown)
           weightNom  *= min(jetWeightNom, egWeightNom)
           weightUp   *= min(jetWeightUp,  egWeightUp)
         
-        # Then loop over all photons/electrons not associated to jets
-        egWeightDown, egWeightNom, egWeightUp = self.getEGPrefireWeight(event,-1)
+        # Then photons/electrons not associated to jets
+        egWeightDown, egWeightNom, egWeightUp = egweight.get(-1,(1.,1.,1.))
         weightDown *= egWeightDown
         weightNom  *= egWeightNom
         weightUp   *= egWeightUp
         
         return weightDown, weightNom, weightUp
-        
     
-    def getEGPrefireWeight(self, event, jid):
-        egWeightDown = 1.0
-        egWeightNom  = 1.0
-        egWeightUp   = 1.0
-        photonInJet  = [ ]
-        
-        # LOOP over PHOTONS
-        for pid, pho in enumerate(Collection(event,'Photon')):
-          if pho.jetIdx==jid and pho.pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(pho.eta)<=self.PhotonMaxEta:
-            phoProbDown, phoProbNom, phoProbUp = self.getPrefireProbability(self.photonmap,pho.eta,pho.pt,self.PhotonMaxPt)
-            eleProbDown, eleProbNom, eleProbUp = 1., 1., 1.
-            if pho.electronIdx>-1: # What if the electron corresponding to the photon would return a different value?
-              if event.Electron_pt[pho.electronIdx]>=self.PhotonMinPt and self.PhotonMinEta<=abs(event.Electron_eta[pho.electronIdx])<=self.PhotonMaxEta:
-                eleProbDown, eleProbNom, eleProbUp = self.getPrefireProbability(self.photonmap,event.Electron_eta[pho.electronIdx],event.Electron_pt[pho.electronIdx],self.PhotonMaxPt)
-            
-            # Choose higher prefire-probablity between the photon and corresponding electron
-            egWeightDown *= 1.-max(phoProbDown,eleProbDown)
-            egWeightNom  *= 1.-max(phoProbNom, eleProbNom)
-            egWeightUp   *= 1.-max(phoProbUp,  eleProbUp)
-            photonInJet.append(pid)
-        
-        # LOOP over ELECTRONS
-        for ele in Collection(event,'Electron'):
-          if ele.jetIdx == jid and ele.photonIdx not in photonInJet and ele.pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(ele.eta)<=self.PhotonMaxEta:
-            pfProbDown, pfProbNom, pfProbUp = self.getPrefireProbability(self.photonmap,ele.eta,ele.pt,self.PhotonMaxPt)
-            egWeightDown *= 1.-pfProbDown
-            egWeightNom  *= 1.-pfProbNom
-            egWeightUp   *= 1.-pfProbUp
+    
+    def getWeightArray(self, block):
+        """Get arrays of pre-fire weights (down, nominal, up) for a block of events (see analysis/columnar.py)."""
+        nevts   = block.nevents
+        jets    = block.collection('Jet')
+        photons = block.collection('Photon')
+        elecs   = block.collection('Electron')
+        jetoffs = np.cumsum(block.counts('Jet')) - block.counts('Jet')
+        njets   = len(jets)
         
-        return egWeightDown, egWeightNom, egWeightUp
+        # PHOTONS & ELECTRONS: multiply weights per jet (index njets+evt if not associated)
+        egweights = np.ones((njets+nevts,3))
+        phojet    = photons.jetIdx.astype(np.int64)
+        phoele    = photons.electronIdx.astype(np.int64)
+        phoeta    = photons.eta
+        phopass   = (phojet>=-1) & (phojet<block.counts('Jet')[photons.evt]) &\
+                    self.inacceptance(photons.pt,phoeta,self.PhotonMinPt,self.PhotonMinEta,self.PhotonMaxEta)
+        probs     = self.photonmap.getProbsArray(phoeta,np.minimum(photons.pt,self.PhotonMaxPt-0.01))
+        eleoffs   = np.cumsum(block.counts('Electron')) - block.counts('Electron')
+        haselec   = phopass & (phoele>-1)
+        eidx      = eleoffs[photons.evt[haselec]] + phoele[haselec]
+        elept, eleeta = elecs.pt, elecs.eta
+        elepass   = self.inacceptance(elept[eidx],eleeta[eidx],self.PhotonMinPt,self.PhotonMinEta,self.PhotonMaxEta)
+        eleprobs  = self.photonmap.getProbsArray(eleeta[eidx],np.minimum(elept[eidx],self.PhotonMaxPt-0.01))
+        probs[np.nonzero(haselec)[0][elepass]] = np.maximum(probs[np.nonzero(haselec)[0][elepass]],eleprobs[elepass])
+        phoindex  = np.where(phojet>=0,jetoffs[photons.evt]+phojet,njets+photons.evt)
+        np.multiply.at(egweights,phoindex[phopass],1.-probs[phopass]) # in order of photons, like in getWeight
+        elejet    = elecs.jetIdx.astype(np.int64)
+        elepho    = elecs.photonIdx.astype(np.int64)
+        phooffs   = np.cumsum(block.counts('Photon')) - block.counts('Photon')
+        overlap   = np.zeros(len(elecs),dtype=bool) # electron's photon was already used for the same jet
+        haspho    = elepho>-1
+        pidx      = phooffs[elecs.evt[haspho]] + elepho[haspho]
+        overlap[haspho] = phopass[pidx] & (phojet[pidx]==elejet[haspho])
+        elepass   = (elejet>=-1) & (elejet<block.counts('Jet')[elecs.evt]) & ~overlap &\
+                    self.inacceptance(elept,eleeta,self.PhotonMinPt,self.PhotonMinEta,self.PhotonMaxEta)
+        probs     = self.photonmap.getProbsArray(eleeta,np.minimum(elept,self.PhotonMaxPt-0.01))
+        eleindex  = np.where(elejet>=0,jetoffs[elecs.evt]+elejet,njets+elecs.evt)
+        np.multiply.at(egweights,eleindex[elepass],1.-probs[elepass])
         
+        # JETS
+        jetpass   = self.inacceptance(jets.pt,jets.eta,self.JetMinPt,self.JetMinEta,self.JetMaxEta)
+        jetprobs  = self.jetmap.getProbsArray(jets.eta,np.minimum(jets.pt,self.JetMaxPt-0.01))
+        jetweights = np.where(jetpass[:,None],1.-jetprobs,1.)
+        weights   = np.ones((nevts,3))
+        np.multiply.at(weights,jets.evt,np.minimum(jetweights,egweights[:njets]))
+        weights  *= egweights[njets:]
+        return weights[:,0], weights[:,1], weights[:,2]
+    
+    
+    @staticmethod
+    def inacceptance(pt, eta, minpt, mineta, maxeta):
+        """Check acceptance for arrays of pt and eta."""
+        abseta = np.abs(eta)
+        return (pt>=minpt) & (abseta>=mineta) & (abseta<=maxeta)
     
-    def getPrefireProbability(self, map, eta, pt, maxpt):
-      bin      = map.FindBin(eta,min(pt,maxpt-0.01))
-      prob     = map.GetBinContent(bin)
-      stat     = map.GetBinError(bin) # bin statistical uncertainty
-      syst     = 0.2*prob # 20% of prefire rate
-      probDown = max(prob-sqrt(stat*stat+syst*syst),0.0)
-      probUp   = min(prob+sqrt(stat*stat+syst*syst),1.0)
-      return probDown, prob, probUp
-      
+
+
+class PrefireMap:
+    """Prefire probability map, with the down and up variations precomputed per bin.
+    Like TH2::FindBin, under- and overflow bins are not clamped."""
+    
+    def __init__(self, hist):
+        xaxis, yaxis = hist.GetXaxis(), hist.GetYaxis()
+        self.hist    = hist # original map
+        self.xedges  = [xaxis.GetBinLowEdge(i) for i in range(1,xaxis.GetNbins()+2)]
+        self.yedges  = [yaxis.GetBinLowEdge(i) for i in range(1,yaxis.GetNbins()+2)]
+        self.xfixed  = getfixedbins(xaxis)
+        self.yfixed  = getfixedbins(yaxis)
+        self.probs   = np.zeros((len(self.xedges)+1,len(self.yedges)+1,3)) # including under- and overflow
+        for ix in range(0,xaxis.GetNbins()+2):
+          for iy in range(0,yaxis.GetNbins()+2):
+            self.probs[ix,iy] = getPrefireProbability(hist.GetBinContent(ix,iy),hist.GetBinError(ix,iy))
+        self._probs  = self.probs.tolist()
+        self._xedges = np.array(self.xedges)
+        self._yedges = np.array(self.yedges)
+    
+    def getProbs(self, eta, pt):
+        """Get prefire probability (down, nominal, up) for a single object."""
+        return self._probs[findbin(self.xedges,self.xfixed,eta)][findbin(self.yedges,self.yfixed,pt)]
+    
+    def getProbsArray(self, eta, pt):
+        """Get prefire probabilities (down, nominal, up) for arrays of objects."""
+        return self.probs[findbins(self._xedges,self.xfixed,eta),findbins(self._yedges,self.yfixed,pt)]
+  
+
+def getfixedbins(axis):
+    """Return (nbins, min, max) of an axis with fixed bin width, or None if it has variable bins."""
+    if axis.GetXbins().GetSize()>0:
+      return None
+    return axis.GetNbins(), axis.GetXmin(), axis.GetXmax()
+  
+
+def findbin(edges, fixed, x):
+    """Find bin of a single value like TAxis::FindBin, with 0 for underflow and nbins+1 for overflow.
+    For fixed bin width, TAxis computes the bin from the width, which can differ from the edges by rounding."""
+    if fixed is None:
+      return bisect_right(edges,x)
+    nbins, xmin, xmax = fixed
+    if x<xmin:
+      return 0
+    if not x<xmax: # also NaN
+      return nbins+1
+    return 1+int(nbins*(x-xmin)/(xmax-xmin))
+  
+
+def findbins(edges, fixed, x):
+    """Find bins of an array of values like TAxis::FindBin."""
+    if fixed is None:
+      return np.searchsorted(edges,x,side='right')
+    nbins, xmin, xmax = fixed
+    with np.errstate(invalid='ignore'):
+      bins = 1+(nbins*(x-xmin)/(xmax-xmin)).astype(np.int64)
+    bins[x<xmin]    = 0
+    bins[~(x<xmax)] = nbins+1 # also NaN
+    return bins
+    
+
+def getPrefireProbability(prob, stat):
+    """Get prefire probability and its variations, given the content and statistical uncertainty of a bin."""
+    syst     = 0.2*prob # 20% of prefire rate
+    probDown = max(prob-sqrt(stat*stat+syst*syst),0.0)
+    probUp   = min(prob+sqrt(stat*stat+syst*syst),1.0)
+    return probDown, prob, probUp
+  
@@ -5,12 +5,14 @@
 # https://twiki.cern.ch/twiki/bin/viewauth/CMS/TopPtReweighting#MC_SFs_Reweighting
 # https://twiki.cern.ch/twiki/bin/view/CMS/TopPtReweighting
 import os
+import numpy as np
 from math import sqrt, exp
 from ctypes import c_float
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.file import ensureTFile
-from TauFW.PicoProducer.analysis.utils import hasbit
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from TauFW.PicoProducer.analysis.utils import hasbit, getgenindex
+from TauFW.PicoProducer.analysis.kinematics import p4, mass
+from TauFW.PicoProducer.corrections.ScaleFactorTool import BinnedLookup
 import ROOT
 from ROOT import TLorentzVector, gROOT, gSystem, gInterpreter, Double
 rcpath  = "HTT-utilities/RecoilCorrections/data/"
@@ -37,18 +39,16 @@ class ZptCorrectionTool:
     file.Close()
     
     self.hist      = hist
+    self.table     = BinnedLookup.fromhist(hist)
     self.filename  = filename
     
   def getZptWeight(self,Zpt,Zmass):
     """Get Z pT weight for a given Z boson pT and mass."""
-    xbin = self.hist.GetXaxis().FindBin(Zmass)
-    ybin = self.hist.GetYaxis().FindBin(Zpt)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    weight = self.hist.GetBinContent(xbin,ybin)
-    return weight
+    return self.table.lookup(Zmass,Zpt)
+    
+  def getZptWeightArray(self,Zpts,Zmasses):
+    """Get Z pT weights for arrays of Z boson pT and mass."""
+    return self.table.lookuparray(Zmasses,Zpts)
   
 
 
@@ -93,41 +93,54 @@ def getTopPtWeight(toppt1,toppt2):
   return sqrt(exp(0.0615-0.0005*min(toppt1,800.0))*exp(0.0615-0.0005*min(toppt2,800.0)))
   
 
+def getTopPtWeightArray(toppt1,toppt2):
+  """Get top pT weights for arrays of top pT, like getTopPtWeight."""
+  return np.sqrt(np.exp(0.0615-0.0005*np.minimum(toppt1,800.0))*np.exp(0.0615-0.0005*np.minimum(toppt2,800.0)))
+  
+
 def getzboson(event):
   """Calculate Z boson pT and mass."""
   #print '-'*80
-  particles  = Collection(event,'GenPart')
+  index      = getgenindex(event)
   zboson     = TLorentzVector()
-  for id in range(event.nGenPart):
-    particle = particles[id]
-    PID      = abs(particle.pdgId)
-    if ((PID==11 or PID==13) and particle.status==1 and hasbit(particle.statusFlags,8)) or\
-                   (PID==15  and particle.status==2 and hasbit(particle.statusFlags,8)):
-      zboson += particle.p4()
+  for id in index.hardleps: # hard-process e/mu with status 1, or tau with status 2
+    zboson += index.p4(id)
       #print "%3d: PID=%3d, mass=%3.1f, pt=%4.1f, status=%2d, statusFlags=%5d (%16s), fromHardProcess=%1d, isHardProcessTauDecayProduct=%1d, isDirectHardProcessTauDecayProduct=%1d"%\
       #(id,particle.pdgId,particle.mass,particle.pt,particle.status,particle.statusFlags,bin(particle.statusFlags),hasbit(particle.statusFlags,8),hasbit(particle.statusFlags,9),hasbit(particle.statusFlags,10))
   #print "tlv: mass=%3.1f, pt=%3.1f"%(zboson.M(),zboson.Pt())
   return zboson
   
 
+def getzbosonarray(block,mask=None):
+  """Calculate Z boson pT and mass for each event in a block of events (see analysis/columnar.py),
+  like getzboson, optionally only for events passing a mask. Return arrays of pT and mass."""
+  parts  = block.collection('GenPart',mask)
+  pid    = np.abs(parts.pdgId)
+  status = parts.status
+  flags  = parts.statusFlags.astype(np.int64)
+  parts  = parts[ ((flags & (1 << 8))>0) & (((status==1) & ((pid==11) | (pid==13))) | ((status==2) & (pid==15))) ]
+  sums   = [np.bincount(parts.evt,weights=x,minlength=block.nevents) for x in p4(parts.pt,parts.eta,parts.phi,parts.mass)]
+  return np.sqrt(sums[0]**2+sums[1]**2), mass(*sums)
+  
+
 def getboson(event):
   """Calculate Z/W/H boson full and visible pT and mass, for recoil corrections."""
   #print '-'*80
-  particles  = Collection(event,'GenPart')
+  index      = getgenindex(event)
   #boson_real = TLorentzVector()
   boson_full = TLorentzVector()
   boson_vis  = TLorentzVector()
-  for id in range(event.nGenPart):
-    particle = particles[id]
-    PID      = abs(particle.pdgId)
+  for id in xrange(index.n):
+    PID      = abs(index.pdgId[id])
     neutrino = PID in [12,14,16]
     #if PID in [23,24,25] and particle.status==62:
     #  boson_real = particle.p4()
     #  print "%3d: PID=%3d, mass=%3.1f, pt=%3.1f, status=%2d"%(id,particle.pdgId,particle.mass,particle.pt,particle.status)
-    if ((PID==11 or PID==13 or neutrino) and particle.status==1 and hasbit(particle.statusFlags,8)) or hasbit(particle.statusFlags,10):
-      boson_full += particle.p4()
+    if ((PID==11 or PID==13 or neutrino) and index.status[id]==1 and hasbit(index.flags[id],8)) or hasbit(index.flags[id],10):
+      p4 = index.p4(id)
+      boson_full += p4
       if not neutrino:
-        boson_vis += particle.p4()
+        boson_vis += p4
       #print "%3d: PID=%3d, mass=%3.1f, pt=%4.1f, status=%2d, statusFlags=%5d (%16s), fromHardProcess=%1d, isHardProcessTauDecayProduct=%1d, isDirectHardProcessTauDecayProduct=%1d"%\
       #(id,particle.pdgId,particle.mass,particle.pt,particle.status,particle.statusFlags,bin(particle.statusFlags),hasbit(particle.statusFlags,8),hasbit(particle.statusFlags,9),hasbit(particle.statusFlags,10))
   #print "real: mass=%3.1f, pt=%3.1f"%(boson_real.M(),boson_real.Pt())
@@ -139,21 +152,36 @@ def getboson(event):
 def gettoppt(event):
   """Calculate top pT."""
   #print '-'*80
-  particles = Collection(event,'GenPart')
+  index     = getgenindex(event)
   toppt1    = -1
   toppt2    = -1
-  for id in range(event.nGenPart):
-    particle = particles[id]
-    PID      = abs(particle.pdgId)
-    if PID==6 and particle.status==62:
-      #print "%3d: PID=%3d, mass=%3.1f, pt=%3.1f, status=%2d"%(id,particle.pdgId,particle.mass,particle.pt,particle.status)
-      if particle.pt>toppt1:
-        if toppt1==-1:
-          toppt1 = particle.pt
-        else:
-          toppt2 = toppt1
-          toppt1 = particle.pt
+  for id in index.tops: # top quarks with status 62
+    pt = index.pt[id]
+    if pt>toppt1:
+      if toppt1==-1:
+        toppt1 = pt
       else:
-        toppt2 = particle.pt
+        toppt2 = toppt1
+        toppt1 = pt
+    else:
+      toppt2 = pt
+  return toppt1, toppt2
+  
+
+def gettopptarray(block,mask=None):
+  """Calculate top pT for each event in a block of events (see analysis/columnar.py),
+  like gettoppt, optionally only for events passing a mask. Return arrays of both top pTs."""
+  parts  = block.collection('GenPart',mask)
+  tops   = parts[(np.abs(parts.pdgId)==6) & (parts.status==62)]
+  toppt1 = np.full(block.nevents,-1.)
+  toppt2 = np.full(block.nevents,-1.)
+  itop   = np.arange(len(tops)) - np.searchsorted(tops.evt,tops.evt) # index of top in its event
+  for i in xrange(itop.max()+1 if len(tops) else 0): # same order as gettoppt
+    evt, pt = tops.evt[itop==i], tops.pt[itop==i]
+    higher  = pt>toppt1[evt]
+    shift   = higher & (toppt1[evt]!=-1)
+    toppt2[evt[shift]]   = toppt1[evt[shift]]
+    toppt1[evt[higher]]  = pt[higher]
+    toppt2[evt[~higher]] = pt[~higher]
   return toppt1, toppt2
   
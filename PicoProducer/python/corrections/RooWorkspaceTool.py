@@ -1,6 +1,9 @@
 # Author: Sebastian Brommer (October 2020)
-import os, re
-from TauFW.common.tools.file import ensureTFile
+import os, re, zipfile
+from bisect import bisect_left, bisect_right
+from itertools import product
+import numpy as np
+from TauFW.common.tools.file import ensureTFile, atomicwrite
 from TauFW.common.tools.log import Logger
 LOG = Logger('RooWorkspaceTool')
 
@@ -9,12 +12,16 @@ class RooScaleFactor:
     """
     Main class for reading out functions from RooWorkspace
     """
-    def __init__(self, workspace, function, arguments):
+    def __init__(self, workspace, function, arguments, **kwargs):
         self.workspace_file = ensureTFile(workspace)
         self.arguments = arguments
         self.workspace = self.workspace_file.Get("w")
         self.function = self.workspace.function(function)
         self.argset = self.workspace.argSet(",".join(self.arguments))
+        self.table = None
+        if kwargs.get('tabulate', False):
+            # sample function on a grid, and interpolate with numpy instead of calling getVal
+            self.table = self.tabulate(workspace, function, **kwargs)
 
     def getSF(self, parameters):
         """
@@ -28,6 +35,221 @@ class RooScaleFactor:
                 'm_eta': abs(eta)
             }
         """
+        if self.table is not None:
+            return self.table.eval(*[parameters[para] for para in self.arguments])
         for para in self.arguments:
             self.argset.setRealValue(para, parameters[para])
-        return self.function.getVal(self.argset)
\ No newline at end of file
+        return self.function.getVal(self.argset)
+
+    def getSFArray(self, *arrays):
+        """
+            Calculate the SFs for arrays of values, given in the same order as the arguments,
+            e.g. getSFArray(pts, abs(etas)) for arguments ['m_pt', 'm_eta']
+        """
+        if self.table is not None:
+            return self.table.evalarray(*arrays)
+        return np.array([self.getSF(dict(zip(self.arguments, values))) for values in zip(*arrays)])
+
+    def getVal(self, values):
+        """Evaluate the workspace function for a list of values, given in the same order as the arguments."""
+        for para, value in zip(self.arguments, values):
+            self.argset.setRealValue(para, value)
+        return self.function.getVal(self.argset)
+
+    def getnodes(self, para, npoints=100):
+        """
+            Get default grid nodes of an argument, and whether the function is binned in it:
+            If it is binned (e.g. a RooHistFunc), return the bin edges, and the table picks the bin
+            of each value explicitly (see RooFunctionTable). Otherwise, take equidistant nodes
+            over the range of the variable for linear interpolation.
+        """
+        var = self.workspace.var(para)
+        xmin, xmax = var.getMin(), var.getMax()
+        if not (np.isfinite(xmin) and np.isfinite(xmax)) or xmax - xmin > 1e6:
+            LOG.throw(ValueError, "RooScaleFactor.getnodes: Range [%s,%s] of %r is too large to sample! Please provide a grid." % (
+                                  xmin, xmax, para))
+        bounds = self.function.binBoundaries(var, xmin, xmax)
+        if bounds:
+            return sorted(set([xmin, xmax] + [x for x in bounds if xmin <= x <= xmax])), True
+        return list(np.linspace(xmin, xmax, npoints)), False
+
+    def tabulate(self, workspace, function, **kwargs):
+        """
+            Sample the function on a grid, or load it from a cache file, if it was created with
+            the same grid from the same workspace file. The grid is a dictionary of argument
+            name to list of nodes for linear interpolation. By default, the nodes are given by getnodes.
+            In strict mode (default), compare to getVal for random points and on the bin edges,
+            and use getVal instead if the table does not agree, e.g. if getnodes missed some steps.
+        """
+        grid = kwargs.get('grid', None) or {}
+        npoints = kwargs.get('npoints', 100)
+        cache = kwargs.get('cache', None)
+        strict = kwargs.get('strict', True)
+        verbosity = kwargs.get('verb', 0)
+        nodes = [(grid[p], False) if p in grid else self.getnodes(p, npoints) for p in self.arguments]
+        nodes, binned = [n for n, b in nodes], [b for n, b in nodes]
+        points = [RooFunctionTable.getpoints(n, b) for n, b in zip(nodes, binned)] # points to sample
+        size = np.prod([len(p) for p in points])
+        if size > kwargs.get('maxsize', 2e6):
+            LOG.warning("RooScaleFactor.tabulate: Grid of %r has too many nodes (%s)! Using getVal instead..." % (function, size))
+            return None
+        key = "%s:%s:%s:%s" % (os.path.abspath(workspace), os.path.getmtime(workspace), function, ','.join(self.arguments))
+        if cache and not cache.endswith(".npz"): # directory
+            cache = os.path.join(cache, "%s_%s.npz" % (os.path.basename(workspace).replace(".root", ""), function))
+        table = None
+        if cache and os.path.isfile(cache):
+            try:
+                table = RooFunctionTable.load(cache, key, nodes, binned)
+            except (IOError, OSError, ValueError, KeyError, EOFError, zipfile.BadZipfile) as error: # e.g. written by another job
+                LOG.warning("RooScaleFactor.tabulate: Could not read cache %s: %s" % (cache, error))
+            if table is not None and verbosity >= 1:
+                print(">>> RooScaleFactor.tabulate: Loaded %r from %s" % (function, cache))
+        if table is None:
+            if verbosity >= 1:
+                print(">>> RooScaleFactor.tabulate: Sampling %r on %s grid..." % (function, 'x'.join(str(len(p)) for p in points)))
+            values = np.array([self.getVal(point) for point in product(*points)])
+            table = RooFunctionTable(nodes, values.reshape([len(p) for p in points]), binned)
+            if cache:
+                try:
+                    table.save(cache, key)
+                except (IOError, OSError) as error:
+                    LOG.warning("RooScaleFactor.tabulate: Could not write cache %s: %s" % (cache, error))
+        if strict:
+            try:
+                self.check(table, kwargs.get('nsamples', 1000), kwargs.get('tol', 1e-6))
+            except ValueError as error:
+                LOG.warning("%s Using getVal instead..." % (error))
+                return None
+        return table
+
+    def check(self, table, nsamples=1000, tol=1e-6):
+        """Compare the table to getVal for random points in the grid. For binned arguments,
+        a quarter of the points lie exactly on a bin edge, or on the nearest values next to it."""
+        points = [ ]
+        for nodes, binned in zip(table.nodes, table.binned):
+            x = np.random.uniform(nodes[0], nodes[-1], nsamples)
+            if binned:
+                edges = np.random.choice(nodes, nsamples // 4)
+                shift = np.random.choice([-1, 0, 1], len(edges))
+                edges = np.where(shift < 0, np.nextafter(edges, -np.inf), np.where(shift > 0, np.nextafter(edges, np.inf), edges))
+                x[:len(edges)] = np.clip(edges, nodes[0], nodes[-1])
+            points.append(x)
+        values = table.evalarray(*points)
+        for point, value in zip(zip(*points), values):
+            exact = self.getVal(point)
+            if abs(value - exact) > tol * max(1., abs(exact)):
+                LOG.throw(ValueError, "RooScaleFactor.check: Table of %r gives %s instead of %s at %s=%s! Please use a finer grid." % (
+                                      self.function.GetName(), value, exact, self.arguments, point))
+
+
+class RooFunctionTable:
+    """
+    Values of a function sampled on a grid, with multilinear interpolation between the nodes.
+    For binned arguments, the nodes are the bin edges, and the function is sampled on each edge
+    and at each bin center. The bin is picked explicitly with numpy.searchsorted without interpolating,
+    and values exactly on an edge take the value sampled there, so the table reproduces the steps of
+    RooFit, whichever side its bins are closed on.
+    Outside the grid, values are clamped to the edges, like RooRealVar.setVal clamps to the range.
+    """
+    def __init__(self, nodes, values, binned=None):
+        self.nodes = [np.array(n, dtype=np.float64) for n in nodes]
+        self.binned = list(binned) if binned else [False] * len(self.nodes)
+        self.values = np.array(values, dtype=np.float64)
+        assert self.values.shape == tuple(len(self.getpoints(n, b)) for n, b in zip(self.nodes, self.binned)),\
+            "RooFunctionTable: Shape of values %s does not match nodes!" % (self.values.shape,)
+        self._nodes = [n.tolist() for n in self.nodes]
+        self._values = self.values.ravel().tolist()
+        self._strides = [s // self.values.itemsize for s in self.values.strides]
+
+    @staticmethod
+    def getpoints(nodes, binned=False):
+        """Return points to sample: the nodes, and for binned arguments, also the bin centers between them."""
+        if not binned:
+            return list(nodes)
+        nodes = list(nodes)
+        centers = [0.5 * (x1 + x2) for x1, x2 in zip(nodes[:-1], nodes[1:])]
+        return [x for pair in zip(nodes, centers + [None]) for x in pair if x is not None]
+    
+    @staticmethod
+    def load(fname, key, nodes, binned=None):
+        """Load table from cache, if it was created with the same key and nodes."""
+        binned = list(binned) if binned else [False] * len(nodes)
+        with np.load(fname) as data:
+            if str(data['key']) != key or len(nodes) != len(data['values'].shape):
+                return None
+            cnodes = [data['nodes%d' % i] for i in range(len(nodes))]
+            if any(len(n) != len(c) or not np.array_equal(n, c) for n, c in zip(nodes, cnodes)):
+                return None
+            if 'binned' not in data or list(data['binned']) != binned:
+                return None
+            return RooFunctionTable(cnodes, data['values'], binned)
+
+    def save(self, fname, key):
+        """Save table to cache file, shared by parallel jobs (see atomicwrite)."""
+        arrays = {'nodes%d' % i: n for i, n in enumerate(self.nodes)}
+        with atomicwrite(fname) as tmpname:
+            with open(tmpname, 'wb') as file: # file object, so numpy does not append .npz
+                np.savez(file, key=np.array(key), values=self.values, binned=np.array(self.binned, dtype=bool), **arrays)
+
+    def eval(self, *xs):
+        """Interpolate the function for a single point."""
+        terms = [(0, 1.)]
+        for x, nodes, binned, stride in zip(xs, self._nodes, self.binned, self._strides):
+            n = len(nodes)
+            if binned: # pick sampled edge or bin center
+                i = self.findpoint(nodes, x)
+                terms = [(k + i * stride, w) for k, w in terms]
+                continue
+            if n == 1 or x <= nodes[0]:
+                continue
+            if x >= nodes[-1]:
+                terms = [(k + (n - 1) * stride, w) for k, w in terms]
+                continue
+            i = bisect_right(nodes, x) - 1
+            t = (x - nodes[i]) / (nodes[i + 1] - nodes[i])
+            terms = [(k + i * stride, w * (1. - t)) for k, w in terms] + [(k + (i + 1) * stride, w * t) for k, w in terms]
+        return sum(self._values[k] * w for k, w in terms if w)
+
+    @staticmethod
+    def findpoint(nodes, x):
+        """Return index of the sampled point of a binned argument for a single value:
+        the edge if the value lies exactly on it, or else the center of its bin."""
+        if x <= nodes[0]:
+            return 0
+        if x >= nodes[-1]:
+            return 2 * (len(nodes) - 1)
+        i = bisect_left(nodes, x)
+        return 2 * i if nodes[i] == x else 2 * i - 1
+    
+    @staticmethod
+    def findpoints(nodes, x):
+        """Return indices of the sampled points of a binned argument for an array of values."""
+        x = np.clip(x, nodes[0], nodes[-1])
+        i = np.searchsorted(nodes, x, side='left')
+        return np.where(nodes[i] == x, 2 * i, 2 * i - 1)
+    
+    def evalarray(self, *xs):
+        """Interpolate the function for arrays of points."""
+        indices, fracs = [], []
+        for x, nodes, binned in zip(xs, self.nodes, self.binned):
+            x = np.clip(np.asarray(x, dtype=np.float64), nodes[0], nodes[-1])
+            if binned:
+                indices.append(self.findpoints(nodes, x))
+                fracs.append(np.zeros(x.shape))
+                continue
+            if len(nodes) == 1:
+                indices.append(np.zeros(x.shape, dtype=np.int64))
+                fracs.append(np.zeros(x.shape))
+                continue
+            i = np.clip(np.searchsorted(nodes, x, side='right') - 1, 0, len(nodes) - 2)
+            indices.append(i)
+            fracs.append((x - nodes[i]) / (nodes[i + 1] - nodes[i]))
+        result = np.zeros(np.broadcast(*indices).shape)
+        for corner in product([0, 1], repeat=len(indices)):
+            weight = 1.
+            index = [ ]
+            for c, i, t, size in zip(corner, indices, fracs, self.values.shape):
+                weight = weight * (t if c else 1. - t)
+                index.append(np.minimum(i + c, size - 1))
+            result += weight * self.values[tuple(index)]
+        return result
@@ -1,10 +1,144 @@
 # Author: Izaak Neutelings (November 2018)
 import os, re
+from bisect import bisect_right
+import numpy as np
 from TauFW.common.tools.file import ensureTFile
 from TauFW.common.tools.log import Logger
 LOG = Logger('ScaleFactorTool')
 
 
+class BinnedLookup:
+  """Lookup table of a 1D or 2D histogram, converted into NumPy arrays of bin edges and contents at load time.
+  Under- and overflow are clamped to the first and last bin, like the FindBin/GetBinContent of ScaleFactor.
+  Use lookup for single values, and lookuparray for arrays of values."""
+  
+  def __init__(self, edges, contents, errors=None, name="<noname>"):
+    self.name     = name
+    self.edges    = [np.array(e,dtype=np.float64) for e in edges]
+    self.nbins    = [len(e)-1 for e in self.edges]
+    self.contents = np.array(contents,dtype=np.float64).reshape(self.nbins) # without under- and overflow
+    self.errors   = None if errors is None else np.array(errors,dtype=np.float64).reshape(self.nbins)
+    self._edges   = [list(e) for e in self.edges] # bisect on python lists is faster for scalars
+    self._conts   = self.contents.tolist()
+    self._errs    = None if errors is None else self.errors.tolist()
+  
+  @classmethod
+  def fromhist(cls, hist, name=None, errors=False):
+    """Convert TH1 or TH2 into lookup table."""
+    axes   = [hist.GetXaxis()] if hist.GetDimension()==1 else [hist.GetXaxis(),hist.GetYaxis()]
+    edges  = [[a.GetBinLowEdge(i) for i in range(1,a.GetNbins()+2)] for a in axes]
+    if len(axes)==1:
+      bins = [(i,) for i in range(1,axes[0].GetNbins()+1)]
+    else:
+      bins = [(i,j) for i in range(1,axes[0].GetNbins()+1) for j in range(1,axes[1].GetNbins()+1)]
+    conts  = [hist.GetBinContent(*b) for b in bins]
+    errs   = [hist.GetBinError(*b) for b in bins] if errors else None
+    return cls(edges,conts,errs,name=name or hist.GetName())
+  
+  def findbin(self, axis, x):
+    """Return index of bin containing x, clamped to the first and last bin."""
+    i = bisect_right(self._edges[axis],x)-1 # NaN ends up in overflow, like TAxis::FindBin
+    return 0 if i<0 else min(i,self.nbins[axis]-1)
+  
+  def findbins(self, axis, x):
+    """Return indices of bins containing the values in array x."""
+    i = np.searchsorted(self.edges[axis],x,side='right')-1
+    return np.clip(i,0,self.nbins[axis]-1)
+  
+  def lookup(self, *x):
+    """Return bin content for a single value per axis."""
+    if len(x)==1:
+      return self._conts[self.findbin(0,x[0])]
+    return self._conts[self.findbin(0,x[0])][self.findbin(1,x[1])]
+  
+  def lookuperr(self, *x):
+    """Return bin error for a single value per axis."""
+    if len(x)==1:
+      return self._errs[self.findbin(0,x[0])]
+    return self._errs[self.findbin(0,x[0])][self.findbin(1,x[1])]
+  
+  def lookuparray(self, *x):
+    """Return array of bin contents for an array of values per axis."""
+    return self.contents[tuple(self.findbins(i,v) for i, v in enumerate(x))]
+  
+  def lookuperrarray(self, *x):
+    """Return array of bin errors for an array of values per axis."""
+    return self.errors[tuple(self.findbins(i,v) for i, v in enumerate(x))]
+  
+
+class GraphLookup:
+  """Lookup table of a TGraph with the same linear interpolation and extrapolation as TGraph::Eval."""
+  
+  def __init__(self, xvals, yvals, name="<noname>"):
+    order      = np.argsort(xvals,kind='mergesort') # stable
+    self.name  = name
+    self.xvals = np.array(xvals,dtype=np.float64)[order]
+    self.yvals = np.array(yvals,dtype=np.float64)[order]
+    self.npts  = len(self.xvals)
+    self._xs   = self.xvals.tolist()
+    self._ys   = self.yvals.tolist()
+    self.below = self.getextrapoints(list(xvals),list(yvals),-1) # (x0,y0,x1,y1) for x < xmin
+    self.above = self.getextrapoints(list(xvals),list(yvals),+1) # (x0,y0,x1,y1) for x > xmax
+  
+  @staticmethod
+  def getextrapoints(xvals, yvals, side):
+    """Get the two points TGraph::Eval uses to extrapolate below (side<0) or above (side>0) the range.
+    For unsorted points, these are not always the two outermost points."""
+    if len(xvals)<2: return None
+    best, second = -1, -1
+    for i, x in enumerate(xvals):
+      if best==-1 or side*x>side*xvals[best]:
+        best, second = i, best
+      elif second==-1:
+        second = i
+    if side<0:
+      return (xvals[best],yvals[best],xvals[second],yvals[second])
+    return (xvals[second],yvals[second],xvals[best],yvals[best])
+  
+  @classmethod
+  def fromgraph(cls, graph, name=None):
+    """Convert TGraph into lookup table."""
+    npts  = graph.GetN()
+    xvals = [graph.GetX()[i] for i in range(npts)]
+    yvals = [graph.GetY()[i] for i in range(npts)]
+    return cls(xvals,yvals,name=name or graph.GetName())
+  
+  def eval(self, x):
+    """Interpolate linearly between the two nearest points, or extrapolate with the first or last two points."""
+    if self.npts<2:
+      return self._ys[0] if self.npts==1 else 0.0
+    xs, ys = self._xs, self._ys
+    i = bisect_right(xs,x)
+    if i>0 and xs[i-1]==x: # no interpolation needed
+      return ys[xs.index(x)]
+    if i==0: # extrapolate
+      x0, y0, x1, y1 = self.below
+    elif i==self.npts:
+      x0, y0, x1, y1 = self.above
+    else: # interpolate
+      x0, y0, x1, y1 = xs[i-1], ys[i-1], xs[i], ys[i]
+    if x0==x1:
+      return y0
+    return y1 + (x-x1)*(y0-y1)/(x0-x1)
+  
+  def evalarray(self, x):
+    """Evaluate for an array of values."""
+    x = np.asarray(x,dtype=np.float64)
+    if self.npts<2:
+      return np.full(x.shape,self.yvals[0] if self.npts==1 else 0.0)
+    xs, ys = self.xvals, self.yvals
+    i  = np.searchsorted(xs,x,side='right')
+    j  = np.clip(i-1,0,self.npts-2)
+    x0, x1, y0, y1 = xs[j], xs[j+1], ys[j], ys[j+1]
+    for mask, (x0_, y0_, x1_, y1_) in [(i==0,self.below),(i==self.npts,self.above)]: # extrapolate
+      x0, y0 = np.where(mask,x0_,x0), np.where(mask,y0_,y0)
+      x1, y1 = np.where(mask,x1_,x1), np.where(mask,y1_,y1)
+    dx = np.where(x0==x1,1.0,x0-x1)
+    y  = np.where(x0==x1,y0,y1+(x-x1)*(y0-y1)/dx)
+    j  = np.searchsorted(xs,x,side='left').clip(0,self.npts-1)
+    return np.where(xs[j]==x,ys[j],y) # no interpolation needed
+  
+
 class ScaleFactor:
   
   def __init__(self, filename, histname, name="<noname>", ptvseta=True, verb=0):
@@ -18,6 +152,7 @@ class ScaleFactor:
     LOG.insist(self.hist,"ScaleFactor(%s): histogram %r does not exist in %s"%(self.name,histname,filename))
     self.hist.SetDirectory(0)
     self.file.Close()
+    self.table    = BinnedLookup.fromhist(self.hist,name=name)
     
     if ptvseta: self.getSF = self.getSF_ptvseta
     else:       self.getSF = self.getSF_etavspt
@@ -27,27 +162,17 @@ class ScaleFactor:
   
   def getSF_ptvseta(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(eta)
-    ybin = self.hist.GetYaxis().FindBin(pt)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf   = self.hist.GetBinContent(xbin,ybin)
-    #print "ScaleFactor(%s).getSF_ptvseta: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
-    return sf
+    return self.table.lookup(eta,pt)
   
   def getSF_etavspt(self, pt, eta):
     """Get SF for a given pT, eta."""
-    xbin = self.hist.GetXaxis().FindBin(pt)
-    ybin = self.hist.GetYaxis().FindBin(eta)
-    if xbin==0: xbin = 1
-    elif xbin>self.hist.GetXaxis().GetNbins(): xbin -= 1
-    if ybin==0: ybin = 1
-    elif ybin>self.hist.GetYaxis().GetNbins(): ybin -= 1
-    sf   = self.hist.GetBinContent(xbin,ybin)
-    #print "ScaleFactor(%s).getSF_etavspt: pt = %6.2f, eta = %6.3f, sf = %6.3f"%(self.name,pt,eta,sf)
-    return sf
+    return self.table.lookup(pt,eta)
+  
+  def getSFArray(self, pts, etas):
+    """Get SFs for arrays of pT, eta."""
+    if self.ptvseta:
+      return self.table.lookuparray(etas,pts)
+    return self.table.lookuparray(pts,etas)
     
 
 class ScaleFactorHTT(ScaleFactor):
@@ -61,19 +186,21 @@ class ScaleFactorHTT(ScaleFactor):
     self.hist_eta.SetDirectory(0)
     self.effs_data = { }
     self.effs_mc   = { }
+    self.etabins   = [ ] # eta labels
     for ieta in range(1,self.hist_eta.GetXaxis().GetNbins()+1):
       etalabel = self.hist_eta.GetXaxis().GetBinLabel(ieta)
-      self.effs_data[etalabel] = self.file.Get(graphname+etalabel+"_Data")
-      self.effs_mc[etalabel]   = self.file.Get(graphname+etalabel+"_MC")
+      self.effs_data[etalabel] = GraphLookup.fromgraph(self.file.Get(graphname+etalabel+"_Data"))
+      self.effs_mc[etalabel]   = GraphLookup.fromgraph(self.file.Get(graphname+etalabel+"_MC"))
+      self.etabins.append(etalabel)
     self.file.Close()
+    self.table     = BinnedLookup.fromhist(self.hist_eta,name=name) # for the eta bin
   
   def getSF(self, pt, eta):
     """Get SF for a given pT, eta."""
     #print pt, eta
-    abseta = abs(eta)
-    etabin = self.hist_eta.GetXaxis().GetBinLabel(min(self.hist_eta.GetXaxis().GetNbins(),self.hist_eta.GetXaxis().FindBin(abseta)))
-    data   = self.effs_data[etabin].Eval(pt)
-    mc     = self.effs_mc[etabin].Eval(pt)
+    etabin = self.etabins[self.table.findbin(0,abs(eta))]
+    data   = self.effs_data[etabin].eval(pt)
+    mc     = self.effs_mc[etabin].eval(pt)
     if mc==0:
       sf   = 1.0
     else:
@@ -81,6 +208,19 @@ class ScaleFactorHTT(ScaleFactor):
     #print "ScaleFactorHTT(%s).getSF: pt = %6.2f, eta = %6.3f, data = %6.3f, mc = %6.3f, sf = %6.3f"%(self.name,pt,eta,data,mc,sf)
     return sf
   
+  def getSFArray(self, pts, etas):
+    """Get SFs for arrays of pT, eta."""
+    pts    = np.asarray(pts,dtype=np.float64)
+    ietas  = self.table.findbins(0,np.abs(etas))
+    data   = np.ones(pts.shape)
+    mc     = np.ones(pts.shape)
+    for ieta, etabin in enumerate(self.etabins):
+      mask = (ietas==ieta)
+      if mask.any():
+        data[mask] = self.effs_data[etabin].evalarray(pts[mask])
+        mc[mask]   = self.effs_mc[etabin].evalarray(pts[mask])
+    return np.where(mc==0,1.0,data/np.where(mc==0,1.0,mc))
+  
 
 class ScaleFactorProduct:
   
@@ -93,9 +233,15 @@ class ScaleFactorProduct:
     self.scaleFactor1 = scaleFactor1
     self.scaleFactor2 = scaleFactor2
   
+  def __mul__(self, oScaleFactor):
+    return ScaleFactorProduct(self, oScaleFactor)
+  
   def getSF(self, pt, eta):
     return self.scaleFactor1.getSF(pt,eta)*self.scaleFactor2.getSF(pt,eta)
   
+  def getSFArray(self, pts, etas):
+    return self.scaleFactor1.getSFArray(pts,etas)*self.scaleFactor2.getSFArray(pts,etas)
+  
 
 #def getBinsFromTGraph(graph):
 #    """Get xbins from TGraph."""
@@ -3,8 +3,10 @@
 # 2017: https://github.com/truggles/TauTriggerSFs/tree/final_2017_MCv2
 # Run2: https://github.com/cms-tau-pog/TauTriggerSFs/blob/run2_SFs/python/getTauTriggerSFs.py
 import os
+import numpy as np
 from TauFW.PicoProducer import datadir
 from TauFW.common.tools.file import ensureTFile, gethist
+from TauFW.PicoProducer.corrections.ScaleFactorTool import BinnedLookup
 datadir = os.path.join(datadir,"trigger")
 
 
@@ -32,7 +34,7 @@ class TauTriggerSFs(object):
         for dm in dms:
           for histtype, histdict in [('data',hists_data),('mc',hists_mc),('sf',hists_sf)]:
             histname = "%s_%s_%s_dm%d_fitted"%(histtype,trigger,wp,dm)
-            histdict[dm] = gethist(file,histname)
+            histdict[dm] = BinnedLookup.fromhist(gethist(file,histname),errors=True)
         file.Close()
         
         self.hists_data = hists_data
@@ -55,17 +57,16 @@ class TauTriggerSFs(object):
         return dm
         
     def getValueFromHist(self, histdict, pt, dm, unc=None):
-        dm   = self.checkDM(dm)
-        hist = histdict[dm]
-        bin  = hist.FindFixBin(pt)
-        bin  = min(hist.GetNbinsX(),max(1,bin))
-        val  = hist.GetBinContent(bin)
+        dm    = self.checkDM(dm)
+        table = histdict[dm]
+        val   = table.lookup(pt)
         if unc=='Up':
-          val += hist.GetBinError(bin)
+          val += table.lookuperr(pt)
         elif unc=='Down':
-          val -= hist.GetBinError(bin)
+          val -= table.lookuperr(pt)
         elif unc=='All':
-          return val-hist.GetBinError(bin), val, val+hist.GetBinError(bin)
+          err = table.lookuperr(pt)
+          return val-err, val, val+err
         return val
         
     def getEff_data(self, pt, dm, unc=None):
@@ -93,6 +94,29 @@ class TauTriggerSFs(object):
         sf = eff_data / eff_mc
         return sf
         
+    def getSFArray(self, pts, dms, unc=None):
+        """Return the data/MC scale factors for arrays of tau pt and decay mode, like getSF,
+        with unc=None, 'Up' or 'Down'."""
+        pts, dms = np.asarray(pts,dtype=np.float64), np.asarray(dms,dtype=np.int64)
+        sfs      = np.zeros(len(pts))
+        for dm in np.unique(dms):
+          mask = dms==dm
+          effs = [ ]
+          for histdict in [self.hists_data,self.hists_mc]:
+            table = histdict[self.checkDM(int(dm))]
+            eff   = table.lookuparray(pts[mask])
+            if unc=='Up':
+              eff = eff + table.lookuperrarray(pts[mask])
+            elif unc=='Down':
+              eff = eff - table.lookuperrarray(pts[mask])
+            effs.append(eff)
+          eff_data, eff_mc = effs
+          low  = eff_mc<1e-5
+          if low.any():
+            print "MC eff. is suspiciously low for %d taus! trigger=%s, ID=%s, WP=%s"%(low.sum(),self.trigger,self.id,self.wp)
+          sfs[mask] = np.where(low,0.0,eff_data/np.where(low,1.0,eff_mc))
+        return sfs
+    
     def getSFPair(self, tau1, tau2, unc=None):
         """Return the data/MC scale factor for two tau legs."""
         if unc=='All':
@@ -102,3 +126,7 @@ class TauTriggerSFs(object):
         else:
           return self.getSF(tau1.pt,tau1.decayMode,unc=unc)*self.getSF(tau2.pt,tau2.decayMode,unc=unc)
     
+    def getSFPairArray(self, pts1, dms1, pts2, dms2, unc=None):
+        """Return the data/MC scale factors for arrays of the pt and decay mode of both tau legs, like getSFPair."""
+        return self.getSFArray(pts1,dms1,unc=unc)*self.getSFArray(pts2,dms2,unc=unc)
+
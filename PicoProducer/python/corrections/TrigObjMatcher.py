@@ -6,7 +6,10 @@
 #   https://cms-nanoaod-integration.web.cern.ch/integration/master-106X/mc106X_doc.html#TrigObj
 import os, sys, yaml #, json
 from collections import namedtuple
+import numpy as np
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from TauFW.PicoProducer.analysis.kinematics import deltaR, deltaRMatrix
+from TauFW.PicoProducer.analysis.columnar import pairs
 TriggerData = namedtuple('TriggerData',['trigdict','combdict']) # simple container class
 objectTypes = { 1: 'Jet', 6: 'FatJet', 2: 'MET', 3: 'HT', 4: 'MHT',
                 11: 'Electron', 13: 'Muon', 15: 'Tau', 22: 'Photon', } 
@@ -127,9 +130,19 @@ class Trigger:
     self.runrange = runrange                            # range of run for this trigger formatted as (first,last); for data only
     self.path     = path                                # human readable trigger combination
     self.patheval = patheval                            # trigger evaluation per event 'e'
-    self.fireddef = "self.fired = lambda e: "+patheval  # exact definition of 'fired' function
-    exec self.fireddef in locals()                      # method to check if trigger was fired for a given event
-    #self.fired = lambda e: any(e.p for p in self.paths)
+  
+  def fired(self,event):
+    """Check if trigger was fired for a given event."""
+    if self.runrange and not (self.runrange[0]<=event.run<=self.runrange[1]):
+      return False
+    return bool(getattr(event,self.path))
+  
+  def firedBlock(self,block):
+    """Return mask of the events in a block (see analysis/columnar.py) that fired this trigger."""
+    fired = getattr(block,self.path)>0
+    if self.runrange:
+      fired = fired & (self.runrange[0]<=block.run) & (block.run<=self.runrange[1])
+    return fired
   
   def __repr__(self):
     """Returns string representation of Trigger object."""
@@ -265,7 +278,6 @@ class TrigObjMatcher:
       else:
         patheval += trigger.patheval
     path    = patheval.replace("e.",'').replace(" or "," || ").replace(" and "," && ")
-    firedef = "self.fired = lambda e: "+patheval
     
     self.triggers = triggers       # list of triggers
     self.nlegs    = nlegs          # number of legs = number of filters
@@ -275,8 +287,7 @@ class TrigObjMatcher:
     self.bits     = bits           # bitwise 'OR'-combination of all filter bits
     self.path     = path           # human readable trigger combination
     self.patheval = patheval       # trigger evaluation per event 'e'
-    self.fireddef = firedef        # exact definition of 'fired' function
-    exec self.fireddef in locals() # method to check if any of the triggers was fired for a given event
+    self.index    = None           # trigger object index of the current event
   
   def __repr__(self):
     """Returns string representation of TriggerFilter object."""
@@ -292,14 +303,116 @@ class TrigObjMatcher:
       for i, filter in enumerate(trigger.filters,1):
         print "%s  leg %d: %s, %r"%(indent,i,filter.type,filter.name)
   
+  def getindex(self,event):
+    """Return trigger object index of this event, created once per event."""
+    if self.index is None or self.index.event is not event:
+      self.index = TrigObjIndex(event,self)
+    return self.index
+  
+  def fired(self,event):
+    """Check if any of the triggers was fired for a given event."""
+    return len(self.getindex(event).fired)>0
+  
   def match(self,event,recoObj,leg=1,dR=0.2):
     """Match given reconstructed object to trigger objects."""
-    leg     -= 1 # index starting at 0
-    trigObjs = [o for o in Collection(event,'TrigObj') if o.id==self.ids[leg]] # and (o.filterBits&self.bits)>0
+    return self.matchall(event,[recoObj],leg=leg,dR=dR)[0]
+  
+  def matchall(self,event,recoObjs,leg=1,dR=0.2):
+    """Match a list of reconstructed objects to trigger objects in one go.
+    Return the matched trigger object (or None) for each reconstructed object."""
+    index   = self.getindex(event)
+    matches = [None]*len(recoObjs)
+    if not recoObjs or not index.fired:
+      return matches
+    leg    -= 1 # index starting at 0
+    etas    = np.array([o.eta for o in recoObjs])
+    phis    = np.array([o.phi for o in recoObjs])
+    pts     = np.array([o.pt for o in recoObjs])
+    dRs     = index.deltaR(leg,etas,phis) # reco objects x trigger objects
+    unmatched = np.ones(len(recoObjs),dtype=bool)
+    for itrig in index.fired: # in order of triggers, like before
+      filter = self.triggers[itrig].filters[leg]
+      passed = (dRs<dR) & index.passbits(leg,itrig) # match bits and DeltaR
+      passed[(pts<=filter.ptmin) | (np.abs(etas)>=filter.etamax) | ~unmatched] = False
+      for i in np.nonzero(passed.any(axis=1))[0]:
+        matches[i] = index.trigobj(leg,passed[i].argmax()) # first matched trigger object
+        unmatched[i] = False
+      if not unmatched.any(): break
+    return matches
+  
+  def firedBlock(self,block):
+    """Return mask of the events in a block (see analysis/columnar.py) that fired any of the triggers."""
+    fired = np.zeros(block.nevents,dtype=bool)
+    for trigger in self.triggers:
+      fired |= trigger.firedBlock(block)
+    return fired
+  
+  def matchBlock(self,block,recoObjs,leg=1,dR=0.2):
+    """Match the reconstructed objects in a block of events to trigger objects, like matchall,
+    given as a flattened collection (see analysis/columnar.py).
+    Return a mask of the reconstructed objects that are matched for any of the fired triggers."""
+    leg      -= 1 # index starting at 0
+    trigobjs  = block.collection('TrigObj',recoObjs.nperevent()>0)
+    trigobjs  = trigobjs[trigobjs.id==self.ids[leg]]
+    ireco, itrig = pairs(recoObjs,trigobjs) # all reco x trigger objects in the same event
+    evts      = recoObjs.evt[ireco]
+    pts       = recoObjs.pt[ireco]
+    etas      = np.abs(recoObjs.eta[ireco])
+    bits      = trigobjs.filterBits[itrig].astype(np.int64)
+    dRs       = deltaR(recoObjs.eta[ireco],recoObjs.phi[ireco],trigobjs.eta[itrig],trigobjs.phi[itrig])
+    passed    = np.zeros(len(ireco),dtype=bool)
     for trigger in self.triggers:
-      if not trigger.fired(event): continue
-      for trigObj in trigObjs:
-        if trigger.filters[leg].matchbits(trigObj) and trigger.filters[leg].match(trigObj,recoObj,dR=dR):
-          return trigObj
-    return None
+      filter  = trigger.filters[leg]
+      passed |= trigger.firedBlock(block)[evts] & (dRs<dR) & ((bits & filter.bits)==filter.bits) &\
+                (pts>filter.ptmin) & (etas<filter.etamax)
+    return np.bincount(ireco[passed],minlength=len(recoObjs))>0
+  
+
+class TrigObjIndex:
+  """Index of the trigger objects in one event for a TrigObjMatcher:
+  The fired triggers are evaluated once, and the trigger objects are grouped per leg,
+  with their filter bits checked once for each trigger filter."""
+  
+  def __init__(self,event,matcher):
+    self.event   = event
+    self.matcher = matcher
+    self.fired   = [i for i, t in enumerate(matcher.triggers) if t.fired(event)] # indices of fired triggers
+    self.objects = None # leg -> indices, eta, phi of trigger objects with the leg's ID
+    self.bits    = { }  # (leg, trigger) -> mask of trigger objects passing the filter bits
+    self.colls   = None
+  
+  def load(self):
+    """Read trigger objects of this event into arrays."""
+    event   = self.event
+    nobjs   = event.nTrigObj
+    ids     = np.array([event.TrigObj_id[i] for i in xrange(nobjs)],dtype=np.int64)
+    bits    = np.array([event.TrigObj_filterBits[i] for i in xrange(nobjs)],dtype=np.int64)
+    etas    = np.array([event.TrigObj_eta[i] for i in xrange(nobjs)])
+    phis    = np.array([event.TrigObj_phi[i] for i in xrange(nobjs)])
+    self.objects = { }
+    for leg, id in enumerate(self.matcher.ids):
+      idxs = np.nonzero(ids==id)[0]
+      self.objects[leg] = (idxs,etas[idxs],phis[idxs],bits[idxs])
+  
+  def deltaR(self,leg,etas,phis):
+    """Return DeltaR of reco objects (rows) to trigger objects of this leg (columns)."""
+    if self.objects is None:
+      self.load()
+    idxs, tetas, tphis, bits = self.objects[leg]
+    return deltaRMatrix(etas,phis,tetas,tphis)
+  
+  def passbits(self,leg,itrig):
+    """Return mask of trigger objects of this leg passing the filter bits of a given trigger."""
+    if (leg,itrig) not in self.bits:
+      if self.objects is None:
+        self.load()
+      fbits = self.matcher.triggers[itrig].filters[leg].bits
+      self.bits[(leg,itrig)] = (self.objects[leg][3] & fbits)==fbits
+    return self.bits[(leg,itrig)]
+  
+  def trigobj(self,leg,i):
+    """Return trigger object, given its index in this leg."""
+    if self.colls is None:
+      self.colls = Collection(self.event,'TrigObj')
+    return self.colls[int(self.objects[leg][0][i])]
   
@@ -0,0 +1,109 @@
+# Description: Help functions to run an analysis module on the input files of a job in parallel processes,
+#              and merge the output of each process
+import os
+import time
+from multiprocessing import Process
+from TauFW.common.tools.utils import chunkify
+from TauFW.common.tools.log import Logger
+LOG = Logger('Parallel')
+
+
+def getnentries(fname,treename='Events'):
+  """Get number of entries in a tree of a file."""
+  from ROOT import TFile
+  file = TFile.Open(fname)
+  if not file or file.IsZombie():
+    LOG.throw(IOError,"getnentries: Could not open %s!"%(fname))
+  tree = file.Get(treename)
+  nevts = tree.GetEntries() if tree else 0
+  file.Close()
+  return nevts
+  
+
+def splitinput(infiles,nworkers,maxevts=None,treename='Events'):
+  """Split the input files into one task per worker. Each task is a tuple (infiles,firstEntry,maxEntries).
+  With at least as many files as workers, split per file. Otherwise, split the files in event ranges."""
+  if nworkers<=1 or not infiles:
+    return [(infiles,0,maxevts)]
+  if len(infiles)>=nworkers: # split per file
+    chunksize = (len(infiles)+nworkers-1)//nworkers
+    return [(files,0,maxevts) for files in chunkify(infiles,chunksize)]
+  tasks = [ ]
+  for i, fname in enumerate(infiles): # split in event ranges
+    nsplit = nworkers//len(infiles) + (1 if i<nworkers%len(infiles) else 0)
+    nevts  = getnentries(fname,treename)
+    if maxevts!=None and maxevts<nevts:
+      nevts = maxevts
+    nrange = (nevts+nsplit-1)//nsplit
+    for first in range(0,nevts,max(nrange,1)):
+      tasks.append(([fname],first,min(nrange,nevts-first)))
+  return tasks
+  
+
+def runparallel(target,tasks,verb=0):
+  """Run target function for each task (a tuple of arguments) in separate processes,
+  and wait until all are finished. The target should be a module-level function, not a lambda
+  or closure, so it can be pickled if processes are not started with fork."""
+  processes = [ ]
+  for i, task in enumerate(tasks):
+    if verb>=1:
+      print ">>> runparallel: Starting process %d for %s..."%(i,task)
+    process = Process(target=target,args=tuple(task))
+    process.start()
+    processes.append(process)
+  failed = [ ]
+  for i, process in enumerate(processes):
+    process.join()
+    if process.exitcode!=0:
+      failed.append(i)
+  if failed:
+    LOG.throw(OSError,"runparallel: Processes %s failed with exit codes %s!"%(
+                      failed,[processes[i].exitcode for i in failed]))
+  
+
+def mergeoutput(outfname,infnames,verb=0):
+  """Merge the output of parallel processes into one file: chain the trees (e.g. 'tree' and
+  those of systematic variations), and add the histograms (e.g. cutflow, pileup, b tag efficiencies) bin by bin."""
+  from ROOT import TFile, TChain, TH1, TTree, TDirectory, TObject
+  time0 = time.time()
+  if verb>=1:
+    print ">>> mergeoutput: Merging %s into %s..."%(infnames,outfname)
+  infiles   = [TFile.Open(f) for f in infnames]
+  outfile   = TFile(outfname,'RECREATE')
+  treenames = [ ] # trees in top directory
+  
+  def mergedir(indirs,outdir):
+    for key in indirs[0].GetListOfKeys():
+      name = key.GetName()
+      obj  = key.ReadObj()
+      if isinstance(obj,TDirectory):
+        subdir = outdir.mkdir(name)
+        mergedir([d.Get(name) for d in indirs],subdir)
+      elif isinstance(obj,TH1):
+        outdir.cd()
+        hist = obj.Clone(name)
+        hist.SetDirectory(outdir)
+        for indir in indirs[1:]:
+          hist.Add(indir.Get(name)) # bin by bin, ignoring labels
+        hist.Write(name,TObject.kOverwrite)
+      elif isinstance(obj,TTree) and outdir is outfile:
+        if name not in treenames:
+          treenames.append(name)
+      else:
+        LOG.warning("mergeoutput: Ignoring %r of type %s..."%(name,type(obj)))
+  
+  mergedir(infiles,outfile)
+  for treename in treenames:
+    chain = TChain(treename)
+    for fname in infnames:
+      chain.Add(fname)
+    outfile.cd()
+    tree = chain.CloneTree(-1,'fast') # copy baskets without decompressing
+    tree.Write(treename,TObject.kOverwrite)
+  outfile.Close()
+  for file in infiles:
+    file.Close()
+  if verb>=1:
+    print ">>> mergeoutput: Merged %d files in %.1f seconds"%(len(infnames),time.time()-time0)
+  return outfname
+  
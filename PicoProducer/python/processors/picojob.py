@@ -19,9 +19,14 @@ parser.add_argument('-t', '--tag',      dest='tag',       type=str, default="")
 parser.add_argument('-d', '--dtype',    dest='dtype',     choices=['data','mc','embed'], default=None)
 parser.add_argument('-y','-e','--era',  dest='era',       type=str, default='2018')
 parser.add_argument('-M', '--module',   dest='module',    type=str, default=None)
-parser.add_argument('-c', '--channel',  dest='channel',   type=str, default=None)
+parser.add_argument('-c', '--channel',  dest='channel',   type=str, default=None) # comma-separated to run several channels on the same events
 parser.add_argument('-E', '--opts',     dest='extraopts', type=str, default=[ ], nargs='+')
 parser.add_argument('-p', '--prefetch', dest='prefetch',  action='store_true', default=False)
+parser.add_argument('-B', '--columnar', dest='blocksize', type=int, nargs='?', const=10000, default=0) # process blocks of events (experimental)
+parser.add_argument('-n', '--ncores',   dest='ncores',    type=int, default=1) # number of parallel processes
+parser.add_argument('-P', '--presel',   dest='dopresel',  action='store_true', default=False) # preselect events in C++
+parser.add_argument('-R', '--record',   dest='record',    action='store_true', default=False) # record input branches read by module
+parser.add_argument(      '--noprune',  dest='prune',     action='store_false', default=True) # do not prune input branches
 parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0, action='store' )
 args = parser.parse_args()
 
@@ -30,17 +35,30 @@ args = parser.parse_args()
 era       = args.era # e.g. '2017', 'UL2017', ...
 year      = getyear(era) # integer year, e.g. 2017
 modname   = args.module
-channel   = args.channel
-if channel:
+channels  = args.channel.split(',') if args.channel else [ ] # e.g. 'mutau,etau,tautau'
+chopts    = [[ ] for c in channels] # extra options per channel
+if channels:
   import TauFW.PicoProducer.tools.config as GLOB
   CONFIG  = GLOB.getconfig(verb=0)
+  assert not (modname and len(channels)>1), "Cannot run the same module %r for several channels %s!"%(modname,channels)
   if not modname:
-    assert channel in CONFIG.channels, "Did not find channel '%s' in configuration. Available channels: %s"%(channel,CONFIG.channels)
-    modname = CONFIG.channels[args.channel]
+    modnames = [ ]
+    for i, channel in enumerate(channels):
+      assert channel in CONFIG.channels, "Did not find channel '%s' in configuration. Available channels: %s"%(channel,CONFIG.channels)
+      parts     = CONFIG.channels[channel].split(' ') # "MODULE [KEY=VALUE ...]"
+      modnames.append(parts[0])
+      chopts[i] = parts[1:]
+  else:
+    modnames = [modname]
 else:
   if not modname:
     modname = "ModuleMuTauSimple"
-  channel = modname
+  modnames = [modname]
+  channels = [modname]
+  chopts   = [[ ]]
+channel   = ','.join(channels)
+modname   = ','.join(modnames)
+multi     = len(channels)>1 # run several channel modules on the same events
 dtype     = args.dtype
 outdir    = ensuredir(args.outdir)
 copydir   = args.copydir
@@ -49,14 +67,27 @@ nfiles    = 1 if maxevts>0 else -1
 tag       = args.tag
 if tag:
   tag     = ('' if tag.startswith('_') else '_') + tag
-outfname  = os.path.join(outdir,"pico_%s%s.root"%(channel,tag))
+outfnames = [os.path.join(outdir,"pico_%s%s.root"%(c,tag)) for c in channels]
 url       = "root://cms-xrd-global.cern.ch/"
 prefetch  = args.prefetch
+blocksize = args.blocksize
+ncores    = args.ncores
+dopresel  = args.dopresel
+record    = args.record
+prune     = args.prune and not record and blocksize<=0
 verbosity = args.verbosity
 presel    = None #"Muon_pt[0] > 50"
 branchsel = os.path.join(moddir,"keep_and_drop_skim.txt")
+inputsel  = os.path.join(moddir,"keep_and_drop_input_%s.txt"%(channels[0])) # recorded input branches
+if not os.path.isfile(inputsel) or multi: # different channels may read different branches
+  prune   = False
+if record and ncores>1: # cannot update the same keep/drop list from parallel processes
+  print(">>> Warning! Recording input branches is not supported with parallel processes! Setting ncores=1...")
+  ncores  = 1
+if record and multi:
+  print(">>> Warning! Recording input branches is not supported with several channels! Ignoring...")
+  record  = False
 json      = None
-modules   = [ ]
 
 # GET FILES
 infiles   = args.infiles or [
@@ -76,12 +107,18 @@ if dtype=='data':
   json = getjson(era,dtype)
 
 # EXTRA OPTIONS
+def getkwargs(options):
+  """Parse extra options of the form 'KEY=VALUE'."""
+  kwargs = { }
+  for option in options:
+    assert '=' in option, "Extra option '%s' should contain '='! All: %s"%(option,options)
+    split       = option.split('=')
+    key, val    = split[0], ''.join(split[1:])
+    kwargs[key] = convertstr(val) # convert to bool, float or int if possible
+  return kwargs
 kwargs = { 'era': era, 'year': year, 'dtype': dtype, 'verb': verbosity }
-for option in args.extraopts:
-  assert '=' in option, "Extra option '%s' should contain '='! All: %s"%(option,args.extraopts)
-  split       = option.split('=')
-  key, val    = split[0], ''.join(split[1:])
-  kwargs[key] = convertstr(val) # convert to bool, float or int if possible
+kwargs.update(getkwargs(args.extraopts))
+chkwargs = [dict(kwargs,**getkwargs(o)) for o in chopts] # per channel, like pico.py
 
 # PRINT
 print('-'*80)
@@ -90,26 +127,89 @@ print(">>> %-12s = %r"%('year',year))
 print(">>> %-12s = %r"%('channel',channel))
 print(">>> %-12s = %r"%('modname',modname))
 print(">>> %-12s = %r"%('dtype',dtype))
-print(">>> %-12s = %r"%('kwargs',kwargs))
+print(">>> %-12s = %r"%('kwargs',kwargs if not multi else chkwargs))
 print(">>> %-12s = %s"%('maxevts',maxevts))
 print(">>> %-12s = %r"%('outdir',outdir))
 print(">>> %-12s = %r"%('copydir',copydir))
 print(">>> %-12s = %s"%('infiles',infiles))
-print(">>> %-12s = %r"%('outfname',outfname))
+print(">>> %-12s = %r"%('outfnames',outfnames))
 print(">>> %-12s = %r"%('branchsel',branchsel))
+print(">>> %-12s = %r"%('inputsel',inputsel))
+print(">>> %-12s = %s"%('prune',prune))
+print(">>> %-12s = %s"%('record',record))
 print(">>> %-12s = %r"%('json',json))
 print(">>> %-12s = %s"%('prefetch',prefetch))
+print(">>> %-12s = %s"%('blocksize',blocksize))
+print(">>> %-12s = %s"%('ncores',ncores))
+print(">>> %-12s = %s"%('dopresel',dopresel))
 print(">>> %-12s = %s"%('cwd',os.getcwd()))
 print('-'*80)
 
-# GET MODULE
-module = getmodule(modname)(outfname,**kwargs)
-modules.append(module)
-
 # RUN
-p = PostProcessor(outdir,infiles,cut=None,branchsel=None,noOut=True,
-                  modules=modules,jsonInput=json,maxEntries=maxevts,prefetch=prefetch)
-p.run()
+def process(outfnames,infiles,first=0,maxevts=maxevts,prefetch=prefetch):
+  """Get modules and run them on the input files."""
+  if multi: # share event-level quantities between channels
+    from TauFW.PicoProducer.analysis.utils import EventCache
+    evtcache = EventCache()
+    chmodules = [getmodule(m)(f,evtcache=evtcache,**k) for m, f, k in zip(modnames,outfnames,chkwargs)]
+  else:
+    chmodules = [getmodule(modnames[0])(outfnames[0],**chkwargs[0])]
+  module    = chmodules[0]
+  formulas  = [presel] # formulas evaluated in C++
+  dopresel_ = False
+  if dopresel: # reject events in C++ before the python event loop
+    if blocksize>0:
+      print(">>> Warning! Preselection is not supported in columnar mode! Ignoring...")
+    elif multi:
+      print(">>> Warning! Preselection is not supported with several channels! Ignoring...")
+    elif not hasattr(module,'preselect'):
+      print(">>> Warning! Module %s has no preselection! Ignoring..."%(modname))
+    else:
+      dopresel_ = True
+      stages    = module.getPreselection()
+      formulas += [f for c, f in stages]+[b for n, b in module.getBranchMap() if isinstance(b,str)] # in case branches are redirected
+      print(">>> %-12s = %r"%('presel'," && ".join("(%s)"%f for c, f in stages)))
+  if blocksize>0: # columnar mode: all modules already see all events of each block
+    modules = chmodules
+  elif multi: # all modules see all events, even if a previous one rejected it
+    from TauFW.PicoProducer.analysis.MultiChannel import MultiChannel
+    modules = [MultiChannel(chmodules,names=channels)]
+  elif dopresel_: # reject events that fail the preselection before module
+    from TauFW.PicoProducer.analysis.Preselector import Preselector
+    modules = [Preselector(module,firstEntry=first,maxEntries=maxevts,verb=verbosity),module]
+  else:
+    modules = [module]
+  if record: # record input branches
+    if blocksize>0:
+      print(">>> Warning! Recording input branches is not supported in columnar mode! Ignoring...")
+    else:
+      from TauFW.PicoProducer.analysis.BranchRecorder import BranchRecorder
+      header   = "Input branches read by %s for channel %s"%(modname,channel)
+      recorder = BranchRecorder(inputsel,record=record,formulas=formulas,header=header,verb=verbosity)
+      modules.insert(0,recorder) # should come first
+  if blocksize>0: # columnar mode
+    print(">>> Warning! Columnar mode is experimental: its output has not yet been validated against the event loop!")
+    from TauFW.PicoProducer.analysis.columnar import ColumnarProcessor
+    p = ColumnarProcessor(infiles,modules,jsonInput=json,maxEntries=maxevts,firstEntry=first,
+                          prefetch=prefetch,blocksize=blocksize,verb=verbosity)
+  else:
+    p = PostProcessor(outdir,infiles,cut=presel,branchsel=(inputsel if prune else None),noOut=True,modules=modules,
+                      jsonInput=json,maxEntries=maxevts,firstEntry=first,prefetch=prefetch)
+  p.run()
+if ncores>1: # split input over parallel processes, and merge their output
+  from TauFW.PicoProducer.processors.parallel import splitinput, runparallel, mergeoutput
+  from TauFW.common.tools.file import rmfile
+  tasks     = splitinput(infiles,ncores,maxevts)
+  partnames = [[f.replace(".root","_part%d.root"%i) for f in outfnames] for i in range(len(tasks))]
+  prefetch  = prefetch and len(infiles)>=ncores # avoid processes copying the same file
+  print(">>> Running %d processes: %s"%(len(tasks),tasks))
+  runparallel(process,[(partnames[i],)+tuple(t)+(prefetch,) for i, t in enumerate(tasks)],verb=verbosity)
+  for i, outfname in enumerate(outfnames):
+    parts = [p[i] for p in partnames]
+    mergeoutput(outfname,parts,verb=verbosity+1)
+    rmfile(parts)
+else:
+  process(outfnames,infiles)
 
 # COPY
 if copydir and outdir!=copydir:
@@ -118,9 +218,10 @@ if copydir and outdir!=copydir:
   from TauFW.PicoProducer.storage.utils import getstorage
   from TauFW.common.tools.file import rmfile
   store = getstorage(copydir,verb=2)
-  store.cp(outfname)
-  print(">>> Removing %r..."%(outfname))
-  rmfile(outfname)
+  for outfname in outfnames:
+    store.cp(outfname)
+    print(">>> Removing %r..."%(outfname))
+    rmfile(outfname)
 
 # DONE
 print(">>> picojob.py done after %.1f seconds"%(time.time()-time0))
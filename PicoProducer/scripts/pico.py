@@ -336,6 +336,8 @@ def main_run(args):
   nfiles    = args.nfiles
   nsamples  = args.nsamples
   prefetch  = args.prefetch
+  ncores    = args.ncores
+  presel    = args.presel
   dryrun    = args.dryrun
   verbosity = args.verbosity
   
@@ -447,6 +449,10 @@ def main_run(args):
           runcmd += " -i %s"%(' '.join(infiles))
         if prefetch:
           runcmd += " -p"
+        if ncores>1 and not skim:
+          runcmd += " -n %d"%(ncores)
+        if presel and not skim:
+          runcmd += " -P"
         if extraopts_:
           runcmd += " --opt '%s'"%("' '".join(extraopts_))
         #elif nfiles:
@@ -511,6 +517,8 @@ def preparejobs(args):
   checkqueue   = args.checkqueue
   extraopts    = args.extraopts  # extra options for module (for all runs)
   prefetch     = args.prefetch
+  ncores       = args.ncores
+  presel       = args.presel
   nfilesperjob = args.nfilesperjob
   split_nfpj   = args.split_nfpj
   testrun      = args.testrun    # only run a few test jobs
@@ -690,6 +698,10 @@ def preparejobs(args):
                 jobcmd   += " -y %s -d %r -c %s -M %s --copydir %s -t %s"%(era,dtype,channel,module,outdir,filetag)
               if prefetch:
                 jobcmd   += " -p"
+              if ncores>1 and not skim:
+                jobcmd   += " -n %d"%(ncores) # parallel processes
+              if presel and not skim:
+                jobcmd   += " -P" # preselection in C++
               if testrun:
                 jobcmd   += " -m %d"%(testrun) # process a limited amount of events
               if extraopts_:
@@ -1333,6 +1345,10 @@ if __name__ == "__main__":
   parser_job = ArgumentParser(add_help=False,parents=[parser_sam])
   parser_job.add_argument('-p','--prefetch',    dest='prefetch', action='store_true',
                                                 help="copy remote file during job to increase processing speed and ensure stability" )
+  parser_job.add_argument('--ncores',           dest='ncores', type=int, default=1,
+                                                help="number of parallel processes per job (analysis only), default=%(default)d" )
+  parser_job.add_argument('--presel',           dest='presel', action='store_true',
+                                                help="preselect events in C++ before the python event loop (analysis only)" )
   parser_job.add_argument('-T','--test',        dest='testrun', type=int, nargs='?', const=10000, default=0,
                           metavar='NJOBS',      help='run a test with limited nummer of jobs and events, default nevts=%(const)d' )
   parser_job.add_argument('--getjobs',          dest='checkqueue', type=int, nargs='?', const=1, default=-1,
@@ -1414,6 +1430,10 @@ if __name__ == "__main__":
                                                 help="output directory, default=%(default)r")
   parser_run.add_argument('-p','--prefetch',    dest='prefetch', action='store_true',
                                                 help="copy remote file during run to increase processing speed and ensure stability" )
+  parser_run.add_argument('--ncores',           dest='ncores', type=int, default=1,
+                                                help="number of parallel processes (analysis only), default=%(default)d" )
+  parser_run.add_argument('--presel',           dest='presel', action='store_true',
+                                                help="preselect events in C++ before the python event loop (analysis only)" )
   parser_sts.add_argument('-l','--log',         dest='showlogs', type=int, nargs='?', const=-1, default=0,
                           metavar='NLOGS',      help="show log files of failed jobs: 0 (show none), -1 (show all), n (show max n)" )
   #parser_hdd.add_argument('--keep',             dest='cleanup', action='store_false',
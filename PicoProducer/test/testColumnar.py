@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# Description: Check that the columnar mode of the channel modules (analyzeBlock) produces the same
+#              pico trees and cutflow as the event loop (analyze), and benchmark both on a nanoAOD file
+#   test/testColumnar.py -i nano.root -c mutau etau tautau emu mumu -n 20000
+import os, time
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from ROOT import TFile, TTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from TauFW.common.tools.log import Logger
+from TauFW.common.tools.file import ensuredir
+from TauFW.PicoProducer.analysis.utils import getmodule, getyear
+from TauFW.PicoProducer.analysis.columnar import ColumnarProcessor
+from TauFW.PicoProducer.corrections.era_config import getjson
+LOG = Logger('testColumnar')
+modnames = { 'mutau': 'ModuleMuTau', 'etau': 'ModuleETau', 'tautau': 'ModuleTauTau', 'emu': 'ModuleEMu', 'mumu': 'ModuleMuMu' }
+
+
+def run(mode, channel, outfname, args):
+  """Run the channel module on the input file in event-by-event or columnar mode, and return the run time."""
+  kwargs  = { 'era': args.era, 'year': getyear(args.era), 'dtype': args.dtype }
+  module  = getmodule(modnames[channel])(outfname,**kwargs)
+  maxevts = args.nevts if args.nevts>0 else None
+  json    = getjson(args.era,args.dtype) if args.dtype=='data' else None
+  if mode=='columnar':
+    proc  = ColumnarProcessor(args.infiles,[module],jsonInput=json,maxEntries=maxevts,blocksize=args.blocksize)
+  else:
+    proc  = PostProcessor(args.outdir,args.infiles,noOut=True,modules=[module],jsonInput=json,maxEntries=maxevts)
+  start = time.time()
+  proc.run()
+  return time.time()-start
+  
+
+def getvalues(tree):
+  """Return the values of all leaves for each entry of a tree."""
+  leaves = [l.GetName() for l in tree.GetListOfLeaves()]
+  values = [ ]
+  for i in xrange(tree.GetEntries()):
+    tree.GetEntry(i)
+    values.append([getattr(tree,l) for l in leaves])
+  return leaves, values
+  
+
+def compare(fname1, fname2, rtol=1e-6):
+  """Compare the cutflow and all trees of two pico files. Return the number of differences."""
+  file1 = TFile.Open(fname1)
+  file2 = TFile.Open(fname2)
+  ndiff = 0
+  hist1, hist2 = file1.Get('cutflow'), file2.Get('cutflow')
+  for i in xrange(hist1.GetNbinsX()+2):
+    y1, y2 = hist1.GetBinContent(i), hist2.GetBinContent(i)
+    if abs(y1-y2)>rtol*max(abs(y1),abs(y2)):
+      LOG.warning("compare: cutflow bin %d (%r) differs: %s vs %s"%(i,hist1.GetXaxis().GetBinLabel(i),y1,y2))
+      ndiff += 1
+  for key in file1.GetListOfKeys():
+    tree1 = key.ReadObj()
+    if not isinstance(tree1,TTree): continue
+    tree2 = file2.Get(tree1.GetName())
+    if tree1.GetEntries()!=tree2.GetEntries():
+      LOG.warning("compare: %r has %d vs %d entries"%(tree1.GetName(),tree1.GetEntries(),tree2.GetEntries()))
+      ndiff += 1
+      continue
+    leaves, values1 = getvalues(tree1)
+    leaves, values2 = getvalues(tree2)
+    for i, (row1, row2) in enumerate(zip(values1,values2)):
+      for leaf, x1, x2 in zip(leaves,row1,row2):
+        if abs(x1-x2)>rtol*max(abs(x1),abs(x2)):
+          LOG.verb("compare: %r entry %d, %r differs: %s vs %s"%(tree1.GetName(),i,leaf,x1,x2),LOG.verbosity,1)
+          ndiff += 1
+  file1.Close()
+  file2.Close()
+  return ndiff
+  
+
+def main(args):
+  ensuredir(args.outdir)
+  nevts = 0 # number of processed entries
+  for fname in args.infiles:
+    file   = TFile.Open(fname)
+    ntot   = file.Get('Events').GetEntries()
+    nevts += min(ntot,args.nevts) if args.nevts>0 else ntot
+    file.Close()
+  TAB = LOG.table("%-8s %-10s %10.2f %12.1f %9.1f")
+  TAB.printheader("channel","mode","time [s]","rate [Hz]","speedup")
+  results = [ ]
+  for channel in args.channels:
+    outfnames = { m: os.path.join(args.outdir,"pico_%s_%s.root"%(channel,m)) for m in ['event','columnar'] }
+    times = { m: run(m,channel,outfnames[m],args) for m in ['event','columnar'] }
+    for mode in ['event','columnar']:
+      TAB.printrow(channel,mode,times[mode],nevts/times[mode],times['event']/times[mode])
+    results.append((channel,compare(outfnames['event'],outfnames['columnar'])))
+  for channel, ndiff in results:
+    LOG.insist(ndiff==0,"%s: Columnar output differs in %d values!"%(channel,ndiff))
+  print ">>> Pico trees and cutflows are identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check that the columnar mode gives the same output as the event loop, and benchmark them."""
+  parser = ArgumentParser(prog="testColumnar",description=description,epilog="Good luck!")
+  parser.add_argument('-i', '--infiles',   dest='infiles', nargs='+', required=True,
+                                           help="input nanoAOD files" )
+  parser.add_argument('-c', '--channel',   dest='channels', nargs='+', default=['mutau'], choices=sorted(modnames),
+                                           help="channels to test, default=%(default)s" )
+  parser.add_argument('-y', '--era',       dest='era', default='2018',
+                                           help="era, default=%(default)s" )
+  parser.add_argument('-d', '--dtype',     dest='dtype', choices=['mc','data','embed'], default='mc',
+                                           help="data type, default=%(default)s" )
+  parser.add_argument('-n', '--nevts',     dest='nevts', type=int, default=20000,
+                                           help="maximum number of events per file, default=%(default)d" )
+  parser.add_argument('-B', '--blocksize', dest='blocksize', type=int, default=10000,
+                                           help="number of events per block, default=%(default)d" )
+  parser.add_argument('-o', '--outdir',    dest='outdir', default="columnar",
+                                           help="output directory, default=%(default)r" )
+  parser.add_argument('-v', '--verbose',   dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                           help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
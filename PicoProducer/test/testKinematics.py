@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# Description: Check parity of the kinematics kernels with the ROOT vector classes, and benchmark them
+#   test/testKinematics.py -n 100000
+import time
+import numpy as np
+from math import sqrt, cos, pi
+from ROOT import TLorentzVector, TVector3
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.kinematics import *
+LOG = Logger('testKinematics')
+
+
+def getvalues(nevts):
+  """Create random kinematics of two objects and the MET."""
+  np.random.seed(1)
+  pt1,  pt2  = np.random.uniform(20,200,nevts), np.random.uniform(20,200,nevts)
+  eta1, eta2 = np.random.uniform(-2.5,2.5,nevts), np.random.uniform(-2.5,2.5,nevts)
+  phi1, phi2 = np.random.uniform(-pi,pi,nevts), np.random.uniform(-pi,pi,nevts)
+  m1,   m2   = np.random.uniform(0,1.8,nevts), np.full(nevts,0.105)
+  metpt      = np.random.uniform(0,100,nevts)
+  metphi     = np.random.uniform(-pi,pi,nevts)
+  return pt1, eta1, phi1, m1, pt2, eta2, phi2, m2, metpt*np.cos(metphi), metpt*np.sin(metphi)
+  
+
+def root(pt1, eta1, phi1, m1, pt2, eta2, phi2, m2, metpx, metpy):
+  """Reference: compute variables with TLorentzVector and TVector3, like the original ModuleTauPair."""
+  tau1, tau2 = TLorentzVector(), TLorentzVector()
+  tau1.SetPtEtaPhiM(pt1,eta1,phi1,m1)
+  tau2.SetPtEtaPhiM(pt2,eta2,phi2,m2)
+  met        = TLorentzVector(metpx,metpy,0,sqrt(metpx**2+metpy**2))
+  leg1       = TVector3(tau1.Px(),tau1.Py(),0.)
+  leg2       = TVector3(tau2.Px(),tau2.Py(),0.)
+  zetaAxis   = TVector3(leg1.Unit()+leg2.Unit()).Unit()
+  return ( (tau1+tau2).M(), (tau1+tau2).Pt(), tau1.Rapidity(), met.Pt(), met.Phi(),
+           sqrt(2*pt1*met.Pt()*(1-cos(tau1.DeltaPhi(met)))),
+           met.Vect()*zetaAxis, leg1*zetaAxis + leg2*zetaAxis, tau1.DeltaR(tau2) )
+  
+
+def kernel(pt1, eta1, phi1, m1, pt2, eta2, phi2, m2, metpx, metpy):
+  """Compute variables with the kinematics kernels."""
+  px1, py1, pz1, e1 = p4(pt1,eta1,phi1,m1)
+  px2, py2, pz2, e2 = p4(pt2,eta2,phi2,m2)
+  mvis, ptll    = invmass(pt1,eta1,phi1,m1,pt2,eta2,phi2,m2)
+  metpt, metphi = ptphi(metpx,metpy)
+  pzetamiss, pzetavis, axis = pzeta(px1,py1,px2,py2,metpx,metpy)
+  return ( mvis, ptll, rapidity(pt1,eta1,phi1,m1), metpt, metphi, mt(pt1,phi1,metpt,metphi),
+           pzetamiss, pzetavis, deltaR(eta1,phi1,eta2,phi2) )
+  
+
+def checkparity(nevts):
+  """Compare kernels for floats and arrays to ROOT."""
+  names   = ['m_vis','pt_ll','y_1','met','metphi','mt_1','pzetamiss','pzetavis','dR_ll']
+  values  = getvalues(nevts)
+  arrays  = kernel(*values)
+  maxdiff = np.zeros(len(names))
+  maxdiff_arr = np.zeros(len(names))
+  for i, args in enumerate(zip(*values)):
+    args  = [float(x) for x in args]
+    ref   = root(*args)
+    new   = kernel(*args)
+    for j, (x, y) in enumerate(zip(ref,new)):
+      maxdiff[j]     = max(maxdiff[j],abs(x-y)/max(1.,abs(x)))
+      maxdiff_arr[j] = max(maxdiff_arr[j],abs(x-arrays[j][i])/max(1.,abs(x)))
+  TAB = LOG.table("%-12s %16.3g %16.3g")
+  TAB.printheader("variable","max. rel. diff.","(arrays)")
+  for name, diff, diff_arr in zip(names,maxdiff,maxdiff_arr):
+    TAB.printrow(name,diff,diff_arr)
+  LOG.insist(max(maxdiff)<1e-9 and max(maxdiff_arr)<1e-9,"Kernels differ from ROOT!")
+  
+
+def benchmark(nevts):
+  """Compare speed of ROOT vector classes with the kernels for floats and arrays."""
+  values = getvalues(nevts)
+  floats = [[float(x) for x in args] for args in zip(*values)]
+  TAB    = LOG.table("%-16s %10.3f %14.3f")
+  TAB.printheader("method","time [s]","time/call [us]")
+  for name, func in [
+    ('ROOT',     lambda: [root(*args) for args in floats]),
+    ('kernel',   lambda: [kernel(*args) for args in floats]),
+    ('arrays',   lambda: kernel(*values)),
+  ]:
+    start = time.time()
+    func()
+    dt = time.time()-start
+    TAB.printrow(name,dt,1e6*dt/nevts)
+  
+
+def main(args):
+  LOG.header("Parity")
+  checkparity(args.nevts//10)
+  LOG.header("Benchmark")
+  benchmark(args.nevts)
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check parity of the kinematics kernels with ROOT, and benchmark them."""
+  parser = ArgumentParser(prog="testKinematics",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   dest='nevts', type=int, default=100000,
+                                         help="number of events for benchmark, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
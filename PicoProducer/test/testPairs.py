@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# Description: Check that bestpair chooses the same pair as max() over LeptonPair objects,
+#              and benchmark them on high-multiplicity events
+#   test/testPairs.py -n 10000 -m 8
+import time
+import numpy as np
+from math import sqrt, pi
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.utils import LeptonPair, LeptonTauPair, DiTauPair, bestpair
+LOG = Logger('testPairs')
+
+
+class Candidate:
+  """Simple object with the same DeltaR as nanoAOD-tools' Object."""
+  def __init__(self, pt, eta, phi, iso):
+    self.pt  = pt
+    self.eta = eta
+    self.phi = phi
+    self.iso = iso
+  def DeltaR(self, other):
+    deta = abs(other.eta - self.eta)
+    dphi = abs(other.phi - self.phi)
+    while dphi>pi:
+      dphi = abs(dphi - 2*pi)
+    return sqrt(dphi**2+deta**2)
+  
+
+def getevents(nevts, nmax):
+  """Create random events with up to nmax leptons and taus. Round pt and isolation to get ties."""
+  np.random.seed(1)
+  def getobjs():
+    n = np.random.randint(1,nmax+1)
+    return [Candidate(float(round(pt)),float(eta),float(phi),float(round(iso,1))) for pt, eta, phi, iso in
+            zip(np.random.uniform(20,40,n),np.random.uniform(-2.5,2.5,n),np.random.uniform(-pi,pi,n),np.random.uniform(0,1,n))]
+  return [(getobjs(),getobjs()) for i in xrange(nevts)]
+  
+
+def maxpair(leps, taus, ordering):
+  """Reference: create pair objects and choose the best with max(), like the original modules."""
+  pairs = [ ]
+  if taus is None:
+    for i, tau1 in enumerate(leps,1):
+      for tau2 in leps[i:]:
+        if tau1.DeltaR(tau2)<0.5: continue
+        pairs.append(ordering(tau1,tau1.iso,tau2,tau2.iso))
+  else:
+    for lep in leps:
+      for tau in taus:
+        if tau.DeltaR(lep)<0.5: continue
+        pairs.append(ordering(lep,lep.iso,tau,tau.iso))
+  if len(pairs)==0:
+    return None
+  return tuple(max(pairs).pair)
+  
+
+def main(args):
+  events = getevents(args.nevts,args.nmax)
+  TAB    = LOG.table("%-14s %-10s %10.3f %14.2f")
+  TAB.printheader("ordering","method","time [s]","time/evt [us]")
+  for ordering in [LeptonPair,LeptonTauPair,DiTauPair]:
+    ditau = ordering==DiTauPair
+    results = { }
+    for name, method in [
+      ('max',      lambda l, t: maxpair(l,None if ditau else t,ordering)),
+      ('bestpair', lambda l, t: bestpair(l,[o.iso for o in l],None if ditau else t,None if ditau else [o.iso for o in t],ordering)),
+    ]:
+      start = time.time()
+      results[name] = [method(leps,taus) for leps, taus in events]
+      dt = time.time()-start
+      TAB.printrow(ordering.__name__,name,dt,1e6*dt/args.nevts)
+    ndiff = sum(p1!=p2 for p1, p2 in zip(results['max'],results['bestpair']))
+    LOG.insist(ndiff==0,"%s: Chosen pairs differ in %d/%d events!"%(ordering.__name__,ndiff,args.nevts))
+  print ">>> Chosen pairs are identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check that bestpair chooses the same pair as max() over LeptonPair objects, and benchmark them."""
+  parser = ArgumentParser(prog="testPairs",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   dest='nevts', type=int, default=10000,
+                                         help="number of events, default=%(default)d" )
+  parser.add_argument('-m', '--nmax',    dest='nmax', type=int, default=8,
+                                         help="maximum number of leptons and taus per event, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
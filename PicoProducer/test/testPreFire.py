@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# Description: Check the one-pass prefire weights of PreFireTool against a verbatim copy of the original loop
+#              over jets, with TH2::FindBin on the original maps, and benchmark them
+#   test/testPreFire.py nano.root -y 2017 -n 10000
+import time
+from math import sqrt
+import numpy as np
+from ROOT import TFile
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.analysis.columnar import EventBlock
+from TauFW.PicoProducer.corrections.PreFireTool import PreFireTool
+LOG = Logger('testPreFire')
+
+
+def getProbs_root(hist, eta, pt, maxpt):
+  """Reference: prefire probability (down, nominal, up) with TH2::FindBin on the original map,
+  like the original PreFireTool.getPrefireProbability."""
+  bin      = hist.FindBin(eta,min(pt,maxpt-0.01))
+  prob     = hist.GetBinContent(bin)
+  stat     = hist.GetBinError(bin) # bin statistical uncertainty
+  syst     = 0.2*prob # 20% of prefire rate
+  probDown = max(prob-sqrt(stat*stat+syst*syst),0.0)
+  probUp   = min(prob+sqrt(stat*stat+syst*syst),1.0)
+  return probDown, prob, probUp
+  
+
+class BaselinePreFireTool():
+    """Reference: verbatim copy of the original PreFireTool.getWeight, on the original maps of a PreFireTool.
+    Note that the default electron probability of 1 zeroes the weight for photons in acceptance
+    without a matched electron in acceptance (see haseledefault)."""
+    def __init__(self, tool):
+        self.jetmap       = tool.jetmap.hist
+        self.photonmap    = tool.photonmap.hist
+        for attr in ['JetMinPt','JetMaxPt','JetMinEta','JetMaxEta','PhotonMinPt','PhotonMaxPt','PhotonMinEta','PhotonMaxEta']:
+          setattr(self,attr,getattr(tool,attr))
+  
+
+    def getWeight(self, event):
+        """Get pre-fire weight"""
+        
+        # WEIGHTS
+        weightDown = 1.
+        weightNom  = 1.
+        weightUp   = 1.
+        
+        # LOOP over JETS
+        jets = Collection(event,'Jet')
+        for jid, jet in enumerate(jets): # First loop over all jets
+          jetpt = jet.pt
+          ###if self.UseEMpT:
+          ###  jetpt *= (jet.chEmEF + jet.neEmEF)
+          
+          if jetpt>=self.JetMinPt and self.JetMinEta<=abs(jet.eta)<=self.JetMaxEta:
+            pfProbDown, pfProbNom, pfProbUp = self.getPrefireProbability(self.jetmap,jet.eta,jetpt,self.JetMaxPt)
+            jetWeightDown = 1.-pfProbDown
+            jetWeightNom  = 1.-pfProbNom
+            jetWeightUp   = 1.-pfProbUp
+          else:
+            jetWeightDown = 1.0
+            jetWeightNom  = 1.0
+            jetWeightUp   = 1.0
+          
+          # The higher prefire-probablity between the jet and the lower-pt photon(s)/elecron(s) from the jet is chosen
+          egWeightDown, egWeightNom, egWeightUp = self.getEGPrefireWeight(event,jid)
+          weightDown *= min(jetWeightDown,egWeightDown)
+          weightNom  *= min(jetWeightNom, egWeightNom)
+          weightUp   *= min(jetWeightUp,  egWeightUp)
+        
+        # Then loop over all photons/electrons not associated to jets
+        egWeightDown, egWeightNom, egWeightUp = self.getEGPrefireWeight(event,-1)
+        weightDown *= egWeightDown
+        weightNom  *= egWeightNom
+        weightUp   *= egWeightUp
+        
+        return weightDown, weightNom, weightUp
+    
+    
+    def getEGPrefireWeight(self, event, jid):
+        egWeightDown = 1.0
+        egWeightNom  = 1.0
+        egWeightUp   = 1.0
+        photonInJet  = [ ]
+        
+        # LOOP over PHOTONS
+        for pid, pho in enumerate(Collection(event,'Photon')):
+          if pho.jetIdx==jid and pho.pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(pho.eta)<=self.PhotonMaxEta:
+            phoProbDown, phoProbNom, phoProbUp = self.getPrefireProbability(self.photonmap,pho.eta,pho.pt,self.PhotonMaxPt)
+            eleProbDown, eleProbNom, eleProbUp = 1., 1., 1.
+            if pho.electronIdx>-1: # What if the electron corresponding to the photon would return a different value?
+              if event.Electron_pt[pho.electronIdx]>=self.PhotonMinPt and self.PhotonMinEta<=abs(event.Electron_eta[pho.electronIdx])<=self.PhotonMaxEta:
+                eleProbDown, eleProbNom, eleProbUp = self.getPrefireProbability(self.photonmap,event.Electron_eta[pho.electronIdx],event.Electron_pt[pho.electronIdx],self.PhotonMaxPt)
+            
+            # Choose higher prefire-probablity between the photon and corresponding electron
+            egWeightDown *= 1.-max(phoProbDown,eleProbDown)
+            egWeightNom  *= 1.-max(phoProbNom, eleProbNom)
+            egWeightUp   *= 1.-max(phoProbUp,  eleProbUp)
+            photonInJet.append(pid)
+        
+        # LOOP over ELECTRONS
+        for ele in Collection(event,'Electron'):
+          if ele.jetIdx == jid and ele.photonIdx not in photonInJet and ele.pt>=self.PhotonMinPt and self.PhotonMinEta<=abs(ele.eta)<=self.PhotonMaxEta:
+            pfProbDown, pfProbNom, pfProbUp = self.getPrefireProbability(self.photonmap,ele.eta,ele.pt,self.PhotonMaxPt)
+            egWeightDown *= 1.-pfProbDown
+            egWeightNom  *= 1.-pfProbNom
+            egWeightUp   *= 1.-pfProbUp
+        
+        return egWeightDown, egWeightNom, egWeightUp
+    
+    
+    def getPrefireProbability(self, map, eta, pt, maxpt):
+      bin      = map.FindBin(eta,min(pt,maxpt-0.01))
+      prob     = map.GetBinContent(bin)
+      stat     = map.GetBinError(bin) # bin statistical uncertainty
+      syst     = 0.2*prob # 20% of prefire rate
+      probDown = max(prob-sqrt(stat*stat+syst*syst),0.0)
+      probUp   = min(prob+sqrt(stat*stat+syst*syst),1.0)
+      return probDown, prob, probUp
+  
+
+def haseledefault(tool, event):
+  """Return True if the baseline default electron probability of 1 applies to any photon in the event,
+  i.e. a photon in acceptance (associated to a jet, or to none) without a matched electron in acceptance."""
+  njets = event.nJet
+  for i in xrange(event.nPhoton):
+    pt, eta, jid = event.Photon_pt[i], event.Photon_eta[i], event.Photon_jetIdx[i]
+    if not (-1<=jid<njets and pt>=tool.PhotonMinPt and tool.PhotonMinEta<=abs(eta)<=tool.PhotonMaxEta):
+      continue
+    eid = event.Photon_electronIdx[i]
+    if eid>-1 and event.Electron_pt[eid]>=tool.PhotonMinPt and tool.PhotonMinEta<=abs(event.Electron_eta[eid])<=tool.PhotonMaxEta:
+      continue
+    return True
+  return False
+  
+
+def compare(name, weights, refweights, affected):
+  """Assert exact equality with the baseline weights for the events not affected by the electron default,
+  and report the number of affected events that differ."""
+  differ = (weights!=refweights).any(axis=1)
+  ndiff  = (differ & ~affected).sum()
+  if ndiff>0:
+    LOG.throw(AssertionError,"%s: Weights of %d events differ from baseline! Max. difference: %s"%(
+                             name,ndiff,abs(weights-refweights)[differ & ~affected].max()))
+  print ">>>   %s: weights are identical to baseline for %d/%d events without the electron default"%(name,(~affected).sum(),len(affected))
+  print ">>>   %s: %d/%d events with the electron default differ from baseline"%(name,(differ & affected).sum(),affected.sum())
+  
+
+def getedgevalues(axis):
+  """Values on, just below and just above every bin edge, and far in the under- and overflow."""
+  edges  = np.array([axis.GetBinLowEdge(i) for i in range(1,axis.GetNbins()+2)]+[axis.GetXmin(),axis.GetXmax()])
+  values = np.concatenate([edges,np.nextafter(edges,-np.inf),np.nextafter(edges,np.inf),
+                           [edges.min()-100.,edges.max()+100.,0.5*(edges.min()+edges.max())]])
+  return np.unique(values)
+  
+
+def checkmap(name, pmap):
+  """Compare PrefireMap lookups against TH2::FindBin on the original map at all bin edges,
+  including under- and overflow. Return the number of differences."""
+  hist   = pmap.hist
+  xvals  = getedgevalues(hist.GetXaxis())
+  yvals  = getedgevalues(hist.GetYaxis())
+  xgrid, ygrid = [a.ravel() for a in np.meshgrid(xvals,yvals)]
+  arrays = pmap.getProbsArray(xgrid,ygrid)
+  ndiff  = 0
+  for i, (x, y) in enumerate(zip(xgrid,ygrid)):
+    bin   = hist.FindBin(x,y)
+    probs = getProbs_root(hist,x,y,float('inf'))
+    if list(pmap.getProbs(x,y))!=list(probs) or list(arrays[i])!=list(probs):
+      LOG.verb("checkmap: %s differs for (%r,%r) in bin %d: %s, %s vs. %s"%(
+        name,x,y,bin,pmap.getProbs(x,y),arrays[i],probs),LOG.verbosity,1)
+      ndiff += 1
+  print ">>>   %-10s %d points at bin edges, %d differences"%(name,len(xgrid),ndiff)
+  return ndiff
+  
+
+def main(args):
+  tool  = PreFireTool(args.year)
+  file  = TFile.Open(args.infile)
+  tree  = InputTree(file.Get('Events'))
+  nevts = min(args.nevts,tree.GetEntries()) if args.nevts>0 else tree.GetEntries()
+  
+  LOG.header("Maps")
+  ndiff  = checkmap('jet',tool.jetmap)
+  ndiff += checkmap('photon',tool.photonmap)
+  LOG.insist(ndiff==0,"Prefire maps differ from TH2::FindBin in %d points!"%(ndiff))
+  
+  LOG.header("Event by event")
+  baseline = BaselinePreFireTool(tool)
+  weights  = { }
+  for name, method in [('baseline',lambda e: baseline.getWeight(e)),('one pass',tool.getWeight)]:
+    start = time.time()
+    weights[name] = np.array([method(Event(tree,i)) for i in xrange(nevts)])
+    dt = time.time()-start
+    print ">>>   %-10s %d events in %.2f seconds (%.1f us per event)"%(name,nevts,dt,1e6*dt/nevts)
+  affected = np.array([haseledefault(tool,Event(tree,i)) for i in xrange(nevts)],dtype=bool)
+  compare('one pass',weights['one pass'],weights['baseline'],affected)
+  
+  LOG.header("Block")
+  start = time.time()
+  block = EventBlock(tree,0,nevts)
+  weights['block'] = np.array(tool.getWeightArray(block)).T
+  dt = time.time()-start
+  print ">>>   %-10s %d events in %.2f seconds (%.1f us per event)"%('block',nevts,dt,1e6*dt/nevts)
+  LOG.insist((weights['one pass']==weights['block']).all(),"Block weights differ from one pass! Max. difference: %s"%(
+                                                            abs(weights['one pass']-weights['block']).max()))
+  compare('block',weights['block'],weights['baseline'],affected)
+  file.Close()
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check the one-pass prefire weights against the original loop over jets, and benchmark them."""
+  parser = ArgumentParser(prog="testPreFire",description=description,epilog="Good luck!")
+  parser.add_argument('infile',                  help="nanoAOD file" )
+  parser.add_argument('-y', '--year',    dest='year', type=int, choices=[2016,2017], default=2017,
+                                         help="year, default=%(default)d" )
+  parser.add_argument('-n', '--nevts',   dest='nevts', type=int, default=10000,
+                                         help="maximum number of events, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+# Description: Check parity of the NumPy lookup tables of ScaleFactorTool with the ROOT histograms and graphs,
+#              and benchmark them
+#   test/testSFLookup.py -n 100000
+import time
+import numpy as np
+from array import array
+from ROOT import TH1D, TH2F, TGraph
+from TauFW.common.tools.log import Logger
+from TauFW.PicoProducer.corrections.ScaleFactorTool import BinnedLookup, GraphLookup
+LOG = Logger('testSFLookup')
+
+
+def getSF_root(hist, x, y):
+  """Reference: FindBin/GetBinContent via PyROOT, like the original ScaleFactor.getSF."""
+  xbin = hist.GetXaxis().FindBin(x)
+  ybin = hist.GetYaxis().FindBin(y)
+  if xbin==0: xbin = 1
+  elif xbin>hist.GetXaxis().GetNbins(): xbin -= 1
+  if ybin==0: ybin = 1
+  elif ybin>hist.GetYaxis().GetNbins(): ybin -= 1
+  return hist.GetBinContent(xbin,ybin)
+  
+
+def gethists():
+  """Create histograms with fixed and variable binning."""
+  etabins = [-2.5,-2.1,-1.6,-1.2,-0.9,-0.3,0.0,0.3,0.9,1.2,1.6,2.1,2.5]
+  ptbins  = [10.,20.,25.,30.,40.,50.,60.,120.,200.,500.]
+  hist1   = TH2F('hist1',"variable binning",len(etabins)-1,array('d',etabins),len(ptbins)-1,array('d',ptbins))
+  hist2   = TH2F('hist2',"fixed binning",20,0,2.4,30,20,200)
+  hist3   = TH1D('hist3',"1D",50,20,200)
+  np.random.seed(1)
+  for hist in [hist1,hist2,hist3]:
+    hist.SetDirectory(0)
+    for ibin in range(0,hist.GetNcells()):
+      hist.SetBinContent(ibin,np.random.uniform(0.8,1.2))
+      hist.SetBinError(ibin,np.random.uniform(0.0,0.1))
+  return [hist1,hist2,hist3]
+  
+
+def getgraph():
+  """Create graph with unsorted points."""
+  xvals = [40.,20.,25.,30.,60.,100.,35.,200.]
+  yvals = [0.9,0.2,0.5,0.7,0.95,0.97,0.8,0.99]
+  return TGraph(len(xvals),array('d',xvals),array('d',yvals))
+  
+
+def checkparity(nevts):
+  """Compare lookup tables to ROOT for random values, bin edges, under- and overflow."""
+  hist1, hist2, hist3 = gethists()
+  graph = getgraph()
+  for hist in [hist1,hist2]:
+    table  = BinnedLookup.fromhist(hist,errors=True)
+    xaxis, yaxis = hist.GetXaxis(), hist.GetYaxis()
+    xvals  = np.random.uniform(xaxis.GetXmin()-1,xaxis.GetXmax()+1,nevts)
+    yvals  = np.random.uniform(yaxis.GetXmin()-10,yaxis.GetXmax()+10,nevts)
+    xedges = [xaxis.GetBinLowEdge(i) for i in range(1,xaxis.GetNbins()+2)]
+    yedges = [yaxis.GetBinLowEdge(i) for i in range(1,yaxis.GetNbins()+2)]
+    if xaxis.IsVariableBinSize(): # with fixed binning, FindBin may round differently at the edges
+      xvals = np.concatenate([xvals,np.repeat(xedges,len(yedges))])
+      yvals = np.concatenate([yvals,np.tile(yedges,len(xedges))])
+    sfs    = table.lookuparray(xvals,yvals)
+    for i, (x, y) in enumerate(zip(xvals,yvals)):
+      sf_root = getSF_root(hist,x,y)
+      LOG.insist(table.lookup(x,y)==sf_root,"%s: lookup(%s,%s)=%s differs from ROOT %s"%(hist.GetName(),x,y,table.lookup(x,y),sf_root))
+      LOG.insist(sfs[i]==sf_root,"%s: lookuparray(%s,%s)=%s differs from ROOT %s"%(hist.GetName(),x,y,sfs[i],sf_root))
+    print ">>>   %s: %d values identical"%(hist.GetName(),len(xvals))
+  table = BinnedLookup.fromhist(hist3,errors=True)
+  xvals = np.random.uniform(0,250,nevts)
+  errs  = table.lookuperrarray(xvals)
+  for x, err in zip(xvals,errs):
+    ibin = min(hist3.GetNbinsX(),max(1,hist3.FindFixBin(x)))
+    LOG.insist(table.lookup(x)==hist3.GetBinContent(ibin),"%s: lookup(%s) differs from ROOT"%(hist3.GetName(),x))
+    LOG.insist(err==table.lookuperr(x)==hist3.GetBinError(ibin),"%s: lookuperr(%s) differs from ROOT"%(hist3.GetName(),x))
+  print ">>>   %s: %d values identical"%(hist3.GetName(),len(xvals))
+  table = GraphLookup.fromgraph(graph)
+  xvals = np.concatenate([np.random.uniform(0,300,nevts),[graph.GetX()[i] for i in range(graph.GetN())]])
+  yvals = table.evalarray(xvals)
+  for x, y in zip(xvals,yvals):
+    y_root = graph.Eval(x)
+    LOG.insist(table.eval(x)==y_root,"graph: eval(%s)=%s differs from ROOT %s"%(x,table.eval(x),y_root))
+    LOG.insist(y==y_root,"graph: evalarray(%s)=%s differs from ROOT %s"%(x,y,y_root))
+  print ">>>   graph: %d values identical"%(len(xvals))
+  
+
+def benchmark(nevts):
+  """Compare speed of ROOT and NumPy lookups."""
+  hist  = gethists()[0]
+  graph = getgraph()
+  table = BinnedLookup.fromhist(hist)
+  gtab  = GraphLookup.fromgraph(graph)
+  etas  = np.random.uniform(-3,3,nevts)
+  pts   = np.random.uniform(0,600,nevts)
+  etas_, pts_ = etas.tolist(), pts.tolist()
+  TAB   = LOG.table("%-24s %10.3f %14.3f")
+  TAB.printheader("method","time [s]","time/call [us]")
+  for name, func in [
+    ('ROOT TH2',      lambda: [getSF_root(hist,x,y) for x, y in zip(etas_,pts_)]),
+    ('lookup',        lambda: [table.lookup(x,y) for x, y in zip(etas_,pts_)]),
+    ('lookuparray',   lambda: table.lookuparray(etas,pts)),
+    ('ROOT TGraph',   lambda: [graph.Eval(x) for x in pts_]),
+    ('GraphLookup',   lambda: [gtab.eval(x) for x in pts_]),
+    ('evalarray',     lambda: gtab.evalarray(pts)),
+  ]:
+    start = time.time()
+    func()
+    dt = time.time()-start
+    TAB.printrow(name,dt,1e6*dt/nevts)
+  
+
+def main(args):
+  LOG.header("Parity")
+  checkparity(args.nevts//10)
+  LOG.header("Benchmark")
+  benchmark(args.nevts)
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Check parity of the NumPy lookup tables with ROOT, and benchmark them."""
+  parser = ArgumentParser(prog="testSFLookup",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   dest='nevts', type=int, default=100000,
+                                         help="number of lookups for benchmark, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
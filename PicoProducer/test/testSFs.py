@@ -34,6 +34,10 @@ print ">>>   imported BTagTool classes after %.1f seconds"%(time.time()-start1)
 start1 = time.time()
 from TauFW.PicoProducer.corrections.PileupTool import *
 print ">>>   imported PileupTool classes after %.1f seconds"%(time.time()-start1)
+
+start1 = time.time()
+from TauFW.PicoProducer.corrections.EmbeddingSFs import *
+print ">>>   imported EmbeddingSFs classes after %.1f seconds"%(time.time()-start1)
 print ">>>   imported everything after %.1f seconds"%(time.time()-start0)
 print ">>> "
 
@@ -184,7 +188,7 @@ def btagSFs(tagger='CSVv2'):
   print ">>> "
   start1 = time.time()
   print ">>> initializing BTagWeightTool(%r) object..."%tagger
-  btagSFs = BTagWeightTool(tagger)
+  btagSFs = BTagWeightTool(tagger,loadsys=True,validate=True)
   print ">>>   initialized in %.1f seconds"%(time.time()-start1)
   
   # GET SFs
@@ -203,17 +207,41 @@ def pileupSFs(era='UL2017'):
   print ">>> "
   start1 = time.time()
   print ">>> initializing PileupTool(%r) object..."%era
-  puTool = PileupWeightTool(era)
+  puTool = PileupWeightTool(era,updown=True)
   print ">>>   initialized in %.1f seconds"%(time.time()-start1)
   
   ## GET SFs
   start2 = time.time()
-  TAB = LOG.table("%9.1f %15.3f")
-  TAB.printheader("npu","pileup weight")
+  TAB = LOG.table("%9.1f %15.3f %15.3f %15.3f %15.3f")
+  TAB.printheader("npu","pileup weight","weight (ROOT)","up","down")
   npus = [0,1,2,5,10,15,18,20,24,25,26,28,30,35,40,50,60,70,80,100]
   for npu in npus:
-    TAB.printrow(npu,puTool.getWeight(npu))
+    data = puTool.datahist.GetBinContent(puTool.datahist.GetXaxis().FindBin(npu))
+    mc   = puTool.mchist.GetBinContent(puTool.mchist.GetXaxis().FindBin(npu))
+    TAB.printrow(npu,puTool.getWeight(npu),min(5.,data/mc) if mc>0 else 1.,puTool.getWeight(npu,unc='Up'),puTool.getWeight(npu,unc='Down'))
   print ">>>   got %d SFs in %.3f seconds"%(len(npus),time.time()-start2)
+  LOG.insist(list(puTool.getWeightArray(npus))==[puTool.getWeight(n) for n in npus],"getWeightArray differs from getWeight!")
+  
+
+def embeddingSFs(era='2018'):
+  LOG.header("embeddingSFs")
+  
+  # EMBEDDING SF TOOLS
+  print ">>> "
+  start1 = time.time()
+  print ">>> initializing EmbeddingMuonSFs(%r) object with RooFit..."%era
+  sftool_roo = EmbeddingMuonSFs(era,tabulate=False)
+  print ">>>   initialized in %.1f seconds"%(time.time()-start1)
+  start1 = time.time()
+  print ">>> initializing EmbeddingMuonSFs(%r) object with tables, checking random points..."%era
+  sftool_tab = EmbeddingMuonSFs(era,strict=True,verb=1)
+  print ">>>   initialized in %.1f seconds"%(time.time()-start1)
+  
+  # GET SFs
+  printtable('trigger (RooFit)',sftool_roo.getTriggerSF)
+  printtable('trigger (table)',sftool_tab.getTriggerSF)
+  printtable('id (RooFit)',sftool_roo.getIdSF)
+  printtable('id (table)',sftool_tab.getIdSF)
   
 
 if __name__ == "__main__":
@@ -228,6 +256,7 @@ if __name__ == "__main__":
   btagSFs('DeepCSV')
   pileupSFs('2017')
   pileupSFs('UL2017')
+  embeddingSFs('2018')
   print ">>> "
   print ">>> done after %.1f seconds"%(time.time()-start0)
   print
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# Description: Benchmark filling the pico tree event by event vs. buffered in blocks vs. from columns
+#   test/testTreeProducer.py -n 100000
+import time
+import numpy as np
+from ROOT import TFile
+from TauFW.common.tools.log import Logger
+from TauFW.common.tools.file import rmfile
+from TauFW.PicoProducer.analysis.TreeProducerMuTau import TreeProducerMuTau
+LOG = Logger('testTreeProducer')
+
+
+class DummyModule:
+  """Dummy module with the attributes the TreeProducer needs."""
+  def __init__(self, buffersize=0):
+    self.isdata     = False
+    self.ismc       = True
+    self.isembed    = False
+    self.dotight    = False
+    self.buffersize = buffersize
+  
+
+def fillTree(fname,nevts,buffersize=0,ncuts=5,blocksize=0):
+  """Fill tree and cutflow with random values, like an analysis module.
+  If blocksize>0, fill the trees from columns per block of events, like in columnar mode."""
+  out = TreeProducerMuTau(fname,DummyModule(buffersize))
+  for i in range(ncuts):
+    out.cutflow.addcut('cut%d'%i,"cut %d"%i)
+  names = [b.GetName() for b in out.tree.GetListOfBranches()]
+  out.addTree('tree_var',"systematic variation")
+  np.random.seed(1)
+  values = np.random.uniform(0,100,(nevts,len(names)))
+  start = time.time()
+  if blocksize>0: # columnar mode
+    for first in xrange(0,nevts,blocksize):
+      block   = values[first:first+blocksize]
+      for row in block:
+        out.cutflow.fill('cut0')
+        out.cutflow.fill('cut1',row[0]-50.)
+      columns = { n: block[:,i] for i, n in enumerate(names) }
+      out.fillColumns(columns,len(block))
+      even    = np.arange(first,first+len(block))%2==0 # fill variation for some events
+      columns = { n: block[even,i] for i, n in enumerate(names) }
+      columns[names[0]] = 2*block[even,0]
+      out.setTree('tree_var')
+      out.fillColumns(columns,even.sum())
+      out.setTree('tree')
+  else: # event by event
+    for ievt in xrange(nevts):
+      row = values[ievt]
+      out.cutflow.fill('cut0')
+      out.cutflow.fill('cut1',row[0]-50.)
+      for i, name in enumerate(names):
+        getattr(out,name)[0] = row[i]
+      out.fill()
+      if ievt%2==0: # fill variation for some events
+        out.setTree('tree_var')
+        getattr(out,names[0])[0] = 2*row[0]
+        out.fill()
+        out.setTree('tree')
+  out.endJob()
+  dt = time.time()-start
+  print ">>>   filled %d events with %d branches in %.2f seconds (%.1f us per event)"%(nevts,len(names),dt,1e6*dt/nevts)
+  return dt
+  
+
+def compareTrees(fname1,fname2):
+  """Compare content of trees and cutflows."""
+  file1, file2 = TFile.Open(fname1), TFile.Open(fname2)
+  for treename in ['tree','tree_var']:
+    tree1, tree2 = file1.Get(treename), file2.Get(treename)
+    LOG.insist(tree1.GetEntries()==tree2.GetEntries(),"Number of entries in %r differ: %s vs. %s"%(treename,tree1.GetEntries(),tree2.GetEntries()))
+    for branch in tree1.GetListOfBranches():
+      name = branch.GetName()
+      for ievt in xrange(tree1.GetEntries()):
+        tree1.GetEntry(ievt); tree2.GetEntry(ievt)
+        LOG.insist(getattr(tree1,name)==getattr(tree2,name),"Branch %r of %r differs in entry %d!"%(name,treename,ievt))
+  hist1, hist2 = file1.Get('cutflow'), file2.Get('cutflow')
+  for bin in xrange(0,hist1.GetNbinsX()+2):
+    LOG.insist(hist1.GetBinContent(bin)==hist2.GetBinContent(bin),"Cutflow bin %d differs!"%(bin))
+    LOG.insist(hist1.GetBinError(bin)==hist2.GetBinError(bin),"Cutflow bin error %d differs!"%(bin))
+  LOG.insist(hist1.GetEntries()==hist2.GetEntries(),"Cutflow entries differ!")
+  print ">>>   trees and cutflows are identical"
+  file1.Close(); file2.Close()
+  
+
+def main(args):
+  nevts   = args.nevts
+  fname1  = "testTreeProducer_fill.root"
+  fname2  = "testTreeProducer_buffer.root"
+  fname3  = "testTreeProducer_columns.root"
+  LOG.header("Event by event")
+  dt1 = fillTree(fname1,nevts)
+  LOG.header("Buffered (%d events per block)"%(args.buffer))
+  dt2 = fillTree(fname2,nevts,buffersize=args.buffer)
+  print ">>>   saved %.1f us per event (%.2fx faster)"%(1e6*(dt1-dt2)/nevts,dt1/dt2 if dt2>0 else 0)
+  LOG.header("Columns (%d events per block)"%(args.buffer))
+  dt3 = fillTree(fname3,nevts,buffersize=args.buffer,blocksize=args.buffer)
+  print ">>>   saved %.1f us per event (%.2fx faster)"%(1e6*(dt1-dt3)/nevts,dt1/dt3 if dt3>0 else 0)
+  LOG.header("Compare")
+  compareTrees(fname1,fname2)
+  compareTrees(fname1,fname3)
+  rmfile([fname1,fname2,fname3])
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Benchmark filling the pico tree event by event vs. buffered in blocks vs. from columns."""
+  parser = ArgumentParser(prog="testTreeProducer",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   dest='nevts', type=int, default=20000,
+                                         help="number of events to fill, default=%(default)d" )
+  parser.add_argument('-b', '--buffer',  dest='buffer', type=int, default=5000,
+                                         help="number of events per block, default=%(default)d" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print "\n>>> Done."
+  
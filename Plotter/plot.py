@@ -4,9 +4,11 @@
 #   ./plot.py -c mutau -y 2018
 from config.samples import *
 from TauFW.Plotter.plot.utils import LOG as PLOG
+from TauFW.Plotter.sample.HistCache import sethistcache
+from TauFW.Plotter.sample.ColumnCache import setcolumncache
 
 
-def plot(sampleset,channel,parallel=True,tag="",outdir="plots",era="",pdf=False):
+def plot(sampleset,channel,parallel=True,ncores=None,tag="",outdir="plots",era="",pdf=False):
   """Test plotting of SampleSet class for data/MC comparison."""
   LOG.header("plot")
   
@@ -49,7 +51,7 @@ def plot(sampleset,channel,parallel=True,tag="",outdir="plots",era="",pdf=False)
   outdir   = ensuredir(repkey(outdir,CHANNEL=channel,ERA=era))
   exts     = ['png','pdf'] if pdf else ['png'] # extensions
   for selection in selections:
-    stacks = sampleset.getstack(variables,selection,method='QCD_OSSS',parallel=parallel)
+    stacks = sampleset.getstack(variables,selection,method='QCD_OSSS',parallel=parallel,ncores=ncores)
     fname  = "%s/$VAR_%s-%s-%s$TAG"%(outdir,channel,selection.filename,era)
     text   = "%s: %s"%(channel.replace('mu',"#mu").replace('tau',"#tau_{h}"),selection.title)
     for stack, variable in stacks.iteritems():
@@ -65,15 +67,24 @@ def main(args):
   channels = args.channels
   eras     = args.eras
   parallel = args.parallel
+  ncores   = args.ncores
+  backend  = args.backend
   pdf      = args.pdf
   outdir   = "plots/$ERA"
   tag      = ""
   fname    = "$PICODIR/$SAMPLE_$CHANNEL$TAG.root"
+  if args.cachedir: # reuse histograms if input files, selections and binning did not change
+    sethistcache(args.cachedir,maxsize=args.cachesize,verb=args.verbosity)
+  if backend=='RDataFrame':
+    LOG.warning("The RDataFrame backend is experimental: its histograms have not been validated against MultiDraw on real pico files yet.")
+  if args.columndir: # read branches from memory-mapped columns instead of the trees
+    LOG.warning("The column cache is experimental: its histograms have not been validated against MultiDraw on real pico files yet.")
+    setcolumncache(args.columndir,maxsize=args.columnsize,verb=args.verbosity)
   for era in eras:
     for channel in channels:
       setera(era) # set era for plot style and lumi-xsec normalization
-      sampleset = getsampleset(channel,era,fname=fname)
-      plot(sampleset,channel,parallel=parallel,tag="",outdir=outdir,era=era,pdf=pdf)
+      sampleset = getsampleset(channel,era,fname=fname,backend=backend)
+      plot(sampleset,channel,parallel=parallel,ncores=ncores,tag="",outdir=outdir,era=era,pdf=pdf)
   
 
 if __name__ == "__main__":
@@ -88,8 +99,22 @@ if __name__ == "__main__":
                                          help="set channel" )
   parser.add_argument('-s', '--serial',  dest='parallel', action='store_false',
                                          help="run Tree::MultiDraw serial instead of in parallel" )
+  parser.add_argument('-j', '--ncores',  dest='ncores', type=int, default=None, action='store',
+                                         help="number of processes to run in parallel, default: number of CPUs" )
+  parser.add_argument('-b', '--backend', dest='backend', choices=['MultiDraw','RDataFrame'], default='MultiDraw', action='store',
+                                         help="fill histograms with MultiDraw or RDataFrame (experimental), default=%(default)r" )
   parser.add_argument('-p', '--pdf',     dest='pdf', action='store_true',
                                          help="create pdf version of each plot" )
+  parser.add_argument('--cache',         dest='cachedir', type=str, default="cache/hists", action='store',
+                                         help="directory to cache histograms, default=%(default)r" )
+  parser.add_argument('--no-cache',      dest='cachedir', action='store_const', const=None,
+                                         help="do not cache histograms" )
+  parser.add_argument('--cache-size',    dest='cachesize', type=float, default=1000, action='store',
+                                         help="maximum size of histogram cache in MB, default=%(default)s" )
+  parser.add_argument('--columns',       dest='columndir', type=str, default=None, action='store',
+                                         help="directory to cache branches as memory-mapped columns for fast replotting (experimental)" )
+  parser.add_argument('--columns-size',  dest='columnsize', type=float, default=10000, action='store',
+                                         help="maximum size of column cache in MB, default=%(default)s" )
   parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
                                          help="set verbosity" )
   args = parser.parse_args()
@@ -3,7 +3,7 @@
 # Description: Data-driven method to estimate QCD from SS region.
 import os, re
 from TauFW.Plotter.plot.string import invertcharge
-from TauFW.Plotter.sample.SampleSet import LOG, SampleSet, Variable, deletehist, getcolor, makehistname
+from TauFW.Plotter.sample.SampleSet import LOG, SampleSet, Variable, Selection, deletehist, getcolor, makehistname
 #from ctypes import c_double
 #print ">>> Loading %s"%(__file__)
 #gROOT.Macro(modulepath+'/QCD/QCD.C+')
@@ -11,14 +11,15 @@ from TauFW.Plotter.sample.SampleSet import LOG, SampleSet, Variable, deletehist,
 
 def QCD_OSSS(self, variables, selection, **kwargs):
   """Substract MC from data with same sign (SS) selection of a lepton - tau pair
-     and return a histogram of the difference."""
+     and return a histogram of the difference.
+     For a list of selections, return a list of histograms for each selection."""
   verbosity      = LOG.getverbosity(kwargs)
   if verbosity>=2:
     LOG.header("Estimating QCD for variables %s"%(', '.join(v.filename for v in variables)))
     #LOG.verbose("\n>>> estimating QCD for variable %s"%(self.var),verbosity,level=2)
-  cuts_OS        = selection.selection
-  cuts_SS        = invertcharge(cuts_OS,to='SS')
-  isjetcat       = re.search(r"(nc?btag|n[cf]?jets)",cuts_OS)
+  ismulti        = isinstance(selection,list) # several selections
+  selections     = selection if ismulti else [selection]
+  cuts_SS        = [invertcharge(s.selection,to='SS') for s in selections]
   #relax          = 'emu' in self.channel or isjetcat
   samples        = self.samples
   name           = kwargs.get('name',            'QCD'          )
@@ -35,14 +36,19 @@ def QCD_OSSS(self, variables, selection, **kwargs):
   #relax          = kwargs.get('relax',           relax          ) #and not vetoRelax
   #file           = kwargs.get('saveto',          None           )
   parallel       = kwargs.get('parallel',        False          )
+  ncores         = kwargs.get('ncores',          None           )
   
   # SCALE
-  if "q_1*q_2>0" in cuts_OS.replace(' ',''):
-    scale = 1.0
-  elif not scale:
-    scale = 2.0 if "emu" in self.channel else 1.10
-  scale          = scale*(1.0+shift) # OS/SS scale & systematic variation
-  LOG.verbose("  QCD: scale=%s, shift=%s"%(scale,shift),verbosity,level=2)
+  scales = [ ]
+  for selection in selections:
+    if "q_1*q_2>0" in selection.selection.replace(' ',''):
+      scale_ = 1.0
+    elif not scale:
+      scale_ = 2.0 if "emu" in self.channel else 1.10
+    else:
+      scale_ = scale
+    scales.append(scale_*(1.0+shift)) # OS/SS scale & systematic variation
+  LOG.verbose("  QCD: scale=%s, shift=%s"%(scales,shift),verbosity,level=2)
   
   # CUTS: relax cuts for QCD_SS_SB
   # https://indico.cern.ch/event/566854/contributions/2367198/attachments/1368758/2074844/QCDStudy_20161109_HTTMeeting.pdf
@@ -73,10 +79,11 @@ def QCD_OSSS(self, variables, selection, **kwargs):
   
   # GET SS HISTOGRAMS
   qcdhists = [ ]
-  args  = variables, cuts_SS #Selection("same-sign",cuts_SS)
+  args  = variables, ([Selection(c) for c in cuts_SS] if ismulti else cuts_SS[0]) #Selection("same-sign",cuts_SS)
   hists = self.gethists(*args,weight=weight,dataweight=dataweight,replaceweight=replaceweight,tag=tag,task="Estimating QCD",
-                              signal=False,split=False,blind=False,parallel=parallel,verbosity=verbosity-1)
-  for variable, datahist, exphists in hists:
+                              signal=False,split=False,blind=False,parallel=parallel,ncores=ncores,verbosity=verbosity-1)
+  hists = [(v,d,e,scale) for histset, scale in zip(hists if ismulti else [hists],scales) for v, d, e in histset]
+  for variable, datahist, exphists, scale in hists:
     
     ## GET WJ
     #histWJ = None
@@ -143,6 +150,9 @@ def QCD_OSSS(self, variables, selection, **kwargs):
     # CLEAN
     deletehist([datahist,exphist]+exphists)
   
+  if ismulti: # split per selection
+    nvars = len(variables)
+    return [qcdhists[i:i+nvars] for i in range(0,len(qcdhists),nvars)]
   return qcdhists
   
 
@@ -13,17 +13,20 @@
 using std::cout;
 using std::endl;
 
-void MultiDraw( TTree* tree, TTreeFormula* commonFormula, TObjArray* formulae, TObjArray* weights, TObjArray* hists, UInt_t listLen ){
+void MultiDraw( TTree* tree, TTreeFormula* commonFormula, TObjArray* formulae, TObjArray* weights, TObjArray* hists, UInt_t listLen,
+                Long64_t firstEntry=0, Long64_t nEntries=-1 ){
     
     // Get an Element from an array
     #define EL(type, array, index) dynamic_cast<type*>(array->At(index))
     
     Long64_t i = 0, NumEvents = tree->GetEntries();
+    if(nEntries>=0 && firstEntry+nEntries<NumEvents) // only loop over entry range
+      NumEvents = firstEntry+nEntries;
     Double_t commonWeight = 0, treeWeight = tree->GetWeight();
     Int_t treeNumber = -1;
     
     //TStopwatch watch;
-    for(i=0; i<NumEvents; i++){
+    for(i=firstEntry; i<NumEvents; i++){
         
         // Display progress every 20000 events
         //if (i%20000==0){
@@ -66,16 +69,19 @@ void MultiDraw( TTree* tree, TTreeFormula* commonFormula, TObjArray* formulae, T
 
 
 
-void MultiDraw2D( TTree* tree, TTreeFormula* commonFormula, TObjArray* xformulae, TObjArray* yformulae, TObjArray* weights, TObjArray* hists, UInt_t listLen ){
+void MultiDraw2D( TTree* tree, TTreeFormula* commonFormula, TObjArray* xformulae, TObjArray* yformulae, TObjArray* weights, TObjArray* hists, UInt_t listLen,
+                  Long64_t firstEntry=0, Long64_t nEntries=-1 ){
     
     // Get an Element from an array
     #define EL(type, array, index) dynamic_cast<type*>(array->At(index))
     
     Long64_t i = 0, NumEvents = tree->GetEntries();
+    if(nEntries>=0 && firstEntry+nEntries<NumEvents) // only loop over entry range
+      NumEvents = firstEntry+nEntries;
     Double_t commonWeight = 0, treeWeight = tree->GetWeight();
     Int_t treeNumber = -1;
     
-    for(i=0; i<NumEvents; i++){
+    for(i=firstEntry; i<NumEvents; i++){
         
         if(treeNumber!=tree->GetTreeNumber()){
             treeWeight = tree->GetWeight();
@@ -6,6 +6,7 @@
 import os, re, traceback
 from ROOT import gROOT, gDirectory, TObject, TTree, TObjArray, TTreeFormula,\
                  TH1D, TH2D, TH2, SetOwnership, TTreeFormulaManager
+from TauFW.Plotter.plot.string import factorcuts
 moddir = os.path.dirname(os.path.realpath(__file__))
 macro  = os.path.join(moddir,"MultiDraw.cxx")
 def error(string): # raise RuntimeError in red color
@@ -49,13 +50,46 @@ def MultiDraw(self, varexps, selection='1', drawoption="", **kwargs):
     either be specified with just a string containing the formula to be 
     drawn, the histogram name and bin configuration. 
     Alternatively it can be a tuple, with  said string, and an additional
-    string specifying the weight to be applied to that histogram only."""
+    string specifying the weight to be applied to that histogram only.
+    To fill histograms for several selections in the same loop, pass a list of selections,
+    and a list of varexps (and hists) for each selection:
+      tree.MultiDraw( [ varexpsA, varexpsB ], [ "selectionA", "selectionB" ] )
+    The cuts and weights common to all selections are only evaluated once per entry.
+    The results are returned as a list of histograms for each selection.
+    Like TTree::Draw, the loop can be restricted to nentries entries, starting from firstentry."""
     
-    selection = kwargs.get('cut',       selection ) # selections cuts
-    verbosity = kwargs.get('verbosity', 0         ) # verbosity
-    poisson   = kwargs.get('poisson',   False     ) # kPoisson errors for data
-    sumw2     = kwargs.get('sumw2',     False     ) # sumw2 for MC
-    histlist  = kwargs.get('hists',     [ ]       ) # to not rely on gDirectory.Get(histname)
+    selection  = kwargs.get('cut',        selection ) # selections cuts
+    verbosity  = kwargs.get('verbosity',  0         ) # verbosity
+    poisson    = kwargs.get('poisson',    False     ) # kPoisson errors for data
+    sumw2      = kwargs.get('sumw2',      False     ) # sumw2 for MC
+    histlist   = kwargs.get('hists',      [ ]       ) # to not rely on gDirectory.Get(histname)
+    firstentry = kwargs.get('firstentry', 0         ) # first entry to process
+    nentries   = kwargs.get('nentries',   -1        ) # number of entries to process; -1 = all
+    
+    # SEVERAL SELECTIONS: factorize common cuts, and add the remaining cuts to the weight of each varexp
+    nvarexps  = None
+    if isinstance(selection,(list,tuple)):
+      if len(varexps)!=len(selection):
+        raise error("MultiDraw: Number of lists of varexps (%d) does not match number of selections (%d)!"%(len(varexps),len(selection)))
+      nvarexps   = [len(v) for v in varexps]
+      selection, rests = factorcuts(selection)
+      allvarexps = [ ]
+      for rest, varexps_ in zip(rests,varexps):
+        for varexp in varexps_:
+          weight = None
+          if isinstance(varexp,tuple):
+            varexp, weight = varexp
+          if rest and weight:
+            weight = "(%s)*(%s)"%(rest,weight)
+          elif rest:
+            weight = rest
+          allvarexps.append((varexp,weight))
+      varexps  = allvarexps
+      histlist = [h for hists_ in histlist for h in hists_]
+      if verbosity>=1:
+        print ">>> MultiDraw: common selection %r, remaining selections %s"%(selection,rests)
+      if not selection:
+        selection = '1'
     
     hists     = { }
     results, xformulae, yformulae, weights = [ ], [ ], [ ], [ ]
@@ -183,12 +217,14 @@ def MultiDraw(self, varexps, selection='1', drawoption="", **kwargs):
       print ">>> MultiDraw: xformulae=%s, yformulae=%s"%(xformulae,yformulae)
       print ">>> MultiDraw: weights=%s, results=%s"%(weights,results)
     if len(yformulae)==0:
-      _MultiDraw(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae))
+      _MultiDraw(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae),firstentry,nentries)
     elif len(xformulae)==len(yformulae):
-      _MultiDraw2D(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(yformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae))
+      _MultiDraw2D(self,commonFormula,makeTObjArray(xformulae),makeTObjArray(yformulae),makeTObjArray(weights),makeTObjArray(results),len(xformulae),firstentry,nentries)
     else:
       raise error("MultiDraw: Given a mix of arguments for 1D (%d) and 2D (%d) histograms!"%(len(xformulae),len(yformulae)))
     
+    if nvarexps: # split per selection
+      results = [results[sum(nvarexps[:i]):sum(nvarexps[:i+1])] for i in range(len(nvarexps))]
     return results
     
 TTree.MultiDraw = MultiDraw # add MultiDraw to TTree as a class method
@@ -3,8 +3,8 @@
 # Source: https://stackoverflow.com/questions/6893968/how-to-get-the-return-value-from-a-thread-in-python
 #         https://stackoverflow.com/questions/10415028/how-can-i-recover-the-return-value-of-a-function-passed-to-multiprocessing-proce/28799109
 #from threading import Thread as _Thread
-from multiprocessing import Process, Pipe, Manager
-manager = Manager()
+import sys, traceback
+from multiprocessing import Process, Pipe, Queue, cpu_count
 
 
 class Thread(Process):
@@ -124,3 +124,73 @@ class ReturnProcess:
         return self.endout
     
 
+class ProcessPool:
+    """Class to run many tasks on a fixed number of worker processes.
+    Idle workers take the next task from a shared queue, so one long task does not leave the other
+    workers idle, and the number of processes does not grow with the number of tasks.
+    The most expensive tasks are queued first. Tasks are added before starting the pool, and are
+    inherited by the forked workers, so only the return values need to be picklable."""
+
+    def __init__(self,nworkers=None,name='nameless'):
+      self.name     = name
+      self.nworkers = nworkers or cpu_count()
+      self.tasks    = [ ]
+    
+    def __len__(self):
+      return len(self.tasks)
+    
+    def add(self, target, args=(), kwargs={}, name=None, cost=1):
+      """Add task with an estimate of its cost (e.g. number of entries). Return the task index."""
+      self.tasks.append((target,args,kwargs,name,cost))
+      return len(self.tasks)-1
+    
+    def worker(self,tasks,results):
+      """Run tasks from the queue until getting None, and return their output via the result queue."""
+      for itask in iter(tasks.get,None):
+        target, args, kwargs, name, cost = self.tasks[itask]
+        try:
+          results.put((itask,True,target(*args,**kwargs)))
+        except BaseException: # pass error to main process
+          results.put((itask,False,traceback.format_exc()))
+    
+    def __iter__(self):
+      """Run all tasks, and yield task index, task name and output of each task as soon as it is done."""
+      order    = sorted(range(len(self.tasks)),key=lambda i: -self.tasks[i][4]) # most expensive first
+      nworkers = min(self.nworkers,len(self.tasks))
+      if nworkers<=1: # run serially
+        for itask in order:
+          target, args, kwargs, name, cost = self.tasks[itask]
+          yield itask, name, target(*args,**kwargs)
+        return
+      ROOT = sys.modules.get('ROOT')
+      if ROOT and ROOT.IsImplicitMTEnabled(): # forked workers would inherit a running thread pool
+        raise RuntimeError("ProcessPool: Cannot fork workers while ROOT's implicit multithreading is enabled! Call ROOT.DisableImplicitMT() first.")
+      tasks, results = Queue(), Queue()
+      for itask in order:
+        tasks.put(itask)
+      for i in range(nworkers):
+        tasks.put(None) # stop worker
+      workers = [Process(target=self.worker,args=(tasks,results),name="%s_%d"%(self.name,i)) for i in range(nworkers)]
+      for worker in workers:
+        worker.start()
+      try:
+        for i in range(len(self.tasks)):
+          itask, success, out = results.get() # wait for next task to finish
+          name = self.tasks[itask][3]
+          if not success:
+            raise RuntimeError("ProcessPool: Task %r failed:\n%s"%(name,out))
+          yield itask, name, out
+      except BaseException: # also on GeneratorExit
+        for worker in workers:
+          worker.terminate()
+        raise
+      for worker in workers:
+        worker.join()
+    
+    def run(self):
+      """Run all tasks, and return a list of their output in the order they were added."""
+      outs = [None]*len(self.tasks)
+      for itask, name, out in self:
+        outs[itask] = out
+      return outs
+  
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Description: Alternative to MultiDraw: fill multiple histograms in one event loop with RDataFrame,
+#              with JIT-compiled expressions and optional implicit multithreading
+import re
+from array import array
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from ROOT import TH2, TH1D
+from TauFW.Plotter.plot.string import factorcuts, splitcuts, joinfactors
+from TauFW.Plotter.plot.MultiDraw import varregex, varregex2D
+def error(string): # raise RuntimeError in red color
+  return RuntimeError("\033[31m"+string+"\033[0m")
+formularexp = re.compile(r"\$|@")                      # TTreeFormula-only syntax, e.g. Sum$, Length$, Alt$, @jpt.size()
+absrexp     = re.compile(r"(?<![\w:.])abs\(")         # TTreeFormula abs acts on doubles
+minmaxrexp  = re.compile(r"(?<![\w:.])(min|max)\(")   # TTreeFormula min/max act on doubles
+divrexp     = re.compile(r"(?<![/*])/(?![/*=])")       # TTreeFormula divides as doubles, also integers
+
+
+def isrdfexpr(*exprs):
+  """Check if TTreeFormula expressions (varexps, cuts and weights) can be JIT-compiled by RDataFrame."""
+  for expr in exprs:
+    if isinstance(expr,(list,tuple)):
+      if not isrdfexpr(*expr):
+        return False
+    elif expr and formularexp.search(expr):
+      return False
+  return True
+  
+
+def tordfexpr(expr):
+  """Convert TTreeFormula expression to C++ for RDataFrame.
+  Cast each divisor to double, so integers are not divided as integers like in C++."""
+  expr = absrexp.sub("std::abs(",expr.strip())
+  expr = divrexp.sub("/(double)",expr)
+  return minmaxrexp.sub(r"std::\1<double>(",expr)
+  
+
+def setimplicitmt(nthreads=None):
+  """Enable implicit multithreading for RDataFrame, if not done already. Use all cores by default.
+  Return True if it was enabled by this call, so it can be disabled again with ROOT.DisableImplicitMT()."""
+  if ROOT.IsImplicitMTEnabled():
+    return False
+  if nthreads>0:
+    ROOT.EnableImplicitMT(nthreads)
+  else:
+    ROOT.EnableImplicitMT()
+  return True
+  
+
+def copyhist(source, target):
+  """Copy contents, under- and overflow, sum of squared weights, statistics and entries
+  of an RDataFrame result into a histogram, without changing its error option.
+  Like TH1::Fill, enable Sumw2 if any weight was not 1."""
+  nbins = target.GetSize()
+  if target.GetSumw2N()==0 and any(abs(source.GetBinError(i)**2-source.GetBinContent(i))>1e-9*abs(source.GetBinContent(i)) for i in range(nbins)):
+    target.Sumw2()
+  for ibin in range(nbins): # including under- and overflow
+    target.SetBinContent(ibin,source.GetBinContent(ibin))
+  if target.GetSumw2N()>0:
+    sumw2 = target.GetSumw2()
+    for ibin in range(nbins):
+      sumw2[ibin] = source.GetBinError(ibin)**2
+  stats = array('d',[0.]*13)
+  source.GetStats(stats)
+  target.PutStats(stats)
+  target.SetEntries(source.GetEntries())
+  return target
+  
+
+def RDataFrameDraw(tree, varexps, selection='1', drawoption="", **kwargs):
+    """Fill histograms with RDataFrame (see _RDataFrameDraw). With nthreads, enable implicit multithreading
+    during the event loop, and disable it afterwards, so no threads are running when processes are forked later."""
+    nthreads  = kwargs.get('nthreads', None) # number of threads, or -1 for all cores
+    enabledmt = setimplicitmt(nthreads) if nthreads else False
+    try:
+      return _RDataFrameDraw(tree,varexps,selection,drawoption,**kwargs)
+    finally:
+      if enabledmt:
+        ROOT.DisableImplicitMT()
+  
+
+def _RDataFrameDraw(tree, varexps, selection='1', drawoption="", **kwargs):
+    """Fill multiple histograms in one event loop over a tree with RDataFrame.
+    Takes the same arguments as TTree.MultiDraw, and returns the same histograms:
+      RDataFrameDraw( tree, [ "pt_1 >> a(100, 0, 100)", ("pt_2 >> b(100, 0, 100)", "weightB") ], "weightA" )
+    For several selections, pass a list of selections, and a list of varexps (and hists) for each.
+    Cuts are applied as filters, and all histograms are booked lazily before running the event loop.
+    Like MultiDraw, entries with zero weight are not filled, so the number of entries is the same.
+    The histograms must be given with hists=[...] to provide the binning."""
+    
+    selection  = kwargs.get('cut',        selection ) # selections cuts
+    verbosity  = kwargs.get('verbosity',  0         ) # verbosity
+    poisson    = kwargs.get('poisson',    False     ) # kPoisson errors for data
+    sumw2      = kwargs.get('sumw2',      False     ) # sumw2 for MC
+    histlist   = kwargs.get('hists',      [ ]       ) # histograms to fill
+    firstentry = kwargs.get('firstentry', 0         ) # first entry to process
+    nentries   = kwargs.get('nentries',   -1        ) # number of entries to process; -1 = all
+    
+    # SEVERAL SELECTIONS: factorize common cuts, and add the remaining cuts to the weight of each varexp
+    nvarexps = None
+    if isinstance(selection,(list,tuple)):
+      if len(varexps)!=len(selection):
+        raise error("RDataFrameDraw: Number of lists of varexps (%d) does not match number of selections (%d)!"%(len(varexps),len(selection)))
+      nvarexps   = [len(v) for v in varexps]
+      selection, rests = factorcuts(selection)
+      allvarexps = [ ]
+      for rest, varexps_ in zip(rests,varexps):
+        for varexp in varexps_:
+          weight = None
+          if isinstance(varexp,tuple):
+            varexp, weight = varexp
+          if rest and weight:
+            weight = "(%s)*(%s)"%(rest,weight)
+          elif rest:
+            weight = rest
+          allvarexps.append((varexp,weight))
+      varexps  = allvarexps
+      histlist = [h for hists_ in histlist for h in hists_]
+      if verbosity>=1:
+        print ">>> RDataFrameDraw: common selection %r, remaining selections %s"%(selection,rests)
+    if len(histlist)!=len(varexps):
+      raise error("RDataFrameDraw: Number of histograms (%d) does not match number of varexps (%d)!"%(len(histlist),len(varexps)))
+    if not isrdfexpr(selection,varexps):
+      raise error("RDataFrameDraw: Expressions contain TTreeFormula-only syntax: %r, %r"%(selection,varexps))
+    
+    # DATAFRAME
+    rdf = ROOT.RDataFrame(tree)
+    if firstentry>0 or nentries>=0:
+      if ROOT.IsImplicitMTEnabled():
+        raise error("RDataFrameDraw: Cannot process an entry range with implicit multithreading!")
+      rdf = rdf.Range(firstentry,firstentry+nentries if nentries>=0 else 0)
+    
+    # COMMON SELECTION: boolean cuts as filter, and the rest as common weight
+    cuts, weights = splitcuts(selection or '1')
+    if cuts:
+      rdf = rdf.Filter(tordfexpr(joinfactors(cuts,[ ])),"common selection")
+    commonweight = joinfactors([ ],weights)
+    treeweight   = tree.GetWeight()
+    if treeweight!=1:
+      commonweight = joinfactors([ ],weights+[repr(treeweight)])
+    
+    # PARSE varexps
+    draws = [ ] # x, y and weight expressions for each histogram
+    for varexp, hist in zip(varexps,histlist):
+      weight = None
+      if isinstance(varexp,tuple):
+        varexp, weight = varexp
+      weight = joinfactors([ ],[w for w in [commonweight,weight] if w and w!='1'])
+      match  = varregex.match(varexp) or varregex2D.match(varexp)
+      if not match:
+        raise error("RDataFrameDraw: Could not parse formula: %r"%(varexp))
+      xvar, name, yvar = match.group(1), match.group(2), None
+      if name!=hist.GetName():
+        raise error("RDataFrameDraw: Histogram mismatch: looking for %r, but found %r."%(name,hist.GetName()))
+      if isinstance(hist,TH2):
+        yvar, xvar = xvar.split(':') # same convention as TTree::Draw
+      draws.append((tordfexpr(xvar),tordfexpr(yvar) if yvar else None,"(double)(%s)"%tordfexpr(weight) if weight else None))
+    
+    # DEFINE columns once for each unique expression
+    columns = { "1.0": "_rdf_one" } # expression -> column name
+    for exprs in draws:
+      for expr in exprs:
+        if expr and expr not in columns:
+          columns[expr] = "_rdf_col%d"%(len(columns))
+    for expr, column in sorted(columns.items(),key=lambda c: c[1]):
+      rdf = rdf.Define(column,expr)
+    
+    # BOOK histograms lazily; skip zero weights like MultiDraw
+    filters = { } # weight column -> filtered node
+    results = [ ]
+    for (xexpr, yexpr, wexpr), hist in zip(draws,histlist):
+      if sumw2:
+        hist.Sumw2()
+      elif poisson:
+        hist.SetBinErrorOption(TH1D.kPoisson)
+      if drawoption:
+        hist.SetDrawOption(drawoption)
+      wcol = columns[wexpr or "1.0"]
+      if wexpr and wcol not in filters:
+        filters[wcol] = rdf.Filter("%s!=0"%wcol)
+      node = filters.get(wcol,rdf)
+      if yexpr:
+        result = node.Histo2D(ROOT.RDF.TH2DModel(hist),columns[xexpr],columns[yexpr],wcol)
+      else:
+        result = node.Histo1D(ROOT.RDF.TH1DModel(hist),columns[xexpr],wcol)
+      results.append((result,hist))
+    
+    # RUN event loop once for all booked histograms
+    if verbosity>=2:
+      print ">>> RDataFrameDraw: columns=%s"%(columns)
+    for result, hist in results:
+      copyhist(result.GetValue(),hist)
+    
+    hists = [h for r, h in results]
+    if nvarexps: # split per selection
+      hists = [hists[sum(nvarexps[:i]):sum(nvarexps[:i+1])] for i in range(len(nvarexps))]
+    return hists
+  
@@ -30,6 +30,7 @@ def createinputs(fname,sampleset,observables,bins,**kwargs):
   replaceweight = kwargs.get('replaceweight', None   ) # replace weight
   extraweight   = kwargs.get('weight',        ""     ) # extraweight
   shiftQCD      = kwargs.get('shiftQCD',      0      ) # e.g 0.30 for 30%
+  onepass       = kwargs.get('onepass',       True   ) # fill histograms of all bins in one loop over each tree
   verbosity     = kwargs.get('verb',          0      )
   option        = 'RECREATE' if recreate else 'UPDATE'
   method        = 'QCD_OSSS' if filters==None or 'QCD' in filters else None
@@ -58,21 +59,32 @@ def createinputs(fname,sampleset,observables,bins,**kwargs):
     files[obs] = file
   
   # GET HISTS
-  for selection in bins:
+  if onepass and len(bins)>1:
+    print ">>>\n>>> Filling histograms for %d bins in one pass..."%(len(bins))
+    allhists = sampleset.gethists(observables,bins,method=method,split=True,
+                                  parallel=parallel,filter=filters,veto=vetoes)
+  for ibin, selection in enumerate(bins):
     bin = selection.filename # bin name
     print ">>>\n>>> "+color(" %s "%(bin),'magenta',bold=True,ul=True)
     if htag:
       print ">>> systematic uncertainty: %s"%(color(htag.lstrip('_'),'grey'))
     if recreate or verbosity>=1:
       print ">>> %r"%(selection.selection)
-    hists = sampleset.gethists(observables,selection,method=method,split=True,
-                               parallel=parallel,filter=filters,veto=vetoes)
+    if onepass and len(bins)>1:
+      hists = allhists[ibin]
+    else:
+      hists = sampleset.gethists(observables,selection,method=method,split=True,
+                                 parallel=parallel,filter=filters,veto=vetoes)
     
     # SAVE HIST
     ljust = 4+max(11,len(htag)) # extra space
     TAB   = LOG.table("%10.1f %10d  %-18s  %s")
     TAB.printheader('events','entries','variable','process'.ljust(ljust))
     for obs, hist in hists.iterhists():
+      if not obs.plotfor(selection): # histograms of all observables were filled in one pass
+        deletehist(hist)
+        continue
+      obs.changecontext(selection)
       name    = lreplace(hist.GetName(),obs.filename).strip('_') # histname = $VAR_$NAME (see Sample.gethist)
       if not name.endswith(htag):
         name += htag # HIST = $PROCESS_$SYSTEMATIC
@@ -334,6 +334,112 @@ def joincuts(*cuts,**kwargs):
   return cuts
   
 
+def gettoplevel(string):
+  """Replace everything between (nested) parentheses and brackets by '_'."""
+  depth, toplevel = 0, ""
+  for char in string:
+    if char in '([':
+      if depth==0:
+        toplevel += '_'
+      depth += 1
+    elif char in ')]':
+      depth -= 1
+    elif depth==0:
+      toplevel += char
+  return toplevel
+  
+
+def splittoplevel(string,sep):
+  """Split string by a separator, but not between parentheses or brackets."""
+  parts, depth, start, i = [ ], 0, 0, 0
+  while i<len(string):
+    char = string[i]
+    if char in '([':
+      depth += 1
+    elif char in ')]':
+      depth -= 1
+    elif depth==0 and string.startswith(sep,i):
+      parts.append(string[start:i].strip())
+      start = i = i+len(sep)
+      continue
+    i += 1
+  parts.append(string[start:].strip())
+  return parts
+  
+
+def stripparens(string):
+  """Remove whitespace and parentheses around the whole string."""
+  string = string.strip()
+  while string.startswith('(') and string.endswith(')') and gettoplevel(string)=='_':
+    string = string[1:-1].strip()
+  return string
+  
+
+def splitcuts(cuts):
+  """Split a selection string into a list of boolean cuts and a list of weights,
+  such that joinfactors(cuts,weights) is equivalent to the original string, e.g.
+    "(pt_1>30 && iso_1<0.15)*idweight_1*trigweight" -> ['pt_1>30','iso_1<0.15'], ['idweight_1','trigweight']
+  Only top-level '&&' and pure products are split, anything else is kept as one weight."""
+  cuts = stripparens(cuts)
+  if cuts in ["","1"]:
+    return [ ], [ ]
+  toplevel = gettoplevel(cuts)
+  if '&&' in toplevel and '||' not in toplevel and '?' not in toplevel:
+    cutlist = [ ]
+    for cut in splittoplevel(cuts,'&&'):
+      subcuts, subweights = splitcuts(cut)
+      if subweights: # not a pure selection
+        cutlist.append(stripparens(cut))
+      else:
+        cutlist.extend(subcuts)
+    return cutlist, [ ]
+  if re.search(r"[<>]|[=!]=",toplevel) and not any(c in toplevel for c in '&|?:^'): # boolean comparison
+    return [cuts], [ ]
+  if '*' in toplevel and '**' not in toplevel and not any(c in toplevel for c in '+-/%<>=!?:|&^'):
+    cutlist, weights = [ ], [ ]
+    for factor in splittoplevel(cuts,'*'):
+      subcuts, subweights = splitcuts(factor)
+      cutlist.extend(subcuts)
+      weights.extend(subweights)
+    return cutlist, weights
+  return [ ], [cuts]
+  
+
+def joinfactors(cuts,weights):
+  """Join lists of boolean cuts and weights as returned by splitcuts."""
+  cuts    = ["(%s)"%c if any(o in gettoplevel(c) for o in ['||','?']) else c for c in cuts]
+  weights = [w if re.match(r"^[\w.]+$",w) else "(%s)"%w for w in weights]
+  if cuts and weights:
+    return "(%s)*%s"%(" && ".join(cuts),"*".join(weights))
+  return " && ".join(cuts) or "*".join(weights)
+  
+
+def factorcuts(selections,prefilter=True):
+  """Factorize cuts and weights that are common to a list of selection strings.
+  Return the common selection, and the remaining selection for each string,
+  such that their product is equivalent to the original selection string.
+  If prefilter is True, add the "or" of the remaining cuts to the common selection,
+  to reject events that do not pass any selection as early as possible."""
+  factors = [splitcuts(s) for s in selections]
+  common  = [[ ],[ ]] # cuts, weights
+  rests   = [([ ],[ ]) for s in selections]
+  for itype in [0,1]:
+    for factor in factors[0][itype]:
+      ncommon = common[itype].count(factor)
+      if all(f[itype].count(factor)>ncommon for f in factors[1:]):
+        common[itype].append(factor)
+    for factor, rest in zip(factors,rests):
+      remain = common[itype][:]
+      for item in factor[itype]:
+        if item in remain:
+          remain.remove(item)
+        else:
+          rest[itype].append(item)
+  if prefilter and len(selections)>1 and all(c for c, w in rests):
+    common[0].append(" || ".join("(%s)"%joinfactors(c,[ ]) for c, w in rests))
+  return joinfactors(*common), [joinfactors(*r) for r in rests]
+  
+
 def shift(*args,**kwargs):
   """Shift all jet variable in a given string (e.g. to propagate JEC/JER)."""
   return shiftjetvars(*args,**kwargs)
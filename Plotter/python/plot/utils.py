@@ -88,6 +88,19 @@ def deletehist(*hists,**kwargs):
     del hist
   
 
+def addhistlists(hists,others):
+  """Add histograms in (nested) lists to the histograms at the same position in another,
+  e.g. partial histograms filled for different entry ranges. Return the first list."""
+  if isinstance(hists,(list,tuple)):
+    LOG.insist(len(hists)==len(others),"addhistlists: Lists of histograms have different lengths: %d vs. %d"%(len(hists),len(others)))
+    for hist, other in zip(hists,others):
+      addhistlists(hist,other)
+  else:
+    hists.Add(others)
+    deletehist(others)
+  return hists
+  
+
 def printhist(hist,min_=0,max_=None,**kwargs):
   """Help function to print bin errors."""
   nbins  = hist.GetNbinsX()
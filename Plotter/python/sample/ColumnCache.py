@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+# Description: Cache of the branches of pico trees as memory-mapped numpy column files,
+#              to fill histograms with vectorized expressions without reading the trees again
+import os, re, ast, time, errno, hashlib, operator
+import numpy as np
+from array import array
+from TauFW.common.tools.file import ensuredir, ensureTFile, atomicwrite
+from TauFW.common.tools.log import Logger
+from TauFW.Plotter.sample.HistCache import getfileid
+from TauFW.Plotter.sample.TreeIO import enableprefetch, prepareread, isremote
+from TauFW.Plotter.plot.MultiDraw import varregex, varregex2D
+from ROOT import TH2
+LOG = Logger('ColumnCache')
+_columncache = None # global cache used by Sample.gethist and gethist2D
+
+
+def setcolumncache(cachedir, **kwargs):
+  """Set global column cache for Sample.gethist and gethist2D. Disable it if cachedir is None.
+  Experimental: validate it for your pico files with test/testColumnCache.py first."""
+  global _columncache
+  _columncache = ColumnCache(cachedir,**kwargs) if cachedir else None
+  return _columncache
+  
+
+def getcolumncache():
+  """Return global column cache, or None if it is not set."""
+  return _columncache
+  
+
+# EXPRESSIONS: evaluate TTreeFormula expressions with numpy arrays, in double precision
+unsupported = re.compile(r"\$|@|\[|\?|\^|~|\"|'") # e.g. Sum$, @jpt.size(), jpt[0], a?b:c, x^2, ~x, strings
+bitwiserexp = re.compile(r"(?<!&)&(?!&)|(?<!\|)\|(?!\|)") # single & or |
+comparerexp = re.compile(r"<|>|==|!=") # comparison
+functions   = {
+  'abs':   np.abs,     'fabs':  np.abs,     'sqrt':  np.sqrt,    'pow':   np.power,
+  'exp':   np.exp,     'log':   np.log,     'log10': np.log10,   'floor': np.floor,   'ceil':  np.ceil,
+  'min':   np.minimum, 'max':   np.maximum,
+  'cos':   np.cos,     'sin':   np.sin,     'tan':   np.tan,     'acos':  np.arccos,  'asin':  np.arcsin,
+  'atan':  np.arctan,  'atan2': np.arctan2, 'cosh':  np.cosh,    'sinh':  np.sinh,    'tanh':  np.tanh,
+  'TMath_Abs':  np.abs,     'TMath_Sqrt':  np.sqrt,    'TMath_Power': np.power,   'TMath_Exp': np.exp,
+  'TMath_Log':  np.log,     'TMath_Log10': np.log10,   'TMath_Min':   np.minimum, 'TMath_Max': np.maximum,
+  'TMath_Cos':  np.cos,     'TMath_Sin':   np.sin,     'TMath_ATan2': np.arctan2, 'TMath_Pi':  lambda: np.pi,
+}
+
+
+def divide(a, b):
+  """Divide like TTreeFormula, which returns 0 for division by zero."""
+  with np.errstate(divide='ignore',invalid='ignore'):
+    return np.where(np.equal(b,0),0.,np.true_divide(a,b))
+  
+
+binops = {
+  ast.Add:  operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: divide,
+  ast.Mod:  lambda a, b: np.fmod(np.trunc(a),np.trunc(b)), # integer modulo
+  ast.BitAnd: lambda a, b: np.bitwise_and(np.asarray(a,dtype=np.int64),np.asarray(b,dtype=np.int64)),
+  ast.BitOr:  lambda a, b: np.bitwise_or(np.asarray(a,dtype=np.int64),np.asarray(b,dtype=np.int64)),
+}
+cmpops = {
+  ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+  ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+unaryops = (ast.Invert,ast.USub,ast.UAdd) # Invert is used for logical not (!)
+allowed  = (ast.BoolOp,ast.And,ast.Or,ast.BinOp,ast.UnaryOp,ast.Compare,ast.Call,ast.Num,ast.Name,ast.Load)+\
+           tuple(binops)+tuple(cmpops)+unaryops # syntax implemented in evalexpr
+_parsed = { } # parsed expressions
+
+
+def parseexpr(expr):
+  """Parse TTreeFormula expression into a python syntax tree. Raise ValueError if it is not supported,
+  or if python's operator precedence differs from C's, like for & and | next to comparisons."""
+  if expr not in _parsed:
+    if unsupported.search(expr):
+      raise ValueError("Unsupported syntax in %r"%(expr))
+    if bitwiserexp.search(expr) and comparerexp.search(expr): # e.g. id&16>0 = id&(16>0) in C
+      raise ValueError("Bitwise operators next to comparisons in %r"%(expr))
+    pyexpr = expr.replace('&&',' and ').replace('||',' or ').replace('TMath::','TMath_')
+    pyexpr = re.sub(r"!(?!=)","~",pyexpr) # unary operator that binds tighter than comparisons, like ! in C
+    try:
+      tree = ast.parse(pyexpr.strip() or '1',mode='eval').body
+    except SyntaxError:
+      raise ValueError("Could not parse %r"%(expr))
+    for node in ast.walk(tree):
+      if not isinstance(node,allowed):
+        raise ValueError("Unsupported syntax %s in %r"%(type(node).__name__,expr))
+      elif isinstance(node,ast.Compare) and len(node.ops)>1: # e.g. a<b<3
+        raise ValueError("Chained comparison in %r"%(expr))
+      elif isinstance(node,ast.Call) and (not isinstance(node.func,ast.Name) or node.func.id not in functions or
+                                          node.keywords or node.starargs or node.kwargs):
+        raise ValueError("Unsupported function in %r"%(expr))
+    _parsed[expr] = tree
+  return _parsed[expr]
+  
+
+def getbranches(expr):
+  """Return set of branch names used in an expression. Raise ValueError if it is not supported."""
+  branches = set()
+  for node in ast.walk(parseexpr(expr)):
+    if isinstance(node,ast.Name) and node.id not in functions and node.id not in ['True','False']:
+      branches.add(node.id)
+  return branches
+  
+
+def evalexpr(expr, columns):
+  """Evaluate a TTreeFormula expression with a dictionary of numpy arrays."""
+  def evalnode(node):
+    if isinstance(node,ast.Num):
+      return float(node.n) # like TTreeFormula: e.g. 1/2 = 0.5
+    elif isinstance(node,ast.Name):
+      if node.id in ['True','False']:
+        return float(node.id=='True')
+      return columns[node.id]
+    elif isinstance(node,ast.BinOp) and type(node.op) in binops:
+      return binops[type(node.op)](evalnode(node.left),evalnode(node.right))
+    elif isinstance(node,ast.UnaryOp) and isinstance(node.op,unaryops):
+      value = evalnode(node.operand)
+      if isinstance(node.op,ast.Invert): # logical not (!)
+        return np.asarray(np.logical_not(value),dtype=np.float64)
+      elif isinstance(node.op,ast.USub):
+        return -value
+      return value
+    elif isinstance(node,ast.BoolOp):
+      func = np.logical_and if isinstance(node.op,ast.And) else np.logical_or
+      return np.asarray(reduce(func,[evalnode(v) for v in node.values]),dtype=np.float64)
+    elif isinstance(node,ast.Compare) and len(node.ops)==1 and type(node.ops[0]) in cmpops: # booleans as 0. or 1.
+      return np.asarray(cmpops[type(node.ops[0])](evalnode(node.left),evalnode(node.comparators[0])),dtype=np.float64)
+    elif isinstance(node,ast.Call) and node.func.id in functions:
+      return functions[node.func.id](*[evalnode(a) for a in node.args])
+    raise ValueError("Unsupported syntax %s in %r"%(type(node).__name__,expr))
+  return evalnode(parseexpr(expr))
+  
+
+def findbins(axis, values):
+  """Return bin indices of an array of values like TAxis::FindBin, with 0 for underflow, and nbins+1 for overflow."""
+  nbins, xmin, xmax = axis.GetNbins(), axis.GetXmin(), axis.GetXmax()
+  xbins = axis.GetXbins()
+  if xbins.GetSize()>0: # variable bin sizes
+    edges = np.array([xbins[i] for i in range(xbins.GetSize())],dtype=np.float64)
+    bins  = np.searchsorted(edges,values,side='right')
+  else:
+    with np.errstate(invalid='ignore'):
+      bins = 1+np.floor(nbins*(values-xmin)/(xmax-xmin)).astype(np.int64)
+  bins[values<xmin] = 0
+  bins[~(values<xmax)] = nbins+1 # including NaN
+  return bins
+  
+
+def fillhist(hist, weights, xvalues, yvalues=None):
+  """Fill a histogram with arrays of values and weights, like TH1::Fill:
+  zero weights are skipped, Sumw2 is enabled if any weight is not 1,
+  and under- and overflow are not included in the statistics."""
+  mask    = (weights!=0)
+  weights = weights[mask]
+  xvalues = xvalues[mask]
+  xbins   = findbins(hist.GetXaxis(),xvalues)
+  nxbins  = hist.GetNbinsX()
+  inrange = (xbins>=1) & (xbins<=nxbins)
+  if yvalues is None:
+    ibins = xbins
+    nstat = 4
+  else:
+    yvalues  = yvalues[mask]
+    ybins    = findbins(hist.GetYaxis(),yvalues)
+    inrange &= (ybins>=1) & (ybins<=hist.GetNbinsY())
+    ibins    = xbins+(nxbins+2)*ybins
+    nstat    = 7
+  size  = hist.GetSize()
+  sumw  = np.bincount(ibins,weights=weights,minlength=size)
+  sumw2 = np.bincount(ibins,weights=weights*weights,minlength=size)
+  if hist.GetSumw2N()==0 and np.any(weights!=1):
+    hist.Sumw2()
+  entries = hist.GetEntries()+len(weights)
+  stats   = array('d',[0.]*13)
+  hist.GetStats(stats) # before SetBinContent resets them
+  w, x    = weights[inrange], xvalues[inrange]
+  newstats = [w.sum(),(w*w).sum(),(w*x).sum(),(w*x*x).sum()]
+  if yvalues is not None:
+    y = yvalues[inrange]
+    newstats += [(w*y).sum(),(w*y*y).sum(),(w*x*y).sum()]
+  for i in range(nstat):
+    stats[i] += newstats[i]
+  hsumw2 = hist.GetSumw2()
+  for ibin in np.nonzero(sumw2)[0]:
+    hist.SetBinContent(int(ibin),hist.GetBinContent(int(ibin))+sumw[ibin])
+    if hist.GetSumw2N()>0:
+      hsumw2[int(ibin)] += sumw2[ibin]
+  hist.PutStats(stats)
+  hist.SetEntries(entries)
+  return hist
+  
+
+class ColumnCache(object):
+  """
+  Cache the branches of trees as numpy column files (one .npy file per branch), which are
+  memory-mapped when filling histograms, so re-plotting does not need to read the trees again.
+  Branches are extracted once per input file, only when an expression needs them.
+  Columns are addressed by the input file identity (path, size and modification time,
+  or UUID for remote files) and tree name, so they are invalidated when the file changes.
+  Only expressions of scalar branches are supported; anything else is drawn with MultiDraw.
+  If the total size exceeds maxsize (in MB), the columns of the least recently used files are removed.
+  """
+  
+  def __init__(self, cachedir, **kwargs):
+    self.cachedir  = ensuredir(cachedir)
+    self.maxsize   = kwargs.get('maxsize',   10000 )*1024**2 # maximum size in bytes
+    self.verbosity = kwargs.get('verb',      0     )
+    self.nhits     = 0 # number of histograms filled from columns
+    self.nmisses   = 0 # number of histograms that could not be filled from columns
+  
+  def __repr__(self):
+    return '<%s(%r) at %s>'%(self.__class__.__name__,self.cachedir,hex(id(self)))
+  
+  def path(self, fname, treename):
+    """Return directory with the columns of a tree."""
+    key = hashlib.sha1(repr((getfileid(fname),treename))).hexdigest()
+    return os.path.join(self.cachedir,key[:2],key)
+  
+  def getcolumns(self, fname, treename, branches):
+    """Return dictionary of memory-mapped arrays for a list of branches.
+    Extract missing branches from the tree first. Parallel processes (e.g. chunks of the same file)
+    wait for the process that is extracting them, so each file is only read once."""
+    dirname = self.path(fname,treename)
+    ismissing = lambda: [b for b in branches if not os.path.isfile(os.path.join(dirname,b+".npy"))]
+    if ismissing():
+      lockname = self.lock(dirname)
+      try:
+        missing = ismissing() # may have been extracted by another process in the meantime
+        if missing:
+          self.extract(fname,treename,missing,dirname)
+      finally:
+        self.remove(lockname)
+    try:
+      os.utime(dirname,None) # for LRU eviction
+      return dict((b,np.load(os.path.join(dirname,b+".npy"),mmap_mode='r')) for b in branches)
+    except (IOError,OSError) as error: # e.g. removed by another process
+      raise ValueError("Could not load columns from %s: %s"%(dirname,error))
+  
+  def lock(self, dirname, timeout=3600):
+    """Create a lock file for extracting the columns of a tree, and return its name.
+    If another process holds the lock, wait until it is released, or until that process died."""
+    lockname = dirname+".lock"
+    ensuredir(os.path.dirname(lockname))
+    start    = time.time()
+    while True:
+      try:
+        fd = os.open(lockname,os.O_CREAT|os.O_EXCL|os.O_WRONLY)
+        os.write(fd,str(os.getpid()))
+        os.close(fd)
+        return lockname
+      except OSError as error:
+        if error.errno!=errno.EEXIST:
+          raise
+      try:
+        with open(lockname) as file:
+          pid = int(file.read() or 0)
+        if pid:
+          os.kill(pid,0) # check if process still exists
+      except (IOError,ValueError): # lock was just released, or is being written
+        pass
+      except OSError as error:
+        if error.errno==errno.ESRCH: # process died: remove stale lock
+          self.remove(lockname)
+          continue
+      if time.time()-start>timeout:
+        raise ValueError("Timed out waiting for lock %s"%(lockname))
+      time.sleep(0.2)
+  
+  def remove(self, fname):
+    """Remove a file, if it was not already removed by another process."""
+    try:
+      os.remove(fname)
+    except OSError:
+      pass
+  
+  def extract(self, fname, treename, branches, dirname):
+    """Read scalar branches from a tree with TTree::Draw, four at a time, and save them as double precision columns,
+    shared by parallel processes (see atomicwrite)."""
+    LOG.verb("ColumnCache.extract: Extracting %s from %s:%s"%(branches,fname,treename),self.verbosity,1)
+    enableprefetch(fname) # for remote files
+    file = ensureTFile(fname,'READ')
+    tree = file.Get(treename)
+    if not tree:
+      file.Close()
+      raise ValueError("Could not find tree %r in %s"%(treename,fname))
+    prepareread(tree,branches,remote=isremote(fname),verb=self.verbosity)
+    for branch in branches:
+      leaf = tree.GetLeaf(branch)
+      if not leaf or leaf.GetLeafCount() or leaf.GetLen()!=1:
+        file.Close()
+        raise ValueError("Branch %r is not a scalar branch of tree %r in %s"%(branch,treename,fname))
+    ensuredir(dirname)
+    nentries = tree.GetEntries()
+    tree.SetEstimate(nentries+1) # make sure buffers can hold all entries
+    for i in range(0,len(branches),4):
+      subset = branches[i:i+4]
+      ndrawn = tree.Draw(':'.join(subset),"","goff")
+      if ndrawn!=nentries:
+        file.Close()
+        raise ValueError("Expected %d entries for %s, but got %s"%(nentries,subset,ndrawn))
+      for j, branch in enumerate(subset,1):
+        buffer  = getattr(tree,"GetV%d"%j)()
+        buffer.SetSize(nentries)
+        column  = np.frombuffer(buffer,dtype=np.float64,count=nentries)
+        cname   = os.path.join(dirname,branch+".npy")
+        with atomicwrite(cname) as tmpname:
+          with open(tmpname,'wb') as tmpfile: # file object, so numpy does not append .npy
+            np.save(tmpfile,column)
+    file.Close()
+    if self.getsize()>self.maxsize:
+      self.evict(keep=dirname)
+  
+  def draw(self, fname, treename, varexps, cuts, hists, **kwargs):
+    """Fill histograms from the cached columns, like Sample.multidraw with MultiDraw:
+    for several selections, pass a list of cuts, and a list of varexps and hists for each.
+    With chunk=(ichunk,nchunks), only fill the ichunk-th of nchunks equal entry ranges.
+    Return False, without filling anything, if any expression is not supported."""
+    drawopt   = kwargs.get('drawopt', ""             )
+    chunk     = kwargs.get('chunk',   None           ) # (ichunk, nchunks)
+    verbosity = kwargs.get('verb',    self.verbosity )
+    if not isinstance(cuts,list):
+      cuts, varexps, hists = [cuts], [varexps], [hists]
+    
+    # PARSE and EVALUATE all expressions before filling any histogram; evaluate each unique expression only once
+    ndraws = sum(len(h) for h in hists)
+    draws  = [ ] # cut, x, y and weight expressions for each histogram
+    try:
+      for cut, varexps_, hists_ in zip(cuts,varexps,hists):
+        for varexp, hist in zip(varexps_,hists_):
+          weight = ""
+          if isinstance(varexp,tuple):
+            varexp, weight = varexp
+          match = varregex.match(varexp) or varregex2D.match(varexp)
+          xvar, yvar = (match.group(1) if match else varexp), None
+          if isinstance(hist,TH2):
+            yvar, xvar = re.split(r"(?<!:):(?!:)",xvar) # same convention as TTree::Draw
+          draws.append((cut or "",xvar,yvar,weight or "",hist))
+      branches = set()
+      for draw in draws:
+        for expr in draw[:4]:
+          if expr:
+            branches |= getbranches(expr)
+      if not branches:
+        raise ValueError("No branches in %s"%(cuts))
+      columns = self.getcolumns(fname,treename,sorted(branches))
+      if chunk: # entry range
+        ichunk, nchunks = chunk
+        ntot    = len(columns.values()[0])
+        first   = ichunk*ntot//nchunks
+        columns = dict((b,c[first:(ichunk+1)*ntot//nchunks]) for b, c in columns.iteritems())
+      nrows  = len(columns.values()[0])
+      values = { }
+      for draw in draws:
+        for expr in draw[:4]:
+          if expr and expr not in values:
+            values[expr] = np.asarray(evalexpr(expr,columns),dtype=np.float64)
+            if values[expr].ndim==0: # constant
+              values[expr] = np.full(nrows,values[expr])
+      values[''] = np.ones(nrows)
+    except (ValueError,KeyError,TypeError) as error:
+      LOG.verb("ColumnCache.draw: Using MultiDraw for %s: %s"%(fname,error),verbosity,1)
+      self.nmisses += ndraws
+      return False
+    
+    # FILL histograms
+    for cut, xvar, yvar, weight, hist in draws:
+      weights = values[cut]
+      if weight:
+        weights = weights*values[weight]
+      fillhist(hist,weights,values[xvar],values[yvar] if yvar else None)
+      if drawopt:
+        hist.SetDrawOption(drawopt)
+    self.nhits += ndraws
+    LOG.verb("ColumnCache.draw: Filled %d histograms from %d columns of %s"%(len(draws),len(columns),fname),verbosity,2)
+    return True
+  
+  def dirs(self):
+    """Return list of (modification time, size, path) of the column directory of each tree."""
+    dirs = [ ]
+    for subdir in os.listdir(self.cachedir):
+      subdir = os.path.join(self.cachedir,subdir)
+      if not os.path.isdir(subdir): continue
+      for dirname in os.listdir(subdir):
+        dirname = os.path.join(subdir,dirname)
+        try:
+          if not os.path.isdir(dirname): continue # e.g. lock file
+          size = sum(os.path.getsize(os.path.join(dirname,f)) for f in os.listdir(dirname))
+          dirs.append((os.path.getmtime(dirname),size,dirname))
+        except OSError: # removed by another process
+          pass
+    return dirs
+  
+  def getsize(self):
+    """Return total size of cache in bytes."""
+    return sum(s for t, s, d in self.dirs())
+  
+  def evict(self, maxsize=None, keep=None):
+    """Remove columns of least recently used trees until the total size is below 90% of maxsize.
+    Never remove the directory keep, e.g. with columns that were just extracted."""
+    if maxsize==None:
+      maxsize = self.maxsize
+    dirs     = sorted(self.dirs())
+    size     = sum(s for t, s, d in dirs)
+    nremoved = 0
+    for mtime, dsize, dirname in dirs:
+      if size<=0.9*maxsize: break
+      if dirname==keep: continue
+      try:
+        fnames = os.listdir(dirname)
+      except OSError: # already removed by another process
+        fnames = [ ]
+      for fname in fnames:
+        self.remove(os.path.join(dirname,fname))
+      try:
+        os.rmdir(dirname)
+      except OSError:
+        pass
+      size     -= dsize
+      nremoved += 1
+    LOG.verb("ColumnCache.evict: Removed columns of %d trees from %s"%(nremoved,self.cachedir),self.verbosity,1)
+    return nremoved
+  
+  def clear(self):
+    """Remove all columns."""
+    return self.evict(maxsize=0)
+  
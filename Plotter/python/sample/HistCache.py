@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Description: Persistent, content-addressed cache of histograms filled by Sample.gethist,
+#              to avoid rerunning MultiDraw if nothing changed since the last run
+import os, hashlib
+from TauFW.common.tools.file import ensuredir, ensureTFile, atomicwrite
+from TauFW.common.tools.log import Logger
+from ROOT import TFile
+LOG = Logger('HistCache')
+_histcache = None # global cache used by Sample.gethist and gethist2D
+_fileids   = { }  # identities of remote files
+
+
+def sethistcache(cachedir, **kwargs):
+  """Set global histogram cache for Sample.gethist and gethist2D. Disable it if cachedir is None."""
+  global _histcache
+  _histcache = HistCache(cachedir,**kwargs) if cachedir else None
+  return _histcache
+  
+
+def gethistcache():
+  """Return global histogram cache, or None if it is not set."""
+  return _histcache
+  
+
+def getfileid(fname):
+  """Return identity of a file: path, size and modification time for local files,
+  or the UUID for remote files (e.g. via XRootD)."""
+  if os.path.isfile(fname):
+    stat = os.stat(fname)
+    return (os.path.abspath(fname),stat.st_size,stat.st_mtime)
+  if fname not in _fileids:
+    file = ensureTFile(fname)
+    _fileids[fname] = (fname,file.GetUUID().AsString())
+    file.Close()
+  return _fileids[fname]
+  
+
+class HistCache(object):
+  """
+  Cache filled histograms on disk, one ROOT file per histogram, addressed by a hash of everything
+  that determines its content:
+  - input file identity: absolute path, size and modification time (or UUID for remote files),
+  - tree name, the joined cuts and weights, and the draw option,
+  - variable expression (without histogram name) and its extra cut,
+  - histogram type, binning and error option.
+  Histograms are cached before scaling by the sample's normalization and scale factors.
+  If the total size exceeds maxsize (in MB), the least recently used histograms are removed.
+  """
+  
+  def __init__(self, cachedir, **kwargs):
+    self.cachedir  = ensuredir(cachedir)
+    self.maxsize   = kwargs.get('maxsize',   1000 )*1024**2 # maximum size in bytes
+    self.verbosity = kwargs.get('verb',      0    )
+    self.nhits     = 0
+    self.nmisses   = 0
+    self.size      = self.getsize()
+  
+  def __repr__(self):
+    return '<%s(%r) at %s>'%(self.__class__.__name__,self.cachedir,hex(id(self)))
+  
+  @staticmethod
+  def binning(hist):
+    """Return histogram type, bin edges of each axis, and error options."""
+    axes  = [hist.GetXaxis()]
+    if hist.GetDimension()>=2:
+      axes.append(hist.GetYaxis())
+    edges = [tuple(a.GetBinLowEdge(i) for i in range(1,a.GetNbins()+2)) for a in axes]
+    return (hist.ClassName(),edges,hist.GetSumw2N()>0,hist.GetBinErrorOption())
+  
+  def getkeys(self, fname, treename, cuts, drawopt, varexps, hists, chunk=None):
+    """Return keys for a list of variable expressions and histograms, as passed to MultiDraw.
+    For histograms of part of the tree, pass the (ichunk,nchunks) entry range."""
+    keys   = [ ]
+    common = repr((getfileid(fname),treename,cuts,drawopt))
+    if chunk:
+      common += repr(tuple(chunk))
+    for varexp, hist in zip(varexps,hists):
+      varcut = ""
+      if isinstance(varexp,tuple):
+        varexp, varcut = varexp
+      expr = varexp.rsplit('>>',1)[0].strip() # remove histogram name
+      keys.append(hashlib.sha1(common+repr((expr,varcut,self.binning(hist)))).hexdigest())
+    return keys
+  
+  def path(self, key):
+    """Return path of cache file for a key."""
+    return os.path.join(self.cachedir,key[:2],key+".root")
+  
+  def get(self, key, hist):
+    """Fill histogram with the cached one and return True, or return False if it is not cached."""
+    fname = self.path(key)
+    if not os.path.isfile(fname):
+      self.nmisses += 1
+      return False
+    file   = TFile.Open(fname)
+    cached = file.Get('hist') if file and not file.IsZombie() else None
+    if not cached:
+      LOG.warning("HistCache.get: Could not read histogram from %s! Removing..."%(fname))
+      if file: file.Close()
+      self.remove(fname)
+      self.nmisses += 1
+      return False
+    hist.Add(cached)
+    hist.SetEntries(cached.GetEntries())
+    file.Close()
+    os.utime(fname,None) # for LRU eviction
+    self.nhits += 1
+    LOG.verb("HistCache.get: Found %r in %s"%(hist.GetName(),fname),self.verbosity,2)
+    return True
+  
+  def put(self, key, hist):
+    """Save a filled histogram, shared by parallel processes (see atomicwrite)."""
+    fname   = self.path(key)
+    with atomicwrite(fname) as tmpname:
+      file = TFile(tmpname,'RECREATE')
+      file.WriteTObject(hist,'hist')
+      file.Close()
+    self.size += os.path.getsize(fname)
+    LOG.verb("HistCache.put: Saved %r to %s"%(hist.GetName(),fname),self.verbosity,2)
+    if self.size>self.maxsize:
+      self.evict()
+  
+  def files(self):
+    """Return list of (modification time, size, path) of all cache files."""
+    files = [ ]
+    for dirpath, dirnames, fnames in os.walk(self.cachedir):
+      for fname in fnames:
+        if not fname.endswith(".root"): continue
+        fname = os.path.join(dirpath,fname)
+        stat  = os.stat(fname)
+        files.append((stat.st_mtime,stat.st_size,fname))
+    return files
+  
+  def getsize(self):
+    """Return total size of cache in bytes."""
+    return sum(s for t, s, f in self.files())
+  
+  def evict(self, maxsize=None):
+    """Remove least recently used histograms until the total size is below 90% of maxsize."""
+    if maxsize==None:
+      maxsize = self.maxsize
+    files     = sorted(self.files())
+    self.size = sum(s for t, s, f in files)
+    nremoved  = 0
+    for mtime, size, fname in files:
+      if self.size<=0.9*maxsize: break
+      self.remove(fname)
+      self.size -= size
+      nremoved  += 1
+    LOG.verb("HistCache.evict: Removed %d histograms from %s"%(nremoved,self.cachedir),self.verbosity,1)
+    return nremoved
+  
+  def clear(self):
+    """Remove all histograms."""
+    return self.evict(maxsize=0)
+  
+  def remove(self, fname):
+    """Remove a cache file, if it was not already removed by another process."""
+    try:
+      os.remove(fname)
+    except OSError:
+      pass
+  
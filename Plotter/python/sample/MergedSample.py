@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 # Author: Izaak Neutelings (July 2020)
 from TauFW.Plotter.sample.Sample import *
-from TauFW.Plotter.plot.MultiThread import MultiProcessor
+from TauFW.Plotter.plot.MultiThread import ProcessPool
+from copy import copy
 
 
 class MergedSample(Sample):
@@ -42,6 +43,10 @@ class MergedSample(Sample):
     for sample in self.samples:
       yield sample
   
+  def getentries(self):
+    """Return total number of entries in the trees of all merged samples."""
+    return sum(s.getentries() for s in self.samples)
+  
   def __add__(self,sample):
     """Start iteration over samples."""
     self.add(sample)
@@ -138,22 +143,83 @@ class MergedSample(Sample):
     hkwargs  = kwargs.copy()
     if parallel and len(self.samples)>1:
       hkwargs['parallel'] = False
-      processor = MultiProcessor()
+      pool = ProcessPool(name=self.name)
       for sample in self.samples:
-        processor.start(sample.gethist,hargs,hkwargs,name=sample.title)        
-      for process in processor:
-        allhists.append(process.join())
+        pool.add(sample.gethist,hargs,hkwargs,name=sample.title)
+      allhists = pool.run()
     else:
       for sample in self.samples:
         if 'name' in kwargs: # prevent memory leaks
           hkwargs['name']  = makehistname(kwargs.get('name',""),sample.name)
         allhists.append(sample.gethist(*hargs,**hkwargs))
     
+    return self.mergehists(variables,selection,issingle,allhists,name=name,title=title,verb=verbosity)
+  
+  def getsplithists(self, *args, **kwargs):
+    """Create and fill histograms for all split samples, reading the tree of each merged sample
+    only once. Overrides Sample.getsplithists."""
+    splitsamples = kwargs.pop('split', self.splitsamples) # split samples to fill
+    if any(isinstance(s,MergedSample) for s in self.samples) or any(s.samples!=self.samples for s in splitsamples):
+      return [s.gethist(*args,**kwargs) for s in splitsamples] # fall back to one loop per split sample
+    variables, selection, issingle = unwrap_gethist_args(*args)
+    verbosity = LOG.getverbosity(kwargs)
+    tag       = kwargs.get('tag',      ""    )
+    parallel  = kwargs.get('parallel', False )
+    hargs     = (variables, selection)
+    hkwargs   = kwargs.copy()
+    hkwargs['parallel'] = False
+    for key in ['name','title']: # set per split sample
+      hkwargs.pop(key,None)
+    
+    # SPLIT SAMPLES of each merged sample: shallow copies (without opening the file)
+    # with the cuts, weight and scale of each split sample of this merged sample
+    def getcomponents(sample):
+      components = [ ]
+      for splitsample in splitsamples:
+        component             = copy(sample)
+        component.name        = makehistname(splitsample.name,sample.name)
+        component.cuts        = joincuts(sample.cuts,splitsample.cuts)
+        component.extraweight = joinweights(sample.extraweight,splitsample.weight)
+        component.scale       = sample.scale * splitsample.scale * splitsample.norm
+        components.append(component)
+      return components
+    
+    # HISTOGRAMS
+    allhists = [ ] # for each merged sample, a list of results for each split sample
+    if parallel and len(self.samples)>1:
+      pool = ProcessPool(name=self.name)
+      for sample in self.samples:
+        pool.add(sample.gethist,hargs,dict(hkwargs,split=getcomponents(sample)),name=sample.title)
+      allhists = pool.run()
+    else:
+      for sample in self.samples:
+        allhists.append(sample.gethist(*hargs,split=getcomponents(sample),**hkwargs))
+    
+    # SUM for each split sample
+    results = [ ]
+    for i, splitsample in enumerate(splitsamples):
+      name = splitsample.name+tag
+      results.append(splitsample.mergehists(variables,selection,issingle,[h[i] for h in allhists],
+                                            name=name,title=splitsample.title,verb=verbosity))
+    return results
+  
+  def mergehists(self, variables, selection, issingle, allhists, **kwargs):
+    """Help function to sum the histograms of all merged samples
+    for each variable (and selection) and set the style of this sample."""
+    verbosity = LOG.getverbosity(kwargs)
+    name      = kwargs.get('name',  self.name  )
+    title     = kwargs.get('title', self.title )
+    ismulti   = isinstance(selection,list) # several selections
+    
     # SUM
     sumhists = [ ]
-    if any(len(subhists)<len(variables) for subhists in allhists):
-      LOG.error("MergedSample.gethist: len(subhists) = %s < %s = len(variables)"%(len(subhists),len(variables)))
-    for ivar, variable in enumerate(variables):
+    allvars  = variables
+    if ismulti: # flatten lists of histograms for each selection
+      allhists = [[h for hists in subhists for h in hists] for subhists in allhists]
+      allvars  = variables*len(selection)
+    if any(len(subhists)<len(allvars) for subhists in allhists):
+      LOG.error("MergedSample.gethist: len(subhists) = %s < %s = len(variables)"%(len(subhists),len(allvars)))
+    for ivar, variable in enumerate(allvars):
       subhists = [subhists[ivar] for subhists in allhists]
       sumhist  = None
       for subhist in subhists:
@@ -181,6 +247,11 @@ class MergedSample(Sample):
       print ">>>\n>>> MergedSample.gethist - %s"%(color(name,color="grey"))
       print ">>>    entries: %d (%.2f integral)"%(nentries,integral)
     
+    if ismulti: # split per selection
+      nvars    = len(variables)
+      sumhists = [sumhists[i:i+nvars] for i in range(0,len(sumhists),nvars)]
+      if issingle:
+        return [hists[0] for hists in sumhists]
     if issingle:
       return sumhists[0]
     return sumhists
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Description: Persistent index of the metadata of pico files (number of entries and cutflow bins)
+#              per directory, so samples can be created without opening their files
+import os, json, hashlib
+from TauFW.common.tools.file import ensureTFile, atomicwrite
+from TauFW.common.tools.log import Logger
+from TauFW.Plotter.plot.MultiThread import ProcessPool
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from ROOT import gSystem, FileStat_t, TTree
+LOG = Logger('MetaIndex')
+_indexes  = { }           # directory -> MetaIndex
+_options  = {             # global options
+  'enable':   False,        # use index in Sample (opt-in)
+  'cachedir': "cache/meta", # directory for indexes
+  'local':    False,        # save index in pico directory itself if it is writable
+}
+
+
+def setmetaindex(enable=True, cachedir=None, local=None):
+  """Enable or disable the metadata index for Sample. Set directory for the indexes,
+  or opt in to save them as a hidden file in the pico directories themselves, if they are writable.
+  Experimental: validate it for your pico files with test/testMetaIndex.py first."""
+  _options['enable'] = enable
+  if cachedir:
+    _options['cachedir'] = cachedir
+  if local!=None:
+    _options['local'] = local
+  _indexes.clear()
+  
+
+def getstat(fname):
+  """Return size and modification time of a file, or None if it does not exist.
+  For remote files, ask the server (e.g. via XRootD) without opening the file."""
+  if ':' not in fname:
+    if not os.path.isfile(fname):
+      return None
+    stat = os.stat(fname)
+    return (stat.st_size,stat.st_mtime)
+  stat = FileStat_t()
+  if gSystem.GetPathInfo(fname,stat)!=0:
+    return None
+  return (stat.fSize,stat.fMtime)
+  
+
+def readmeta(fname, treename='tree', cutflow='cutflow'):
+  """Open a file and return its metadata: number of entries of the tree,
+  and contents of all bins of the cutflow histogram (including under- and overflow).
+  Missing objects are stored as None."""
+  file = ensureTFile(fname,'READ')
+  tree = file.Get(treename)
+  hist = file.Get(cutflow)
+  meta = {
+    'trees':   { treename: tree.GetEntries() if tree and isinstance(tree,TTree) else None },
+    'cutflow': { cutflow: [hist.GetBinContent(i) for i in range(hist.GetNbinsX()+2)] if hist else None },
+  }
+  file.Close()
+  return meta
+  
+
+def getmetaindex(dirname):
+  """Return metadata index of a directory."""
+  if dirname not in _indexes:
+    _indexes[dirname] = MetaIndex(dirname)
+  return _indexes[dirname]
+  
+
+def getmeta(fname, treename='tree', cutflow='cutflow'):
+  """Return metadata of a file from the index of its directory,
+  or open the file and update the index if it is missing or out of date."""
+  stat = getstat(fname) if _options['enable'] else None
+  if not stat: # disabled, or file does not exist: open file directly to raise error
+    return readmeta(fname,treename,cutflow)
+  index = getmetaindex(os.path.dirname(fname))
+  meta  = index.get(fname,stat,treename,cutflow)
+  if not meta:
+    meta = index.update(fname,stat,readmeta(fname,treename,cutflow))
+    index.save()
+  return meta
+  
+
+def fillmetaindex(fnames, treename='tree', cutflow='cutflow', ncores=None, verb=0):
+  """Read metadata of all files that are missing or out of date in their index in parallel, and save the indexes.
+  Files that do not exist are skipped, so that the error is raised when their sample is created."""
+  if not _options['enable']:
+    return
+  pool = ProcessPool(ncores,name="fillmetaindex")
+  jobs = [ ] # (index, fname, stat) of each task
+  for fname in fnames:
+    stat = getstat(fname)
+    if not stat: continue
+    index = getmetaindex(os.path.dirname(fname))
+    if not index.get(fname,stat,treename,cutflow):
+      pool.add(readmeta,(fname,treename,cutflow),name=fname)
+      jobs.append((index,fname,stat))
+  if not jobs:
+    return
+  LOG.verb("fillmetaindex: Reading metadata of %d files with %d processes..."%(len(jobs),min(pool.nworkers,len(jobs))),verb,1)
+  for (index, fname, stat), meta in zip(jobs,pool.run()):
+    index.update(fname,stat,meta)
+  for index in set(j[0] for j in jobs):
+    index.save()
+  
+
+class MetaIndex(object):
+  """
+  Index of the metadata of all files in a directory, saved as a JSON file in the cache directory,
+  or, if enabled with setmetaindex(local=True), in the directory itself if it is local and writable.
+  Entries are addressed by file name, and are only valid if the file size and modification time did not change.
+  """
+  
+  def __init__(self, dirname):
+    self.dirname = dirname
+    islocal      = ':' not in dirname
+    if islocal and _options['local'] and os.access(dirname or '.',os.W_OK):
+      self.path  = os.path.join(dirname,".metaindex.json")
+    else:
+      key        = hashlib.sha1(os.path.abspath(dirname) if islocal else dirname).hexdigest()
+      self.path  = os.path.join(_options['cachedir'],key+".json")
+    self.files   = self.load()
+    self.changed = False
+  
+  def __repr__(self):
+    return '<%s(%r) at %s>'%(self.__class__.__name__,self.path,hex(id(self)))
+  
+  def load(self):
+    """Load entries from the index file."""
+    if not os.path.isfile(self.path):
+      return { }
+    try:
+      with open(self.path) as file:
+        return json.load(file)
+    except ValueError: # corrupted
+      LOG.warning("MetaIndex.load: Could not read %s! Ignoring..."%(self.path))
+      return { }
+  
+  def get(self, fname, stat, treename='tree', cutflow='cutflow'):
+    """Return metadata of a file if it is up to date, and contains the tree and cutflow histogram."""
+    meta = self.files.get(os.path.basename(fname),None)
+    if not meta or (meta['size'],meta['mtime'])!=tuple(stat):
+      return None
+    if treename not in meta['trees'] or cutflow not in meta['cutflow']:
+      return None
+    return meta
+  
+  def update(self, fname, stat, meta):
+    """Add metadata of a file. Keep other trees and histograms if the file did not change."""
+    old = self.files.get(os.path.basename(fname),None)
+    if old and (old['size'],old['mtime'])==tuple(stat):
+      old['trees'].update(meta['trees'])
+      old['cutflow'].update(meta['cutflow'])
+      meta = old
+    else:
+      meta = dict(meta,size=stat[0],mtime=stat[1])
+    self.files[os.path.basename(fname)] = meta
+    self.changed = True
+    return meta
+  
+  def save(self):
+    """Write index, merged with entries added by other processes in the meantime (see atomicwrite)."""
+    if not self.changed:
+      return
+    files = self.load()
+    files.update(self.files)
+    self.files = files
+    try:
+      with atomicwrite(self.path) as tmpname:
+        with open(tmpname,'w') as file:
+          json.dump(self.files,file)
+    except (IOError,OSError) as error: # e.g. read-only
+      LOG.warning("MetaIndex.save: Could not write %s: %s"%(self.path,error))
+    self.changed = False
+  
@@ -7,6 +7,11 @@ from TauFW.Plotter.plot.string import *
 from TauFW.Plotter.plot.utils import deletehist, printhist
 from TauFW.Plotter.sample.SampleStyle import *
 from TauFW.Plotter.plot.MultiDraw import MultiDraw
+from TauFW.Plotter.plot.RDataFrameDraw import RDataFrameDraw, isrdfexpr
+from TauFW.Plotter.sample.HistCache import gethistcache
+from TauFW.Plotter.sample.ColumnCache import getcolumncache
+from TauFW.Plotter.sample.TreeIO import enableprefetch, prepareread, getreadstats, isremote
+from TauFW.Plotter.sample.MetaIndex import getmeta
 from ROOT import TTree
 
 
@@ -79,8 +84,7 @@ class Sample(object):
     self.linecolor    = kwargs.get('lcolor',       kBlack       ) # line color
     self.tags         = kwargs.get('tags',         [ ]          ) # extra tags to be used for matching of search terms
     if not isinstance(self,MergedSample):
-      file = ensureTFile(self.filename) # check file
-      file.Close()
+      getmeta(self.filename,self.treename) # check file, without opening it if it is indexed
       if self.isdata:
         self.setnevents(self.binnevts,self.binsumw)
       elif not self.isembed: #self.xsec>=0:
@@ -193,12 +197,20 @@ class Sample(object):
   
   def get_newfile_and_tree(self):
     """Create and return a new TFile and TTree without saving to self for thread safety."""
+    enableprefetch(self.filename) # for remote files
     file = ensureTFile(self.filename,'READ')
     tree = file.Get(self.treename)
     if not tree or not isinstance(tree,TTree):
       LOG.throw(IOError,'Sample.get_newfile_and_tree: Could not find tree %r for %r in %s!'%(self.treename,self.name,self.filename))
     return file, tree
   
+  def getentries(self):
+    """Return number of entries in the tree, from the metadata index if possible."""
+    nentries = getmeta(self.filename,self.treename)['trees'][self.treename]
+    if nentries==None:
+      nentries = self.tree.GetEntries()
+    return nentries
+  
   @property
   def tree(self):
     if not self.file:
@@ -361,21 +373,21 @@ class Sample(object):
    return None
   
   def setnevents(self,binnevts=None,binsumw=None,cutflow='cutflow'):
-    """Automatocally set number of events from the cutflow histogram."""
-    file   = self.getfile()
-    cfhist = file.Get(cutflow)
+    """Automatocally set number of events from the cutflow histogram, via the metadata index."""
+    cfbins = getmeta(self.filename,self.treename,cutflow)['cutflow'][cutflow] # bin contents
     if binnevts==None: binnevts = self.binnevts
     if binsumw==None:  binsumw  = self.binsumw
-    if not cfhist:
+    if not cfbins:
       errstr = 'Could not find cutflow histogram %r in %s!'%(cutflow,self.filename)
       if self.nevents>0:
         if self.sumweights<=0:
           self.sumweights = self.nevents
         LOG.warning("Could not find cutflow histogram %r in %s! nevents=%.1f, sumweights=%.1f"%(cutflow,self.filename,self.nevents,self.sumweights))
+        return self.nevents
       else:
         LOG.throw(IOError,"Could not find cutflow histogram %r in %s!"%(cutflow,self.filename))
-    self.nevents    = cfhist.GetBinContent(binnevts)
-    self.sumweights = cfhist.GetBinContent(binsumw)
+    self.nevents    = cfbins[min(binnevts,len(cfbins)-1)] # like TH1::GetBinContent
+    self.sumweights = cfbins[min(binsumw,len(cfbins)-1)]
     if self.nevents<=0:
       LOG.warning("Sample.setnevents: Bin %d of %r to retrieve nevents is %s<=0!"
                   "In initialization, please specify the keyword 'binnevts' to select the right bin, or directly set the number of events with 'nevts'."%(binnevts,self.nevents,cutflow))
@@ -383,7 +395,6 @@ class Sample(object):
       LOG.warning("Sample.setnevents: Bin %d of %r to retrieve sumweights is %s<=0!"
                   "In initialization, please specify the keyword 'binsumw' to select the right bin, or directly set the number of events with 'sumw'."%(binsumw,self.sumweights,cutflow))
       self.sumweights = self.nevents
-    file.Close()
     if 0<self.nevents<self.nexpevts*0.97: # check for missing events
       LOG.warning('Sample.setnevents: Sample %r has significantly fewer events (%d) than expected (%d).'%(self.name,self.nevents,self.nexpevts))
     return self.nevents
@@ -535,113 +546,215 @@ class Sample(object):
     self.splitsamples = splitsamples # save list of split samples
     return splitsamples
   
+  def multidraw(self, varexps, cuts, drawopt, hists, **kwargs):
+    """Fill histograms from the tree with MultiDraw, or RDataFrame with backend='RDataFrame'.
+    If the global histogram cache is set, take histograms from the cache, and only draw missing ones.
+    If the global column cache is set, fill histograms from the cached columns, if the expressions allow it.
+    For several selections, pass a list of cuts, and a list of varexps and hists for each.
+    With chunk=(ichunk,nchunks), only fill the ichunk-th of nchunks equal entry ranges of the tree.
+    For MultiDraw, only the branches used in the expressions are activated and cached in the TTreeCache."""
+    verbosity = LOG.getverbosity(kwargs)
+    histcache = gethistcache() if kwargs.get('cache',True) else None
+    colcache  = getcolumncache()
+    chunk     = kwargs.get('chunk', None) # (ichunk, nchunks)
+    backend   = kwargs.get('backend', 'MultiDraw') # 'MultiDraw' or 'RDataFrame'
+    if not isinstance(cuts,list):
+      cuts, varexps, hists = [cuts], [varexps], [hists]
+    if histcache:
+      missing = [ ] # cuts, varexps, hists and keys of histograms that are not cached
+      for cuts_, varexps_, hists_ in zip(cuts,varexps,hists):
+        keys   = histcache.getkeys(self.filename,self.treename,cuts_,drawopt,varexps_,hists_,chunk=chunk)
+        misses = [i for i, (key, hist) in enumerate(zip(keys,hists_)) if not histcache.get(key,hist)]
+        if misses:
+          missing.append((cuts_,[varexps_[i] for i in misses],[hists_[i] for i in misses],[keys[i] for i in misses]))
+      nhists  = sum(len(h) for h in hists)
+      nmisses = sum(len(m[2]) for m in missing)
+      LOG.verb("Sample.multidraw: %d/%d histograms of %r from cache"%(nhists-nmisses,nhists,self.name),verbosity,2)
+      if not missing:
+        return
+      cuts, varexps, hists, keys = [list(m) for m in zip(*missing)]
+    if not (colcache and colcache.draw(self.filename,self.treename,varexps,cuts,hists,drawopt=drawopt,chunk=chunk,verb=verbosity)):
+      try:
+        file, tree = self.get_newfile_and_tree() # create new file and tree for thread safety
+        dkwargs = { }
+        if chunk: # entry range
+          ichunk, nchunks = chunk
+          ntot    = tree.GetEntries()
+          first   = ichunk*ntot//nchunks
+          dkwargs = { 'firstentry': first, 'nentries': (ichunk+1)*ntot//nchunks-first }
+        if len(cuts)==1:
+          dargs = (varexps[0],cuts[0],drawopt)
+          dkwargs['hists'] = hists[0]
+        else: # fill histograms of all selections in one loop
+          dargs = (varexps,cuts,drawopt)
+          dkwargs['hists'] = hists
+        if backend=='RDataFrame' and isrdfexpr(cuts,varexps):
+          out = RDataFrameDraw(tree,*dargs,nthreads=kwargs.get('nthreads',None),**dkwargs) # RDataFrame sets up its own TTreeCache
+        else: # MultiDraw by default
+          if backend=='RDataFrame':
+            LOG.warning("Sample.multidraw: Expressions for %r cannot be compiled by RDataFrame. Using MultiDraw..."%(self.name))
+          prepareread(tree,[cuts,varexps],remote=isremote(self.filename),verb=verbosity,
+                      firstentry=dkwargs.get('firstentry',0),nentries=dkwargs.get('nentries',-1))
+          out = tree.MultiDraw(*dargs,**dkwargs)
+        nbytes, ncalls = getreadstats(file)
+        LOG.verb("Sample.multidraw: Read %.2f MB in %d calls from %s for %d histograms of %r"%(
+                 nbytes/1024.**2,ncalls,self.filename,sum(len(h) for h in hists),self.name),verbosity,1)
+        file.Close()
+      except KeyboardInterrupt:
+        nhists = sum(len(v) for v in varexps)
+        LOG.throw(KeyboardInterrupt,"Interrupted Sample.gethist for %r (%d histogram%s)"%(self.name,nhists,'' if nhists==1 else 's'))
+    if histcache:
+      for keys_, hists_ in zip(keys,hists):
+        for key, hist in zip(keys_,hists_):
+          histcache.put(key,hist) # before scaling
+  
+  def getsplithists(self, *args, **kwargs):
+    """Create and fill histograms for all split samples, reading each tree only once.
+    Return a list with the histogram (or list of histograms) for each split sample."""
+    samples = kwargs.pop('split', self.splitsamples) # split samples to fill
+    groups  = { } # split samples sharing the same file and tree, e.g. not shifted by SampleSet.shift
+    for sample in samples:
+      groups.setdefault((sample.filename,sample.treename),[ ]).append(sample)
+    results = { }
+    for group in groups.itervalues():
+      for sample, result in zip(group,group[0].gethist(*args,split=group,**kwargs)):
+        results[sample] = result
+    return [results[s] for s in samples]
+  
   def gethist(self, *args, **kwargs):
-    """Create and fill a histogram from a tree."""
+    """Create and fill a histogram from a tree.
+    For a list of Selection objects, fill the histograms of all selections in one loop over the tree,
+    and return a list with the histogram (or list of histograms) for each selection.
+    Split samples sharing this sample's file and tree can be filled in the same loop with
+    split=[...], in which case a list with the result for each split sample is returned."""
     variables, selection, issingle = unwrap_gethist_args(*args)
+    ismulti    = isinstance(selection,list)
+    selections = selection if ismulti else [selection]
+    samples    = kwargs.get('split',    None           ) or [self] # split samples with the same file and tree
     verbosity  = LOG.getverbosity(kwargs)
-    scale      = kwargs.get('scale',    1.0            ) * self.scale * self.norm
-    name       = kwargs.get('name',     self.name      ) # hist name
-    name      += kwargs.get('tag',      ""             ) # tag for hist name
-    title      = kwargs.get('title',    self.title     ) # hist title
     blind      = kwargs.get('blind',    self.isdata    ) # blind data in some given range, e.g. blind={xvar:(xmin,xmax)}
-    fcolor     = kwargs.get('color',    self.fillcolor ) # fill color
-    lcolor     = kwargs.get('lcolor',   self.linecolor ) # line color
+    cache      = kwargs.get('cache',    True           ) # use histogram cache, if set
     #replaceweight = kwargs.get('replaceweight', None )
-    undoshifts = self.isdata and (any('Up' in v.name or 'Down' in v.name for v in variables)
-                                  or 'Up' in selection or 'Down' in selection)
     drawopt = 'E0' if self.isdata else 'HIST'
     drawopt = kwargs.get('option', drawopt ) + 'gOff'
+    jobs    = [(sample,selection) for sample in samples for selection in selections]
     
     # SELECTION STRING & WEIGHTS
-    if self.isdata:
-      weight = joinweights(self.weight,self.extraweight,kwargs.get('weight',""))
-    else:
-      weight = joinweights(selection.weight,self.weight,self.extraweight,kwargs.get('weight',""))
-    cuts     = joincuts(selection.selection,self.cuts,kwargs.get('cuts',""),kwargs.get('extracuts',""))
-    #if replaceweight:
-    #  if len(replaceweight)==2 and not isList(replaceweight[0]):
-    #    replaceweight = [replaceweight]
-    #  for pattern, substitution in replaceweight:
-    #    LOG.verb('Sample.gethist: replacing weight: before %r'%weight,verbosity,3)
-    #    weight = re.sub(pattern,substitution,weight)
-    #    weight = weight.replace("**","*").strip('*')
-    #    LOG.verb('Sample.gethist: replacing weight: after  %r'%weight,verbosity,3)
-    cuts = joincuts(cuts,weight=weight)
+    allcuts = [ ]
+    for sample, selection in jobs:
+      if sample.isdata:
+        weight = joinweights(sample.weight,sample.extraweight,kwargs.get('weight',""))
+      else:
+        weight = joinweights(selection.weight,sample.weight,sample.extraweight,kwargs.get('weight',""))
+      cuts     = joincuts(selection.selection,sample.cuts,kwargs.get('cuts',""),kwargs.get('extracuts',""))
+      #if replaceweight:
+      #  if len(replaceweight)==2 and not isList(replaceweight[0]):
+      #    replaceweight = [replaceweight]
+      #  for pattern, substitution in replaceweight:
+      #    LOG.verb('Sample.gethist: replacing weight: before %r'%weight,verbosity,3)
+      #    weight = re.sub(pattern,substitution,weight)
+      #    weight = weight.replace("**","*").strip('*')
+      #    LOG.verb('Sample.gethist: replacing weight: after  %r'%weight,verbosity,3)
+      cuts = joincuts(cuts,weight=weight)
+      allcuts.append(cuts)
     
     # PREPARE HISTOGRAMS
-    hists   = [ ]
-    varexps = [ ]
-    for variable in variables:
+    allhists   = [ ]
+    allvarexps = [ ]
+    for sample, selection in jobs:
+      name       = kwargs.get('name',  sample.name  ) # hist name
+      name      += kwargs.get('tag',   ""           ) # tag for hist name
+      title      = kwargs.get('title', sample.title ) # hist title
+      undoshifts = self.isdata and (any('Up' in v.name or 'Down' in v.name for v in variables)
+                                    or 'Up' in selection or 'Down' in selection)
+      hists   = [ ]
+      varexps = [ ]
+      for variable in variables:
+        if ismulti: # binning may depend on selection; keep caller's variables unchanged
+          variable = variable.clone()
+          variable.changecontext(selection)
       
-      # VAREXP
-      hname  = makehistname(variable,name) # $VAR_$NAME
-      varcut = ""
-      if self.isdata and (blind or variable.blindcuts or variable.cut or variable.dataweight):
-        blindcuts = ""
-        if blind:
-          if isinstance(blind,tuple) and len(blind)==2:
-            blindcuts = variable.blind(*blind)
-          elif variable.name_ in self.blinddict:
-            blindcuts = variable.blind(*self.blinddict[variable.name_])
-          elif variable.blindcuts:
-            blindcuts = variable.blindcuts
-        varcut = joincuts(blindcuts,variable.cut,weight=variable.dataweight)
-      elif not self.isdata and (variable.cut or variable.weight):
-        varcut = joincuts(variable.cut,weight=variable.weight)
-      if varcut:
-        varexp = (variable.drawcmd(hname),varcut)
-      else:
-        varexp = variable.drawcmd(hname)
-      if undoshifts:
-        varexp = undoshift(varexp)
-      varexps.append(varexp)
+        # VAREXP
+        hname  = makehistname(variable,name) # $VAR_$NAME
+        varcut = ""
+        if self.isdata and (blind or variable.blindcuts or variable.cut or variable.dataweight):
+          blindcuts = ""
+          if blind:
+            if isinstance(blind,tuple) and len(blind)==2:
+              blindcuts = variable.blind(*blind)
+            elif variable.name_ in sample.blinddict:
+              blindcuts = variable.blind(*sample.blinddict[variable.name_])
+            elif variable.blindcuts:
+              blindcuts = variable.blindcuts
+          varcut = joincuts(blindcuts,variable.cut,weight=variable.dataweight)
+        elif not self.isdata and (variable.cut or variable.weight):
+          varcut = joincuts(variable.cut,weight=variable.weight)
+        if varcut:
+          varexp = (variable.drawcmd(hname),varcut)
+        else:
+          varexp = variable.drawcmd(hname)
+        if undoshifts:
+          varexp = undoshift(varexp)
+        varexps.append(varexp)
       
-      # HISTOGRAM
-      hist = variable.gethist(hname,title,sumw2=(not self.isdata),poisson=self.isdata)
-      hist.SetDirectory(0)
-      hists.append(hist)
+        # HISTOGRAM
+        hist = variable.gethist(hname,title,sumw2=(not self.isdata),poisson=self.isdata)
+        hist.SetDirectory(0)
+        hists.append(hist)
+      
+      LOG.insist(len(variables)==len(varexps)==len(hists),
+                 "Number of variables (%d), variable expressions (%d) and histograms (%d) must be equal!"%(len(variables),len(varexps),len(hists)))
+      allhists.append(hists)
+      allvarexps.append(varexps)
     
     # FILL HISTOGRAMS
-    LOG.insist(len(variables)==len(varexps)==len(hists),
-               "Number of variables (%d), variable expressions (%d) and histograms (%d) must be equal!"%(len(variables),len(varexps),len(hists)))
-    if varexps:
-      try:
-        file, tree = self.get_newfile_and_tree() # create new file and tree for thread safety
-        out = tree.MultiDraw(varexps,cuts,drawopt,hists=hists)
-        file.Close()
-      except KeyboardInterrupt:
-        LOG.throw(KeyboardInterrupt,"Interrupted Sample.gethist for %r (%d histogram%s)"%(self.name,len(varexps),'' if len(varexps)==1 else 's'))
+    if variables:
+      self.multidraw(allvarexps,allcuts,drawopt,allhists,cache=cache,chunk=kwargs.get('chunk',None),
+                     backend=kwargs.get('backend','MultiDraw'),nthreads=kwargs.get('nthreads',None),verb=verbosity)
     
     # FINISH
     nentries = 0
     integral = 0
-    for variable, hist in zip(variables,hists):
-      if scale!=1.0:   hist.Scale(scale)
-      if scale==0.0:   LOG.warning("Scale of %s is 0!"%self.name)
-      hist.SetLineColor(lcolor)
-      hist.SetFillColor(kWhite if self.isdata or self.issignal else fcolor)
-      hist.SetMarkerColor(lcolor)
-      if hist.GetEntries()>nentries:
-        nentries = hist.GetEntries()
-        integral = hist.Integral()
+    for (sample, selection), hists in zip(jobs,allhists):
+      scale  = kwargs.get('scale',  1.0              ) * sample.scale * sample.norm
+      fcolor = kwargs.get('color',  sample.fillcolor ) # fill color
+      lcolor = kwargs.get('lcolor', sample.linecolor ) # line color
+      if scale==0.0:   LOG.warning("Scale of %s is 0!"%sample.name)
+      for hist in hists:
+        if scale!=1.0:   hist.Scale(scale)
+        hist.SetLineColor(lcolor)
+        hist.SetFillColor(kWhite if sample.isdata or sample.issignal else fcolor)
+        hist.SetMarkerColor(lcolor)
+        if hist.GetEntries()>nentries:
+          nentries = hist.GetEntries()
+          integral = hist.Integral()
     
     # PRINT
     if verbosity>=3:
       print ">>>\n>>> Sample.gethist: %s, %s"%(color(self.name,color="grey"),self.fnameshort)
       print ">>>   entries: %d (%.2f integral)"%(nentries,integral)
-      print ">>>   scale: %.6g (scale=%.6g, norm=%.6g)"%(scale,self.scale,self.norm)
-      print ">>>   %r"%(cuts)
-      if verbosity>=4:
-        for var, varexp, hist in zip(variables,varexps,hists):
-          print '>>>   Variable %r: varexp=%r, entries=%d, integral=%d'%(var.name,varexp,hist.GetEntries(),hist.Integral())
-          #print '>>>   Variable %r: cut=%r, weight=%r, varexp=%r'%(var.name,var.cut,var.weight,varexp)
-          if verbosity>=5:
-            printhist(hist,pre=">>>   ")
+      for (sample, selection), cuts, varexps, hists in zip(jobs,allcuts,allvarexps,allhists):
+        if len(samples)>1:
+          print ">>>   split sample %s:"%(color(sample.name,color="grey"))
+        print ">>>   scale: %.6g (scale=%.6g, norm=%.6g)"%(kwargs.get('scale',1.0)*sample.scale*sample.norm,sample.scale,sample.norm)
+        print ">>>   %r"%(cuts)
+        if verbosity>=4:
+          for var, varexp, hist in zip(variables,varexps,hists):
+            print '>>>   Variable %r: varexp=%r, entries=%d, integral=%d'%(var.name,varexp,hist.GetEntries(),hist.Integral())
+            #print '>>>   Variable %r: cut=%r, weight=%r, varexp=%r'%(var.name,var.cut,var.weight,varexp)
+            if verbosity>=5:
+              printhist(hist,pre=">>>   ")
       
     
-    if issingle:
-      return hists[0]
-    return hists
+    results = [ ]
+    for i in range(0,len(allhists),len(selections)): # for each (split) sample
+      hists = allhists[i:i+len(selections)]
+      if issingle:
+        hists = [h[0] for h in hists]
+      results.append(hists if ismulti else hists[0])
+    if kwargs.get('split',None):
+      return results
+    return results[0]
   
   def gethist2D(self, *args, **kwargs):
     """Create and fill a 2D histogram from a tree."""
@@ -651,6 +764,7 @@ class Sample(object):
     name      = kwargs.get('name',          self.name  )
     name     += kwargs.get('tag',           ""         )
     title     = kwargs.get('title',         self.title )
+    cache     = kwargs.get('cache',         True       ) # use histogram cache, if set
     drawopt   = 'COLZ'
     drawopt   = 'gOff'+kwargs.get('option', drawopt    )
     
@@ -689,12 +803,8 @@ class Sample(object):
     LOG.insist(len(variables)==len(varexps)==len(hists),
                "Number of variables (%d), variable expressions (%d) and histograms (%d) must be equal!"%(len(variables),len(varexps),len(hists)))
     if varexps:
-      try:
-        file, tree = self.get_newfile_and_tree() # create new file and tree for thread safety
-        out = tree.MultiDraw(varexps,cuts,drawopt,hists=hists)
-        file.Close()
-      except KeyboardInterrupt:
-        LOG.throw(KeyboardInterrupt,"Interrupted Sample.gethist for %r (%d histogram%s)"%(self.name,len(varexps),'' if len(varexps)==1 else 's'))
+      self.multidraw(varexps,cuts,drawopt,hists,cache=cache,chunk=kwargs.get('chunk',None),
+                     backend=kwargs.get('backend','MultiDraw'),nthreads=kwargs.get('nthreads',None),verb=verbosity)
     
     # FINISH
     nentries = 0
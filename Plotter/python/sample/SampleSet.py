@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
 # Author: Izaak Neutelings (July 2020)
 import os, re
-from math import sqrt
+from math import sqrt, ceil
 from copy import copy, deepcopy
 from TauFW.Plotter.sample.utils import *
 from TauFW.Plotter.sample.HistSet import HistSet
 from TauFW.Plotter.plot.string import makelatex, maketitle, makehistname
 from TauFW.Plotter.plot.Variable import Variable
 from TauFW.Plotter.plot.Stack import Stack
-from TauFW.Plotter.plot.MultiThread import MultiProcessor
+from TauFW.Plotter.plot.utils import addhistlists
+from TauFW.Plotter.plot.MultiThread import ProcessPool
 from TauFW.common.tools.LoadingBar import LoadingBar
 
 
@@ -42,6 +43,7 @@ class SampleSet(object):
     self.loadingbar     = kwargs.get('loadingbar', True ) and self.verbosity<=1
     self.ignore         = kwargs.get('ignore',     [ ]  )
     self.sharedsamples  = kwargs.get('shared',     [ ]  ) # shared samples with set variation to reduce number of files
+    self.backend        = kwargs.get('backend', 'MultiDraw' ) # fill histograms with 'MultiDraw' or 'RDataFrame'
     #self.shiftQCD       = kwargs.get('shiftQCD',   0    )
     #self.weight         = kwargs.get('weight',     ""   ) # use Sample objects to store weight !
     self.closed         = False
@@ -246,6 +248,7 @@ class SampleSet(object):
     kwargs['label']     = self.label
     kwargs['channel']   = self.channel
     kwargs['verbosity'] = self.verbosity
+    kwargs['backend']   = self.backend
     newset = SampleSet(datasample,expsamples,sigsamples,**kwargs)
     newset.closed = close
     return newset
@@ -307,11 +310,15 @@ class SampleSet(object):
     return result.data
   
   def gethists(self, *args, **kwargs):
-    """Create and fill histograms for all samples and return lists of histograms."""
+    """Create and fill histograms for all samples and return lists of histograms.
+    For a list of Selection objects, fill the histograms of all selections in one loop over
+    each sample's tree, and return a list of HistSet objects, one for each selection."""
     verbosity     = LOG.getverbosity(kwargs)
     if verbosity>=1:
       print ">>> gethists"
     variables, selection, issingle = unwrap_gethist_args(*args)
+    ismulti       = isinstance(selection,list) # several selections
+    selections    = selection if ismulti else [selection]
     datavars      = filter(lambda v: v.data,variables)    # filter out gen-level variables
     dodata        = kwargs.get('data',          True    ) # create data hists
     domc          = kwargs.get('mc',            True    ) # create expected (SM background) hists
@@ -321,10 +328,14 @@ class SampleSet(object):
     dataweight    = kwargs.get('dataweight',    ""      ) # extra weight for data
     replaceweight = kwargs.get('replaceweight', None    ) # replace substring of weight
     split         = kwargs.get('split',         True    ) # split samples into components
+    onepass       = kwargs.get('onepass',       True    ) # fill all components of a split sample in one loop over its tree
     blind         = kwargs.get('blind',         True    ) # blind data in some given range: blind={xvar:(xmin,xmax)}
     scaleup       = kwargs.get('scaleup',       0.0     ) # scale up histograms
     reset         = kwargs.get('reset',         False   ) # reset scales
     parallel      = kwargs.get('parallel',      False   ) # create and fill hists in parallel
+    ncores        = kwargs.get('ncores',        None    ) # number of worker processes; default: number of CPUs
+    chunksize     = kwargs.get('chunksize',     1000000 ) # split samples into tasks of about this many entries
+    backend       = kwargs.get('backend',       self.backend ) # 'MultiDraw' or 'RDataFrame'
     tag           = kwargs.get('tag',           ""      )
     method        = kwargs.get('method',        None    ) # data-driven method; 'QCD_OSSS', 'QCD_ABCD', 'JTF', 'FakeFactor', ...
     imethod       = kwargs.get('imethod',       -1      ) # position on list; -1 = last (bottom of stack)
@@ -349,7 +360,7 @@ class SampleSet(object):
       ensuremodule(method,'Plotter.methods') # load SampleSet class method
     
     # FILTER
-    samples = [ ]
+    jobs = [ ] # (sample, list of split samples to fill in one pass, or None)
     for sample in self.samples:
       if not dosignal and sample.issignal: continue
       if not dodata   and sample.isdata:   continue
@@ -357,23 +368,42 @@ class SampleSet(object):
         subsamples = sample.splitsamples
       else:
         subsamples = [sample] # sample itself
+      selected = [ ]
       for subsample in subsamples:
         if filters and not subsample.match(*filters): continue
         if vetoes  and subsample.match(*vetoes): continue
-        samples.append(subsample)
+        if reset: subsample.resetscale()
+        if subsample.name in self.ignore: continue
+        selected.append(subsample)
+      if onepass and len(selected)>1 and not sample.isdata:
+        jobs.append((sample,selected))
+      else:
+        jobs.extend((s,None) for s in selected)
     #if nojtf:
     #  samples = [s for s in samples if not ((not keepWJ and s.match('WJ',"W*J","W*j")) or "gen_match_2==6" in s.cuts or "genPartFlav_2==0" in s.cuts)]
     
     # INPUT / OUTPUT
     mcargs     = (variables,selection)
     dataargs   = (datavars, selection)
-    expkwargs  = { 'tag':tag, 'weight': weight, 'replaceweight': replaceweight, 'verbosity': verbosity, } #'nojtf': nojtf 
-    sigkwargs  = { 'tag':tag, 'weight': weight, 'replaceweight': replaceweight, 'verbosity': verbosity, 'scaleup': scaleup }
-    datakwargs = { 'tag':tag, 'weight': dataweight, 'verbosity': verbosity, 'blind': blind, 'parallel': parallel }
-    result     = HistSet(variables,dodata,doexp,dosignal) # container for dictionaries of histogram (list): data, exp, signal
+    nthreads   = None
+    if parallel and backend=='RDataFrame': # multithreading in each event loop instead of several processes
+      nthreads = ncores or -1 # all cores by default
+      parallel = False
+    expkwargs  = { 'tag':tag, 'weight': weight, 'replaceweight': replaceweight, 'verbosity': verbosity, 'backend': backend, 'nthreads': nthreads, } #'nojtf': nojtf 
+    sigkwargs  = { 'tag':tag, 'weight': weight, 'replaceweight': replaceweight, 'verbosity': verbosity, 'scaleup': scaleup, 'backend': backend, 'nthreads': nthreads }
+    datakwargs = { 'tag':tag, 'weight': dataweight, 'verbosity': verbosity, 'blind': blind, 'parallel': parallel, 'backend': backend, 'nthreads': nthreads }
+    results    = [HistSet(variables,dodata,doexp,dosignal) for s in selections] # containers for dictionaries of histogram (list): data, exp, signal
+    result     = results[0]
     if not variables:
       LOG.warning("Sample.gethists: No variables to make histograms for...")
-      return result
+      return results if ismulti else result
+    def addhists(dtype,varset,hists): # help function to add histograms of a sample for each selection
+      for result, hists_ in zip(results,hists if ismulti else [hists]):
+        for var, hist in zip(varset,hists_): # assume match variables -> histograms
+          if dtype=='data':
+            result.data[var] = hist
+          else:
+            getattr(result,dtype)[var].append(hist)
     
     # PRINT
     bar = None
@@ -384,61 +414,79 @@ class SampleSet(object):
       #print ">>> split=%s, makeQCD=%s, makeJTF=%s, nojtf=%s, keepWJ=%s"%(split,makeQCD,makeJTF,nojtf,keepWJ)
       print '>>>   with extra weights "%s" for MC and "%s" for data'%(weight,dataweight)
     elif self.loadingbar and verbosity<=1:
-      bar = LoadingBar(len(samples),width=16,pre=">>> %s: "%(task),counter=True,remove=True) # %s: selection.title
+      bar = LoadingBar(len(jobs),width=16,pre=">>> %s: "%(task),counter=True,remove=True) # %s: selection.title
     
     # GET HISTOGRAMS (PARALLEL)
+    # Split each sample into tasks over entry ranges, run them on a fixed number of processes,
+    # and add the partial histograms of each sample
     if parallel:
-      expproc  = MultiProcessor()
-      sigproc  = MultiProcessor()
-      dataproc = MultiProcessor()
-      for sample in samples:
-        if reset: sample.resetscale()
-        if sample.name in self.ignore: continue
+      pool    = ProcessPool(ncores,name="gethists")
+      jobinfo = { } # data type and variables of each job
+      tasks   = [ ] # job index and number of chunks of each task
+      for ijob, (sample, subsamples) in enumerate(jobs):
         if dosignal and sample.issignal: # SIGNAL
-          sigproc.start(sample.gethist,mcargs,sigkwargs,name=sample.title)
+          dtype, varset, hargs, hkwargs = 'signal', variables, mcargs, sigkwargs
         elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
-          expproc.start(sample.gethist,mcargs,expkwargs,name=sample.title)
+          dtype, varset, hargs, hkwargs = 'exp', variables, mcargs, expkwargs
         elif dodata and sample.isdata:   # DATA
-          dataproc.start(sample.gethist,dataargs,datakwargs,name=sample.title)
-      for dtype, processor, varset in [('exp',expproc,variables),('sig',sigproc,variables),('data',dataproc,datavars)]:
-        for process in processor:
-          if bar: bar.message(process.name)
-          newhists = process.join()
-          for var, hist in zip(varset,newhists): # assume match variables -> histograms
-            if dtype=='data':
-              getattr(result,dtype)[var] = hist
-            else:
-              getattr(result,dtype)[var].append(hist)
-          if bar: bar.count("%s done"%process.name)
+          dtype, varset, hargs, hkwargs = 'data', datavars, dataargs, datakwargs
+        else:
+          continue
+        gethist  = sample.getsplithists if subsamples else sample.gethist
+        hkwargs  = dict(hkwargs,parallel=False) # no nested processes
+        if subsamples: # all split samples in one pass
+          hkwargs['split'] = subsamples
+        nentries = sample.getentries()
+        nchunks  = max(1,min(pool.nworkers,int(ceil(nentries/float(chunksize)))))
+        jobinfo[ijob] = (dtype,varset)
+        for ichunk in range(nchunks):
+          ckwargs = dict(hkwargs,chunk=(ichunk,nchunks)) if nchunks>1 else hkwargs
+          pool.add(gethist,hargs,ckwargs,name=sample.title,cost=nentries/nchunks)
+          tasks.append((ijob,nchunks))
+      outs   = { } # sum of partial histograms of each job
+      ndones = { } # number of finished tasks of each job
+      for itask, name, out in pool:
+        ijob, nchunks = tasks[itask]
+        if ijob in outs:
+          addhistlists(outs[ijob],out)
+        else:
+          outs[ijob] = out
+        ndones[ijob] = ndones.get(ijob,0)+1
+        if bar and ndones[ijob]==nchunks: bar.count("%s done"%name)
+      for ijob in sorted(outs): # keep order of samples
+        dtype, varset = jobinfo[ijob]
+        for hists in (outs[ijob] if jobs[ijob][1] else [outs[ijob]]):
+          addhists(dtype,varset,hists)
     
     # GET HISTOGRAMS (SEQUENTIAL)
     else:
-      for sample in samples:
+      for sample, subsamples in jobs:
         if bar:   bar.message(sample.title)
-        if reset: sample.resetscale()
-        if sample.name in self.ignore:
-          if bar: bar.count("%s skipped"%sample.title)
-          continue
-        if dosignal and sample.issignal: # SIGNAL
+        if subsamples: # all split samples in one pass
+          if dosignal and sample.issignal: # SIGNAL
+            for hists in sample.getsplithists(*mcargs,split=subsamples,**sigkwargs):
+              addhists('signal',variables,hists)
+          elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
+            for hists in sample.getsplithists(*mcargs,split=subsamples,**expkwargs):
+              addhists('exp',variables,hists)
+        elif dosignal and sample.issignal: # SIGNAL
           hists = sample.gethist(*mcargs,**sigkwargs)
-          for var, hist in zip(variables,hists):
-            result.signal[var].append(hist)
+          addhists('signal',variables,hists)
         elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
           hists = sample.gethist(*mcargs,**expkwargs)
-          for var, hist in zip(variables,hists):
-            result.exp[var].append(hist)
+          addhists('exp',variables,hists)
         elif dodata and sample.isdata:   # DATA
           hists = sample.gethist(*mcargs,**datakwargs)
-          for var, hist in zip(datavars,hists):
-            result.data[var] = hist
+          addhists('data',datavars,hists)
         if bar: bar.count("%s done"%sample.title)
     
     # EXTRA METHODS
     if method:
-      hists = getattr(self,method)(*dataargs,**kwargs)
-      for var, hist in zip(datavars,hists):
-        idx = imethod if imethod>=0 else len(result.exp[var])+1+imethod
-        result.exp[var].insert(idx,hist)
+      allhists = getattr(self,method)(*dataargs,**kwargs)
+      for result, hists in zip(results,allhists if ismulti else [allhists]):
+        for var, hist in zip(datavars,hists):
+          idx = imethod if imethod>=0 else len(result.exp[var])+1+imethod
+          result.exp[var].insert(idx,hist)
     
     ## ADD QCD
     #if makeJTF:
@@ -462,27 +510,30 @@ class SampleSet(object):
     # YIELDS
     if verbosity>=2 and len(variables)>0:
       var = variables[0]
-      print ">>> selection:"
-      print ">>>  %r"%(selection.selection)
-      print ">>> yields: "
-      TAB = LOG.table("%11.1f %11.2f    %r")
-      TAB.printheader("entries","integral","hist name")
-      totint = 0
-      totent = 0
-      if dodata:
-        TAB.printrow(result.data[var].Integral(),result.data[var].GetEntries(),result.data[var].GetName())
-      for hist in result.exp[var]:
-        totint += hist.Integral()
-        totent += hist.GetEntries()
-        TAB.printrow(hist.Integral(),hist.GetEntries(),hist.GetName())
-      TAB.printrow(totint,totent,"total exp.")
-      if dosignal:
-        for hist in result.signal[var]:
+      for selection, result in zip(selections,results):
+        print ">>> selection:"
+        print ">>>  %r"%(selection.selection)
+        print ">>> yields: "
+        TAB = LOG.table("%11.1f %11.2f    %r")
+        TAB.printheader("entries","integral","hist name")
+        totint = 0
+        totent = 0
+        if dodata:
+          TAB.printrow(result.data[var].Integral(),result.data[var].GetEntries(),result.data[var].GetName())
+        for hist in result.exp[var]:
+          totint += hist.Integral()
+          totent += hist.GetEntries()
           TAB.printrow(hist.Integral(),hist.GetEntries(),hist.GetName())
+        TAB.printrow(totint,totent,"total exp.")
+        if dosignal:
+          for hist in result.signal[var]:
+            TAB.printrow(hist.Integral(),hist.GetEntries(),hist.GetName())
     
     if issingle:
-      result.setsingle()
-      return result
+      for result in results:
+        result.setsingle()
+    if ismulti:
+      return results
     return result
   
   def gethists2D(self, *args, **kwargs):
@@ -496,6 +547,10 @@ class SampleSet(object):
     weight     = kwargs.get('weight',     ""       ) # extra weight (for MC only)
     dataweight = kwargs.get('dataweight', ""       ) # extra weight for data
     tag        = kwargs.get('tag',        ""       )
+    parallel   = kwargs.get('parallel',   False    ) # create and fill hists in parallel
+    ncores     = kwargs.get('ncores',     None     ) # number of worker processes; default: number of CPUs
+    chunksize  = kwargs.get('chunksize',  1000000  ) # split samples into tasks of about this many entries
+    backend    = kwargs.get('backend',    self.backend ) # 'MultiDraw' or 'RDataFrame'
     #makeJTF    = kwargs.get('JFR',        False    )
     #nojtf      = kwargs.get('nojtf',      makeJTF  )
     task       = kwargs.get('task',       "making histograms" )
@@ -503,9 +558,13 @@ class SampleSet(object):
     
     # INPUT / OUTPUT
     args       = (variables,selection)
-    expkwargs  = { 'tag':tag, 'weight': weight, 'verbosity': verbosity } #, 'nojtf': nojtf
-    sigkwargs  = { 'tag':tag, 'weight': weight, 'verbosity': verbosity }
-    datakwargs = { 'tag':tag, 'weight': dataweight, 'verbosity': verbosity }
+    nthreads   = None
+    if parallel and backend=='RDataFrame': # multithreading in each event loop instead of several processes
+      nthreads = ncores or -1 # all cores by default
+      parallel = False
+    expkwargs  = { 'tag':tag, 'weight': weight, 'verbosity': verbosity, 'backend': backend, 'nthreads': nthreads } #, 'nojtf': nojtf
+    sigkwargs  = { 'tag':tag, 'weight': weight, 'verbosity': verbosity, 'backend': backend, 'nthreads': nthreads }
+    datakwargs = { 'tag':tag, 'weight': dataweight, 'verbosity': verbosity, 'backend': backend, 'nthreads': nthreads }
     result     = HistSet(variables,dodata,doexp,dosignal)
     if not variables:
       LOG.warning("Sample.gethists: No variables to make histograms for...")
@@ -524,24 +583,60 @@ class SampleSet(object):
     bar = None
     if self.loadingbar and verbosity<=1:
       bar = LoadingBar(len(samples),width=16,pre=">>> %s: "%(task),counter=True,remove=True)
-    for sample in samples:
-      if bar:   bar.message(sample.title)
-      if sample.name in self.ignore:
-        if bar: bar.count("%s skipped"%sample.title)
-        continue
-      if dosignal and sample.issignal: # SIGNAL
-        hists = sample.gethist2D(*args,**sigkwargs)
-        for variable, hist in zip(variables,hists):
-          result.signal[variable].append(hist)
-      elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
-        hists = sample.gethist2D(*args,**expkwargs)
-        for variable, hist in zip(variables,hists):
-          result.exp[variable].append(hist)
-      elif dodata and sample.isdata:   # DATA
-        hists = sample.gethist2D(*args,**datakwargs)
+    if parallel: # split samples into tasks over entry ranges, and run them on a fixed number of processes
+      pool  = ProcessPool(ncores,name="gethists2D")
+      tasks = [ ] # sample index and number of chunks of each task
+      for isample, sample in enumerate(samples):
+        if sample.name in self.ignore: continue
+        if dosignal and sample.issignal: # SIGNAL
+          hkwargs = sigkwargs
+        elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
+          hkwargs = expkwargs
+        elif dodata and sample.isdata:   # DATA
+          hkwargs = datakwargs
+        else:
+          continue
+        nentries = sample.getentries()
+        nchunks  = max(1,min(pool.nworkers,int(ceil(nentries/float(chunksize)))))
+        for ichunk in range(nchunks):
+          ckwargs = dict(hkwargs,chunk=(ichunk,nchunks)) if nchunks>1 else hkwargs
+          pool.add(sample.gethist2D,args,ckwargs,name=sample.title,cost=nentries/nchunks)
+          tasks.append((isample,nchunks))
+      outs   = { } # sum of partial histograms of each sample
+      ndones = { } # number of finished tasks of each sample
+      for itask, name, out in pool:
+        isample, nchunks = tasks[itask]
+        if isample in outs:
+          addhistlists(outs[isample],out)
+        else:
+          outs[isample] = out
+        ndones[isample] = ndones.get(isample,0)+1
+        if bar and ndones[isample]==nchunks: bar.count("%s done"%name)
+      for isample in sorted(outs): # keep order of samples
+        sample = samples[isample]
+        hists  = outs[isample]
+        dtype  = 'signal' if sample.issignal else 'exp' if sample.isexp else 'data'
         for variable, hist in zip(variables,hists):
-          result.data[variable].append(hist)
-      if bar: bar.count("%s done"%sample.name)
+          getattr(result,dtype)[variable].append(hist)
+    else:
+      for sample in samples:
+        if bar:   bar.message(sample.title)
+        if sample.name in self.ignore:
+          if bar: bar.count("%s skipped"%sample.title)
+          continue
+        if dosignal and sample.issignal: # SIGNAL
+          hists = sample.gethist2D(*args,**sigkwargs)
+          for variable, hist in zip(variables,hists):
+            result.signal[variable].append(hist)
+        elif doexp and sample.isexp:     # EXPECTED (SM BACKGROUND)
+          hists = sample.gethist2D(*args,**expkwargs)
+          for variable, hist in zip(variables,hists):
+            result.exp[variable].append(hist)
+        elif dodata and sample.isdata:   # DATA
+          hists = sample.gethist2D(*args,**datakwargs)
+          for variable, hist in zip(variables,hists):
+            result.data[variable].append(hist)
+        if bar: bar.count("%s done"%sample.name)
     
     ## ADD JTF
     #if makeJTF:
@@ -687,6 +782,7 @@ class SampleSet(object):
       datasample = self.datasample
       sharedsamples.append(datasample)
     kwargs['shared'] = sharedsamples
+    kwargs.setdefault('backend',self.backend)
     newset = SampleSet(datasample,expsamples,sigsamples,**kwargs)
     newset.closed = close
     return newset
@@ -727,5 +823,6 @@ class SampleSet(object):
         sigsamples.append(newsample)
     if not filter:
         datasample = self.datasample
+    kwargs.setdefault('backend',self.backend)
     return SampleSet(datasample,expsamples,sigsamples,**kwargs)
   
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Description: Tune reading of trees for drawing: fill the TTreeCache with the branches used in the expressions,
+#              and optionally only activate those, with asynchronous prefetching for remote files
+import re
+import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
+from ROOT import gEnv
+from TauFW.common.tools.log import Logger
+LOG = Logger('TreeIO')
+namerexp = re.compile(r"(?<![\w.$])(?<!::)([A-Za-z_][\w.]*)(\$|\s*::)?") # identifiers: branches, leaves, aliases or functions
+functions = set([ # functions, constants and types known to TTreeFormula that do not need a branch
+  'abs','fabs','sqrt','exp','log','log10','pow','sin','cos','tan','asin','acos','atan','atan2',
+  'sinh','cosh','tanh','min','max','floor','ceil','pi','true','false',
+  'int','float','double','bool','char','short','long','unsigned',
+])
+_options = { # global options for Sample.multidraw
+  'activate':        False, # only activate branches used in the expressions (opt-in)
+  'cachesize':       30,    # TTreeCache size in MB for local files
+  'remotecachesize': 100,   # TTreeCache size in MB for remote files, to read in fewer, larger requests
+  'prefetch':        True,  # asynchronous prefetching of the next cache block for remote files
+}
+
+
+def setreadoptions(**kwargs):
+  """Set global options for reading trees in Sample.multidraw:
+  activate, cachesize, remotecachesize (in MB) and prefetch."""
+  for key, value in kwargs.iteritems():
+    if key not in _options:
+      LOG.throw(KeyError,"setreadoptions: Unknown option %r! Choose from %s"%(key,', '.join(sorted(_options))))
+    _options[key] = value
+  return _options
+  
+
+def isremote(fname):
+  """Check if a file is accessed over the network, e.g. via XRootD."""
+  return ':' in fname
+  
+
+def enableprefetch(fname):
+  """Enable asynchronous prefetching for remote files. Must be called before opening the file."""
+  if _options['prefetch'] and isremote(fname):
+    gEnv.SetValue("TFile.AsyncPrefetching",1)
+  
+
+def getnames(*exprs):
+  """Return set of identifiers in TTreeFormula expressions, skipping special functions
+  like Sum$ and Length$, and namespaces like TMath::."""
+  names = set()
+  for expr in exprs:
+    if isinstance(expr,(list,tuple)):
+      names |= getnames(*expr)
+    elif expr:
+      names |= set(n for n, s in namerexp.findall(expr.split('>>')[0]) if not s) # remove histogram name
+  return names
+  
+
+def getbranches(tree, *exprs, **kwargs):
+  """Return set of branches used by TTreeFormula expressions (cuts, weights or varexps),
+  including branches used by aliases, and the branches holding the length of arrays.
+  If unresolved is a set, it is filled with identifiers that are no branch, leaf, alias or known function."""
+  unresolved = kwargs.get('unresolved', None) # set to fill with unresolved identifiers
+  names      = getnames(*exprs)
+  branches   = set()
+  checked    = set()
+  while names:
+    name = names.pop()
+    checked.add(name)
+    alias = tree.GetAlias(name)
+    if alias:
+      names |= getnames(alias)-checked
+      continue
+    for bname in [name,name.split('.')[0]]: # e.g. jpt.size()
+      branch = tree.GetBranch(bname)
+      leaf   = tree.GetLeaf(bname)
+      if branch:
+        leaves = list(branch.GetListOfLeaves())
+      elif leaf:
+        branch = leaf.GetBranch()
+        leaves = [leaf]
+      else:
+        continue
+      branches.add(branch.GetName())
+      for leaf in leaves: # arrays
+        if leaf.GetLeafCount():
+          branches.add(leaf.GetLeafCount().GetBranch().GetName())
+      break
+    else:
+      if unresolved is not None and name not in functions:
+        unresolved.add(name)
+  return branches
+  
+
+def prepareread(tree, exprs, **kwargs):
+  """Prepare a tree for drawing expressions: add the branches they use to the TTreeCache,
+  instead of learning them from the first entries, and if activate=True, only activate those.
+  If no branches could be found, or some identifier is no branch, leaf, alias or known function
+  (e.g. a friend tree or a macro), keep all branches active, and let the cache learn.
+  Return the set of used branches."""
+  firstentry = kwargs.get('firstentry', 0                        ) # first entry to process
+  nentries   = kwargs.get('nentries',   -1                       ) # number of entries to process; -1 = all
+  remote     = kwargs.get('remote',     False                    ) # file is read over the network
+  activate   = kwargs.get('activate',   _options['activate']     ) # only activate used branches
+  verbosity  = kwargs.get('verb',       0                        )
+  cachesize  = _options['remotecachesize' if remote else 'cachesize']
+  unresolved = set()
+  branches   = getbranches(tree,exprs,unresolved=unresolved)
+  tree.SetCacheSize(int(cachesize*1024**2))
+  if unresolved:
+    LOG.verb("prepareread: Could not resolve %s in %r; keeping all branches..."%(
+             ', '.join(repr(n) for n in sorted(unresolved)),tree.GetName()),verbosity,1)
+    branches = set()
+  if branches:
+    if activate:
+      tree.SetBranchStatus('*',0)
+      for branch in branches:
+        tree.SetBranchStatus(branch,1)
+    for branch in branches:
+      tree.AddBranchToCache(branch,True)
+    tree.StopCacheLearningPhase()
+  else:
+    tree.SetCacheLearnEntries(10)
+  if firstentry>0 or nentries>=0:
+    tree.SetCacheEntryRange(firstentry,firstentry+nentries if nentries>=0 else tree.GetEntries())
+  LOG.verb("prepareread: Reading %d/%d branches of %r with a %s MB cache"%(
+           len(branches),len(tree.GetListOfBranches()),tree.GetName(),cachesize),verbosity,3)
+  return branches
+  
+
+def getreadstats(file):
+  """Return number of bytes read from a file, and number of read calls."""
+  return file.GetBytesRead(), file.GetReadCalls()
+  
@@ -37,6 +37,7 @@ def getsampleset(datasample,expsamples,sigsamples=[ ],**kwargs):
   dataweight = kwargs.pop('dataweight', ""   ) # weight for data samples
   url        = kwargs.pop('url',        ""   ) # XRootD url
   tag        = kwargs.pop('tag',        ""   ) # extra tag for file name
+  ncores     = kwargs.pop('ncores',     None ) # number of processes to fill metadata index
   
   if not fpattern:
     fpattern = "$PICODIR/$SAMPLE_$CHANNEL$TAG.root"
@@ -49,6 +50,11 @@ def getsampleset(datasample,expsamples,sigsamples=[ ],**kwargs):
     fpattern = "%s/%s"%(fpattern,url)
   LOG.verb("getsampleset: fpattern=%r"%(fpattern),level=1)
   
+  # METADATA: read entries and cutflow of all MC files that are not indexed yet in parallel
+  treename = kwargs.get('tree',None) or 'tree'
+  fnames   = [repkey(fpattern,ERA=era,GROUP=info[0],SAMPLE=info[1],CHANNEL=channel,TAG=tag) for info in expsamples]
+  fillmetaindex(fnames,treename,ncores=ncores)
+  
   # MC (EXPECTED)
   for i, info in enumerate(expsamples[:]):
     expkwargs = kwargs.copy()
@@ -86,6 +92,7 @@ def getsampleset(datasample,expsamples,sigsamples=[ ],**kwargs):
     LOG.throw(IOError,"Did not recognize data row %s"%(datasample))
   fpattern = repkey(fpattern,ERA=era,GROUP=group,SAMPLE=name,CHANNEL=channel,TAG=tag)
   fnames   = glob.glob(fpattern)
+  fillmetaindex(fnames,treename,ncores=ncores)
   #print fnames
   if len(fnames)==1:
     datasample = Data(name,title,fnames[0])
@@ -129,11 +136,13 @@ def unwrap_gethist_args(*args,**kwargs):
     gethist(str xvar, list xbins, str cuts="")
     gethist(Variable xvar, str cuts="")
     gethist(list varlist, str cuts="")
+    gethist(list varlist, list sellist)
   where varlist is a list of Variables objects, or a list of tuples defining a variable:
     - [(str xvar, int nxbins, float xmin, float xmax), ... ]
     - [(str xvar, list xbins), ... ]
-  Returns a list of Variable objects, a Selection object, and a boolean to flag a single
-  instead of a list of variables was given:
+  and sellist is a list of Selection objects.
+  Returns a list of Variable objects, a Selection object (or list of Selection objects),
+  and a boolean to flag a single instead of a list of variables was given:
     - (list vars, str cut, bool single)
   For testing, see test/testUnwrapping.py.
   """
@@ -147,6 +156,9 @@ def unwrap_gethist_args(*args,**kwargs):
     elif isinstance(args[-1],str):
       sel   = Selection(args[-1])
       vargs = args[:-1]
+    elif islist(args[-1]) and args[-1] and all(isinstance(s,Selection) for s in args[-1]):
+      sel   = list(args[-1]) # several selections
+      vargs = args[:-1]
     else:
       sel   = Selection() # no selection given
       vargs = args
@@ -162,8 +174,8 @@ def unwrap_gethist_args(*args,**kwargs):
     single = True
   if vars==None or sel==None:
     LOG.throw(IOError,'unwrap_gethist_args: Could not unwrap arguments %s, len(args)=%d, vars=%s, sel=%s.'%(
-                                                                       args,len(args),vars,sel.selection))
-  LOG.verb("unwrap_gethist_args: vars=%s, sel=%r, single=%r"%(vars,sel.selection,single),level=4)
+                                                                       args,len(args),vars,sel))
+  LOG.verb("unwrap_gethist_args: vars=%s, sel=%r, single=%r"%(vars,sel,single),level=4)
   return vars, sel, single
   
 
@@ -205,6 +217,9 @@ def unwrap_gethist2D_args(*args,**kwargs):
     elif isinstance(args[-1],str):
       sel   = Selection(args[-1])
       vargs = args[:-1]
+    elif islist(args[-1]) and args[-1] and all(isinstance(s,Selection) for s in args[-1]):
+      sel   = list(args[-1]) # several selections
+      vargs = args[:-1]
     else:
       sel   = Selection() # no selection given
       vargs = args
@@ -473,4 +488,5 @@ def getxsec_nlo(*searchterms,**kwargs):
 from TauFW.Plotter.sample.Sample import *
 from TauFW.Plotter.sample.MergedSample import MergedSample
 from TauFW.Plotter.sample.SampleSet import SampleSet
+from TauFW.Plotter.sample.MetaIndex import fillmetaindex
 import TauFW.Plotter.sample.SampleStyle as STYLE
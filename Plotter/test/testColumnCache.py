@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# Description: Test the column cache of Sample.gethist: check that histograms filled from
+#              memory-mapped columns are identical to those drawn with MultiDraw, and compare the timing
+#   test/testColumnCache.py -v2
+import os, time
+from TauFW.Plotter.sample.utils import LOG, setera, ensuredir, Sample
+from TauFW.Plotter.sample.ColumnCache import setcolumncache
+from TauFW.Plotter.plot.Variable import Variable
+from pseudoSamples import makesamples
+
+selections = [
+  "pt_1>30 && pt_2>30 && abs(eta_1)<2.4 && abs(eta_2)<2.4",
+  "pt_1>40 && pt_2>40 && abs(eta_1)<2.1 && abs(eta_2)<2.1",
+]
+variables = [
+  Variable('m_vis',            32,  0, 160),
+  Variable('m_vis',            [0,20,40,50,60,65,70,75,80,85,90,95,100,110,130,160,200]),
+  Variable('pt_1',             40,  0, 120),
+  Variable('pt_2',             40,  0, 120, cut="njets>0"),
+  Variable('pt_1+pt_2',        40,  0, 200),
+  Variable('min(pt_1,pt_2)/max(pt_1,pt_2)', 20, 0, 1),
+  Variable('njets',            10,  0,  10),
+]
+variables2D = [
+  (Variable('pt_1',  50,  0, 100), Variable('pt_2',  50,  0, 100)),
+]
+
+
+def compare(hists1, hists2):
+  """Return number of histograms with different entries, content or errors, up to rounding of the sums."""
+  ndiff = 0
+  close = lambda x, y: abs(x-y)<=1e-9*max(abs(x),abs(y),1.)
+  for hist1, hist2 in zip(hists1,hists2):
+    nbins = (hist1.GetNbinsX()+2)*(hist1.GetNbinsY()+2)
+    if hist1.GetEntries()!=hist2.GetEntries() or not close(hist1.GetMean(),hist2.GetMean()) or any(
+       not close(hist1.GetBinContent(i),hist2.GetBinContent(i)) or not close(hist1.GetBinError(i),hist2.GetBinError(i)) for i in xrange(nbins)):
+      LOG.warning("Histograms %r and %r differ!"%(hist1.GetName(),hist2.GetName()))
+      ndiff += 1
+  return ndiff
+  
+
+def main(args):
+  LOG.header("Prepare samples")
+  if args.infiles: # real pico files
+    samples  = [(os.path.basename(f).replace('.root',''),f) for f in args.infiles]
+  else:
+    snames   = ['ZTT','Data']
+    outdir   = ensuredir('plots')
+    filedict = makesamples(args.nevts,sample=snames,outdir=outdir)
+    samples  = [ ]
+    for name in snames:
+      file, tree = filedict[name]
+      samples.append((name,file.GetName()))
+      file.Close()
+  setera(2018,0.001)
+  TAB      = LOG.table("%-6s %-10s %10.3f %8d %8d")
+  TAB.printheader("sample","method","time [s]","hits","misses")
+  for name, fname in samples:
+    sample = Sample(name,name,fname,1.0,data=(name=='Data'))
+    hists  = { }
+    for method in ['MultiDraw','cold','warm']:
+      cache = setcolumncache(None if method=='MultiDraw' else args.cachedir,verb=args.verbosity)
+      if method=='cold':
+        cache.clear()
+      start = time.time()
+      hists[method] = [ ]
+      for selection in selections:
+        hists[method] += sample.gethist(variables,selection,tag='_'+method,cache=False) +\
+                         sample.gethist2D(variables2D,selection,tag='_'+method,cache=False)
+      nhits, nmisses = (cache.nhits, cache.nmisses) if cache else (0,0)
+      TAB.printrow(name,method,time.time()-start,nhits,nmisses)
+    for method in ['cold','warm']:
+      ndiff = compare(hists['MultiDraw'],hists[method])
+      LOG.insist(ndiff==0,"%d/%d %s histograms of %s differ from MultiDraw!"%(ndiff,len(hists[method]),method,name))
+  setcolumncache(args.cachedir).clear()
+  setcolumncache(None)
+  print ">>> Histograms from columns are identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test the column cache of Sample.gethist"""
+  parser = ArgumentParser(prog="testColumnCache",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   type=int, default=50000, action='store',
+                                         help="number of events to generate per sample" )
+  parser.add_argument('-i', '--input',   dest='infiles', nargs='+', default=[ ], action='store',
+                                         help="pico files to use instead of pseudo data" )
+  parser.add_argument('-c', '--cache',   dest='cachedir', type=str, default="cache/testcolumns", action='store',
+                                         help="temporary directory for the column cache" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print ">>>\n>>> Done."
+  
\ No newline at end of file
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# Description: Test the histogram cache of Sample.gethist: check that cached histograms
+#              are identical to freshly drawn ones, and compare the timing
+#   test/testHistCache.py -v2
+import time
+from TauFW.Plotter.sample.utils import LOG, setera, ensuredir, Sample
+from TauFW.Plotter.sample.HistCache import sethistcache
+from TauFW.Plotter.plot.Variable import Variable
+from pseudoSamples import makesamples
+
+selection = "pt_1>30 && pt_2>30 && abs(eta_1)<2.4 && abs(eta_2)<2.4"
+variables = [
+  Variable('m_vis',            32,  0, 160),
+  Variable('m_vis',            [0,20,40,50,60,65,70,75,80,85,90,95,100,110,130,160,200]),
+  Variable('pt_1',             40,  0, 120),
+  Variable('pt_2',             40,  0, 120, cut="njets>0"),
+  Variable('pt_1+pt_2',        40,  0, 200),
+  Variable('njets',            10,  0,  10),
+]
+variables2D = [
+  (Variable('pt_1',  50,  0, 100), Variable('pt_2',  50,  0, 100)),
+]
+
+
+def compare(hists1, hists2):
+  """Return number of histograms with different content or errors."""
+  ndiff = 0
+  for hist1, hist2 in zip(hists1,hists2):
+    nbins = (hist1.GetNbinsX()+2)*(hist1.GetNbinsY()+2)
+    if hist1.GetEntries()!=hist2.GetEntries() or any(
+       hist1.GetBinContent(i)!=hist2.GetBinContent(i) or hist1.GetBinError(i)!=hist2.GetBinError(i) for i in xrange(nbins)):
+      LOG.warning("Histograms %r and %r differ!"%(hist1.GetName(),hist2.GetName()))
+      ndiff += 1
+  return ndiff
+  
+
+def main(args):
+  LOG.header("Prepare samples")
+  snames   = ['ZTT','Data']
+  outdir   = ensuredir('plots')
+  filedict = makesamples(args.nevts,sample=snames,outdir=outdir)
+  setera(2018,0.001)
+  cache    = sethistcache(args.cachedir,verb=args.verbosity)
+  cache.clear()
+  TAB      = LOG.table("%-6s %-10s %10.3f %8d %8d")
+  TAB.printheader("sample","method","time [s]","hits","misses")
+  for name in snames:
+    file, tree = filedict[name]
+    fname  = file.GetName()
+    file.Close()
+    sample = Sample(name,name,fname,1.0,data=(name=='Data'))
+    hists  = { }
+    for method, kwargs in [('nocache',{'cache':False}),('cold',{ }),('warm',{ })]:
+      nhits, nmisses = cache.nhits, cache.nmisses
+      start = time.time()
+      hists[method] = sample.gethist(variables,selection,tag='_'+method,**kwargs) +\
+                      sample.gethist2D(variables2D,selection,tag='_'+method,**kwargs)
+      TAB.printrow(name,method,time.time()-start,cache.nhits-nhits,cache.nmisses-nmisses)
+    for method in ['cold','warm']:
+      ndiff = compare(hists['nocache'],hists[method])
+      LOG.insist(ndiff==0,"%d/%d %s histograms of %s differ from uncached ones!"%(ndiff,len(hists[method]),method,name))
+  cache.clear()
+  print ">>> Cached histograms are identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test the histogram cache of Sample.gethist"""
+  parser = ArgumentParser(prog="testHistCache",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   type=int, default=50000, action='store',
+                                         help="number of events to generate per sample" )
+  parser.add_argument('-c', '--cache',   dest='cachedir', type=str, default="cache/test", action='store',
+                                         help="temporary directory for the histogram cache" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print ">>>\n>>> Done."
+  
\ No newline at end of file
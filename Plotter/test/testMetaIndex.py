@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# Description: Test the metadata index of pico files: check that samples created from the index
+#              have the same number of events and sum of weights, and compare the timing
+#   test/testMetaIndex.py -v2
+import os, time
+from TauFW.Plotter.sample.utils import LOG, setera, ensuredir, Sample, fillmetaindex
+from TauFW.Plotter.sample.MetaIndex import setmetaindex, getmetaindex
+from pseudoSamples import makesamples
+
+
+def main(args):
+  LOG.header("Prepare samples")
+  if args.infiles: # real pico files; do not touch them
+    snames   = [os.path.basename(f).replace('.root','') for f in args.infiles]
+    fnames   = args.infiles
+    methods  = ['noindex','fill','warm']
+  else:
+    snames   = ['ZTT','WJ','QCD','TT','Data']
+    outdir   = ensuredir('plots')
+    filedict = makesamples(args.nevts,sample=snames,outdir=outdir)
+    fnames   = [ ]
+    for name in snames:
+      file, tree = filedict[name]
+      fnames.append(file.GetName())
+      file.Close()
+    methods  = ['noindex','fill','warm','touched']
+  setera(2018,0.001)
+  indexes = [getmetaindex(d) for d in set(os.path.dirname(f) for f in fnames)]
+  for index in indexes:
+    if os.path.isfile(index.path):
+      os.remove(index.path)
+  TAB = LOG.table("%-10s %10.4f")
+  TAB.printheader("method","time [s]")
+  samples = { }
+  for method in methods:
+    setmetaindex(enable=(method!='noindex')) # also reload index from disk
+    if method=='touched': # index entry should be invalidated by new modification time
+      os.utime(fnames[0],(time.time(),time.time()+10))
+    start = time.time()
+    if method=='fill':
+      fillmetaindex(fnames,ncores=args.ncores,verb=args.verbosity)
+    samples[method] = [Sample(n,n,f,1.0,data=(n=='Data')) for n, f in zip(snames,fnames)]
+    TAB.printrow(method,time.time()-start)
+  for method in methods[1:]:
+    for sample1, sample2 in zip(samples['noindex'],samples[method]):
+      LOG.insist(sample1.nevents==sample2.nevents and sample1.sumweights==sample2.sumweights and sample1.getentries()==sample2.getentries(),
+                 "Metadata of %r from index (%s) differs: nevents=%s vs. %s, sumw=%s vs. %s"%(
+                 sample1.name,method,sample1.nevents,sample2.nevents,sample1.sumweights,sample2.sumweights))
+  for index in indexes:
+    os.remove(index.path)
+  setmetaindex(enable=False) # default
+  print ">>> Metadata from index is identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test the metadata index of pico files"""
+  parser = ArgumentParser(prog="testMetaIndex",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   type=int, default=1000, action='store',
+                                         help="number of events to generate per sample" )
+  parser.add_argument('-i', '--input',   dest='infiles', nargs='+', default=[ ], action='store',
+                                         help="pico files to use instead of pseudo data" )
+  parser.add_argument('-j', '--ncores',  type=int, default=None, action='store',
+                                         help="number of processes to fill the index" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print ">>>\n>>> Done."
+  
\ No newline at end of file
@@ -11,6 +11,7 @@ from TauFW.common.tools.file import ensuredir
 from ROOT import gROOT, gSystem, gDirectory, TFile, TTree, TH1D, TH2D, gRandom, TColor
 from TauFW.Plotter.plot.utils import LOG
 from TauFW.Plotter.plot.MultiDraw import MultiDraw
+from TauFW.Plotter.plot.RDataFrameDraw import RDataFrameDraw
 #from test.pseudoSamples import makesamples
 from pseudoSamples import makesamples
 
@@ -144,15 +145,93 @@ def multidraw2D(tree,variables,selections,predefine=False,outdir='plots'):
   return dtime
   
 
-def main():
+def multidrawsel(tree,variables,selections):
+  """Fill histograms for several selections with one MultiDraw call per selection,
+  and with one MultiDraw call for all selections, and check they are the same."""
+  print ">>> multidrawsel: Filling histograms for %d selections with MultiDraw..."%(len(selections))
+  allhists = { }
+  dtimes   = { }
+  for method in ['loop','onepass']:
+    start    = time()
+    cuts     = [ ]
+    varexps  = [ ]
+    hists    = [ ]
+    for i, (selection, weight) in enumerate(selections):
+      cuts.append("(%s)*%s"%(selection,weight))
+      varexps.append([ ])
+      hists.append([ ])
+      for varname, nbins, xmin, xmax in variables:
+        hname = "%s_sel%d_%s"%(varname.replace('+','_').replace('/','_').replace('(','').replace(')','').replace(',','_'),i+1,method)
+        varexps[-1].append("%s >> %s"%(varname,hname))
+        hists[-1].append(TH1D(hname,hname,nbins,xmin,xmax))
+    if method=='loop':
+      for cut, varexps_, hists_ in zip(cuts,varexps,hists):
+        tree.MultiDraw(varexps_,cut,hists=hists_)
+    else:
+      results = tree.MultiDraw(varexps,cuts,hists=hists)
+      assert all(r is h for r_, h_ in zip(results,hists) for r, h in zip(r_,h_)), "Mismatch between histograms (%s) and results (%s)!"%(hists,results)
+    dtimes[method]   = time()-start
+    allhists[method] = [h for hists_ in hists for h in hists_]
+    print ">>>   %-8s took %.2fs"%(method,dtimes[method])
+  for hist1, hist2 in zip(allhists['loop'],allhists['onepass']):
+    assert hist1.GetEntries()==hist2.GetEntries(), "Mismatch in entries for %r (%s) and %r (%s)!"%(
+      hist1.GetName(),hist1.GetEntries(),hist2.GetName(),hist2.GetEntries())
+    assert all(abs(hist1.GetBinContent(i)-hist2.GetBinContent(i))<=1e-9*abs(hist1.GetBinContent(i)) for i in range(hist1.GetNbinsX()+2)),\
+      "Mismatch in content of %r and %r!"%(hist1.GetName(),hist2.GetName())
+  return dtimes['loop'], dtimes['onepass']
+  
+
+def rdataframedraw(tree,variables,selections):
+  """Fill histograms for several selections with MultiDraw and with RDataFrame,
+  and check they are identical, including under- and overflow, errors and entries."""
+  print ">>> rdataframedraw: Filling histograms for %d selections with MultiDraw and RDataFrame..."%(len(selections))
+  allhists = { }
+  dtimes   = { }
+  for method in ['MultiDraw','RDataFrame']:
+    start    = time()
+    cuts     = [ ]
+    varexps  = [ ]
+    hists    = [ ]
+    for i, (selection, weight) in enumerate(selections):
+      cuts.append("(%s)*%s"%(selection,weight))
+      varexps.append([ ])
+      hists.append([ ])
+      for varname, nbins, xmin, xmax in variables:
+        hname = "%s_sel%d_%s"%(varname.replace('+','_').replace('/','_').replace('(','').replace(')','').replace(',','_'),i+1,method)
+        varexps[-1].append("%s >> %s"%(varname,hname))
+        hists[-1].append(TH1D(hname,hname,nbins,xmin,xmax))
+        hists[-1][-1].Sumw2()
+    if method=='MultiDraw':
+      tree.MultiDraw(varexps,cuts,hists=hists)
+    else:
+      RDataFrameDraw(tree,varexps,cuts,hists=hists)
+    dtimes[method]   = time()-start
+    allhists[method] = [h for hists_ in hists for h in hists_]
+    print ">>>   %-10s took %.2fs"%(method,dtimes[method])
+  for hist1, hist2 in zip(allhists['MultiDraw'],allhists['RDataFrame']):
+    assert hist1.GetEntries()==hist2.GetEntries(), "Mismatch in entries for %r (%s) and %r (%s)!"%(
+      hist1.GetName(),hist1.GetEntries(),hist2.GetName(),hist2.GetEntries())
+    for i in range(hist1.GetNbinsX()+2):
+      for get in [hist1.__class__.GetBinContent,hist1.__class__.GetBinError]:
+        assert abs(get(hist1,i)-get(hist2,i))<=1e-9*abs(get(hist1,i)),\
+          "Mismatch in bin %d of %r (%s) and %r (%s)!"%(i,hist1.GetName(),get(hist1,i),hist2.GetName(),get(hist2,i))
+  return dtimes['MultiDraw'], dtimes['RDataFrame']
+  
+
+def main(args):
   nevts      = 1000000
   predefine  = True #and False # initialize histogram before calling filling
   sample     = 'ZTT' #'Data'
   outdir     = ensuredir('plots')
-  filedict   = makesamples(nevts,sample=sample,outdir=outdir)
-  file, tree = filedict[sample]
+  if args.infile: # real pico file, e.g. to validate RDataFrame
+    file     = TFile.Open(args.infile,'READ')
+    tree     = file.Get(args.treename)
+    print ">>> Using %s..."%(file.GetName())
+  else:
+    filedict   = makesamples(nevts,sample=sample,outdir=outdir)
+    file, tree = filedict[sample]
+    print ">>> Using pseudo data %s..."%(file.GetName())
   nevts      = tree.GetEntries()
-  print ">>> Using pseudo data %s..."%(file.GetName())
   
   variables = [
     ('m_vis',            20,  0, 140),
@@ -179,14 +258,32 @@ def main():
     ('pt_1>30 && pt_2>30 && abs(eta_1)<2.4 && abs(eta_2)<2.4', "weight"),
   ]
   
+  baseline   = "pt_1>30 && pt_2>30 && abs(eta_1)<2.4 && abs(eta_2)<2.4"
+  ptbins     = [30,35,40,50,70,1000]
+  binselections = [ # e.g. tau pt bins for datacards
+    ("%s && pt_2>=%s && pt_2<%s"%(baseline,ptmin,ptmax), "weight") for ptmin, ptmax in zip(ptbins[:-1],ptbins[1:])
+  ]
+  
   dtime1 = singledraw(tree,variables,selections,outdir=outdir,predefine=predefine)
   dtime2 = multidraw(tree,variables,selections,outdir=outdir,predefine=predefine)
   dtime3 = multidraw2D(tree,variables2D,selections,outdir=outdir,predefine=predefine)
+  dtime4, dtime5 = multidrawsel(tree,[v for v in variables if len(v)==4],binselections)
+  dtime6, dtime7 = rdataframedraw(tree,[v for v in variables if len(v)==4]+[('njets/2',10,0,5)],binselections) # integer division
   file.Close()
   print ">>> Result: MultiDraw is %.2f times faster than TTree::Draw for %s events and %s variables!"%(dtime1/dtime2,nevts,len(variables))
+  print ">>> Result: One MultiDraw for %d selections is %.2f times faster than one per selection!"%(len(binselections),dtime4/dtime5)
+  print ">>> Result: RDataFrame is %.2f times faster than MultiDraw for %d selections!"%(dtime6/dtime7,len(binselections))
   
 
 if __name__ == '__main__':
-  main()
+  from argparse import ArgumentParser
+  description = """Test MultiDraw and RDataFrameDraw on pseudo data, or on a pico file"""
+  parser = ArgumentParser(prog="testMultiDraw",description=description,epilog="Good luck!")
+  parser.add_argument('-i', '--input',   dest='infile', type=str, default=None, action='store',
+                                         help="pico file to use instead of pseudo data" )
+  parser.add_argument('-t', '--tree',    dest='treename', type=str, default='tree', action='store',
+                                         help="name of tree in input file, default=%(default)r" )
+  args = parser.parse_args()
+  main(args)
   print ">>> Done!"
   
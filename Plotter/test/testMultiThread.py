@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 # Author: Izaak Neutelings (Februari, 2019)
 from TauFW.Plotter.plot.utils import LOG
-from TauFW.Plotter.plot.MultiThread import MultiProcessor, Thread
+from TauFW.Plotter.plot.MultiThread import MultiProcessor, ProcessPool, Thread
 from ROOT import gROOT, gSystem, gDirectory, TFile, TH1D
 import time
 
@@ -20,6 +20,18 @@ def foo(i,bar,**kwargs):
   return result
   
 
+def work(nevts,chunk=None):
+  """Simple CPU-bound test function, looping over a number of "events", or a chunk of them."""
+  first, last = 0, nevts
+  if chunk:
+    ichunk, nchunks = chunk
+    first, last = ichunk*nevts//nchunks, (ichunk+1)*nevts//nchunks
+  result = 0
+  for i in xrange(first,last):
+    result += i%7
+  return result
+  
+
 def draw(histname):
   """Simple test function to be multithreaded."""
   #print ">>> Drawing %s..."%histname
@@ -123,6 +135,37 @@ def testMultiProcessorWithDraw(N=5):
   print
   
 
+def testProcessPool(N=40,nevts=400000):
+  """Benchmark per-sample processes vs. a bounded process pool on an unbalanced set of
+  samples: one large sample with N times more events than each of the N small ones."""
+  LOG.header("testProcessPool")
+  samples = [N*nevts]+N*[nevts] # number of events per sample
+  
+  print ">>> One process per sample (%d processes):"%(len(samples))
+  start = time.time()
+  processor = MultiProcessor()
+  for nevts_ in samples:
+    processor.start(target=work,args=(nevts_,))
+  results1 = [process.join() for process in processor]
+  print ">>> Took %.1f seconds"%(time.time()-start)
+  
+  pool = ProcessPool()
+  print "\n>>> Process pool with %d workers, large sample split into %d chunks:"%(pool.nworkers,pool.nworkers)
+  start = time.time()
+  tasks = [ ] # sample index of each task
+  for i, nevts_ in enumerate(samples):
+    nchunks = pool.nworkers if nevts_>nevts else 1
+    for ichunk in range(nchunks):
+      pool.add(work,(nevts_,),{'chunk':(ichunk,nchunks)},name="sample %d"%i,cost=nevts_/nchunks)
+      tasks.append(i)
+  results2 = [0]*len(samples)
+  for itask, name, result in pool:
+    results2[tasks[itask]] += result
+  print ">>> Took %.1f seconds"%(time.time()-start)
+  assert results1==results2, "Results differ!"
+  print
+  
+
 def testThread(N=5):
   """Test threading behavior."""
   LOG.header("testThread")
@@ -217,6 +260,7 @@ def main():
   #testThreadWithSharedTFile(N) # gives issues in ROOT
   testMultiProcessor(N)
   testMultiProcessorWithDraw(N)
+  testProcessPool()
   
 
 if __name__ == '__main__':
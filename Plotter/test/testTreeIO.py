@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+# Description: Test branch activation and TTreeCache settings of Sample.multidraw: check that
+#              histograms are identical to those drawn with all branches, and compare the bytes read
+#   test/testTreeIO.py -v2
+import time
+from TauFW.Plotter.sample.utils import LOG, setera, ensuredir, Sample
+from TauFW.Plotter.sample.TreeIO import setreadoptions, getbranches
+from TauFW.Plotter.plot.Variable import Variable
+from pseudoSamples import makesamples
+from ROOT import TFile
+
+selection = "pt_1>30 && pt_2>30 && abs(eta_1)<2.4 && abs(eta_2)<2.4"
+variables = [
+  Variable('m_vis',            32,  0, 160),
+  Variable('pt_1',             40,  0, 120),
+  Variable('pt_2',             40,  0, 120, cut="njets>0"),
+  Variable('pt_1+pt_2',        40,  0, 200),
+]
+
+
+def compare(hists1, hists2):
+  """Return number of histograms with different content or errors."""
+  ndiff = 0
+  for hist1, hist2 in zip(hists1,hists2):
+    nbins = hist1.GetNbinsX()+2
+    if hist1.GetEntries()!=hist2.GetEntries() or any(
+       hist1.GetBinContent(i)!=hist2.GetBinContent(i) or hist1.GetBinError(i)!=hist2.GetBinError(i) for i in xrange(nbins)):
+      LOG.warning("Histograms %r and %r differ!"%(hist1.GetName(),hist2.GetName()))
+      ndiff += 1
+  return ndiff
+  
+
+def main(args):
+  LOG.header("Prepare samples")
+  snames   = ['ZTT','Data']
+  outdir   = ensuredir('plots')
+  filedict = makesamples(args.nevts,sample=snames,outdir=outdir)
+  setera(2018,0.001)
+  activate = setreadoptions()['activate'] # default
+  TAB      = LOG.table("%-6s %-10s %10.3f %10.3f %8d")
+  TAB.printheader("sample","branches","time [s]","read [MB]","calls")
+  for name in snames:
+    file, tree = filedict[name]
+    fname  = file.GetName()
+    file.Close()
+    sample = Sample(name,name,fname,1.0,data=(name=='Data'))
+    LOG.verb("Used branches: %s"%(sorted(getbranches(sample.tree,selection,[v.name for v in variables]))),args.verbosity,1)
+    hists  = { }
+    for method in ['all','used']:
+      setreadoptions(activate=(method=='used'))
+      nbytes, ncalls = TFile.GetFileBytesRead(), TFile.GetFileReadCalls()
+      start  = time.time()
+      hists[method] = sample.gethist(variables,selection,tag='_'+method,cache=False)
+      nbytes = (TFile.GetFileBytesRead()-nbytes)/1024.**2
+      TAB.printrow(name,method,time.time()-start,nbytes,TFile.GetFileReadCalls()-ncalls)
+    ndiff = compare(hists['all'],hists['used'])
+    LOG.insist(ndiff==0,"%d/%d histograms of %s differ when only activating used branches!"%(ndiff,len(variables),name))
+  setreadoptions(activate=activate)
+  print ">>> Histograms are identical"
+  
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  description = """Test branch activation and TTreeCache settings of Sample.multidraw"""
+  parser = ArgumentParser(prog="testTreeIO",description=description,epilog="Good luck!")
+  parser.add_argument('-n', '--nevts',   type=int, default=50000, action='store',
+                                         help="number of events to generate per sample" )
+  parser.add_argument('-v', '--verbose', dest='verbosity', type=int, nargs='?', const=1, default=0, action='store',
+                                         help="set verbosity" )
+  args = parser.parse_args()
+  LOG.verbosity = args.verbosity
+  main(args)
+  print ">>>\n>>> Done."
+  
\ No newline at end of file
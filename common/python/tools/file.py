@@ -1,6 +1,7 @@
 # Author: Izaak Neutelings (May 2020)
 import os, re, shutil
 import importlib, traceback
+from contextlib import contextmanager
 import ROOT; ROOT.PyConfig.IgnoreCommandLineOptions = True
 from TauFW.common.tools.log import LOG
 from TauFW.common.tools.utils import ensurelist
@@ -80,6 +81,27 @@ def ensuremodule(modname,package):
   return module
   
 
+@contextmanager
+def atomicwrite(fname):
+  """Context manager to write a file atomically. It yields the name of a temporary file
+  in the same directory, unique per process, which is renamed to fname when the block exits
+  without error. As renaming is atomic, processes that read fname in parallel never see an
+  incomplete file, and the last writer wins. The temporary file is removed on errors.
+    with atomicwrite(fname) as tmpname:
+      with open(tmpname,'w') as file:
+        json.dump(data,file)
+  """
+  ensuredir(os.path.dirname(fname))
+  tmpname = "%s.%d.tmp"%(fname,os.getpid())
+  try:
+    yield tmpname
+    os.rename(tmpname,fname)
+  except:
+    if os.path.isfile(tmpname):
+      os.unlink(tmpname)
+    raise
+  
+
 def rmfile(filepaths):
   """Remove (list of) files."""
   if isinstance(filepaths,str):